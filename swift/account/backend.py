@@ -24,11 +24,35 @@ import errno
 
 import sqlite3
 
-from swift.common.utils import normalize_timestamp, lock_parent_directory
+from swift.common.utils import normalize_timestamp, \
+    lock_parent_directory, OrderedDict
 from swift.common.db import DatabaseBroker, DatabaseConnectionError, \
     PENDING_CAP, PICKLE_PROTOCOL, utf8encode
 
 
+def _merge_container_record(record, row):
+    """
+    Merge a container row into a newer record for the same container.
+
+    :param record: list of [name, put_timestamp, delete_timestamp,
+                   object_count, bytes_used, deleted]; updated in place
+    :param row: the older row, in the same form
+    """
+    for i in xrange(5):
+        if record[i] is None and row[i] is not None:
+            record[i] = row[i]
+    if row[1] > record[1]:  # Keep newest put_timestamp
+        record[1] = row[1]
+    if row[2] > record[2]:  # Keep newest delete_timestamp
+        record[2] = row[2]
+    # If deleted, mark as such
+    if record[2] > record[1] and \
+            record[3] in (None, '', 0, '0'):
+        record[5] = 1
+    else:
+        record[5] = 0
+
+
 class AccountBroker(DatabaseBroker):
     """Encapsulates working with an account database."""
     db_type = 'account'
@@ -351,6 +375,17 @@ class AccountBroker(DatabaseBroker):
                     break
             return results
 
+    def list_containers_batches(self, limit, marker, end_marker, prefix,
+                                delimiter):
+        """
+        Get the same listing as :func:`list_containers_iter`, read from the
+        DB in batches of up to LISTING_BATCH_SIZE entries as it is consumed.
+
+        :returns: a generator of lists of entries
+        """
+        return self._list_batches(self.list_containers_iter, limit, marker,
+                                  end_marker, prefix, delimiter)
+
     def merge_items(self, item_list, source=None):
         """
         Merge items into the container table.
@@ -360,49 +395,86 @@ class AccountBroker(DatabaseBroker):
                           'deleted'}
         :param source: if defined, update incoming_sync with the source
         """
+        # Records for the same name are merged with each other first, just
+        # as they would be with a row already in the table.
+        records = OrderedDict()
+        max_rowid = -1
+        for rec in item_list:
+            if source:
+                max_rowid = max(max_rowid, rec['ROWID'])
+            record = [rec['name'], rec['put_timestamp'],
+                      rec['delete_timestamp'], rec['object_count'],
+                      rec['bytes_used'], rec['deleted']]
+            row = records.pop(rec['name'], None)
+            if row:
+                _merge_container_record(record, row)
+            records[rec['name']] = record
         with self.get() as conn:
-            max_rowid = -1
-            for rec in item_list:
-                record = [rec['name'], rec['put_timestamp'],
-                          rec['delete_timestamp'], rec['object_count'],
-                          rec['bytes_used'], rec['deleted']]
-                query = '''
-                    SELECT name, put_timestamp, delete_timestamp,
-                           object_count, bytes_used, deleted
-                    FROM container WHERE name = ?
-                '''
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                curs = conn.execute(query, (rec['name'],))
-                curs.row_factory = None
-                row = curs.fetchone()
-                if row:
-                    row = list(row)
-                    for i in xrange(5):
-                        if record[i] is None and row[i] is not None:
-                            record[i] = row[i]
-                    if row[1] > record[1]:  # Keep newest put_timestamp
-                        record[1] = row[1]
-                    if row[2] > record[2]:  # Keep newest delete_timestamp
-                        record[2] = row[2]
-                    # If deleted, mark as such
-                    if record[2] > record[1] and \
-                            record[3] in (None, '', 0, '0'):
-                        record[5] = 1
-                    else:
-                        record[5] = 0
-                conn.execute('''
-                    DELETE FROM container WHERE name = ? AND
-                                                deleted IN (0, 1)
-                ''', (record[0],))
-                conn.execute('''
-                    INSERT INTO container (name, put_timestamp,
-                        delete_timestamp, object_count, bytes_used,
-                        deleted)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', record)
-                if source:
-                    max_rowid = max(max_rowid, rec['ROWID'])
+            conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS container_merge (
+                    name TEXT PRIMARY KEY,
+                    put_timestamp TEXT,
+                    delete_timestamp TEXT,
+                    object_count INTEGER,
+                    bytes_used INTEGER,
+                    deleted INTEGER,
+                    seq INTEGER,
+                    merged INTEGER DEFAULT 0
+                )''')
+            conn.execute('DELETE FROM container_merge')
+            conn.executemany('''
+                INSERT INTO container_merge (name, put_timestamp,
+                    delete_timestamp, object_count, bytes_used, deleted, seq)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [record + [seq] for seq, record in
+                  enumerate(records.itervalues())])
+            # Merge in the rows already in the table, the way
+            # _merge_container_record does. CROSS JOIN makes SQLite look up
+            # each merged name in the table rather than the other way round.
+            conn.execute('''
+                INSERT OR REPLACE INTO container_merge (name, put_timestamp,
+                    delete_timestamp, object_count, bytes_used, deleted, seq,
+                    merged)
+                SELECT m.name,
+                    CASE WHEN m.put_timestamp IS NULL OR
+                              c.put_timestamp > m.put_timestamp
+                         THEN c.put_timestamp ELSE m.put_timestamp END,
+                    CASE WHEN m.delete_timestamp IS NULL OR
+                              c.delete_timestamp > m.delete_timestamp
+                         THEN c.delete_timestamp ELSE m.delete_timestamp END,
+                    coalesce(m.object_count, c.object_count),
+                    coalesce(m.bytes_used, c.bytes_used),
+                    m.deleted, m.seq, 1
+                FROM container_merge m
+                CROSS JOIN container c
+                ON c.name = m.name AND c.deleted IN (0, 1)
+            ''')
+            conn.execute('''
+                UPDATE container_merge
+                SET deleted = CASE
+                    WHEN (delete_timestamp > put_timestamp OR
+                          (put_timestamp IS NULL AND
+                           delete_timestamp IS NOT NULL)) AND
+                         (object_count IS NULL OR
+                          object_count IN ('', 0, '0'))
+                    THEN 1 ELSE 0 END
+                WHERE merged = 1
+            ''')
+            conn.execute('''
+                DELETE FROM container WHERE ROWID IN (
+                    SELECT c.ROWID FROM container_merge m
+                    CROSS JOIN container c
+                    ON c.name = m.name AND c.deleted IN (0, 1)
+                    WHERE m.merged = 1)
+            ''')
+            conn.execute('''
+                INSERT INTO container (name, put_timestamp, delete_timestamp,
+                    object_count, bytes_used, deleted)
+                SELECT name, put_timestamp, delete_timestamp, object_count,
+                    bytes_used, deleted
+                FROM container_merge ORDER BY seq
+            ''')
+            conn.execute('DELETE FROM container_merge')
             if source:
                 try:
                     conn.execute('''
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import time
+from itertools import chain, islice
 from xml.sax import saxutils
 
 from swift.common.swob import HTTPOk, HTTPNoContent
@@ -36,11 +37,61 @@ class FakeAccountBroker(object):
     def list_containers_iter(self, *_, **__):
         return []
 
+    def list_containers_batches(self, *_, **__):
+        return iter([])
+
     @property
     def metadata(self):
         return {}
 
 
+def _json_listing(batches):
+    """
+    Serialize batches of account listing entries as a JSON list.
+
+    :param batches: iterable of lists of entries from list_containers_iter
+    :returns: a generator of parts of the body, one per batch
+    """
+    start = '['
+    for batch in batches:
+        data = []
+        for (name, object_count, bytes_used, is_subdir) in batch:
+            if is_subdir:
+                data.append({'subdir': name})
+            else:
+                data.append({'name': name, 'count': object_count,
+                             'bytes': bytes_used})
+        yield start + json.dumps(data)[1:-1]
+        start = ', '
+    yield '[]' if start == '[' else ']'
+
+
+def _xml_listing(account, batches):
+    """
+    Serialize batches of account listing entries as an XML document.
+
+    :param account: the account name
+    :param batches: iterable of lists of entries from list_containers_iter
+    :returns: a generator of parts of the body, one per batch
+    """
+    output_list = ['<?xml version="1.0" encoding="UTF-8"?>',
+                   '<account name=%s>' % saxutils.quoteattr(account)]
+    for batch in batches:
+        for (name, object_count, bytes_used, is_subdir) in batch:
+            if is_subdir:
+                output_list.append(
+                    '<subdir name=%s />' % saxutils.quoteattr(name))
+            else:
+                item = '<container><name>%s</name><count>%s</count>' \
+                       '<bytes>%s</bytes></container>' % \
+                       (saxutils.escape(name), object_count, bytes_used)
+                output_list.append(item)
+        yield '\n'.join(output_list)
+        output_list = ['']
+    output_list.append('</account>')
+    yield '\n'.join(output_list)
+
+
 def account_listing_response(account, req, response_content_type, broker=None,
                              limit='', marker='', end_marker='', prefix='',
                              delimiter=''):
@@ -58,39 +109,31 @@ def account_listing_response(account, req, response_content_type, broker=None,
                         for key, (value, timestamp) in
                         broker.metadata.iteritems() if value != '')
 
-    account_list = broker.list_containers_iter(limit, marker, end_marker,
-                                               prefix, delimiter)
+    account_list = broker.list_containers_batches(limit, marker, end_marker,
+                                                  prefix, delimiter)
+    # Read up to two batches now, so that errors still get an error
+    # response, and only a listing longer than a batch is streamed
+    batches = list(islice(account_list, 2))
+    streaming = len(batches) > 1
+    if streaming:
+        batches = chain(batches, account_list)
     if response_content_type == 'application/json':
-        data = []
-        for (name, object_count, bytes_used, is_subdir) in account_list:
-            if is_subdir:
-                data.append({'subdir': name})
-            else:
-                data.append({'name': name, 'count': object_count,
-                             'bytes': bytes_used})
-        account_list = json.dumps(data)
+        account_list = _json_listing(batches)
     elif response_content_type.endswith('/xml'):
-        output_list = ['<?xml version="1.0" encoding="UTF-8"?>',
-                       '<account name=%s>' % saxutils.quoteattr(account)]
-        for (name, object_count, bytes_used, is_subdir) in account_list:
-            if is_subdir:
-                output_list.append(
-                    '<subdir name=%s />' % saxutils.quoteattr(name))
-            else:
-                item = '<container><name>%s</name><count>%s</count>' \
-                       '<bytes>%s</bytes></container>' % \
-                       (saxutils.escape(name), object_count, bytes_used)
-                output_list.append(item)
-        output_list.append('</account>')
-        account_list = '\n'.join(output_list)
+        account_list = _xml_listing(account, batches)
     else:
-        if not account_list:
+        if not batches:
             resp = HTTPNoContent(request=req, headers=resp_headers)
             resp.content_type = response_content_type
             resp.charset = 'utf-8'
             return resp
-        account_list = '\n'.join(r[0] for r in account_list) + '\n'
-    ret = HTTPOk(body=account_list, request=req, headers=resp_headers)
+        account_list = ('\n'.join(r[0] for r in batch) + '\n'
+                        for batch in batches)
+    if streaming:
+        ret = HTTPOk(app_iter=account_list, request=req, headers=resp_headers)
+    else:
+        ret = HTTPOk(body=''.join(account_list), request=req,
+                     headers=resp_headers)
     ret.content_type = response_content_type
     ret.charset = 'utf-8'
     return ret
@@ -27,8 +27,11 @@ BufferedHTTPResponse.
 """
 
 from swift import gettext_ as _
+from collections import defaultdict
 from urllib import quote
 import logging
+import select
+import socket
 import time
 
 from eventlet.green.httplib import CONTINUE, HTTPConnection, HTTPMessage, \
@@ -129,8 +132,92 @@ class BufferedHTTPConnection(HTTPConnection):
         return response
 
 
+class ConnectionPool(object):
+    """
+    Per-process pool of idle, persistent BufferedHTTPConnections to backend
+    servers, keyed by (ip, port).
+
+    Connections are handed out by :func:`http_connect` and come back through
+    :meth:`put` once their response has been read to the end. Idle
+    connections are dropped when they have been idle too long or when the
+    server has closed or written to them, and :meth:`discard` drops every
+    idle connection to a node that just failed.
+
+    :param max_idle_per_node: maximum number of idle connections kept to
+                              each (ip, port)
+    :param idle_timeout: seconds an idle connection may be kept
+    :param logger: optional logger used to count connection_pool.hit and
+                   connection_pool.miss
+    """
+
+    def __init__(self, max_idle_per_node=8, idle_timeout=10, logger=None):
+        self.max_idle_per_node = max_idle_per_node
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self._idle = defaultdict(list)
+
+    def _increment(self, metric):
+        if self.logger:
+            self.logger.increment('connection_pool.%s' % metric)
+
+    def _is_usable(self, conn, idle_since):
+        if conn.sock is None or \
+                time.time() - idle_since > self.idle_timeout:
+            return False
+        try:
+            # An idle connection has nothing to read; if it is readable the
+            # server has closed it or sent something we can't make sense of.
+            readable = select.select([conn.sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def get(self, ipaddr, port):
+        """
+        Take an idle connection to the given node out of the pool.
+
+        :param ipaddr: IP address of the node
+        :param port: port of the node
+        :returns: a connected BufferedHTTPConnection, or None if the pool has
+                  no usable connection to the node
+        """
+        idle = self._idle.get((ipaddr, str(port)))
+        while idle:
+            idle_since, conn = idle.pop()
+            if self._is_usable(conn, idle_since):
+                self._increment('hit')
+                return conn
+            conn.close()
+        self._increment('miss')
+        return None
+
+    def put(self, conn):
+        """
+        Return a connection to the pool, or close it if it can't be reused
+        or the node already has max_idle_per_node idle connections.
+
+        :param conn: a BufferedHTTPConnection whose last response has been
+                     read to the end and closed
+        """
+        idle = self._idle[(conn.ipaddr, str(conn.port))]
+        if conn.sock is None or len(idle) >= self.max_idle_per_node:
+            conn.close()
+            return
+        idle.append((time.time(), conn))
+
+    def discard(self, ipaddr, port):
+        """
+        Close every idle connection to a node.
+
+        :param ipaddr: IP address of the node
+        :param port: port of the node
+        """
+        for _junk, conn in self._idle.pop((ipaddr, str(port)), []):
+            conn.close()
+
+
 def http_connect(ipaddr, port, device, partition, method, path,
-                 headers=None, query_string=None, ssl=False):
+                 headers=None, query_string=None, ssl=False, pool=None):
     """
     Helper function to create an HTTPConnection object. If ssl is set True,
     HTTPSConnection will be used. However, if ssl=False, BufferedHTTPConnection
@@ -145,6 +232,7 @@ def http_connect(ipaddr, port, device, partition, method, path,
     :param headers: dictionary of headers
     :param query_string: request query string
     :param ssl: set True if SSL should be used (default: False)
+    :param pool: optional ConnectionPool to take an idle connection from
     :returns: HTTPConnection object
     """
     if isinstance(path, unicode):
@@ -154,11 +242,11 @@ def http_connect(ipaddr, port, device, partition, method, path,
             logging.exception(_('Error encoding to UTF-8: %s'), str(e))
     path = quote('/' + device + '/' + str(partition) + path)
     return http_connect_raw(
-        ipaddr, port, method, path, headers, query_string, ssl)
+        ipaddr, port, method, path, headers, query_string, ssl, pool)
 
 
 def http_connect_raw(ipaddr, port, method, path, headers=None,
-                     query_string=None, ssl=False):
+                     query_string=None, ssl=False, pool=None):
     """
     Helper function to create an HTTPConnection object. If ssl is set True,
     HTTPSConnection will be used. However, if ssl=False, BufferedHTTPConnection
@@ -171,20 +259,39 @@ def http_connect_raw(ipaddr, port, method, path, headers=None,
     :param headers: dictionary of headers
     :param query_string: request query string
     :param ssl: set True if SSL should be used (default: False)
+    :param pool: optional ConnectionPool to take an idle connection from; the
+                 pool is remembered as conn.pool so the caller can put the
+                 connection back once its response has been read
     :returns: HTTPConnection object
     """
     if not port:
         port = 443 if ssl else 80
+    if query_string:
+        path += '?' + query_string
+    if pool and not ssl:
+        conn = pool.get(ipaddr, port)
+        if conn:
+            try:
+                _send_request(conn, method, path, headers)
+                return conn
+            except socket.error:
+                # The server went away between the health check and now;
+                # nothing has been sent, so just use a new connection.
+                conn.close()
     if ssl:
         conn = HTTPSConnection('%s:%s' % (ipaddr, port))
     else:
         conn = BufferedHTTPConnection('%s:%s' % (ipaddr, port))
-    if query_string:
-        path += '?' + query_string
+        conn.ipaddr = ipaddr
+        conn.pool = pool
+    _send_request(conn, method, path, headers)
+    return conn
+
+
+def _send_request(conn, method, path, headers):
     conn.path = path
     conn.putrequest(method, path, skip_host=(headers and 'Host' in headers))
     if headers:
         for header, value in headers.iteritems():
             conn.putheader(header, str(value))
     conn.endheaders()
-    return conn
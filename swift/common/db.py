@@ -23,6 +23,8 @@ from uuid import uuid4
 import sys
 import time
 import errno
+import struct
+import zlib
 from swift import gettext_ as _
 from tempfile import mkstemp
 
@@ -30,7 +32,7 @@ from eventlet import sleep, Timeout
 import sqlite3
 
 from swift.common.utils import json, normalize_timestamp, renamer, \
-    mkdirs, lock_parent_directory, fallocate
+    mkdirs, lock_parent_directory, fallocate, OrderedDict
 from swift.common.exceptions import LockTimeout
 
 
@@ -42,6 +44,116 @@ BROKER_TIMEOUT = 25
 PICKLE_PROTOCOL = 2
 #: Max number of pending entries
 PENDING_CAP = 131072
+#: Max number of rows a batched listing reads from the DB at a time
+LISTING_BATCH_SIZE = 1000
+#: Starts a binary entry in a .pending file; older entries start with ':'
+PENDING_BINARY_MARKER = '\x00'
+#: Follows PENDING_BINARY_MARKER: length and CRC32 of the encoded update
+PENDING_HEADER = struct.Struct('!Ii')
+#: SQLite journal mode for account and container DBs; see set_db_profile()
+DB_JOURNAL_MODE = 'DELETE'
+#: Bytes of each DB to access through mmap; 0 leaves it to SQLite
+DB_MMAP_SIZE = 0
+#: Pages of each DB to cache per connection; 0 leaves it to SQLite
+DB_CACHE_SIZE = 0
+#: Page size for newly created DBs; 0 leaves it to SQLite
+DB_PAGE_SIZE = 0
+#: Open connections kept for reuse, or None; see DBConnectionCache
+DB_CONNECTION_CACHE = None
+
+
+def set_db_profile(conf):
+    """
+    Set how account and container DBs are accessed, from the db_journal_mode
+    (delete or wal), db_mmap_size, db_cache_size, db_page_size and
+    db_conn_cache_size options in a server or daemon config.
+
+    :param conf: the config dict
+    """
+    global DB_JOURNAL_MODE, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_PAGE_SIZE, \
+        DB_CONNECTION_CACHE
+    DB_JOURNAL_MODE = conf.get('db_journal_mode', 'delete').upper()
+    if DB_JOURNAL_MODE not in ('DELETE', 'WAL'):
+        raise ValueError('db_journal_mode must be delete or wal, not %r' %
+                         conf['db_journal_mode'])
+    DB_MMAP_SIZE = int(conf.get('db_mmap_size', 0))
+    DB_CACHE_SIZE = int(conf.get('db_cache_size', 0))
+    DB_PAGE_SIZE = int(conf.get('db_page_size', 0))
+    if DB_CONNECTION_CACHE is not None:
+        DB_CONNECTION_CACHE.clear()
+    cache_size = int(conf.get('db_conn_cache_size', 0))
+    DB_CONNECTION_CACHE = \
+        DBConnectionCache(cache_size) if cache_size > 0 else None
+
+
+def pending_entry(data):
+    """
+    Frame the binary encoding of an update for appending to a .pending file.
+
+    :param data: the encoded update
+    :returns: the entry to append
+    """
+    return PENDING_BINARY_MARKER + \
+        PENDING_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def _pending_frame_end(data, pos):
+    """
+    Check for a whole binary entry at a position in .pending file contents.
+
+    :returns: the end of the entry, or None if there is no valid entry there
+    """
+    start = pos + 1 + PENDING_HEADER.size
+    if data[pos:pos + 1] != PENDING_BINARY_MARKER or start > len(data):
+        return None
+    length, crc = PENDING_HEADER.unpack_from(data, pos + 1)
+    end = start + length
+    # updates are never empty; and runs of zeros would look like empty ones
+    if not length or end > len(data) or \
+            zlib.crc32(data[start:end]) != crc:
+        return None
+    return end
+
+
+def split_pending(data):
+    """
+    Split the contents of a .pending file into entries. The file may hold
+    both binary entries, which are framed by :func:`pending_entry`, and
+    older base64 entries, which are separated by colons.
+
+    A torn binary entry is yielded as is, so it fails to load, and splitting
+    picks up again at the next whole binary entry.
+
+    :param data: the contents of the .pending file
+    :returns: a generator of entries; binary entries are returned as
+              PENDING_BINARY_MARKER followed by the encoded update
+    """
+    pos = 0
+    while pos < len(data):
+        if data[pos] == PENDING_BINARY_MARKER:
+            end = _pending_frame_end(data, pos)
+            if end is None:
+                end = data.find(PENDING_BINARY_MARKER, pos + 1)
+                while end >= 0 and _pending_frame_end(data, end) is None:
+                    end = data.find(PENDING_BINARY_MARKER, end + 1)
+                if end < 0:
+                    end = len(data)
+                yield data[pos:end]
+            else:
+                yield PENDING_BINARY_MARKER + \
+                    data[pos + 1 + PENDING_HEADER.size:end]
+            pos = end
+        else:
+            end = data.find(':', pos + 1)
+            if end < 0:
+                end = len(data)
+            marker = data.find(PENDING_BINARY_MARKER, pos + 1, end)
+            if marker >= 0:
+                end = marker
+            entry = data[pos:end].lstrip(':')
+            if entry:
+                yield entry
+            pos = end
 
 
 def utf8encode(*args):
@@ -126,6 +238,11 @@ class GreenDBCursor(sqlite3.Cursor):
             self.timeout, self.db_file, lambda: sqlite3.Cursor.execute(
                 self, *args, **kwargs))
 
+    def executemany(self, *args, **kwargs):
+        return _db_timeout(
+            self.timeout, self.db_file, lambda: sqlite3.Cursor.executemany(
+                self, *args, **kwargs))
+
 
 def dict_factory(crs, row):
     """
@@ -147,10 +264,40 @@ def chexor(old, name, timestamp):
     :param timestamp: timestamp of the new record
     :returns: a hex representation of the new hash value
     """
+    return '%032x' % (int(old, 16) ^ entry_hash(name, timestamp))
+
+
+def entry_hash(name, timestamp):
+    """
+    Get the 128-bit hash that :func:`chexor` XORs into the DB hash for an
+    entry, so that callers changing many entries can XOR them together and
+    update the DB hash once.
+
+    :param name: name of the object or container, as unicode or UTF-8
+    :param timestamp: timestamp of the record
+    :returns: the hash as an int
+    """
     if name is None:
         raise Exception('name is None!')
-    new = hashlib.md5(('%s-%s' % (name, timestamp)).encode('utf8')).hexdigest()
-    return '%032x' % (int(old, 16) ^ int(new, 16))
+    entry = '%s-%s' % (name, timestamp)
+    if isinstance(entry, unicode):
+        entry = entry.encode('utf8')
+    return int(hashlib.md5(entry).hexdigest(), 16)
+
+
+def remove_db_logs(db_file):
+    """
+    Remove the write-ahead log and shared-memory index that SQLite may have
+    left next to a DB file. Only do this while nothing has the DB open.
+
+    :param db_file: path to the DB
+    """
+    for suffix in ('-wal', '-shm'):
+        try:
+            os.unlink(db_file + suffix)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
 
 
 def get_db_connection(path, timeout=30, okay_to_create=False):
@@ -179,7 +326,20 @@ def get_db_connection(path, timeout=30, okay_to_create=False):
             cur.execute('PRAGMA synchronous = NORMAL')
             cur.execute('PRAGMA count_changes = OFF')
             cur.execute('PRAGMA temp_store = MEMORY')
-            cur.execute('PRAGMA journal_mode = DELETE')
+            if DB_MMAP_SIZE:
+                cur.execute('PRAGMA mmap_size = %d' % DB_MMAP_SIZE)
+            if DB_CACHE_SIZE:
+                cur.execute('PRAGMA cache_size = %d' % DB_CACHE_SIZE)
+            journal_mode = cur.execute('PRAGMA journal_mode').fetchone()[0]
+        if path != ':memory:' and journal_mode.upper() != DB_JOURNAL_MODE:
+            # Switching needs the DB to ourselves, so don't wait for it; a
+            # later connection will switch it instead.
+            with closing(conn.cursor(sqlite3.Cursor)) as cur:
+                try:
+                    cur.execute('PRAGMA journal_mode = %s' % DB_JOURNAL_MODE)
+                except sqlite3.OperationalError as err:
+                    if 'locked' not in str(err):
+                        raise
         conn.create_function('chexor', 3, chexor)
     except sqlite3.DatabaseError:
         import traceback
@@ -188,6 +348,100 @@ def get_db_connection(path, timeout=30, okay_to_create=False):
     return conn
 
 
+class DBConnectionCache(object):
+    """
+    Open DB connections kept for reuse by later brokers of the same DB, so
+    that a busy DB doesn't pay for a new connection on every request.
+
+    One idle connection is kept per DB, and the least recently used ones are
+    closed when the cache is full. A connection is only handed out again if
+    the DB file is still the one it was opened on, so DBs that have since
+    been deleted, quarantined or replaced by replication are not reused.
+
+    This is meant to be shared by the greenthreads of a single process and
+    does no locking.
+
+    :param maxsize: the most idle connections to keep
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._conns = OrderedDict()
+
+    def __len__(self):
+        return len(self._conns)
+
+    def connect(self, db_file, timeout):
+        """
+        Open a new connection that may later be put in the cache.
+
+        :param db_file: path to the DB
+        :param timeout: timeout for the connection
+        :returns: DB connection object
+        """
+        # stat before connecting, so if the file is replaced in between the
+        # connection is only ever thrown away too soon
+        try:
+            stat = os.stat(db_file)
+        except OSError:
+            stat = None
+        conn = get_db_connection(db_file, timeout)
+        if stat:
+            conn.file_id = (stat.st_dev, stat.st_ino)
+        return conn
+
+    def get(self, db_file):
+        """
+        Take the idle connection to a DB out of the cache.
+
+        :param db_file: path to the DB
+        :returns: DB connection object, or None
+        """
+        conn = self._conns.pop(db_file, None)
+        if conn:
+            try:
+                stat = os.stat(db_file)
+            except OSError:
+                stat = None
+            if not stat or conn.file_id != (stat.st_dev, stat.st_ino):
+                conn.close()
+                conn = None
+        return conn
+
+    def put(self, db_file, conn):
+        """
+        Return an idle connection to the cache.
+
+        :param db_file: path to the DB
+        :param conn: DB connection object from :func:`connect` or
+                     :func:`get`, with no transaction open
+        """
+        if not getattr(conn, 'file_id', None):
+            conn.close()
+            return
+        old_conn = self._conns.pop(db_file, None)
+        if old_conn:
+            old_conn.close()
+        while len(self._conns) >= self.maxsize:
+            self._conns.popitem(last=False)[1].close()
+        self._conns[db_file] = conn
+
+    def discard(self, db_file):
+        """
+        Close the idle connection to a DB, if there is one.
+
+        :param db_file: path to the DB
+        """
+        conn = self._conns.pop(db_file, None)
+        if conn:
+            conn.close()
+
+    def clear(self):
+        """Close all the idle connections."""
+        while self._conns:
+            self._conns.popitem()[1].close()
+
+
 class DatabaseBroker(object):
     """Encapsulates working with a database."""
 
@@ -233,6 +487,8 @@ class DatabaseBroker(object):
         # creating dbs implicitly does a lot of transactions, so we
         # pick fast, unsafe options here and do a big fsync at the end.
         with closing(conn.cursor()) as cur:
+            if DB_PAGE_SIZE:
+                cur.execute('PRAGMA page_size = %d' % DB_PAGE_SIZE)
             cur.execute('PRAGMA synchronous = OFF')
             cur.execute('PRAGMA temp_store = MEMORY')
             cur.execute('PRAGMA journal_mode = MEMORY')
@@ -289,7 +545,7 @@ class DatabaseBroker(object):
                     # of the system were "racing" each other.
                     raise DatabaseAlreadyExists(self.db_file)
                 renamer(tmp_db_file, self.db_file)
-            self.conn = get_db_connection(self.db_file, self.timeout)
+            self.conn = self._connect()
         else:
             self.conn = conn
 
@@ -323,6 +579,8 @@ class DatabaseBroker(object):
             exc_hint = 'corrupted'
         else:
             raise exc_type, exc_value, exc_traceback
+        if DB_CONNECTION_CACHE is not None:
+            DB_CONNECTION_CACHE.discard(self.db_file)
         prefix_path = os.path.dirname(self.db_dir)
         partition_path = os.path.dirname(prefix_path)
         dbs_path = os.path.dirname(partition_path)
@@ -342,13 +600,33 @@ class DatabaseBroker(object):
         self.logger.error(detail)
         raise sqlite3.DatabaseError(detail)
 
+    def _connect(self):
+        """
+        Get a connection to the DB, from the connection cache if there is
+        one.
+        """
+        if self.db_file == ':memory:' or DB_CONNECTION_CACHE is None:
+            return get_db_connection(self.db_file, self.timeout)
+        return DB_CONNECTION_CACHE.get(self.db_file) or \
+            DB_CONNECTION_CACHE.connect(self.db_file, self.timeout)
+
+    def _release(self, conn):
+        """
+        Keep a connection for the broker's next use, in the connection cache
+        if there is one.
+        """
+        if self.db_file == ':memory:' or DB_CONNECTION_CACHE is None:
+            self.conn = conn
+        else:
+            DB_CONNECTION_CACHE.put(self.db_file, conn)
+
     @contextmanager
     def get(self):
         """Use with the "with" statement; returns a database connection."""
         if not self.conn:
             if self.db_file != ':memory:' and os.path.exists(self.db_file):
                 try:
-                    self.conn = get_db_connection(self.db_file, self.timeout)
+                    self.conn = self._connect()
                 except (sqlite3.DatabaseError, DatabaseConnectionError):
                     self.possibly_quarantine(*sys.exc_info())
             else:
@@ -358,7 +636,7 @@ class DatabaseBroker(object):
         try:
             yield conn
             conn.rollback()
-            self.conn = conn
+            self._release(conn)
         except sqlite3.DatabaseError:
             try:
                 conn.close()
@@ -374,7 +652,7 @@ class DatabaseBroker(object):
         """Use with the "with" statement; locks a database."""
         if not self.conn:
             if self.db_file != ':memory:' and os.path.exists(self.db_file):
-                self.conn = get_db_connection(self.db_file, self.timeout)
+                self.conn = self._connect()
             else:
                 raise DatabaseConnectionError(self.db_file, "DB doesn't exist")
         conn = self.conn
@@ -389,12 +667,71 @@ class DatabaseBroker(object):
         try:
             conn.execute('ROLLBACK')
             conn.isolation_level = orig_isolation_level
-            self.conn = conn
+            self._release(conn)
         except (Exception, Timeout):
             logging.exception(
                 _('Broker error trying to rollback locked connection'))
             conn.close()
 
+    @contextmanager
+    def _transaction(self, conn):
+        """
+        Use with the "with" statement; runs the statements in it in one
+        transaction, committed at the end. The transaction takes the DB's
+        write lock up front, so what it reads cannot change before it
+        writes, and schema changes made in it are part of it too.
+
+        :param conn: DB connection object
+        """
+        orig_isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except (Exception, Timeout):
+            exc_info = sys.exc_info()
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass  # the error may have ended the transaction already
+            conn.isolation_level = orig_isolation_level
+            raise exc_info[0], exc_info[1], exc_info[2]
+        conn.execute('COMMIT')
+        conn.isolation_level = orig_isolation_level
+
+    def checkpoint(self):
+        """
+        Copy the changes committed to the DB's write-ahead log, if it has
+        one, into the DB file itself so the file can be copied on its own.
+        This does not wait for other connections, so it may be called while
+        holding :func:`lock`.
+
+        :returns: True if the DB file holds every committed change
+        """
+        if self.db_file == ':memory:' or \
+                not os.path.exists(self.db_file + '-wal'):
+            return True
+        conn = sqlite3.connect(self.db_file, check_same_thread=False,
+                               factory=GreenDBConnection, timeout=0)
+        try:
+            busy, log_frames, checkpointed = conn.execute(
+                'PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        finally:
+            conn.close()
+        return log_frames == checkpointed
+
+    def close(self):
+        """
+        Close the broker's connection to the DB, and any cached one. When the
+        last connection to a DB with a write-ahead log is closed, SQLite
+        copies the log into the DB file and removes it.
+        """
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        if DB_CONNECTION_CACHE is not None:
+            DB_CONNECTION_CACHE.discard(self.db_file)
+
     def newid(self, remote_id):
         """
         Re-id the database.  This should be called after an rsync.
@@ -452,6 +789,28 @@ class DatabaseBroker(object):
             curs.row_factory = dict_factory
             return [r for r in curs]
 
+    def _list_batches(self, list_func, limit, marker, *args):
+        """
+        Run a listing as a series of smaller listings, each continuing from
+        the last name of the one before. The DB is only held while a batch
+        is read, not while it is sent on.
+
+        :param list_func: the listing method, such as list_objects_iter
+        :param limit: maximum number of entries to get
+        :param marker: marker query
+        :param args: the rest of the arguments to list_func
+        :returns: a generator of the lists list_func returns; none are empty
+        """
+        while limit > 0:
+            batch_limit = min(limit, LISTING_BATCH_SIZE)
+            batch = list_func(batch_limit, marker, *args)
+            if batch:
+                yield batch
+            if len(batch) < batch_limit:
+                return
+            limit -= len(batch)
+            marker = batch[-1][0]
+
     def get_sync(self, id, incoming=True):
         """
         Gets the most recent sync point for a server from the sync table.
@@ -533,7 +892,7 @@ class DatabaseBroker(object):
                     self.merge_items(item_list)
                 return
             with open(self.pending_file, 'r+b') as fp:
-                for entry in fp.read().split(':'):
+                for entry in split_pending(fp.read()):
                     if entry:
                         try:
                             self._commit_puts_load(item_list, entry)
@@ -694,23 +1053,34 @@ class DatabaseBroker(object):
         """
         self._commit_puts()
         with self.get() as conn:
-            conn.execute('''
-                DELETE FROM %s WHERE deleted = 1 AND %s < ?
-            ''' % (self.db_contains_type, self.db_reclaim_timestamp),
-                (age_timestamp,))
-            try:
-                conn.execute('''
-                    DELETE FROM outgoing_sync WHERE updated_at < ?
-                ''', (sync_timestamp,))
-                conn.execute('''
-                    DELETE FROM incoming_sync WHERE updated_at < ?
-                ''', (sync_timestamp,))
-            except sqlite3.OperationalError as err:
-                # Old dbs didn't have updated_at in the _sync tables.
-                if 'no such column: updated_at' not in str(err):
-                    raise
-            DatabaseBroker._reclaim(self, conn, age_timestamp)
-            conn.commit()
+            with self._transaction(conn):
+                self._reclaim_items(conn, age_timestamp)
+                try:
+                    conn.execute('''
+                        DELETE FROM outgoing_sync WHERE updated_at < ?
+                    ''', (sync_timestamp,))
+                    conn.execute('''
+                        DELETE FROM incoming_sync WHERE updated_at < ?
+                    ''', (sync_timestamp,))
+                except sqlite3.OperationalError as err:
+                    # Old dbs didn't have updated_at in the _sync tables.
+                    if 'no such column: updated_at' not in str(err):
+                        raise
+                DatabaseBroker._reclaim(self, conn, age_timestamp)
+
+    def _reclaim_items(self, conn, timestamp):
+        """
+        Delete the rows of the db_contains_type table that are marked
+        deleted and older than the timestamp, using the given database
+        connection, within reclaim's transaction.
+
+        :param conn: DB connection object
+        :param timestamp: max created_at timestamp of rows to delete
+        """
+        conn.execute('''
+            DELETE FROM %s WHERE deleted = 1 AND %s < ?
+        ''' % (self.db_contains_type, self.db_reclaim_timestamp),
+            (timestamp,))
 
     def _reclaim(self, conn, timestamp):
         """
@@ -16,18 +16,24 @@
 import os
 import random
 import math
+import signal
+import sys
 import time
 import shutil
 import uuid
 import errno
 import re
+import zlib
 from swift import gettext_ as _
+from tempfile import mkstemp
 
-from eventlet import GreenPool, sleep, Timeout
+from eventlet import GreenPool, patcher, sleep, spawn, Timeout
 from eventlet.green import subprocess
+from eventlet.semaphore import Semaphore
 import simplejson
 
 import swift.common.db
+from swift.common.db import remove_db_logs
 from swift.common.direct_client import quote
 from swift.common.utils import get_logger, whataremyips, storage_directory, \
     renamer, mkdirs, lock_parent_directory, config_true_value, \
@@ -43,6 +49,16 @@ from swift.common.swob import Response, HTTPNotFound, HTTPNoContent, \
 
 DEBUG_TIMINGS_THRESHOLD = 10
 
+#: zlib level of compressed REPLICATE bodies; replication rows compress well
+#: even at the fastest level
+REPLICATE_COMPRESSION_LEVEL = 1
+
+#: Replication priorities of DBs, most urgent first: DBs on handoff nodes,
+#: DBs with rows not yet sent to all their peers, DBs changed since the last
+#: pass began, and the rest.
+PRIORITY_HANDOFF, PRIORITY_PENDING, PRIORITY_MODIFIED, PRIORITY_IDLE = \
+    range(4)
+
 
 def quarantine_db(object_file, server_type):
     """
@@ -107,15 +123,37 @@ def roundrobin_datadirs(datadirs):
                 its.remove(it)
 
 
+def get_replicate_args(req):
+    """
+    Get the RPC call of a REPLICATE request from its JSON body, which
+    ReplConnection compresses for servers that accept that.
+
+    :param req: swob.Request of the REPLICATE call
+    :returns: the decoded RPC call, a list of the operation and its args
+    :raises ValueError: if the body cannot be decoded
+    """
+    body = req.body
+    if req.headers.get('Content-Encoding') == 'deflate':
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as err:
+            raise ValueError(str(err))
+    return simplejson.loads(body)
+
+
 class ReplConnection(BufferedHTTPConnection):
     """
     Helper to simplify REPLICATEing to a remote server.
+
+    Set compress to send request bodies compressed, once the remote server
+    has said it accepts that.
     """
 
     def __init__(self, node, partition, hash_, logger):
         ""
         self.logger = logger
         self.node = node
+        self.compress = False
         host = "%s:%s" % (node['replication_ip'], node['replication_port'])
         BufferedHTTPConnection.__init__(self, host)
         self.path = '/%s/%s/%s' % (node['device'], partition, hash_)
@@ -130,8 +168,11 @@ class ReplConnection(BufferedHTTPConnection):
         """
         try:
             body = simplejson.dumps(args)
-            self.request('REPLICATE', self.path, body,
-                         {'Content-Type': 'application/json'})
+            headers = {'Content-Type': 'application/json'}
+            if self.compress:
+                body = zlib.compress(body, REPLICATE_COMPRESSION_LEVEL)
+                headers['Content-Encoding'] = 'deflate'
+            self.request('REPLICATE', self.path, body, headers)
             response = self.getresponse()
             response.data = response.read()
             return response
@@ -154,9 +195,17 @@ class Replicator(Daemon):
         self.port = int(conf.get('bind_port', self.default_port))
         concurrency = int(conf.get('concurrency', 8))
         self.cpool = GreenPool(size=concurrency)
+        self.device_concurrency = int(conf.get('device_concurrency') or
+                                      concurrency)
+        self.node_concurrency = int(conf.get('node_concurrency') or
+                                    concurrency)
+        self.node_semaphores = {}
+        self.processes = int(conf.get('processes', 0))
         swift_dir = conf.get('swift_dir', '/etc/swift')
         self.ring = ring.Ring(swift_dir, ring_name=self.server_type)
         self.per_diff = int(conf.get('per_diff', 1000))
+        self.max_per_diff = max(int(conf.get('max_per_diff', 10000)),
+                                self.per_diff)
         self.max_diffs = int(conf.get('max_diffs') or 100)
         self.interval = int(conf.get('interval') or
                             conf.get('run_pause') or 30)
@@ -166,7 +215,9 @@ class Replicator(Daemon):
         self.reclaim_age = float(conf.get('reclaim_age', 86400 * 7))
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.set_db_profile(conf)
         self._zero_stats()
+        self.modified_since = self.stats['start']
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
         self.recon_replicator = '%s.recon' % self.server_type
@@ -181,6 +232,7 @@ class Replicator(Daemon):
                       'no_change': 0, 'hashmatch': 0, 'rsync': 0, 'diff': 0,
                       'remove': 0, 'empty': 0, 'remote_merge': 0,
                       'start': time.time(), 'diff_capped': 0}
+        self.replication_lag = 0
 
     def _report_stats(self):
         """Report the current stats to the logs."""
@@ -194,10 +246,14 @@ class Replicator(Daemon):
         self.logger.info(_('Removed %(remove)d dbs') % self.stats)
         self.logger.info(_('%(success)s successes, %(failure)s failures')
                          % self.stats)
+        self.logger.info(_('DBs with pending changes were replicated within '
+                           '%.2fs of the start of the run'),
+                         self.replication_lag)
         dump_recon_cache(
             {'replication_stats': self.stats,
              'replication_time': time.time() - self.stats['start'],
-             'replication_last': time.time()},
+             'replication_last': time.time(),
+             'replication_lag': self.replication_lag},
             self.rcache, self.logger)
         self.logger.info(' '.join(['%s:%s' % item for item in
                          self.stats.items() if item[0] in
@@ -247,14 +303,19 @@ class Replicator(Daemon):
         else:
             remote_file = '%s::%s/%s/tmp/%s' % (
                 device_ip, self.server_type, device['device'], local_id)
+        # with a write-ahead log, recent changes are not in the db file yet
+        broker.checkpoint()
         mtime = os.path.getmtime(broker.db_file)
         if not self._rsync_file(broker.db_file, remote_file):
             return False
         # perform block-level sync if the db was modified during the first sync
         if os.path.exists(broker.db_file + '-journal') or \
+                os.path.exists(broker.db_file + '-wal') or \
                 os.path.getmtime(broker.db_file) > mtime:
             # grab a lock so nobody else can modify it
             with broker.lock():
+                if not broker.checkpoint():
+                    return False
                 if not self._rsync_file(broker.db_file, remote_file, False):
                     return False
         with Timeout(replicate_timeout or self.node_timeout):
@@ -265,6 +326,12 @@ class Replicator(Daemon):
         """
         Sync a db by sending all records since the last sync.
 
+        Batches start at per_diff rows and double, up to max_per_diff, while
+        the remote merges them in under a quarter of node_timeout; they halve
+        when it takes over half. Each batch is read while the remote merges
+        the one before, and the sync point is saved as each is merged, so a
+        sync cut short by max_diffs or an error picks up where it left off.
+
         :param point: synchronization high water mark between the replicas
         :param broker: database broker object
         :param http: ReplConnection object for the remote server
@@ -277,12 +344,23 @@ class Replicator(Daemon):
         self.logger.increment('diffs')
         self.logger.debug(_('Syncing chunks with %s'), http.host)
         sync_table = broker.get_syncs()
-        objects = broker.get_items_since(point, self.per_diff)
-        diffs = 0
-        while len(objects) and diffs < self.max_diffs:
-            diffs += 1
-            with Timeout(self.node_timeout):
-                response = http.replicate('merge_items', objects, local_id)
+        per_diff = self.per_diff
+        # max_diffs caps the rows sent per pass, however large the batches
+        rows_left = self.max_diffs * self.per_diff
+        objects = broker.get_items_since(point, min(per_diff, rows_left))
+        while objects and rows_left > 0:
+            rows_left -= len(objects)
+            next_point = objects[-1]['ROWID']
+            # past the cap, only look for whether any rows are left
+            next_objects = spawn(broker.get_items_since, next_point,
+                                 max(min(per_diff, rows_left), 1))
+            start = time.time()
+            try:
+                with Timeout(self.node_timeout):
+                    response = http.replicate('merge_items', objects,
+                                              local_id)
+            finally:
+                next_objects = next_objects.wait()
             if not response or response.status >= 300 or response.status < 200:
                 if response:
                     self.logger.error(_('ERROR Bad response %(status)s from '
@@ -290,8 +368,16 @@ class Replicator(Daemon):
                                       {'status': response.status,
                                        'host': http.host})
                 return False
-            point = objects[-1]['ROWID']
-            objects = broker.get_items_since(point, self.per_diff)
+            elapsed = time.time() - start
+            if elapsed < self.node_timeout / 4.0:
+                per_diff = min(per_diff * 2, self.max_per_diff)
+            elif elapsed > self.node_timeout / 2.0:
+                per_diff = max(per_diff // 2, 1)
+            point = next_point
+            objects = next_objects
+            if objects:
+                broker.merge_syncs([{'remote_id': remote_id,
+                                     'sync_point': point}], incoming=False)
         if objects:
             self.logger.debug(_(
                 'Synchronization for %s has fallen more than '
@@ -384,17 +470,23 @@ class Replicator(Daemon):
             local_sync = broker.get_sync(rinfo['id'], incoming=False)
             if self._in_sync(rinfo, info, broker, local_sync):
                 return True
-            # if the difference in rowids between the two differs by
-            # more than 50%, rsync then do a remote merge.
-            if rinfo['max_row'] / float(info['max_row']) < 0.5:
+            http.compress = rinfo.get('accept_encoding') == 'deflate'
+            # A brand new remote db, with less than a batch of rows and more
+            # than a pass of them to catch up on, is sent whole with rsync
+            # and then merged with what it has; any other gets the rows it
+            # is missing, over as many passes as that takes.
+            sync_point = max(rinfo['point'], local_sync)
+            if rinfo['max_row'] < self.per_diff and \
+                    info['max_row'] - sync_point > \
+                    self.max_diffs * self.per_diff:
                 self.stats['remote_merge'] += 1
                 self.logger.increment('remote_merges')
                 return self._rsync_db(broker, node, http, info['id'],
                                       replicate_method='rsync_then_merge',
                                       replicate_timeout=(info['count'] / 2000))
             # else send diffs over to the remote server
-            return self._usync_db(max(rinfo['point'], local_sync),
-                                  broker, http, rinfo['id'], info['id'])
+            return self._usync_db(sync_point, broker, http, rinfo['id'],
+                                  info['id'])
 
     def _replicate_object(self, partition, object_file, node_id):
         """
@@ -470,7 +562,9 @@ class Replicator(Daemon):
         for node in repl_nodes:
             success = False
             try:
-                success = self._repl_to_node(node, broker, partition, info)
+                with self._node_semaphore(node):
+                    success = self._repl_to_node(node, broker, partition,
+                                                 info)
             except DriveNotMounted:
                 repl_nodes.append(more_nodes.next())
                 self.logger.error(_('ERROR Remote drive not mounted %s'), node)
@@ -517,8 +611,171 @@ class Replicator(Daemon):
     def report_up_to_date(self, full_info):
         return True
 
+    def _node_semaphore(self, node):
+        """
+        Get the semaphore limiting the replication requests in flight to a
+        server.
+
+        :param node: node dictionary from the ring
+        :returns: a Semaphore shared by all the devices of the node's server
+        """
+        key = (node['ip'], node['port'])
+        if key not in self.node_semaphores:
+            self.node_semaphores[key] = Semaphore(self.node_concurrency)
+        return self.node_semaphores[key]
+
+    def _get_priority(self, partition, object_file, node_id):
+        """
+        Rank a DB for replication with cheap checks, so that the DBs most
+        likely to be out of sync are replicated first.
+
+        :param partition: partition of the DB
+        :param object_file: path of the DB
+        :param node_id: ID of the local device in the ring
+        :returns: tuple of (priority, -mtime), which sorts the most urgent
+                  and then the most recently changed DBs first
+        """
+        try:
+            mtime = os.path.getmtime(object_file)
+            try:
+                stat = os.stat(object_file + '.pending')
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                pending = 0
+            else:
+                mtime = max(mtime, stat.st_mtime)
+                pending = stat.st_size
+        except OSError:
+            return PRIORITY_IDLE, 0
+        nodes = self.ring.get_part_nodes(int(partition))
+        if node_id not in [node['id'] for node in nodes]:
+            return PRIORITY_HANDOFF, -mtime
+        if pending:
+            return PRIORITY_PENDING, -mtime
+        try:
+            broker = self.brokerclass(object_file)
+            max_row = broker.get_replication_info()['max_row']
+            syncs = broker.get_syncs(incoming=False)
+        except (Exception, Timeout):
+            # replication quarantines it, if it cannot be read
+            return PRIORITY_PENDING, -mtime
+        if len(syncs) < len(nodes) - 1 or \
+                [sync for sync in syncs if sync['sync_point'] < max_row]:
+            return PRIORITY_PENDING, -mtime
+        if mtime >= self.modified_since:
+            return PRIORITY_MODIFIED, -mtime
+        return PRIORITY_IDLE, -mtime
+
+    def _schedule(self, dirs):
+        """
+        Order the DBs of each device by priority, and take the devices in
+        turn.
+
+        :param dirs: a list of (path, node_id) of the data dirs to walk
+        :returns: a generator of (priority, partition, path_to_db_file,
+                  node_id)
+        """
+        queues = []
+        for datadir, node_id in dirs:
+            queue = [self._get_priority(part, object_file, node_id) +
+                     (part, object_file, node_id)
+                     for part, object_file, node_id in
+                     roundrobin_datadirs([(datadir, node_id)])]
+            if queue:
+                queue.sort(reverse=True)
+                queues.append(queue)
+        while queues:
+            for queue in list(queues):
+                priority, _mtime, part, object_file, node_id = queue.pop()
+                yield priority, part, object_file, node_id
+                if not queue:
+                    queues.remove(queue)
+
+    def _replicate_scheduled(self, semaphore, priority, partition,
+                             object_file, node_id):
+        """
+        Replicate a DB once its device has a free slot, and track how long
+        into the pass DBs with pending changes were replicated.
+
+        :param semaphore: the Semaphore of the DB's device
+        :param priority: the DB's priority, as from _get_priority
+        :param partition: partition of the DB
+        :param object_file: path of the DB
+        :param node_id: ID of the local device in the ring
+        """
+        with semaphore:
+            self._replicate_object(partition, object_file, node_id)
+        if priority <= PRIORITY_PENDING:
+            self.replication_lag = max(self.replication_lag,
+                                       time.time() - self.stats['start'])
+
+    def _replicate_dirs(self, dirs):
+        """
+        Replicate the DBs in data dirs, with no more than device_concurrency
+        at a time on each device.
+
+        :param dirs: a list of (path, node_id) of the data dirs to replicate
+        """
+        semaphores = dict((node_id, Semaphore(self.device_concurrency))
+                          for _junk, node_id in dirs)
+        for priority, part, object_file, node_id in self._schedule(dirs):
+            self.cpool.spawn_n(
+                self._replicate_scheduled, semaphores[node_id], priority,
+                part, object_file, node_id)
+        self.cpool.waitall()
+
+    def _replicate_in_processes(self, dirs):
+        """
+        Replicate the data dirs in up to `processes` child processes, each
+        with its share of the devices, and add up their stats.
+
+        :param dirs: a list of (path, node_id) of the data dirs to replicate
+        """
+        pid2filename = {}
+        for index in xrange(self.processes):
+            group = dirs[index::self.processes]
+            if not group:
+                continue
+            fd, tmpfilename = mkstemp()
+            os.close(fd)
+            pid = os.fork()
+            if pid:
+                pid2filename[pid] = tmpfilename
+            else:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                patcher.monkey_patch(all=False, socket=True)
+                try:
+                    self._replicate_dirs(group)
+                    with open(tmpfilename, 'w') as fp:
+                        simplejson.dump({'stats': self.stats,
+                                         'lag': self.replication_lag}, fp)
+                except (Exception, Timeout):
+                    self.logger.exception(_('ERROR trying to replicate'))
+                sys.exit()
+        while pid2filename:
+            pid = os.wait()[0]
+            tmpfilename = pid2filename.pop(pid, None)
+            if not tmpfilename:
+                continue
+            try:
+                with open(tmpfilename) as fp:
+                    results = simplejson.load(fp)
+            except ValueError:
+                self.logger.error(_('ERROR replicator process %d exited '
+                                    'without its stats'), pid)
+                continue
+            finally:
+                os.unlink(tmpfilename)
+            for key, value in results['stats'].iteritems():
+                if key != 'start':
+                    self.stats[key] = self.stats.get(key, 0) + value
+            self.replication_lag = max(self.replication_lag,
+                                       results['lag'])
+
     def run_once(self, *args, **kwargs):
         """Run a replication pass once."""
+        self.modified_since = self.stats['start']
         self._zero_stats()
         dirs = []
         ips = whataremyips()
@@ -540,10 +797,10 @@ class Replicator(Daemon):
                 if os.path.isdir(datadir):
                     dirs.append((datadir, node['id']))
         self.logger.info(_('Beginning replication run'))
-        for part, object_file, node_id in roundrobin_datadirs(dirs):
-            self.cpool.spawn_n(
-                self._replicate_object, part, object_file, node_id)
-        self.cpool.waitall()
+        if self.processes > 1 and len(dirs) > 1:
+            self._replicate_in_processes(dirs)
+        else:
+            self._replicate_dirs(dirs)
         self.logger.info(_('Replication run OVER'))
         self._report_stats()
 
@@ -644,6 +901,8 @@ class ReplicatorRpc(object):
             if timespan > DEBUG_TIMINGS_THRESHOLD:
                 self.logger.debug(_('replicator-rpc-sync time for '
                                     'merge_syncs: %.02fs') % timespan)
+        # tell the replicator it may compress the rows it sends
+        info['accept_encoding'] = 'deflate'
         return Response(simplejson.dumps(info))
 
     def merge_syncs(self, broker, args):
@@ -662,6 +921,11 @@ class ReplicatorRpc(object):
             return HTTPNotFound()
         broker = self.broker_class(old_filename)
         broker.newid(args[0])
+        # make sure everything is in the db file itself, and that no log left
+        # over from a db that used to be here gets applied to it
+        broker.close()
+        remove_db_logs(old_filename)
+        remove_db_logs(db_file)
         renamer(old_filename, db_file)
         return HTTPNoContent()
 
@@ -671,6 +935,22 @@ class ReplicatorRpc(object):
             return HTTPNotFound()
         new_broker = self.broker_class(old_filename)
         existing_broker = self.broker_class(db_file)
+        if swift.common.db.DB_JOURNAL_MODE == 'WAL' or \
+                os.path.exists(db_file + '-wal'):
+            # Other processes may have the db open, and replacing the file
+            # would leave its write-ahead log to be applied to the new file;
+            # merge the new records into the db where it is instead.
+            point = -1
+            objects = new_broker.get_items_since(point, 1000)
+            while len(objects):
+                existing_broker.merge_items(objects, args[0])
+                point = objects[-1]['ROWID']
+                objects = new_broker.get_items_since(point, 1000)
+                sleep()
+            new_broker.close()
+            remove_db_logs(old_filename)
+            os.unlink(old_filename)
+            return HTTPNoContent()
         point = -1
         objects = existing_broker.get_items_since(point, 1000)
         while len(objects):
@@ -679,6 +959,8 @@ class ReplicatorRpc(object):
             objects = existing_broker.get_items_since(point, 1000)
             sleep()
         new_broker.newid(args[0])
+        new_broker.close()
+        remove_db_logs(old_filename)
         renamer(old_filename, db_file)
         return HTTPNoContent()
 
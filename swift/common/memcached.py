@@ -48,13 +48,14 @@ import cPickle as pickle
 import logging
 import time
 from bisect import bisect
+from collections import defaultdict
 from swift import gettext_ as _
 from hashlib import md5
 from distutils.version import StrictVersion
 
 from eventlet.green import socket
 from eventlet.pools import Pool
-from eventlet import Timeout, __version__ as eventlet_version
+from eventlet import GreenPile, Timeout, __version__ as eventlet_version
 
 from swift.common.utils import json
 
@@ -218,10 +219,10 @@ class MemcacheRing(object):
                 self._error_limited[server] = now + ERROR_LIMIT_DURATION
                 logging.error(_('Error limiting server %s'), server)
 
-    def _get_conns(self, key):
+    def _get_servers(self, key):
         """
-        Retrieves a server conn from the pool, or connects a new one.
-        Chooses the server based on a consistent hash of "key".
+        Yields the servers to try for "key", in order, based on a consistent
+        hash of "key" and skipping any that are error limited.
         """
         pos = bisect(self._sorted, key)
         served = []
@@ -233,6 +234,14 @@ class MemcacheRing(object):
             served.append(server)
             if self._error_limited[server] > time.time():
                 continue
+            yield server
+
+    def _get_conns(self, key):
+        """
+        Retrieves a server conn from the pool, or connects a new one.
+        Chooses the server based on a consistent hash of "key".
+        """
+        for server in self._get_servers(key):
             sock = None
             try:
                 with MemcachePoolTimeout(self._pool_timeout):
@@ -249,12 +258,74 @@ class MemcacheRing(object):
                 self._exception_occurred(
                     server, e, action='connecting', sock=sock)
 
+    def _get_server_conns(self, server):
+        """
+        Like _get_conns, but only ever yields a conn to the given server.
+        """
+        sock = None
+        try:
+            with MemcachePoolTimeout(self._pool_timeout):
+                fp, sock = self._client_cache[server].get()
+            yield server, fp, sock
+        except MemcachePoolTimeout as e:
+            self._exception_occurred(
+                server, e, action='getting a connection',
+                got_connection=False)
+        except (Exception, Timeout) as e:
+            self._exception_occurred(
+                server, e, action='connecting', sock=sock)
+
+    def _run_on_servers(self, keys, func):
+        """
+        Groups (hashed) keys by the server each would be sent to and calls
+        func(keys, conns) for every group concurrently, so that the requests
+        to all of the servers are in flight at once. The keys of any group
+        for which func returns None are regrouped by their next server and
+        tried again.
+
+        :param keys: hashed keys
+        :param func: callable taking the keys of a group and an iterator of
+                     connections to the group's server, returning a dict of
+                     results or None on failure
+        :returns: dict of the merged results of func
+        """
+        def run(server, server_keys):
+            return server_keys, func(server_keys,
+                                     self._get_server_conns(server))
+
+        servers = dict((key, list(self._get_servers(key))) for key in keys)
+        results = {}
+        pending = list(keys)
+        for attempt in xrange(self._tries):
+            groups = defaultdict(list)
+            for key in pending:
+                if attempt < len(servers[key]):
+                    groups[servers[key][attempt]].append(key)
+            if not groups:
+                break
+            if len(groups) == 1:
+                # no need for another greenthread
+                replies = [run(*groups.popitem())]
+            else:
+                replies = GreenPile(len(groups))
+                for server, server_keys in groups.iteritems():
+                    replies.spawn(run, server, server_keys)
+            pending = []
+            for server_keys, result in replies:
+                if result is None:
+                    pending.extend(server_keys)
+                else:
+                    results.update(result)
+            if not pending:
+                break
+        return results
+
     def _return_conn(self, server, fp, sock):
         """Returns a server connection to the pool."""
         self._client_cache[server].put((fp, sock))
 
     def set(self, key, value, serialize=True, timeout=0, time=0,
-            min_compress_len=0):
+            min_compress_len=0, noreply=False):
         """
         Set a key/value pair in memcache
 
@@ -274,11 +345,18 @@ class MemcacheRing(object):
                            to keep the signature compatible with
                            python-memcached interface. This implementation
                            ignores it.
+        :param noreply: if True, don't wait for memcache to acknowledge the
+                        set
         """
         key = md5hash(key)
         if timeout:
             logging.warn("parameter timeout has been deprecated, use time")
         timeout = sanitize_timeout(time or timeout)
+        msg = self._set_msg(key, value, serialize, timeout, noreply)
+        self._send_sets(msg, 0 if noreply else 1, self._get_conns(key))
+
+    def _set_msg(self, key, value, serialize, timeout, noreply):
+        """Returns the set command for a (hashed) key and value."""
         flags = 0
         if serialize and self._allow_pickle:
             value = pickle.dumps(value, PICKLE_PROTOCOL)
@@ -286,15 +364,28 @@ class MemcacheRing(object):
         elif serialize:
             value = json.dumps(value)
             flags |= JSON_FLAG
-        for (server, fp, sock) in self._get_conns(key):
+        return 'set %s %d %d %s%s\r\n%s\r\n' % (
+            key, flags, timeout, len(value), ' noreply' if noreply else '',
+            value)
+
+    def _send_sets(self, msg, replies, conns):
+        """
+        Sends set commands on the first connection of conns that works.
+
+        :param msg: one or more set commands
+        :param replies: number of replies to wait for
+        :param conns: iterator of connections, as from _get_conns
+        :returns: True if the sets were sent, else None
+        """
+        for (server, fp, sock) in conns:
             try:
                 with Timeout(self._io_timeout):
-                    sock.sendall('set %s %d %d %s\r\n%s\r\n' %
-                                 (key, flags, timeout, len(value), value))
-                    # Wait for the set to complete
-                    fp.readline()
+                    sock.sendall(msg)
+                    # Wait for the sets to complete
+                    for _junk in xrange(replies):
+                        fp.readline()
                     self._return_conn(server, fp, sock)
-                    return
+                    return True
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
 
@@ -308,14 +399,28 @@ class MemcacheRing(object):
         :returns: value of the key in memcache
         """
         key = md5hash(key)
-        value = None
-        for (server, fp, sock) in self._get_conns(key):
+        values = self._get_from([key], self._get_conns(key))
+        if values:
+            return values.get(key)
+
+    def _get_from(self, keys, conns):
+        """
+        Sends a single get for all of the (hashed) keys on the first
+        connection of conns that works.
+
+        :param keys: hashed keys
+        :param conns: iterator of connections, as from _get_conns
+        :returns: dict of the values found, keyed by hashed key, or None if
+                  no connection worked
+        """
+        for (server, fp, sock) in conns:
             try:
                 with Timeout(self._io_timeout):
-                    sock.sendall('get %s\r\n' % key)
+                    sock.sendall('get %s\r\n' % ' '.join(keys))
                     line = fp.readline().strip().split()
+                    responses = {}
                     while line[0].upper() != 'END':
-                        if line[0].upper() == 'VALUE' and line[1] == key:
+                        if line[0].upper() == 'VALUE':
                             size = int(line[3])
                             value = fp.read(size)
                             if int(line[2]) & PICKLE_FLAG:
@@ -325,10 +430,11 @@ class MemcacheRing(object):
                                     value = None
                             elif int(line[2]) & JSON_FLAG:
                                 value = json.loads(value)
+                            responses[line[1]] = value
                             fp.readline()
                         line = fp.readline().strip().split()
                     self._return_conn(server, fp, sock)
-                    return value
+                    return responses
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
 
@@ -428,14 +534,18 @@ class MemcacheRing(object):
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
 
-    def set_multi(self, mapping, server_key, serialize=True, timeout=0,
-                  time=0, min_compress_len=0):
+    def set_multi(self, mapping, server_key=None, serialize=True, timeout=0,
+                  time=0, min_compress_len=0, noreply=False):
         """
         Sets multiple key/value pairs in memcache.
 
+        Without a server_key, each key is set on the server it hashes to; the
+        sets for each server are pipelined into a single send and all of the
+        servers are written to concurrently.
+
         :param mapping: dictonary of keys and values to be set in memcache
-        :param servery_key: key to use in determining which server in the ring
-                            is used
+        :param servery_key: optional key to use in determining which single
+                            server in the ring is used for all of the keys
         :param serialize: if True, value is serialized with JSON before sending
                           to memcache, or with pickle if configured to use
                           pickle instead of JSON (to avoid cache poisoning)
@@ -450,74 +560,49 @@ class MemcacheRing(object):
                            to keep the signature compatible with
                            python-memcached interface. This implementation
                            ignores it
+        :param noreply: if True, don't wait for memcache to acknowledge the
+                        sets
         """
         if timeout:
             logging.warn("parameter timeout has been deprecated, use time")
 
-        server_key = md5hash(server_key)
         timeout = sanitize_timeout(time or timeout)
-        msg = ''
-        for key, value in mapping.iteritems():
-            key = md5hash(key)
-            flags = 0
-            if serialize and self._allow_pickle:
-                value = pickle.dumps(value, PICKLE_PROTOCOL)
-                flags |= PICKLE_FLAG
-            elif serialize:
-                value = json.dumps(value)
-                flags |= JSON_FLAG
-            msg += ('set %s %d %d %s\r\n%s\r\n' %
-                    (key, flags, timeout, len(value), value))
-        for (server, fp, sock) in self._get_conns(server_key):
-            try:
-                with Timeout(self._io_timeout):
-                    sock.sendall(msg)
-                    # Wait for the set to complete
-                    for _ in range(len(mapping)):
-                        fp.readline()
-                    self._return_conn(server, fp, sock)
-                    return
-            except (Exception, Timeout) as e:
-                self._exception_occurred(server, e, sock=sock, fp=fp)
-
-    def get_multi(self, keys, server_key):
+        msgs = dict((md5hash(key),
+                     self._set_msg(md5hash(key), value, serialize, timeout,
+                                   noreply))
+                    for key, value in mapping.iteritems())
+        if server_key is not None:
+            self._send_sets(''.join(msgs.values()),
+                            0 if noreply else len(msgs),
+                            self._get_conns(md5hash(server_key)))
+            return
+
+        def send(keys, conns):
+            if self._send_sets(''.join(msgs[key] for key in keys),
+                               0 if noreply else len(keys), conns):
+                return {}
+
+        self._run_on_servers(msgs.keys(), send)
+
+    def get_multi(self, keys, server_key=None):
         """
         Gets multiple values from memcache for the given keys.
 
+        Without a server_key, each key is looked up on the server it hashes
+        to; there is one get per server and all of the servers are queried
+        concurrently.
+
         :param keys: keys for values to be retrieved from memcache
-        :param servery_key: key to use in determining which server in the ring
-                            is used
+        :param servery_key: optional key to use in determining which single
+                            server in the ring is used for all of the keys
         :returns: list of values
         """
-        server_key = md5hash(server_key)
         keys = [md5hash(key) for key in keys]
-        for (server, fp, sock) in self._get_conns(server_key):
-            try:
-                with Timeout(self._io_timeout):
-                    sock.sendall('get %s\r\n' % ' '.join(keys))
-                    line = fp.readline().strip().split()
-                    responses = {}
-                    while line[0].upper() != 'END':
-                        if line[0].upper() == 'VALUE':
-                            size = int(line[3])
-                            value = fp.read(size)
-                            if int(line[2]) & PICKLE_FLAG:
-                                if self._allow_unpickle:
-                                    value = pickle.loads(value)
-                                else:
-                                    value = None
-                            elif int(line[2]) & JSON_FLAG:
-                                value = json.loads(value)
-                            responses[line[1]] = value
-                            fp.readline()
-                        line = fp.readline().strip().split()
-                    values = []
-                    for key in keys:
-                        if key in responses:
-                            values.append(responses[key])
-                        else:
-                            values.append(None)
-                    self._return_conn(server, fp, sock)
-                    return values
-            except (Exception, Timeout) as e:
-                self._exception_occurred(server, e, sock=sock, fp=fp)
+        if server_key is not None:
+            responses = self._get_from(
+                keys, self._get_conns(md5hash(server_key)))
+            if responses is None:
+                return None
+        else:
+            responses = self._run_on_servers(set(keys), self._get_from)
+        return [responses.get(key) for key in keys]
@@ -18,7 +18,8 @@ from swift import gettext_ as _
 import eventlet
 
 from swift.common.utils import cache_from_env, get_logger, register_swift_info
-from swift.proxy.controllers.base import get_container_memcache_key
+from swift.proxy.controllers.base import get_container_memcache_key, \
+    get_info_from_memcache
 from swift.common.memcached import MemcacheConnectionError
 from swift.common.swob import Request, Response
 
@@ -107,18 +108,20 @@ class RateLimitMiddleware(object):
         self.container_listing_ratelimits = interpret_conf_limits(
             conf, 'container_listing_ratelimit_')
 
-    def get_container_size(self, account_name, container_name):
+    def get_container_size(self, account_name, container_name, env=None):
         rv = 0
-        memcache_key = get_container_memcache_key(account_name,
-                                                  container_name)
-        container_info = self.memcache_client.get(memcache_key)
+        # Any info found is left in env for the proxy to reuse
+        container_info = get_info_from_memcache(
+            self.memcache_client, {} if env is None else env, account_name,
+            container_name)
         if isinstance(container_info, dict):
             rv = container_info.get(
                 'object_count', container_info.get('container_size', 0))
         return rv
 
     def get_ratelimitable_key_tuples(self, req_method, account_name,
-                                     container_name=None, obj_name=None):
+                                     container_name=None, obj_name=None,
+                                     env=None):
         """
         Returns a list of key (used in memcache), ratelimit tuples. Keys
         should be checked in order.
@@ -127,6 +130,8 @@ class RateLimitMiddleware(object):
         :param account_name: account name from path
         :param container_name: container name from path
         :param obj_name: object name from path
+        :param env: optional WSGI environment of the request, to share cached
+                    account and container info with the proxy
         """
         keys = []
         # COPYs are not limited
@@ -139,7 +144,7 @@ class RateLimitMiddleware(object):
         if account_name and container_name and obj_name and \
                 req_method in ('PUT', 'DELETE', 'POST'):
             container_size = self.get_container_size(
-                account_name, container_name)
+                account_name, container_name, env)
             container_rate = get_maxrate(
                 self.container_ratelimits, container_size)
             if container_rate:
@@ -150,7 +155,7 @@ class RateLimitMiddleware(object):
         if account_name and container_name and not obj_name and \
                 req_method == 'GET':
             container_size = self.get_container_size(
-                account_name, container_name)
+                account_name, container_name, env)
             container_rate = get_maxrate(
                 self.container_listing_ratelimits, container_size)
             if container_rate:
@@ -219,7 +224,7 @@ class RateLimitMiddleware(object):
             return None
         for key, max_rate in self.get_ratelimitable_key_tuples(
                 req.method, account_name, container_name=container_name,
-                obj_name=obj_name):
+                obj_name=obj_name, env=getattr(req, 'environ', None)):
             try:
                 need_to_sleep = self._get_sleep_time(key, max_rate)
                 if self.log_sleep_time_seconds and \
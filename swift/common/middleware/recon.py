@@ -126,12 +126,14 @@ class ReconMiddleware(object):
         if recon_type == 'account':
             return self._from_recon_cache(['replication_time',
                                            'replication_stats',
-                                           'replication_last'],
+                                           'replication_last',
+                                           'replication_lag'],
                                           self.account_recon_cache)
         elif recon_type == 'container':
             return self._from_recon_cache(['replication_time',
                                            'replication_stats',
-                                           'replication_last'],
+                                           'replication_last',
+                                           'replication_lag'],
                                           self.container_recon_cache)
         elif recon_type == 'object':
             return self._from_recon_cache(['object_replication_time',
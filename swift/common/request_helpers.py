@@ -24,6 +24,7 @@ from swift.common.constraints import FORMAT2CONTENT_TYPE
 from swift.common.swob import HTTPBadRequest, HTTPNotAcceptable
 from swift.common.utils import split_path, validate_device_partition
 from urllib import unquote
+from xml.sax import saxutils
 
 
 def get_param(req, name, default=None):
@@ -71,6 +72,56 @@ def get_listing_content_type(req):
     return out_content_type
 
 
+def _xml_escape_attr(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return saxutils.escape(value, {'"': '&quot;', '\n': '&#10;'})
+
+
+def _xml_element(tag, value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    text = saxutils.escape(str(value))
+    if not text:
+        return '<%s />' % tag
+    return '<%s>%s</%s>' % (tag, text, tag)
+
+
+def container_xml_listing(container, batches):
+    """
+    Serialize batches of container listing records as an XML document, the
+    same as ElementTree would.
+
+    :param container: the container name
+    :param batches: iterable of lists of records, as dicts like those of
+                    JSON listings
+    :returns: a generator of parts of the body, one per batch
+    """
+    start = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+        '<container name="%s"' % _xml_escape_attr(container)
+    output_list = [start, '>']
+    for batch in batches:
+        for record in batch:
+            if 'subdir' in record:
+                output_list.append(
+                    '<subdir name="%s">%s</subdir>' % (
+                        _xml_escape_attr(record['subdir']),
+                        _xml_element('name', record['subdir'])))
+            else:
+                record = dict(record)
+                output_list.append('<object>')
+                for field in ["name", "hash", "bytes", "content_type",
+                              "last_modified"]:
+                    output_list.append(
+                        _xml_element(field, record.pop(field)))
+                for field in sorted(record):
+                    output_list.append(_xml_element(field, record[field]))
+                output_list.append('</object>')
+        yield ''.join(output_list)
+        output_list = []
+    yield start + ' />' if output_list else '</container>'
+
+
 def split_and_validate_path(request, minsegs=1, maxsegs=None,
                             rest_with_last=False):
     """
@@ -15,6 +15,9 @@
 
 import array
 import cPickle as pickle
+import ctypes
+import mmap
+import sys
 from collections import defaultdict
 from gzip import GzipFile
 from os.path import getmtime
@@ -23,11 +26,19 @@ from time import time
 import os
 from io import BufferedReader
 from hashlib import md5
-from itertools import chain
+from itertools import chain, islice
 
-from swift.common.utils import hash_path, validate_configuration, json
+from swift.common.utils import hash_path, validate_configuration, json, \
+    LRUCache
 from swift.common.ring.utils import tiers_for_dev
 
+V2_HEADER_LEN = 10
+V2_ALIGNMENT = 8
+# How many partitions keep their leading handoffs cached, and how many
+# handoffs per replica are kept for each of them.
+HANDOFF_CACHE_SIZE = 65536
+HANDOFF_CACHE_DEPTH = 2
+
 
 class RingData(object):
     """Partitioned consistent hashing ring data (used for serialization)."""
@@ -52,6 +63,38 @@ class RingData(object):
                 array.array('H', gz_file.read(2 * partition_count)))
         return ring_dict
 
+    @classmethod
+    def deserialize_v2(cls, ring_file):
+        """
+        Read the header of an uncompressed version 2 ring and map its
+        replica2part2dev_id tables straight from the file.
+
+        The file is mapped copy-on-write and never written to, so its pages
+        stay shared through the page cache between all the processes that
+        load the same ring. A ring written on a host with a different byte
+        order is read into memory and swapped instead.
+
+        :param ring_file: file object positioned just after the magic and
+                          version
+        """
+        json_len, = struct.unpack('!I', ring_file.read(4))
+        ring_dict = json.loads(ring_file.read(json_len))
+        offset = V2_HEADER_LEN + json_len
+        offset += -offset % V2_ALIGNMENT
+        mapped = mmap.mmap(ring_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        ring_dict['replica2part2dev_id'] = []
+        for part_count in ring_dict['part_counts']:
+            if ring_dict['byteorder'] == sys.byteorder:
+                part2dev_id = (ctypes.c_uint16 * part_count).from_buffer(
+                    mapped, offset)
+            else:
+                part2dev_id = array.array(
+                    'H', mapped[offset:offset + 2 * part_count])
+                part2dev_id.byteswap()
+            ring_dict['replica2part2dev_id'].append(part2dev_id)
+            offset += 2 * part_count
+        return ring_dict
+
     @classmethod
     def load(cls, filename):
         """
@@ -60,6 +103,11 @@ class RingData(object):
         :param filename: Path to a file serialized by the save() method.
         :returns: A RingData instance containing the loaded data.
         """
+        with open(filename, 'rb') as ring_file:
+            if ring_file.read(6) == struct.pack('!4sH', 'R1NG', 2):
+                ring_data = cls.deserialize_v2(ring_file)
+                return RingData(ring_data['replica2part2dev_id'],
+                                ring_data['devs'], ring_data['part_shift'])
         gz_file = GzipFile(filename, 'rb')
         # Python 2.6 GzipFile doesn't support BufferedIO
         if hasattr(gz_file, '_checkReadable'):
@@ -94,26 +142,66 @@ class RingData(object):
         file_obj.write(struct.pack('!I', json_len))
         file_obj.write(json_text)
         for part2dev_id in ring['replica2part2dev_id']:
+            if not isinstance(part2dev_id, array.array):
+                part2dev_id = array.array('H', part2dev_id)
+            file_obj.write(part2dev_id.tostring())
+
+    def serialize_v2(self, file_obj):
+        # Uncompressed, so that the tables can be mapped by load(); they start
+        # on an aligned offset and are stored in this host's byte order.
+        file_obj.write(struct.pack('!4sH', 'R1NG', 2))
+        ring = self.to_dict()
+        json_encoder = json.JSONEncoder(sort_keys=True)
+        json_text = json_encoder.encode(
+            {'devs': ring['devs'], 'part_shift': ring['part_shift'],
+             'replica_count': len(ring['replica2part2dev_id']),
+             'part_counts': [len(part2dev_id) for part2dev_id in
+                             ring['replica2part2dev_id']],
+             'byteorder': sys.byteorder})
+        json_len = len(json_text)
+        file_obj.write(struct.pack('!I', json_len))
+        file_obj.write(json_text)
+        file_obj.write('\x00' * (-(V2_HEADER_LEN + json_len) % V2_ALIGNMENT))
+        for part2dev_id in ring['replica2part2dev_id']:
+            if not isinstance(part2dev_id, array.array):
+                part2dev_id = array.array('H', part2dev_id)
             file_obj.write(part2dev_id.tostring())
 
-    def save(self, filename):
+    def save(self, filename, format_version=2):
         """
         Serialize this RingData instance to disk.
 
+        The ring is written to a temporary file that is then renamed into
+        place, so processes that have the old ring mapped keep reading a
+        consistent copy until they reload.
+
         :param filename: File into which this instance should be serialized.
+        :param format_version: 2 for the uncompressed, mappable format or 1
+                               for the gzipped format understood by older
+                               releases.
         """
-        # Override the timestamp so that the same ring data creates
-        # the same bytes on disk. This makes a checksum comparison a
-        # good way to see if two rings are identical.
-        #
-        # This only works on Python 2.7; on 2.6, we always get the
-        # current time in the gzip output.
-        try:
-            gz_file = GzipFile(filename, 'wb', mtime=1300507380.0)
-        except TypeError:
-            gz_file = GzipFile(filename, 'wb')
-        self.serialize_v1(gz_file)
-        gz_file.close()
+        if format_version not in (1, 2):
+            raise Exception('Unknown ring format version %d' %
+                            format_version)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as ring_file:
+            if format_version == 1:
+                # Override the timestamp so that the same ring data creates
+                # the same bytes on disk. This makes a checksum comparison a
+                # good way to see if two rings are identical.
+                #
+                # This only works on Python 2.7; on 2.6, we always get the
+                # current time in the gzip output.
+                try:
+                    gz_file = GzipFile(filename, 'wb', fileobj=ring_file,
+                                       mtime=1300507380.0)
+                except TypeError:
+                    gz_file = GzipFile(filename, 'wb', fileobj=ring_file)
+                self.serialize_v1(gz_file)
+                gz_file.close()
+            else:
+                self.serialize_v2(ring_file)
+        os.rename(tmp_filename, filename)
 
     def to_dict(self):
         return {'devs': self.devs,
@@ -127,9 +215,12 @@ class Ring(object):
 
     :param serialized_path: path to serialized RingData instance
     :param reload_time: time interval in seconds to check for a ring change
+    :param handoff_cache_size: number of partitions whose leading handoffs
+                               are kept between calls to get_more_nodes()
     """
 
-    def __init__(self, serialized_path, reload_time=15, ring_name=None):
+    def __init__(self, serialized_path, reload_time=15, ring_name=None,
+                 handoff_cache_size=HANDOFF_CACHE_SIZE):
         # can't use the ring unless HASH_PATH_SUFFIX is set
         validate_configuration()
         if ring_name:
@@ -138,6 +229,8 @@ class Ring(object):
         else:
             self.serialized_path = os.path.join(serialized_path)
         self.reload_time = reload_time
+        self._handoff_cache = LRUCache(maxsize=handoff_cache_size,
+                                       ttl=float('inf'))
         self._reload(force=True)
 
     def _reload(self, force=False):
@@ -178,6 +271,10 @@ class Ring(object):
             self._num_zones = len(zones)
 
     def _rebuild_tier_data(self):
+        # Cached handoffs were computed from the old devices.
+        self._handoff_cache.clear()
+        self._handoff_depth = \
+            HANDOFF_CACHE_DEPTH * len(self._replica2part2dev_id) or 1
         self.tier2devs = defaultdict(list)
         for dev in self._devs:
             if not dev:
@@ -308,6 +405,23 @@ class Ring(object):
         """
         if time() > self._rtime:
             self._reload()
+        # The walk below is deterministic for a given ring, so the first few
+        # handoffs of a partition are kept and replayed; callers that want
+        # more than that resume the walk past the cached ones.
+        handoff_ids = self._handoff_cache.get(part)
+        if handoff_ids is None:
+            handoff_ids = array.array('H', islice(
+                self._iter_handoff_dev_ids(part), self._handoff_depth))
+            self._handoff_cache.set(part, handoff_ids)
+        for dev_id in handoff_ids:
+            yield self._devs[dev_id]
+        if len(handoff_ids) < self._handoff_depth:
+            return
+        for dev_id in islice(self._iter_handoff_dev_ids(part),
+                             len(handoff_ids), None):
+            yield self._devs[dev_id]
+
+    def _iter_handoff_dev_ids(self, part):
         primary_nodes = self._get_part_nodes(part)
 
         used = set(d['id'] for d in primary_nodes)
@@ -335,7 +449,7 @@ class Ring(object):
                     region = dev['region']
                     zone = (region, dev['zone'])
                     if dev_id not in used and region not in same_regions:
-                        yield dev
+                        yield dev_id
                         used.add(dev_id)
                         same_regions.add(region)
                         same_zones.add(zone)
@@ -357,7 +471,7 @@ class Ring(object):
                     dev = self._devs[dev_id]
                     zone = (dev['region'], dev['zone'])
                     if dev_id not in used and zone not in same_zones:
-                        yield dev
+                        yield dev_id
                         used.add(dev_id)
                         same_zones.add(zone)
                         if len(same_zones) == self._num_zones:
@@ -376,7 +490,7 @@ class Ring(object):
                 if handoff_part < len(part2dev_id):
                     dev_id = part2dev_id[handoff_part]
                     if dev_id not in used:
-                        yield self._devs[dev_id]
+                        yield dev_id
                         used.add(dev_id)
                         if len(used) == self._num_devs:
                             hit_all_devs = True
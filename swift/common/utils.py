@@ -77,6 +77,8 @@ SysLogHandler.priority_map['NOTICE'] = 'notice'
 # These are lazily pulled from libc elsewhere
 _sys_fallocate = None
 _posix_fadvise = None
+_sys_sendfile = None
+_sys_syncfs = None
 
 # If set to non-zero, fallocate routines will fail based on free space
 # available being at or below this amount, in bytes.
@@ -477,6 +479,32 @@ def fdatasync(fd):
         fsync(fd)
 
 
+def syncfs_available():
+    """
+    Check whether syncfs can be used on this system.
+
+    :returns: True if libc has syncfs
+    """
+    global _sys_syncfs
+    if _sys_syncfs is None:
+        _sys_syncfs = load_libc_function('syncfs', log_error=False)
+    return _sys_syncfs is not noop_libc_function
+
+
+def syncfs(fd):
+    """
+    Sync all modified data and metadata of the filesystem a file is on to
+    disk.
+
+    :param fd: file descriptor of any file on the filesystem
+    """
+    if not syncfs_available():
+        raise OSError(errno.ENOSYS, 'syncfs is not available')
+    if _sys_syncfs(fd) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, 'Unable to syncfs(%s)' % fd)
+
+
 def drop_buffer_cache(fd, offset, length):
     """
     Drop 'buffer' cache for the given range of the given file.
@@ -496,6 +524,48 @@ def drop_buffer_cache(fd, offset, length):
                      % (fd, offset, length, ret))
 
 
+def _load_sendfile():
+    global _sys_sendfile
+    if _sys_sendfile is None:
+        _sys_sendfile = load_libc_function('sendfile64', log_error=False)
+        if _sys_sendfile is not noop_libc_function:
+            _sys_sendfile.restype = ctypes.c_ssize_t
+    return _sys_sendfile
+
+
+def sendfile_available():
+    """
+    Check whether sendfile can be used on this system.
+
+    :returns: True if libc has sendfile64
+    """
+    return _load_sendfile() is not noop_libc_function
+
+
+def sendfile(out_fd, in_fd, offset, count):
+    """
+    Copy data from a file to a socket within the kernel, without reading it
+    into user space.
+
+    :param out_fd: file descriptor to write to
+    :param in_fd: file descriptor of the file to read from
+    :param offset: offset in the file to start reading at
+    :param count: most bytes to copy
+    :returns: the number of bytes copied; 0 at the end of the file
+    :raises OSError: if the copy fails, with EAGAIN if out_fd is a
+                     non-blocking socket that is full
+    """
+    if not sendfile_available():
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+    ret = _sys_sendfile(out_fd, in_fd, ctypes.byref(ctypes.c_int64(offset)),
+                        ctypes.c_size_t(count))
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, 'Unable to sendfile(%s, %s, %s, %s)' % (
+            out_fd, in_fd, offset, count))
+    return ret
+
+
 def normalize_timestamp(timestamp):
     """
     Format a timestamp (string or numeric) into a standardized
@@ -2150,6 +2220,98 @@ def tpool_reraise(func, *args, **kwargs):
     return resp
 
 
+class GroupSync(object):
+    """
+    Group commit for the files of one filesystem: batches the syncs to disk
+    made by concurrent OS threads, so that one flush does for them all.
+
+    The first thread to sync becomes the leader. It waits for the threads
+    that have entered :func:`batch` after it to sync too, for at most window
+    seconds, then syncs the whole filesystem with syncfs, or each file in
+    turn where syncfs is not available. Threads that sync while it does wait
+    for the next leader.
+
+    :param window: most seconds a sync is held back for others to join
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._cond = stdlib_threading.Condition()
+        # threads in batch() that have not synced yet
+        self._expected = 0
+        self._fds = []
+        self._generation = 0
+        self._synced = 0
+        self._failed = 0
+        self._leading = False
+
+    def _flush(self, fds):
+        if syncfs_available():
+            syncfs(fds[0])
+        else:
+            for fd in fds:
+                fsync(fd)
+
+    def _sync(self, fd):
+        with self._cond:
+            self._expected -= 1
+            self._fds.append(fd)
+            # whichever sync starts next starts after this file was written
+            generation = self._generation + 1
+            self._cond.notify_all()
+            while self._synced < generation:
+                if self._leading:
+                    self._cond.wait()
+                    continue
+                self._leading = True
+                deadline = time.time() + self.window
+                while self._expected > 0 and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                self._generation += 1
+                fds, self._fds = self._fds, []
+                failed = False
+                self._cond.release()
+                try:
+                    self._flush(fds)
+                except (Exception, Timeout):
+                    failed = True
+                finally:
+                    self._cond.acquire()
+                    self._synced = self._generation
+                    if failed:
+                        self._failed = self._generation
+                    self._leading = False
+                    self._cond.notify_all()
+            failed = generation <= self._failed
+        if failed:
+            # let each find out for itself what went wrong
+            fsync(fd)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager for an OS thread that is about to sync a file, e.g.
+        once it has written the file's metadata. Yields the function to
+        sync the file with, which takes its file descriptor; a leader waits
+        for each thread in this context to sync before it does.
+        """
+        with self._cond:
+            self._expected += 1
+        synced = []
+
+        def sync(fd):
+            synced.append(fd)
+            self._sync(fd)
+
+        try:
+            yield sync
+        finally:
+            if not synced:
+                with self._cond:
+                    self._expected -= 1
+                    self._cond.notify_all()
+
+
 class ThreadPool(object):
     BYTE = 'a'.encode('utf-8')
 
@@ -2158,12 +2320,18 @@ class ThreadPool(object):
 
     Call its methods from within greenlets to green-wait for results without
     blocking the eventlet reactor (hopefully).
+
+    With a group_commit_window, files synced through :func:`group_commit` are
+    batched by a :class:`GroupSync`.
     """
-    def __init__(self, nthreads=2):
+    def __init__(self, nthreads=2, group_commit_window=0):
         self.nthreads = nthreads
         self._run_queue = Queue()
         self._result_queue = Queue()
         self._threads = []
+        self._group_sync = None
+        if group_commit_window > 0:
+            self._group_sync = GroupSync(group_commit_window)
 
         if nthreads <= 0:
             return
@@ -2314,6 +2482,20 @@ class ThreadPool(object):
         else:
             return self.run_in_thread(func, *args, **kwargs)
 
+    @contextmanager
+    def group_commit(self):
+        """
+        Context manager for a function run in a thread that is about to sync
+        a file to disk. Yields the function to sync it with, which takes its
+        file descriptor: :func:`fsync`, or with group commit, one that
+        batches the sync with those of other threads in this context.
+        """
+        if self._group_sync:
+            with self._group_sync.batch() as sync:
+                yield sync
+        else:
+            yield fsync
+
 
 def ismount(path):
     """
@@ -2399,8 +2581,173 @@ def override_bytes_from_content_type(listing_dict, logger=None):
     listing_dict['content_type'] = content_type
 
 
+def find_shard_range(name, shard_ranges):
+    """
+    Find the shard range a name falls in. A shard range holds the names
+    greater than its lower bound and up to and including its upper bound; an
+    empty bound is no bound.
+
+    :param name: object name
+    :param shard_ranges: list of shard range dicts, with at least 'lower'
+                         and 'upper' keys
+    :returns: the shard range dict, or None
+    """
+    for shard_range in shard_ranges:
+        if shard_range['lower'] < name and \
+                (not shard_range['upper'] or name <= shard_range['upper']):
+            return shard_range
+    return None
+
+
 def quote(value, safe='/'):
     """
     Patched version of urllib.quote that encodes utf-8 strings before quoting
     """
     return _quote(get_valid_utf8_str(value), safe)
+
+
+class _OrderedDict(dict):
+    """
+    A dict that remembers the order its keys were first set in, for Python
+    2.6, which has no collections.OrderedDict. Only the methods swift uses
+    are ordered.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        # doubly linked list of [prev, next, key], in order
+        self._root = root = []
+        root[:] = [root, root, None]
+        self._links = {}
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = self._links[key] = [last, root, key]
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        prev, next_, _junk = self._links.pop(key)
+        prev[1] = next_
+        next_[0] = prev
+
+    def __iter__(self):
+        root = self._root
+        link = root[1]
+        while link is not root:
+            yield link[2]
+            link = link[1]
+
+    def clear(self):
+        dict.clear(self)
+        self._root[:] = [self._root, self._root, None]
+        self._links.clear()
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self, last=True):
+        if not self:
+            raise KeyError('dictionary is empty')
+        key = self._root[0][2] if last else self._root[1][2]
+        return key, self.pop(key)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = _OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded in-memory mapping whose entries expire after a time to live.
+    When full, the least recently used entry is evicted to make room.
+
+    This is meant to be shared by the greenthreads of a single process and
+    does no locking.
+
+    :param maxsize: the maximum number of entries to keep
+    :param ttl: the default number of seconds an entry is kept
+    """
+
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get the value of an entry, marking it as most recently used.
+
+        :param key: the key to look up
+        :param default: returned if the key is missing or expired
+        """
+        try:
+            expires, value = self._entries.pop(key)
+        except KeyError:
+            return default
+        if expires <= time.time():
+            return default
+        self._entries[key] = (expires, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Add or replace an entry.
+
+        :param key: the key to set
+        :param value: the value to keep for the key
+        :param ttl: seconds to keep the entry, defaults to self.ttl; entries
+                    with a ttl of zero or less are not kept
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self._entries.pop(key, None)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        while len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+        self._entries[key] = (time.time() + ttl, value)
+
+    def delete(self, key):
+        """
+        Remove an entry if present.
+
+        :param key: the key to remove
+        """
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
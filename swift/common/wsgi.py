@@ -197,6 +197,17 @@ class RestrictedGreenPool(GreenPool):
             self.waitall()
 
 
+class EventletPlungerString(str):
+    """
+    An empty string that looks long enough to make eventlet.wsgi write out
+    what it has buffered, headers included, at once. Yielding one lets an
+    app send the rest of the response body straight to the client socket.
+    """
+
+    def __len__(self):
+        return wsgi.MINIMUM_CHUNK_SIZE + 1
+
+
 def run_server(conf, logger, sock, global_conf=None):
     # Ensure TZ environment variable exists to avoid stat('/etc/localtime') on
     # some platforms. This locks in reported times to the timezone in which
@@ -44,6 +44,7 @@ class ContainerAuditor(Daemon):
             float(conf.get('containers_per_second', 200))
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.set_db_profile(conf)
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
         self.rcache = os.path.join(self.recon_cache_path, "container.recon")
@@ -116,12 +117,45 @@ class ContainerAuditor(Daemon):
             broker = ContainerBroker(path)
             if not broker.is_deleted():
                 broker.get_info()
-                self.logger.increment('passes')
-                self.container_passes += 1
-                self.logger.debug(_('Audit passed for %s'), broker)
+                error = self.check_shard_ranges(broker.get_shard_ranges())
+                if error:
+                    self.logger.increment('failures')
+                    self.container_failures += 1
+                    self.logger.error(
+                        _('ERROR Bad shard ranges in %(db)s: %(error)s'),
+                        {'db': path, 'error': error})
+                else:
+                    self.logger.increment('passes')
+                    self.container_passes += 1
+                    self.logger.debug(_('Audit passed for %s'), broker)
         except (Exception, Timeout):
             self.logger.increment('failures')
             self.container_failures += 1
             self.logger.exception(_('ERROR Could not get container info %s'),
                                   path)
         self.logger.timing_since('timing', start_time)
+
+    def check_shard_ranges(self, shard_ranges):
+        """
+        Check that the shard ranges of a container hold every name exactly
+        once: the first starts from no lower bound, each starts where the
+        one before ends, and the last has no upper bound.
+
+        :param shard_ranges: list of shard range dicts, sorted as from
+                             get_shard_ranges
+        :returns: a description of the first problem found, or None
+        """
+        lower = ''
+        for shard_range in shard_ranges:
+            if lower is None:
+                return _('%s is after the last range') % shard_range['name']
+            if shard_range['lower'] != lower:
+                return _('%(name)s starts at %(lower)r, not %(expected)r') % {
+                    'name': shard_range['name'],
+                    'lower': shard_range['lower'], 'expected': lower}
+            lower = shard_range['upper'] or None
+            if lower is not None and lower <= shard_range['lower']:
+                return _('%s is empty') % shard_range['name']
+        if shard_ranges and lower is not None:
+            return _('no range after %r') % lower
+        return None
@@ -21,12 +21,66 @@ from uuid import uuid4
 import time
 import cPickle as pickle
 import errno
+import struct
 
 import sqlite3
 
-from swift.common.utils import normalize_timestamp, lock_parent_directory
+from swift.common.utils import normalize_timestamp, \
+    lock_parent_directory, OrderedDict
 from swift.common.db import DatabaseBroker, DatabaseConnectionError, \
-    PENDING_CAP, PICKLE_PROTOCOL, utf8encode
+    PENDING_CAP, PICKLE_PROTOCOL, PENDING_BINARY_MARKER, utf8encode, \
+    pending_entry, dict_factory, entry_hash, LISTING_BATCH_SIZE
+
+DATADIR = 'containers'
+
+#: The shard containers of the containers in an account are kept in the
+#: account named by this followed by the account name
+SHARD_ACCOUNT_PREFIX = '.shards_'
+
+#: Number of names under one subdir a delimited listing steps over before
+#: it runs a new query to seek past the rest
+DELIMITER_SKIP_ROWS = 32
+#: Whether new container DBs index all the columns listings read
+COVERING_INDEX = False
+#: Whether to keep the object count, bytes used and hash of container DBs up
+#: to date once per transaction instead of by triggers on each row change,
+#: dropping the triggers from DBs that have them
+BATCH_STATS = False
+
+#: Fixed-size start of a binary .pending entry for an object: size, deleted,
+#: then the lengths of name, created_at, content_type and etag that follow
+PENDING_OBJECT = struct.Struct('!qBIIII')
+
+
+def sum_object_rows(rows):
+    """
+    Add up rows of the object table as they count in container_stat.
+
+    :param rows: iterable of (name, created_at, size, deleted) rows
+    :returns: tuple of (object count, bytes used, XOR of the rows' hashes,
+              number of rows)
+    """
+    object_count = bytes_used = hashes = count = 0
+    for name, created_at, size, deleted in rows:
+        object_count += 1 - deleted
+        bytes_used += size
+        hashes ^= entry_hash(name, created_at)
+        count += 1
+    return object_count, bytes_used, hashes, count
+
+
+def shard_account(account):
+    """
+    Get the name of the account that holds the shard containers of the
+    containers in an account. Shards of shard containers stay in the same
+    account.
+
+    :param account: account name
+    :returns: the shard account name
+    """
+    if account.startswith(SHARD_ACCOUNT_PREFIX):
+        return account
+    return SHARD_ACCOUNT_PREFIX + account
 
 
 class ContainerBroker(DatabaseBroker):
@@ -47,14 +101,25 @@ class ContainerBroker(DatabaseBroker):
                 'Attempting to create a new database with no container set')
         self.create_object_table(conn)
         self.create_container_stat_table(conn, put_timestamp)
+        self.create_shard_range_table(conn)
 
     def create_object_table(self, conn):
         """
         Create the object table which is specifc to the container DB.
         Not a part of Pluggable Back-ends, internal to the baseline code.
 
+        With BATCH_STATS, the object count, bytes used and hash in
+        container_stat are kept up to date by the methods that change the
+        rows, once per transaction; see :func:`_update_object_stats`.
+        Otherwise triggers update them on each row change.
+
         :param conn: DB connection object
         """
+        # With COVERING_INDEX, listings are read from the index alone instead
+        # of looking up each row in the table.
+        index_columns = 'deleted, name'
+        if COVERING_INDEX:
+            index_columns += ', created_at, size, content_type, etag'
         conn.executescript("""
             CREATE TABLE object (
                 ROWID INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,29 +131,31 @@ class ContainerBroker(DatabaseBroker):
                 deleted INTEGER DEFAULT 0
             );
 
-            CREATE INDEX ix_object_deleted_name ON object (deleted, name);
-
-            CREATE TRIGGER object_insert AFTER INSERT ON object
-            BEGIN
-                UPDATE container_stat
-                SET object_count = object_count + (1 - new.deleted),
-                    bytes_used = bytes_used + new.size,
-                    hash = chexor(hash, new.name, new.created_at);
-            END;
+            CREATE INDEX ix_object_deleted_name ON object (%s);
 
             CREATE TRIGGER object_update BEFORE UPDATE ON object
             BEGIN
                 SELECT RAISE(FAIL, 'UPDATE not allowed; DELETE and INSERT');
             END;
-
-            CREATE TRIGGER object_delete AFTER DELETE ON object
-            BEGIN
-                UPDATE container_stat
-                SET object_count = object_count - (1 - old.deleted),
-                    bytes_used = bytes_used - old.size,
-                    hash = chexor(hash, old.name, old.created_at);
-            END;
-        """)
+        """ % index_columns)
+        if not BATCH_STATS:
+            conn.executescript("""
+                CREATE TRIGGER object_insert AFTER INSERT ON object
+                BEGIN
+                    UPDATE container_stat
+                    SET object_count = object_count + (1 - new.deleted),
+                        bytes_used = bytes_used + new.size,
+                        hash = chexor(hash, new.name, new.created_at);
+                END;
+
+                CREATE TRIGGER object_delete AFTER DELETE ON object
+                BEGIN
+                    UPDATE container_stat
+                    SET object_count = object_count - (1 - old.deleted),
+                        bytes_used = bytes_used - old.size,
+                        hash = chexor(hash, old.name, old.created_at);
+                END;
+            """)
 
     def create_container_stat_table(self, conn, put_timestamp=None):
         """
@@ -132,6 +199,111 @@ class ContainerBroker(DatabaseBroker):
         ''', (self.account, self.container, normalize_timestamp(time.time()),
               str(uuid4()), put_timestamp))
 
+    def create_shard_range_table(self, conn):
+        """
+        Create the shard_range table, which holds the name ranges the
+        container is split into and the shard containers that hold them.
+        Older DBs get it when shard ranges are first merged into them.
+
+        :param conn: DB connection object
+        """
+        conn.executescript("""
+            CREATE TABLE shard_range (
+                name TEXT PRIMARY KEY,
+                lower TEXT,
+                upper TEXT,
+                created_at TEXT,
+                object_count INTEGER DEFAULT 0,
+                bytes_used INTEGER DEFAULT 0,
+                deleted INTEGER DEFAULT 0,
+                usage_at TEXT DEFAULT '0'
+            );
+        """)
+
+    def _migrate_add_shard_usage_at(self, conn):
+        """
+        Add the usage_at column to a shard_range table created without it.
+
+        :param conn: DB connection object
+        """
+        conn.executescript("""
+            ALTER TABLE shard_range ADD COLUMN usage_at TEXT DEFAULT '0';
+        """)
+
+    def _batch_object_stats(self, conn):
+        """
+        Find out whether the transaction changing object rows has to
+        account for them in container_stat itself, through
+        :func:`_update_object_stats`, or the DB's triggers do it. With
+        BATCH_STATS, the triggers are dropped from DBs that have them, in
+        the transaction. Without it, DBs keep their triggers, since
+        container servers and replicators of older versions rely on them;
+        but DBs whose triggers have been dropped are still accounted for
+        in batch. Call this before changing any rows.
+
+        :param conn: DB connection object
+        :returns: True if the rows are to be accounted for in batch
+        """
+        triggers = conn.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'trigger' AND name IN ('object_insert',
+                                                'object_delete')
+        ''').fetchall()
+        if not BATCH_STATS:
+            return not triggers
+        for row in triggers:
+            conn.execute('DROP TRIGGER %s' % row[0])
+        return True
+
+    def _delete_object_rows(self, conn, where, args=(), batch=True):
+        """
+        Delete rows of the object table.
+
+        :param conn: DB connection object
+        :param where: SQL condition the rows to delete meet
+        :param args: arguments of the condition
+        :param batch: whether to add up the rows for container_stat
+        :returns: what the rows added up to in container_stat, as
+                  :func:`sum_object_rows` returns it, or nothing if not
+                  batch
+        """
+        removed = (0, 0, 0, 0)
+        if batch:
+            removed = sum_object_rows(conn.execute('''
+                SELECT name, created_at, size, deleted FROM object WHERE %s
+            ''' % where, args))
+        conn.execute('DELETE FROM object WHERE %s' % where, args)
+        return removed
+
+    def _update_object_stats(self, conn, added, removed):
+        """
+        Update the object count, bytes used and hash in container_stat for
+        rows added to and deleted from the object table, at the end of the
+        transaction that changed them.
+
+        :param conn: DB connection object
+        :param added: sum of the rows added, from :func:`sum_object_rows`
+        :param removed: sum of the rows deleted, from
+                        :func:`sum_object_rows`
+        """
+        if not (added[3] or removed[3]):
+            return
+        old_hash = conn.execute(
+            'SELECT hash FROM container_stat').fetchone()[0]
+        conn.execute('''
+            UPDATE container_stat
+            SET object_count = object_count + ?, bytes_used = bytes_used + ?,
+                hash = ?
+        ''', (added[0] - removed[0], added[1] - removed[1],
+              '%032x' % (int(old_hash, 16) ^ added[2] ^ removed[2])))
+
+    def _reclaim_items(self, conn, timestamp):
+        """See :func:`swift.common.db.DatabaseBroker._reclaim_items`"""
+        removed = self._delete_object_rows(
+            conn, 'deleted = 1 AND created_at < ?', (timestamp,),
+            self._batch_object_stats(conn))
+        self._update_object_stats(conn, (0, 0, 0, 0), removed)
+
     def get_db_version(self, conn):
         if self._db_version == -1:
             self._db_version = 0
@@ -163,8 +335,21 @@ class ContainerBroker(DatabaseBroker):
 
     def _commit_puts_load(self, item_list, entry):
         """See :func:`swift.common.db.DatabaseBroker._commit_puts_load`"""
-        (name, timestamp, size, content_type, etag, deleted) = \
-            pickle.loads(entry.decode('base64'))
+        if entry.startswith(PENDING_BINARY_MARKER):
+            (size, deleted, name_len, timestamp_len, content_type_len,
+             etag_len) = PENDING_OBJECT.unpack_from(entry, 1)
+            pos = 1 + PENDING_OBJECT.size
+            fields = []
+            for length in (name_len, timestamp_len, content_type_len,
+                           etag_len):
+                fields.append(entry[pos:pos + length])
+                pos += length
+            if pos != len(entry):
+                raise ValueError('Pending entry has the wrong length')
+            name, timestamp, content_type, etag = fields
+        else:
+            (name, timestamp, size, content_type, etag, deleted) = \
+                pickle.loads(entry.decode('base64'))
         item_list.append({'name': name,
                           'created_at': timestamp,
                           'size': size,
@@ -182,7 +367,7 @@ class ContainerBroker(DatabaseBroker):
         with self.get() as conn:
             row = conn.execute(
                 'SELECT object_count from container_stat').fetchone()
-            return (row[0] == 0)
+            return (row[0] == 0) and self._get_shard_usage(conn)[0] == 0
 
     def delete_object(self, name, timestamp):
         """
@@ -222,15 +407,23 @@ class ContainerBroker(DatabaseBroker):
         if pending_size > PENDING_CAP:
             self._commit_puts([record])
         else:
+            try:
+                name, timestamp, content_type, etag = utf8encode(
+                    name, timestamp, content_type, etag)
+                entry = pending_entry(PENDING_OBJECT.pack(
+                    size, deleted, len(name), len(timestamp),
+                    len(content_type), len(etag)) +
+                    name + timestamp + content_type + etag)
+            except (TypeError, struct.error):
+                # not the types the binary entry is for; colons aren't used
+                # in base64 encoding, so they are our delimiter
+                entry = ':' + pickle.dumps(
+                    (name, timestamp, size, content_type, etag, deleted),
+                    protocol=PICKLE_PROTOCOL).encode('base64')
             with lock_parent_directory(self.pending_file,
                                        self.pending_timeout):
                 with open(self.pending_file, 'a+b') as fp:
-                    # Colons aren't used in base64 encoding; so they are our
-                    # delimiter
-                    fp.write(':')
-                    fp.write(pickle.dumps(
-                        (name, timestamp, size, content_type, etag, deleted),
-                        protocol=PICKLE_PROTOCOL).encode('base64'))
+                    fp.write(entry)
                     fp.flush()
 
     def is_deleted(self, timestamp=None):
@@ -264,6 +457,8 @@ class ContainerBroker(DatabaseBroker):
                   reported_put_timestamp, reported_delete_timestamp,
                   reported_object_count, reported_bytes_used, hash, id,
                   x_container_sync_point1, and x_container_sync_point2.
+                  The object_count and bytes_used of a sharded container
+                  include those last reported for its shards.
         """
         self._commit_puts_stale_ok()
         with self.get() as conn:
@@ -286,6 +481,9 @@ class ContainerBroker(DatabaseBroker):
                     else:
                         raise
             data = dict(data)
+            object_count, bytes_used = self._get_shard_usage(conn)
+            data['object_count'] += object_count
+            data['bytes_used'] += bytes_used
             return data
 
     def set_x_container_sync_points(self, sync_point1, sync_point2):
@@ -382,6 +580,14 @@ class ContainerBroker(DatabaseBroker):
             delimiter = '/'
         elif delimiter and not prefix:
             prefix = ''
+        if prefix:
+            # Names are compared as bytes, so all the names starting with
+            # prefix sort before this; a prefix of just '\xff's needs no end.
+            prefix_end = prefix.rstrip('\xff')
+            if prefix_end:
+                prefix_end = prefix_end[:-1] + chr(ord(prefix_end[-1]) + 1)
+                if not end_marker or prefix_end < end_marker:
+                    end_marker = prefix_end
         orig_marker = marker
         with self.get() as conn:
             results = []
@@ -407,31 +613,32 @@ class ContainerBroker(DatabaseBroker):
                     query += ' +deleted = 0'
                 else:
                     query += ' deleted = 0'
-                query += ' ORDER BY name LIMIT ?'
-                query_args.append(limit - len(results))
-                curs = conn.execute(query, query_args)
-                curs.row_factory = None
-
-                if prefix is None:
+                query += ' ORDER BY name'
+                if not delimiter:
                     # A delimiter without a specified prefix is ignored
+                    query += ' LIMIT ?'
+                    query_args.append(limit)
+                    curs = conn.execute(query, query_args)
+                    curs.row_factory = None
                     return [r for r in curs]
-                if not delimiter:
-                    if not prefix:
-                        # It is possible to have a delimiter but no prefix
-                        # specified. As above, the prefix will be set to the
-                        # empty string, so avoid performing the extra work to
-                        # check against an empty prefix.
-                        return [r for r in curs]
-                    else:
-                        return [r for r in curs if r[0].startswith(prefix)]
+                curs = conn.execute(query, query_args)
+                curs.row_factory = None
 
                 # We have a delimiter and a prefix (possibly empty string) to
-                # handle
-                rowcount = 0
+                # handle. The names in a subdir are stepped over in this
+                # query while there are only a few of them; past that, a new
+                # query seeks to the end of the subdir.
+                skip_dir = None
                 for row in curs:
-                    rowcount += 1
-                    marker = name = row[0]
-                    if len(results) >= limit or not name.startswith(prefix):
+                    name = row[0]
+                    if skip_dir:
+                        if name.startswith(skip_dir):
+                            skipped += 1
+                            if skipped < DELIMITER_SKIP_ROWS:
+                                continue
+                            break
+                        skip_dir = None
+                    if len(results) >= limit:
                         curs.close()
                         return results
                     end = name.find(delimiter, len(prefix))
@@ -439,23 +646,244 @@ class ContainerBroker(DatabaseBroker):
                         if name == path:
                             continue
                         if end >= 0 and len(name) > end + len(delimiter):
-                            marker = name[:end] + chr(ord(delimiter) + 1)
-                            curs.close()
-                            break
+                            skip_dir = name[:end + 1]
+                            skipped = 0
+                            continue
                     elif end > 0:
-                        marker = name[:end] + chr(ord(delimiter) + 1)
-                        # we want result to be inclusinve of delim+1
-                        delim_force_gte = True
-                        dir_name = name[:end + 1]
-                        if dir_name != orig_marker:
-                            results.append([dir_name, '0', 0, None, ''])
-                        curs.close()
-                        break
+                        skip_dir = name[:end + 1]
+                        skipped = 0
+                        if skip_dir != orig_marker:
+                            results.append([skip_dir, '0', 0, None, ''])
+                        continue
                     results.append(row)
-                if not rowcount:
+                else:
                     break
+                curs.close()
+                marker = skip_dir[:-1] + chr(ord(delimiter) + 1)
+                # we want result to be inclusive of delim+1
+                delim_force_gte = True
             return results
 
+    def list_objects_batches(self, limit, marker, end_marker, prefix,
+                             delimiter, path=None):
+        """
+        Get the same listing as :func:`list_objects_iter`, read from the DB
+        in batches of up to LISTING_BATCH_SIZE entries as it is consumed.
+
+        :returns: a generator of lists of entries
+        """
+        return self._list_batches(self.list_objects_iter, limit, marker,
+                                  end_marker, prefix, delimiter, path)
+
+    def _get_shard_usage(self, conn):
+        """
+        Get the totals of the object counts and bytes used of the shard
+        ranges.
+
+        :param conn: DB connection object
+        :returns: tuple of (object_count, bytes_used)
+        """
+        try:
+            row = conn.execute('''
+                SELECT SUM(object_count), SUM(bytes_used) FROM shard_range
+                WHERE deleted = 0''').fetchone()
+        except sqlite3.OperationalError as err:
+            if 'no such table: shard_range' not in str(err):
+                raise
+            return 0, 0
+        return row[0] or 0, row[1] or 0
+
+    def get_shard_ranges(self, include_deleted=False):
+        """
+        Get the shard ranges the container is split into, sorted by name.
+
+        :param include_deleted: if True, include deleted shard ranges
+        :returns: list of dicts of {'name', 'lower', 'upper', 'created_at',
+                  'object_count', 'bytes_used', 'deleted', 'usage_at'},
+                  where name is the account and container of the shard
+                  container joined with a '/'
+        """
+        query = '''
+            SELECT name, lower, upper, created_at, object_count, bytes_used,
+                deleted, %s
+            FROM shard_range'''
+        if not include_deleted:
+            query += ' WHERE deleted = 0'
+        # the last range has an empty upper bound
+        query += " ORDER BY upper = '', upper"
+        with self.get() as conn:
+            try:
+                try:
+                    curs = conn.execute(query % 'usage_at')
+                except sqlite3.OperationalError as err:
+                    if 'no such column: usage_at' not in str(err):
+                        raise
+                    curs = conn.execute(query % "'0' AS usage_at")
+            except sqlite3.OperationalError as err:
+                if 'no such table: shard_range' not in str(err):
+                    raise
+                return []
+            curs.row_factory = dict_factory
+            return [r for r in curs]
+
+    def merge_shard_ranges(self, shard_ranges):
+        """
+        Merge shard ranges into the shard_range table. A shard range only
+        replaces one of the same name that has an older created_at; for one
+        with the same created_at, only its usage is taken, if it has a newer
+        usage_at.
+
+        :param shard_ranges: list of shard range dicts, as from
+                             :func:`get_shard_ranges`
+        """
+        with self.get() as conn:
+            try:
+                self._merge_shard_ranges(conn, shard_ranges)
+            except sqlite3.OperationalError as err:
+                if 'no such table: shard_range' in str(err):
+                    self.create_shard_range_table(conn)
+                elif 'no such column: usage_at' in str(err):
+                    self._migrate_add_shard_usage_at(conn)
+                else:
+                    raise
+                self._merge_shard_ranges(conn, shard_ranges)
+            conn.commit()
+
+    def _merge_shard_ranges(self, conn, shard_ranges):
+        for shard_range in shard_ranges:
+            usage_at = shard_range.get('usage_at', '0')
+            row = conn.execute('''
+                SELECT created_at, usage_at FROM shard_range WHERE name = ?
+            ''', (shard_range['name'],)).fetchone()
+            if row and row[0] == shard_range['created_at']:
+                if row[1] < usage_at:
+                    conn.execute('''
+                        UPDATE shard_range SET object_count = ?,
+                            bytes_used = ?, usage_at = ?
+                        WHERE name = ?
+                    ''', (shard_range.get('object_count', 0),
+                          shard_range.get('bytes_used', 0), usage_at,
+                          shard_range['name']))
+                continue
+            if row and row[0] > shard_range['created_at']:
+                continue
+            conn.execute('''
+                INSERT OR REPLACE INTO shard_range (name, lower, upper,
+                    created_at, object_count, bytes_used, deleted, usage_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (shard_range['name'], shard_range['lower'],
+                  shard_range['upper'], shard_range['created_at'],
+                  shard_range.get('object_count', 0),
+                  shard_range.get('bytes_used', 0),
+                  shard_range.get('deleted', 0), usage_at))
+
+    def set_shard_range_usage(self, name, object_count, bytes_used,
+                              timestamp=None):
+        """
+        Record the object count and bytes used last reported for a shard
+        container. They are replicated with the shard ranges, and replace
+        those of other replicas that were reported earlier.
+
+        :param name: name of the shard range
+        :param object_count: object count of the shard container
+        :param bytes_used: bytes used by the shard container
+        :param timestamp: when they were reported; defaults to now
+        """
+        usage_at = timestamp or normalize_timestamp(time.time())
+        query = '''
+            UPDATE shard_range SET object_count = ?, bytes_used = ?,
+                usage_at = ?
+            WHERE name = ?'''
+        with self.get() as conn:
+            try:
+                conn.execute(query, (object_count, bytes_used, usage_at,
+                                     name))
+            except sqlite3.OperationalError as err:
+                if 'no such column: usage_at' not in str(err):
+                    raise
+                self._migrate_add_shard_usage_at(conn)
+                conn.execute(query, (object_count, bytes_used, usage_at,
+                                     name))
+            conn.commit()
+
+    def find_shard_points(self, rows_per_shard):
+        """
+        Find names that split the objects of the container into ranges of
+        rows_per_shard objects each; the last range gets the rest, and is
+        never empty.
+
+        :param rows_per_shard: number of objects in each range
+        :returns: list of names, each the upper bound of a range
+        """
+        self._commit_puts_stale_ok()
+        points = []
+        with self.get() as conn:
+            while True:
+                rows = conn.execute('''
+                    SELECT name FROM object WHERE deleted = 0 AND name > ?
+                    ORDER BY name LIMIT 2 OFFSET ?
+                ''', (points[-1] if points else '',
+                      rows_per_shard - 1)).fetchall()
+                if len(rows) < 2:
+                    return points
+                points.append(rows[0][0])
+
+    def get_shard_items(self, lower, upper, max_row,
+                        count=LISTING_BATCH_SIZE):
+        """
+        Get the rows, deleted ones included, with names in a shard range.
+        Only rows up to max_row are read, so that rows added meanwhile are
+        left for :func:`remove_shard_items` too.
+
+        :param lower: lower bound of the range; names must be greater
+        :param upper: upper bound of the range, or '' for no bound
+        :param max_row: the highest ROWID to read
+        :param count: number of rows to read at a time
+        :returns: a generator of lists of object dicts, as from
+                  :func:`get_items_since`
+        """
+        self._commit_puts_stale_ok()
+        for deleted in (0, 1):
+            marker = lower
+            while True:
+                query = '''SELECT * FROM object
+                           WHERE deleted = ? AND name > ? AND ROWID <= ?'''
+                query_args = [deleted, marker, max_row]
+                if upper:
+                    query += ' AND name <= ?'
+                    query_args.append(upper)
+                query += ' ORDER BY name LIMIT ?'
+                query_args.append(count)
+                with self.get() as conn:
+                    curs = conn.execute(query, query_args)
+                    curs.row_factory = dict_factory
+                    items = [r for r in curs]
+                if items:
+                    yield items
+                if len(items) < count:
+                    break
+                marker = items[-1]['name']
+
+    def remove_shard_items(self, lower, upper, max_row):
+        """
+        Delete the rows with names in a shard range once they have been
+        moved to the shard container.
+
+        :param lower: lower bound of the range; names must be greater
+        :param upper: upper bound of the range, or '' for no bound
+        :param max_row: the highest ROWID to delete
+        """
+        where = 'deleted IN (0, 1) AND name > ? AND ROWID <= ?'
+        args = [lower, max_row]
+        if upper:
+            where += ' AND name <= ?'
+            args.append(upper)
+        with self.get() as conn:
+            with self._transaction(conn):
+                removed = self._delete_object_rows(
+                    conn, where, args, self._batch_object_stats(conn))
+                self._update_object_stats(conn, (0, 0, 0, 0), removed)
+
     def merge_items(self, item_list, source=None):
         """
         Merge items into the object table.
@@ -464,37 +892,83 @@ class ContainerBroker(DatabaseBroker):
                           'size', 'content_type', 'etag', 'deleted'}
         :param source: if defined, update incoming_sync with the source
         """
+        # Only the newest record for each name can make it into the table,
+        # so drop the others up front; of records with the same timestamp,
+        # the first one wins.
+        records = OrderedDict()
+        max_rowid = -1
+        for rec in item_list:
+            if source:
+                max_rowid = max(max_rowid, rec['ROWID'])
+            old = records.get(rec['name'])
+            if old is None or old[1] < rec['created_at']:
+                records.pop(rec['name'], None)
+                records[rec['name']] = (
+                    rec['name'], rec['created_at'], rec['size'],
+                    rec['content_type'], rec['etag'], rec['deleted'])
         with self.get() as conn:
-            max_rowid = -1
-            for rec in item_list:
-                query = '''
-                    DELETE FROM object
-                    WHERE name = ? AND (created_at < ?)
-                '''
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                conn.execute(query, (rec['name'], rec['created_at']))
-                query = 'SELECT 1 FROM object WHERE name = ?'
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                if not conn.execute(query, (rec['name'],)).fetchall():
-                    conn.execute('''
-                        INSERT INTO object (name, created_at, size,
-                            content_type, etag, deleted)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', ([rec['name'], rec['created_at'], rec['size'],
-                          rec['content_type'], rec['etag'], rec['deleted']]))
+            deleted_clause = ''
+            if self.get_db_version(conn) >= 1:
+                deleted_clause = ' AND object.deleted IN (0, 1)'
+            with self._transaction(conn):
+                batch = self._batch_object_stats(conn)
+                conn.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS object_merge (
+                        name TEXT,
+                        created_at TEXT,
+                        size INTEGER,
+                        content_type TEXT,
+                        etag TEXT,
+                        deleted INTEGER
+                    )''')
+                conn.execute('DELETE FROM object_merge')
+                conn.executemany('''
+                    INSERT INTO object_merge (name, created_at, size,
+                        content_type, etag, deleted)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', records.values())
+                # Replace the rows older than the merged records, then add
+                # the records for names that are not in the table (any
+                # more). CROSS JOIN makes SQLite look up each merged name in
+                # the table rather than the other way round.
+                removed = self._delete_object_rows(conn, '''
+                    ROWID IN (
+                        SELECT object.ROWID FROM object_merge
+                        CROSS JOIN object
+                        ON object.name = object_merge.name%s
+                        WHERE object.created_at < object_merge.created_at)
+                ''' % deleted_clause, batch=batch)
+                if batch:
+                    row = conn.execute('''
+                        SELECT seq FROM sqlite_sequence WHERE name = 'object'
+                    ''').fetchone()
+                    max_row = row[0] if row else -1
+                conn.execute('''
+                    INSERT INTO object (name, created_at, size, content_type,
+                        etag, deleted)
+                    SELECT name, created_at, size, content_type, etag, deleted
+                    FROM object_merge
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM object
+                        WHERE object.name = object_merge.name%s)
+                    ORDER BY object_merge.ROWID
+                ''' % deleted_clause)
+                if batch:
+                    added = sum_object_rows(conn.execute('''
+                        SELECT name, created_at, size, deleted FROM object
+                        WHERE ROWID > ?
+                    ''', (max_row,)))
+                    self._update_object_stats(conn, added, removed)
+                conn.execute('DELETE FROM object_merge')
                 if source:
-                    max_rowid = max(max_rowid, rec['ROWID'])
-            if source:
-                try:
-                    conn.execute('''
-                        INSERT INTO incoming_sync (sync_point, remote_id)
-                        VALUES (?, ?)
-                    ''', (max_rowid, source))
-                except sqlite3.IntegrityError:
-                    conn.execute('''
-                        UPDATE incoming_sync SET sync_point=max(?, sync_point)
-                        WHERE remote_id=?
-                    ''', (max_rowid, source))
-            conn.commit()
+                    try:
+                        conn.execute('''
+                            INSERT INTO incoming_sync (sync_point, remote_id)
+                            VALUES (?, ?)
+                        ''', (max_rowid, source))
+                    except sqlite3.IntegrityError:
+                        conn.execute('''
+                            UPDATE incoming_sync
+                            SET sync_point=max(?, sync_point)
+                            WHERE remote_id=?
+                        ''', (max_rowid, source))
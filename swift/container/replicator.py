@@ -13,20 +13,248 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from swift.container import server as container_server
-from swift.container.backend import ContainerBroker
+import os
+import time
+from hashlib import md5
+from swift import gettext_ as _
+
+from eventlet import GreenPile, Timeout
+
+import swift.container.backend
+from swift.container.backend import ContainerBroker, DATADIR, \
+    shard_account
 from swift.common import db_replicator
+from swift.common.db import DatabaseAlreadyExists
+from swift.common.direct_client import direct_head_container
+from swift.common.exceptions import ConnectionTimeout
+from swift.common.swob import HTTPAccepted
+from swift.common.utils import config_true_value, hash_path, mkdirs, \
+    normalize_timestamp, storage_directory
 
 
 class ContainerReplicator(db_replicator.Replicator):
     server_type = 'container'
     brokerclass = ContainerBroker
-    datadir = container_server.DATADIR
+    datadir = DATADIR
     default_port = 6001
 
+    def __init__(self, conf):
+        super(ContainerReplicator, self).__init__(conf)
+        self.shard_container_threshold = \
+            int(conf.get('shard_container_threshold', 0))
+        swift.container.backend.BATCH_STATS = \
+            config_true_value(conf.get('db_batch_stats', 'f'))
+
     def report_up_to_date(self, full_info):
         for key in ('put_timestamp', 'delete_timestamp', 'object_count',
                     'bytes_used'):
             if full_info['reported_' + key] != full_info[key]:
                 return False
         return True
+
+    def _replicate_object(self, partition, object_file, node_id):
+        """
+        Split the container into shards if it has grown too large, and move
+        its rows to its shards if it is sharded, before replicating it.
+
+        See :func:`swift.common.db_replicator.Replicator._replicate_object`
+        """
+        try:
+            self._process_shards(partition, object_file, node_id)
+        except (Exception, Timeout):
+            self.logger.exception(_('ERROR sharding %s'), object_file)
+        super(ContainerReplicator, self)._replicate_object(
+            partition, object_file, node_id)
+
+    def _repl_to_node(self, node, broker, partition, info):
+        """
+        Replicate the DB to a node, and then its shard ranges.
+
+        See :func:`swift.common.db_replicator.Replicator._repl_to_node`
+        """
+        success = super(ContainerReplicator, self)._repl_to_node(
+            node, broker, partition, info)
+        if not success:
+            return False
+        shard_ranges = broker.get_shard_ranges(include_deleted=True)
+        if not shard_ranges:
+            return True
+        with ConnectionTimeout(self.conn_timeout):
+            http = self._http_connect(node, partition, broker.db_file)
+        with Timeout(self.node_timeout):
+            response = http.replicate('merge_shard_ranges', shard_ranges)
+        return bool(response and 200 <= response.status < 300)
+
+    def _process_shards(self, partition, object_file, node_id):
+        """
+        Shard a container DB that has more than shard_container_threshold
+        objects, and move the rows of a sharded one to its shard containers.
+
+        Only the replica on the first primary node of the container picks
+        the shard ranges and polls the shards for their usage; the others
+        get both by replication. Each replica moves its own rows, since rows
+        still reach it from replicas that have not been sharded yet.
+
+        :param partition: partition of the container DB
+        :param object_file: path of the container DB
+        :param node_id: ID of the local device in the ring
+        """
+        broker = ContainerBroker(object_file, logger=self.logger)
+        if broker.is_deleted():
+            return
+        shard_ranges = broker.get_shard_ranges()
+        if not shard_ranges:
+            if not self.shard_container_threshold:
+                return
+            info = broker.get_info()
+            if info['object_count'] <= self.shard_container_threshold:
+                return
+            if not self._is_first_primary(partition, node_id):
+                return
+            shard_ranges = self._make_shard_ranges(broker, info)
+            if not shard_ranges:
+                return
+            broker.merge_shard_ranges(shard_ranges)
+            self.logger.info(_('Sharded %(db)s into %(count)d containers'),
+                             {'db': object_file, 'count': len(shard_ranges)})
+        max_row = broker.get_replication_info()['max_row']
+        device_path = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.dirname(object_file)))))
+        for shard_range in shard_ranges:
+            shard_broker = self._cleave(broker, shard_range, max_row,
+                                        device_path)
+            if shard_broker:
+                super(ContainerReplicator, self)._replicate_object(
+                    self.ring.get_part(*shard_range['name'].split('/')),
+                    shard_broker.db_file, node_id)
+        if self._is_first_primary(partition, node_id):
+            self._update_shard_usage(broker, shard_ranges)
+
+    def _is_first_primary(self, partition, node_id):
+        nodes = self.ring.get_part_nodes(int(partition))
+        return bool(nodes) and nodes[0]['id'] == node_id
+
+    def _make_shard_ranges(self, broker, info):
+        """
+        Pick the shard ranges for a container; each gets half of
+        shard_container_threshold objects, so that it has room to grow.
+
+        :param broker: ContainerBroker of the container
+        :param info: the container's info, as from get_info
+        :returns: list of shard range dicts
+        """
+        points = broker.find_shard_points(
+            max(self.shard_container_threshold // 2, 1))
+        if not points:
+            return []
+        timestamp = normalize_timestamp(time.time())
+        account = shard_account(info['account'])
+        shard_ranges = []
+        for lower, upper in zip([''] + points, points + ['']):
+            container = '%s-%s' % (info['container'], md5('%s/%s/%s/%s' % (
+                info['account'], info['container'], upper,
+                timestamp)).hexdigest())
+            shard_ranges.append({
+                'name': '%s/%s' % (account, container), 'lower': lower,
+                'upper': upper, 'created_at': timestamp, 'object_count': 0,
+                'bytes_used': 0, 'deleted': 0})
+        return shard_ranges
+
+    def _cleave(self, broker, shard_range, max_row, device_path):
+        """
+        Move the rows in a shard range from a container DB into a DB of the
+        shard container on the same device, creating it if need be. The
+        shard DB is then placed by replication like any other; once the rows
+        are in it, they can be deleted from the container DB.
+
+        :param broker: ContainerBroker of the sharded container
+        :param shard_range: the shard range dict
+        :param max_row: the highest ROWID of the container DB to move
+        :param device_path: path of the device the container DB is on
+        :returns: ContainerBroker of the shard DB if rows were moved, or None
+        """
+        batches = broker.get_shard_items(
+            shard_range['lower'], shard_range['upper'], max_row)
+        shard_broker = None
+        for items in batches:
+            if not shard_broker:
+                shard_broker = self._get_shard_broker(shard_range,
+                                                      device_path)
+            shard_broker.merge_items(items)
+        if shard_broker:
+            broker.remove_shard_items(
+                shard_range['lower'], shard_range['upper'], max_row)
+        return shard_broker
+
+    def _get_shard_broker(self, shard_range, device_path):
+        """
+        Get a broker for the local DB of a shard container, creating it if
+        it does not exist.
+
+        :param shard_range: the shard range dict
+        :param device_path: path of the device to put the DB on
+        :returns: ContainerBroker of the shard DB
+        """
+        account, container = shard_range['name'].split('/')
+        part = self.ring.get_part(account, container)
+        hsh = hash_path(account, container)
+        db_dir = os.path.join(device_path,
+                              storage_directory(DATADIR, part, hsh))
+        shard_broker = ContainerBroker(
+            os.path.join(db_dir, hsh + '.db'), account=account,
+            container=container, logger=self.logger)
+        if not os.path.exists(shard_broker.db_file):
+            mkdirs(db_dir)
+            try:
+                shard_broker.initialize(shard_range['created_at'])
+            except DatabaseAlreadyExists:
+                pass
+        return shard_broker
+
+    def _head_shard(self, shard_range):
+        """
+        Ask the primary nodes of a shard container in turn for its object
+        count and bytes used.
+
+        :param shard_range: the shard range dict
+        :returns: tuple of (shard range name, object count, bytes used), or
+                  None if no node answered
+        """
+        account, container = shard_range['name'].split('/')
+        part, nodes = self.ring.get_nodes(account, container)
+        for node in nodes:
+            try:
+                headers = direct_head_container(
+                    node, part, account, container,
+                    conn_timeout=self.conn_timeout,
+                    response_timeout=self.node_timeout)
+            except (Exception, Timeout):
+                continue
+            return (shard_range['name'],
+                    int(headers['x-container-object-count']),
+                    int(headers['x-container-bytes-used']))
+        return None
+
+    def _update_shard_usage(self, broker, shard_ranges):
+        """
+        Ask each shard container for its object count and bytes used,
+        concurrently, and record the answers in the container DB, from where
+        they are replicated with the shard ranges.
+
+        :param broker: ContainerBroker of the sharded container
+        :param shard_ranges: list of shard range dicts
+        """
+        pile = GreenPile(self.cpool.size)
+        for shard_range in shard_ranges:
+            pile.spawn(self._head_shard, shard_range)
+        for usage in pile:
+            if usage:
+                broker.set_shard_range_usage(*usage)
+
+
+class ContainerReplicatorRpc(db_replicator.ReplicatorRpc):
+    """Handle the replication RPC calls of container DBs."""
+
+    def merge_shard_ranges(self, broker, args):
+        broker.merge_shard_ranges(args[0])
+        return HTTPAccepted()
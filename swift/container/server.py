@@ -18,15 +18,18 @@ import time
 import traceback
 from datetime import datetime
 from swift import gettext_ as _
-from xml.etree.cElementTree import Element, SubElement, tostring
+from itertools import chain, islice
 
 from eventlet import Timeout
 
 import swift.common.db
-from swift.container.backend import ContainerBroker
+import swift.container.backend
+from swift.container.backend import ContainerBroker, DATADIR
+from swift.container.replicator import ContainerReplicatorRpc
 from swift.common.db import DatabaseAlreadyExists
+from swift.common.db_replicator import get_replicate_args
 from swift.common.request_helpers import get_param, get_listing_content_type, \
-    split_and_validate_path
+    split_and_validate_path, container_xml_listing
 from swift.common.utils import get_logger, hash_path, public, \
     normalize_timestamp, storage_directory, validate_sync_to, \
     config_true_value, json, timing_stats, replication, \
@@ -35,15 +38,12 @@ from swift.common.constraints import CONTAINER_LISTING_LIMIT, \
     check_mount, check_float, check_utf8
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ConnectionTimeout
-from swift.common.db_replicator import ReplicatorRpc
 from swift.common.http import HTTP_NOT_FOUND, is_success
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPConflict, \
     HTTPCreated, HTTPInternalServerError, HTTPNoContent, HTTPNotFound, \
     HTTPPreconditionFailed, HTTPMethodNotAllowed, Request, Response, \
     HTTPInsufficientStorage, HTTPException, HeaderKeyDict
 
-DATADIR = 'containers'
-
 
 class ContainerController(object):
     """WSGI Controller for the container server."""
@@ -66,7 +66,7 @@ class ContainerController(object):
             h.strip()
             for h in conf.get('allowed_sync_hosts', '127.0.0.1').split(',')
             if h.strip()]
-        self.replicator_rpc = ReplicatorRpc(
+        self.replicator_rpc = ContainerReplicatorRpc(
             self.root, DATADIR, ContainerBroker, self.mount_check,
             logger=self.logger)
         self.auto_create_account_prefix = \
@@ -75,6 +75,11 @@ class ContainerController(object):
             self.save_headers.append('x-versions-location')
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.set_db_profile(conf)
+        swift.container.backend.COVERING_INDEX = \
+            config_true_value(conf.get('db_covering_index', 'f'))
+        swift.container.backend.BATCH_STATS = \
+            config_true_value(conf.get('db_batch_stats', 'f'))
 
     def _get_container_broker(self, drive, part, account, container, **kwargs):
         """
@@ -308,6 +313,8 @@ class ContainerController(object):
             for key, (value, timestamp) in broker.metadata.iteritems()
             if value != '' and (key.lower() in self.save_headers or
                                 key.lower().startswith('x-container-meta-')))
+        if broker.get_shard_ranges():
+            headers['X-Backend-Sharded'] = 'true'
         headers['Content-Type'] = out_content_type
         return HTTPNoContent(request=req, headers=headers, charset='utf-8')
 
@@ -376,39 +383,70 @@ class ContainerController(object):
             if value and (key.lower() in self.save_headers or
                           key.lower().startswith('x-container-meta-')):
                 resp_headers[key] = value
+        # The listing of a sharded container is put together from the
+        # listings of its shards by the proxy, which asks for the shard
+        # ranges instead with X-Backend-Record-Type: auto.
+        record_type = req.headers.get('X-Backend-Record-Type', '').lower()
+        shard_ranges = broker.get_shard_ranges()
+        if shard_ranges:
+            resp_headers['X-Backend-Sharded'] = 'true'
+        if record_type == 'shard' or (record_type == 'auto' and
+                                      shard_ranges):
+            resp_headers['X-Backend-Record-Type'] = 'shard'
+            return Response(request=req, headers=resp_headers,
+                            body=json.dumps(shard_ranges),
+                            content_type='application/json', charset='utf-8')
         ret = Response(request=req, headers=resp_headers,
                        content_type=out_content_type, charset='utf-8')
-        container_list = broker.list_objects_iter(limit, marker, end_marker,
-                                                  prefix, delimiter, path)
+        container_list = broker.list_objects_batches(
+            limit, marker, end_marker, prefix, delimiter, path)
+        # Read up to two batches now, so that errors still get an error
+        # response, and only a listing longer than a batch is streamed
+        batches = list(islice(container_list, 2))
+        streaming = len(batches) > 1
+        if streaming:
+            batches = chain(batches, container_list)
         if out_content_type == 'application/json':
-            ret.body = json.dumps([self.update_data_record(record)
-                                   for record in container_list])
+            listing = self._json_listing(batches)
         elif out_content_type.endswith('/xml'):
-            doc = Element('container', name=container.decode('utf-8'))
-            for obj in container_list:
-                record = self.update_data_record(obj)
-                if 'subdir' in record:
-                    name = record['subdir'].decode('utf-8')
-                    sub = SubElement(doc, 'subdir', name=name)
-                    SubElement(sub, 'name').text = name
-                else:
-                    obj_element = SubElement(doc, 'object')
-                    for field in ["name", "hash", "bytes", "content_type",
-                                  "last_modified"]:
-                        SubElement(obj_element, field).text = str(
-                            record.pop(field)).decode('utf-8')
-                    for field in sorted(record):
-                        SubElement(obj_element, field).text = str(
-                            record[field]).decode('utf-8')
-            ret.body = tostring(doc, encoding='UTF-8').replace(
-                "<?xml version='1.0' encoding='UTF-8'?>",
-                '<?xml version="1.0" encoding="UTF-8"?>', 1)
+            listing = self._xml_listing(container, batches)
         else:
-            if not container_list:
+            if not batches:
                 return HTTPNoContent(request=req, headers=resp_headers)
-            ret.body = '\n'.join(rec[0] for rec in container_list) + '\n'
+            listing = ('\n'.join(rec[0] for rec in batch) + '\n'
+                       for batch in batches)
+        if streaming:
+            ret.app_iter = listing
+        else:
+            ret.body = ''.join(listing)
         return ret
 
+    def _json_listing(self, batches):
+        """
+        Serialize batches of container listing records as a JSON list.
+
+        :param batches: iterable of lists of records from list_objects_iter
+        :returns: a generator of parts of the body, one per batch
+        """
+        start = '['
+        for batch in batches:
+            yield start + json.dumps(
+                [self.update_data_record(record) for record in batch])[1:-1]
+            start = ', '
+        yield '[]' if start == '[' else ']'
+
+    def _xml_listing(self, container, batches):
+        """
+        Serialize batches of container listing records as an XML document.
+
+        :param container: the container name
+        :param batches: iterable of lists of records from list_objects_iter
+        :returns: a generator of parts of the body, one per batch
+        """
+        return container_xml_listing(container, (
+            [self.update_data_record(record) for record in batch]
+            for batch in batches))
+
     @public
     @replication
     @timing_stats(sample_rate=0.01)
@@ -421,7 +459,7 @@ class ContainerController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         try:
-            args = json.load(req.environ['wsgi.input'])
+            args = get_replicate_args(req)
         except ValueError as err:
             return HTTPBadRequest(body=str(err), content_type='text/plain')
         ret = self.replicator_rpc.dispatch(post_args, args)
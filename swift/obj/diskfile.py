@@ -33,6 +33,7 @@ are also not considered part of the backend API.
 import cPickle as pickle
 import errno
 import os
+import struct
 import time
 import uuid
 import hashlib
@@ -40,40 +41,82 @@ import logging
 import traceback
 from os.path import basename, dirname, exists, getmtime, join
 from random import shuffle
+from StringIO import StringIO
 from tempfile import mkstemp
 from contextlib import contextmanager
 from collections import defaultdict
+from itertools import izip
 
 from xattr import getxattr, setxattr
 from eventlet import Timeout
+from eventlet.hubs import trampoline
 
 from swift import gettext_ as _
 from swift.common.constraints import check_mount
 from swift.common.utils import mkdirs, normalize_timestamp, \
     storage_directory, hash_path, renamer, fallocate, fsync, \
-    fdatasync, drop_buffer_cache, ThreadPool, lock_path, write_pickle, \
-    config_true_value, listdir, split_path, ismount
+    fdatasync, drop_buffer_cache, ThreadPool, lock_path, \
+    config_true_value, listdir, split_path, ismount, json, sendfile, \
+    sendfile_available, list_from_csv, LRUCache, OrderedDict
 from swift.common.exceptions import DiskFileQuarantined, DiskFileNotExist, \
     DiskFileCollision, DiskFileNoSpace, DiskFileDeviceUnavailable, \
     DiskFileDeleted, DiskFileError, DiskFileNotOpen, PathNotDir, \
-    ReplicationLockTimeout
+    ReplicationLockTimeout, ChunkWriteTimeout
 from swift.common.swob import multi_range_iterator
+from swift.obj.volume import VOLUME_DIR, EXTENSION_RECORDS, \
+    PartitionVolumes, live_names
 
 
 PICKLE_PROTOCOL = 2
 ONE_WEEK = 604800
-HASH_FILE = 'hashes.pkl'
+HASH_FILE = 'hashes.dat'
+HASH_INVALIDATIONS_FILE = 'hashes.invalid'
+HASH_INDEX_FILE = 'hashes.index'
+# First line of a hash index that is still being built by a walk of its
+# partition; appends made meanwhile follow it.
+HASH_INDEX_REBUILDING = '# rebuilding\n'
+LEGACY_HASH_FILE = 'hashes.pkl'
+HASH_FILE_MAGIC = 'SWHS'
+ASYNC_UPDATE_MAGIC = 'SWAU'
+METADATA_MAGIC = 'SWMD'
+# Bump these when changing the layout of the files they start; readers must
+# keep understanding every older version.
+HASH_FILE_VERSION = 1
+ASYNC_UPDATE_VERSION = 1
+METADATA_VERSION = 1
+# magic, version and length of the keys and values that follow
+METADATA_HEADER = '!4sBI'
 METADATA_KEY = 'user.swift.metadata'
 # These are system-set metadata keys that cannot be changed with a POST.
 # They should be lowercase.
 DATAFILE_SYSTEM_META = set('content-length content-type deleted etag'.split())
 DATADIR = 'objects'
 ASYNCDIR = 'async_pending'
+# Hash dirs changed more recently than this many seconds ago are not cached,
+# since another change within the granularity of the filesystem's timestamps
+# could leave their mtime as it was.
+OPEN_CACHE_MIN_AGE = 1
+
+
+def _metadata_length(metastr):
+    """
+    Get the length of encoded metadata from its header.
+
+    :param metastr: the start of metadata read from xattrs
+    :returns: the length of the whole encoded metadata, or None if it is
+              pickled or its header has not been read in full
+    """
+    if not metastr.startswith(METADATA_MAGIC) or \
+            len(metastr) < struct.calcsize(METADATA_HEADER):
+        return None
+    return struct.calcsize(METADATA_HEADER) + \
+        struct.unpack_from(METADATA_HEADER, metastr)[2]
 
 
 def read_metadata(fd):
     """
-    Helper function to read the pickled metadata from an object file.
+    Helper function to read the metadata from an object file, as written by
+    :func:`write_metadata` in either format.
 
     :param fd: file descriptor or filename to load the metadata from
 
@@ -85,19 +128,41 @@ def read_metadata(fd):
         while True:
             metadata += getxattr(fd, '%s%s' % (METADATA_KEY, (key or '')))
             key += 1
+            # Encoded metadata says how long it is, so it usually takes one
+            # getxattr, and any stale pieces of longer metadata written over
+            # are left alone; pickles go on until the pieces run out.
+            length = _metadata_length(metadata)
+            if length is not None and len(metadata) >= length:
+                break
     except IOError:
         pass
-    return pickle.loads(metadata)
+    return decode_metadata(metadata)
 
 
-def write_metadata(fd, metadata):
+def write_metadata(fd, metadata, compact=False):
     """
-    Helper function to write pickled metadata for an object file.
+    Helper function to write metadata for an object file.
+
+    The metadata is pickled and split over xattrs of 254 bytes, which every
+    version of Swift reads. If compact is True, it is encoded with
+    :func:`encode_metadata` instead and written to a single xattr, falling
+    back to pieces of 254 bytes where the filesystem does not take xattrs
+    that large.
 
     :param fd: file descriptor or filename to write the metadata
     :param metadata: metadata to write
+    :param compact: whether to write the metadata in the compact format
     """
-    metastr = pickle.dumps(metadata, PICKLE_PROTOCOL)
+    if compact:
+        metastr = encode_metadata(metadata)
+        try:
+            setxattr(fd, METADATA_KEY, metastr)
+            return
+        except IOError as err:
+            if err.errno not in (errno.E2BIG, errno.ENOSPC, errno.ERANGE):
+                raise
+    else:
+        metastr = pickle.dumps(metadata, PICKLE_PROTOCOL)
     key = 0
     while metastr:
         setxattr(fd, '%s%s' % (METADATA_KEY, key or ''), metastr[:254])
@@ -105,6 +170,131 @@ def write_metadata(fd, metadata):
         key += 1
 
 
+def _utf8_strings(obj):
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, dict):
+        return dict((_utf8_strings(k), _utf8_strings(v))
+                    for k, v in obj.iteritems())
+    if isinstance(obj, list):
+        return [_utf8_strings(v) for v in obj]
+    return obj
+
+
+def encode_metadata(metadata):
+    """
+    Serialize object metadata compactly: a magic string, a version byte and
+    the length of what follows, which is the metadata's keys and values
+    separated by NUL bytes.
+
+    :param metadata: dictionary of metadata
+    :returns: encoded string
+    """
+    items = []
+    for key, value in metadata.iteritems():
+        if not isinstance(key, str) or not isinstance(value, str) or \
+                '\x00' in key or '\x00' in value:
+            # Only strings without NULs fit, anything else can only be kept
+            # in the older format
+            return pickle.dumps(metadata, PICKLE_PROTOCOL)
+        items.extend((key, value))
+    body = '\x00'.join(items)
+    return struct.pack(METADATA_HEADER, METADATA_MAGIC, METADATA_VERSION,
+                       len(body)) + body
+
+
+def decode_metadata(metastr):
+    """
+    Deserialize object metadata encoded by :func:`encode_metadata`, or
+    pickled.
+
+    :param metastr: encoded string
+    :returns: dictionary of metadata
+    :raises ValueError: if the metadata's format version is unknown, or it
+                        is cut short
+    """
+    length = _metadata_length(metastr)
+    if length is None:
+        return pickle.loads(metastr)
+    version = struct.unpack_from(METADATA_HEADER, metastr)[1]
+    if version > METADATA_VERSION:
+        raise ValueError('Unknown metadata format version %d' % version)
+    if len(metastr) < length:
+        raise ValueError('Metadata is %d bytes short' %
+                         (length - len(metastr)))
+    body = metastr[struct.calcsize(METADATA_HEADER):length]
+    items = body.split('\x00') if body else []
+    if len(items) % 2:
+        raise ValueError('Metadata key without a value')
+    items = iter(items)
+    return dict(izip(items, items))
+
+
+def encode_async_update(update):
+    """
+    Serialize an async pending container update: a magic string and version
+    byte followed by the update as JSON.
+
+    :param update: dict describing the container update
+    :returns: encoded string
+    """
+    try:
+        body = json.dumps(update)
+    except UnicodeDecodeError:
+        # Not valid UTF-8, so it can only be kept in the older format
+        return pickle.dumps(update, PICKLE_PROTOCOL)
+    return struct.pack('!4sB', ASYNC_UPDATE_MAGIC,
+                       ASYNC_UPDATE_VERSION) + body
+
+
+def decode_async_update(data):
+    """
+    Deserialize an async pending container update written by
+    :func:`encode_async_update`, or pickled by older versions.
+
+    :param data: encoded string
+    :returns: dict describing the container update
+    :raises ValueError: if the update's format version is unknown
+    """
+    if not data.startswith(ASYNC_UPDATE_MAGIC):
+        return pickle.loads(data)
+    version = struct.unpack_from('!B', data, len(ASYNC_UPDATE_MAGIC))[0]
+    if version > ASYNC_UPDATE_VERSION:
+        raise ValueError('Unknown async update format version %d' % version)
+    return _utf8_strings(json.loads(data[len(ASYNC_UPDATE_MAGIC) + 1:]))
+
+
+def read_async_update(update_path):
+    """
+    Load an async pending container update from disk.
+
+    :param update_path: path to the async pending file
+    :returns: dict describing the container update
+    """
+    with open(update_path, 'rb') as fp:
+        return decode_async_update(fp.read())
+
+
+def write_async_update(update, dest, tmp=None):
+    """
+    Ensure that an async pending container update gets written to disk. As
+    with :func:`swift.common.utils.write_pickle`, the file is written and
+    synced in tmp before being moved to its final location.
+
+    :param update: dict describing the container update
+    :param dest: path of final destination file
+    :param tmp: path to tmp to use, defaults to None
+    """
+    if tmp is None:
+        tmp = dirname(dest)
+    fd, tmppath = mkstemp(dir=tmp, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fo:
+        fo.write(encode_async_update(update))
+        fo.flush()
+        os.fsync(fd)
+        renamer(tmppath, dest)
+
+
 def quarantine_renamer(device_path, corrupted_file_path):
     """
     In the case that a file is corrupted, move it to a quarantined
@@ -127,6 +317,53 @@ def quarantine_renamer(device_path, corrupted_file_path):
             raise
         to_dir = "%s-%s" % (to_dir, uuid.uuid4().hex)
         renamer(from_dir, to_dir)
+    update_hash_index(from_dir, [])
+    return to_dir
+
+
+def quarantine_packed(device_path, hsh_path, volumes):
+    """
+    Quarantine an object on a device that packs small objects into volumes:
+    move its hash dir, if it has one, as :func:`quarantine_renamer` does,
+    and copy its packed records there as files before removing them from the
+    volumes.
+
+    :params device_path: The path to the device the object is on.
+    :params hsh_path: The path of the object's hash dir.
+    :params volumes: PartitionVolumes of the object's partition
+
+    :returns: path (str) of directory the object was moved to
+    """
+    object_hash = basename(hsh_path)
+    if os.path.isdir(hsh_path):
+        to_dir = quarantine_renamer(device_path, join(hsh_path, object_hash))
+    else:
+        to_dir = join(device_path, 'quarantined', 'objects', object_hash)
+        if exists(to_dir):
+            to_dir = "%s-%s" % (to_dir, uuid.uuid4().hex)
+        mkdirs(to_dir)
+        invalidate_hash(dirname(hsh_path))
+        update_hash_index(hsh_path, [])
+    records = volumes.get(object_hash)
+    for name, record in records.iteritems():
+        try:
+            metastr, data = volumes.read(object_hash, record)
+        except (IOError, ValueError):
+            # gone, or damaged past saving
+            continue
+        with open(join(to_dir, name), 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            # as it was, in pieces read_metadata takes whatever the format
+            key = 0
+            while metastr:
+                setxattr(fp.fileno(), '%s%s' % (METADATA_KEY, key or ''),
+                         metastr[:254])
+                metastr = metastr[254:]
+                key += 1
+    if records:
+        volumes.remove(object_hash,
+                       max(record.timestamp for record in records.values()))
     return to_dir
 
 
@@ -165,25 +402,83 @@ def hash_cleanup_listdir(hsh_path, reclaim_age=ONE_WEEK):
     return files
 
 
-def hash_suffix(path, reclaim_age):
+def packed_cleanup_listdir(hsh_path, volumes, reclaim_age=ONE_WEEK):
+    """
+    List an object's files and packed records on a device that packs small
+    objects into volumes, and clean up any made obsolete by the others or
+    old, by the same rules as :func:`hash_cleanup_listdir`.
+
+    :param hsh_path: object hash path, which need not exist
+    :param volumes: PartitionVolumes of the object's partition
+    :param reclaim_age: age in seconds at which to remove tombstones
+    :returns: list of the names of the files and records remaining, reverse
+              sorted
+    """
+    object_hash = basename(hsh_path)
+    try:
+        files = os.listdir(hsh_path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        files = []
+    records = volumes.get(object_hash)
+    names = live_names(files + records.keys())
+    for filename in files:
+        if filename not in names:
+            os.unlink(join(hsh_path, filename))
+    obsolete = [record.timestamp for name, record in records.iteritems()
+                if name not in names]
+    live = [records[name].timestamp for name in names if name in records]
+    # a removal takes every older record with it, so obsolete records newer
+    # than a live one are left for compaction
+    if obsolete and (not live or max(obsolete) < min(live)):
+        volumes.remove(object_hash, max(obsolete))
+    if len(names) == 1 and names[0].endswith('.ts') and \
+            time.time() - float(names[0].rsplit('.', 1)[0]) > reclaim_age:
+        # the volumes no longer list a reclaimed record, and compaction
+        # drops it
+        if names[0] in files:
+            os.unlink(join(hsh_path, names[0]))
+        names = []
+    if files and not set(files).intersection(names):
+        try:
+            os.rmdir(hsh_path)
+        except OSError:
+            pass
+    return names
+
+
+def hash_suffix(path, reclaim_age, index_entries=None, volumes=None):
     """
     Performs reclamation and returns an md5 of all (remaining) files.
 
     :param reclaim_age: age in seconds at which to remove tombstones
+    :param index_entries: optional dict to be filled in with the remaining
+                          files of each hash dir, keyed by hash, for the
+                          partition's hash index
+    :param volumes: PartitionVolumes of the partition, if its device packs
+                    small objects; their records are hashed as files
     :raises PathNotDir: if given path is not a valid directory
     :raises OSError: for non-ENOTDIR errors
     """
     md5 = hashlib.md5()
+    packed = volumes.hashes(basename(path)) if volumes else {}
     try:
-        path_contents = sorted(os.listdir(path))
+        path_contents = os.listdir(path)
     except OSError as err:
-        if err.errno in (errno.ENOTDIR, errno.ENOENT):
+        if err.errno not in (errno.ENOTDIR, errno.ENOENT):
+            raise
+        if not packed or err.errno == errno.ENOTDIR:
             raise PathNotDir()
-        raise
-    for hsh in path_contents:
+        path_contents = []
+    for hsh in sorted(set(path_contents).union(packed)):
         hsh_path = join(path, hsh)
         try:
-            files = hash_cleanup_listdir(hsh_path, reclaim_age)
+            if volumes:
+                files = packed_cleanup_listdir(hsh_path, volumes,
+                                               reclaim_age)
+            else:
+                files = hash_cleanup_listdir(hsh_path, reclaim_age)
         except OSError as err:
             if err.errno == errno.ENOTDIR:
                 partition_path = dirname(path)
@@ -196,7 +491,10 @@ def hash_suffix(path, reclaim_age):
                 continue
             raise
         if not files:
-            os.rmdir(hsh_path)
+            if not volumes:
+                os.rmdir(hsh_path)
+        elif index_entries is not None:
+            index_entries[hsh] = files
         for filename in files:
             md5.update(filename)
     try:
@@ -206,40 +504,352 @@ def hash_suffix(path, reclaim_age):
     return md5.hexdigest()
 
 
+def hash_suffix_from_index(path, index_entries, reclaim_age, volumes=None):
+    """
+    Returns the same md5 as :func:`hash_suffix` would, but computed from the
+    suffix's entries in the partition's hash index rather than by listing
+    every hash dir. Only hash dirs holding a lone tombstone are looked at on
+    disk, so that it can be reclaimed once it is older than reclaim_age.
+
+    :param path: path of the suffix dir
+    :param index_entries: dict of hash -> remaining files for the suffix, as
+                          loaded by :func:`read_hash_index`; updated in place
+                          for any reclaimed hash dirs
+    :param reclaim_age: age in seconds at which to remove tombstones
+    :param volumes: PartitionVolumes of the partition, if its device packs
+                    small objects
+    :raises PathNotDir: if the suffix has no entries and given path is not a
+                        valid directory
+    """
+    md5 = hashlib.md5()
+    for hsh in sorted(index_entries):
+        files = index_entries[hsh]
+        if len(files) == 1 and files[0].endswith('.ts') and \
+                time.time() - float(files[0].rsplit('.', 1)[0]) > reclaim_age:
+            hsh_path = join(path, hsh)
+            try:
+                if volumes:
+                    files = packed_cleanup_listdir(hsh_path, volumes,
+                                                   reclaim_age)
+                else:
+                    files = hash_cleanup_listdir(hsh_path, reclaim_age)
+                    if not files:
+                        os.rmdir(hsh_path)
+            except OSError as err:
+                if err.errno not in (errno.ENOTDIR, errno.ENOENT):
+                    raise
+                files = []
+            if not files:
+                del index_entries[hsh]
+                continue
+            index_entries[hsh] = files
+        for filename in files:
+            md5.update(filename)
+    if not index_entries:
+        try:
+            os.rmdir(path)
+        except OSError as err:
+            if err.errno in (errno.ENOTDIR, errno.ENOENT):
+                raise PathNotDir()
+    return md5.hexdigest()
+
+
+def _load_hash_index_lines(lines, index):
+    for line in lines:
+        if not line.endswith('\n'):
+            # torn append, the hash dir will be rehashed on the next check
+            continue
+        parts = line.split()
+        if not parts:
+            continue
+        hsh, files = parts[0], parts[1:]
+        if files:
+            index.setdefault(hsh[-3:], {})[hsh] = files
+        else:
+            index.get(hsh[-3:], {}).pop(hsh, None)
+
+
+def read_hash_index(partition_dir):
+    """
+    Load a partition's hash index: a journal of the files remaining in each
+    of the partition's hash dirs, appended to by
+    :func:`update_hash_index` whenever an object file is written or a hash
+    dir is quarantined. Later entries for a hash replace earlier ones and an
+    entry with no files removes the hash.
+
+    :param partition_dir: absolute path of partition
+    :returns: tuple of (dict of suffix -> dict of hash -> files, number of
+              bytes read), or (None, 0) if the partition has no index or
+              its index is still being built
+    """
+    index = {}
+    try:
+        with open(join(partition_dir, HASH_INDEX_FILE), 'rb') as fp:
+            data = fp.read()
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return None, 0
+    if data.startswith(HASH_INDEX_REBUILDING):
+        return None, 0
+    _load_hash_index_lines(data.splitlines(True), index)
+    return index, len(data)
+
+
+def start_hash_index(partition_dir):
+    """
+    Create a partition's hash index, marked as being built, before its
+    partition is walked to build it; :func:`update_hash_index` appends to it
+    meanwhile, so that no change made during the walk is lost when
+    :func:`write_hash_index` replaces it.
+
+    :param partition_dir: absolute path of partition
+    :returns: offset into the index the walk's result reflects
+    """
+    index_file = join(partition_dir, HASH_INDEX_FILE)
+    with lock_path(partition_dir):
+        with open(index_file, 'a+b') as fp:
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            if not size:
+                fp.write(HASH_INDEX_REBUILDING)
+                return len(HASH_INDEX_REBUILDING)
+            fp.seek(0)
+            if fp.read(len(HASH_INDEX_REBUILDING)) == HASH_INDEX_REBUILDING:
+                # left by a walk that did not finish; all appended since
+                # are newer than what it found
+                return len(HASH_INDEX_REBUILDING)
+            # written since it was found missing, the walk sees all of it
+            return size
+
+
+def write_hash_index(partition_dir, index, offset):
+    """
+    Rewrite a partition's hash index in compacted form. Entries appended to
+    the index after the first offset bytes were read are applied on top of
+    the given index first, so the caller must hold the partition lock to keep
+    any more from being appended until the new index is in place.
+
+    :param partition_dir: absolute path of partition
+    :param index: dict of suffix -> dict of hash -> files to write
+    :param offset: number of bytes of the current index already reflected in
+                   index
+    """
+    index_file = join(partition_dir, HASH_INDEX_FILE)
+    try:
+        with open(index_file, 'rb') as fp:
+            fp.seek(offset)
+            _load_hash_index_lines(fp.readlines(), index)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    fd, tmppath = mkstemp(dir=partition_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fo:
+        for suffix in sorted(index):
+            for hsh, files in sorted(index[suffix].iteritems()):
+                fo.write('%s %s\n' % (hsh, ' '.join(files)))
+        fo.flush()
+        os.fsync(fd)
+        renamer(tmppath, index_file)
+
+
+def update_hash_index(hsh_path, files):
+    """
+    Record the files remaining in a hash dir in its partition's hash index,
+    if the partition has one.
+
+    :param hsh_path: absolute path of the hash dir
+    :param files: list of files remaining in the hash dir, as returned by
+                  :func:`hash_cleanup_listdir`; empty if the hash dir is gone
+    """
+    partition_dir = dirname(dirname(hsh_path))
+    index_file = join(partition_dir, HASH_INDEX_FILE)
+    if not exists(index_file):
+        # Not locking when there is none; one created after this check is
+        # being built, and its walk of the partition finds these files.
+        return
+    entry = '%s %s\n' % (basename(hsh_path), ' '.join(files))
+    with lock_path(partition_dir):
+        try:
+            fd = os.open(index_file, os.O_WRONLY | os.O_APPEND)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            os.write(fd, entry)
+        except OSError:
+            # The index can no longer be trusted; the next get_hashes will
+            # rebuild it from the filesystem.
+            os.unlink(index_file)
+            raise
+        finally:
+            os.close(fd)
+
+
 def invalidate_hash(suffix_dir):
     """
     Invalidates the hash for a suffix_dir in the partition's hashes file.
 
+    The suffix is only appended to the partition's invalidations journal;
+    the next :func:`consolidate_hashes` folds it into the hashes file.
+
     :param suffix_dir: absolute path to suffix dir whose hash needs
                        invalidating
     """
 
     suffix = basename(suffix_dir)
     partition_dir = dirname(suffix_dir)
-    hashes_file = join(partition_dir, HASH_FILE)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
+    with lock_path(partition_dir):
+        with open(invalidations_file, 'ab') as fp:
+            fp.write(suffix + '\n')
+
+
+def encode_hashes(hashes):
+    """
+    Serialize suffix hashes to the hashes file format: a magic string and
+    version byte, followed by a record per suffix of its length, a valid
+    flag, the suffix and, when valid, the 16 byte md5 of the suffix.
+
+    :param hashes: dict of suffix -> hex md5, or None if invalidated
+    :returns: encoded string
+    """
+    records = [struct.pack('!4sB', HASH_FILE_MAGIC, HASH_FILE_VERSION)]
+    for suffix, hash_ in hashes.iteritems():
+        records.append(struct.pack('!B?', len(suffix), bool(hash_)))
+        records.append(suffix)
+        if hash_:
+            records.append(hash_.decode('hex'))
+    return ''.join(records)
+
+
+def decode_hashes(data):
+    """
+    Deserialize suffix hashes written by :func:`encode_hashes`.
+
+    :param data: encoded string
+    :returns: dict of suffix -> hex md5, or None if invalidated
+    :raises ValueError: if data is not a valid hashes file
+    """
+    try:
+        magic, version = struct.unpack_from('!4sB', data)
+    except struct.error:
+        raise ValueError('Truncated hashes file')
+    if magic != HASH_FILE_MAGIC or version > HASH_FILE_VERSION:
+        raise ValueError('Unknown hashes file format')
+    hashes = {}
+    pos = 5
+    try:
+        while pos < len(data):
+            length, valid = struct.unpack_from('!B?', data, pos)
+            pos += 2
+            suffix = data[pos:pos + length]
+            pos += length
+            if valid:
+                hashes[suffix] = data[pos:pos + 16].encode('hex')
+                pos += 16
+            else:
+                hashes[suffix] = None
+    except struct.error:
+        raise ValueError('Truncated hashes file')
+    if pos != len(data):
+        raise ValueError('Truncated hashes file')
+    return hashes
+
+
+def read_hashes(partition_dir):
+    """
+    Load a partition's suffix hashes from its hashes file, or from the
+    hashes.pkl written by older versions if it has not been replaced yet.
+
+    :param partition_dir: absolute path of partition
+    :returns: dict of suffix -> hex md5, or None if invalidated
+    :raises: IOError if neither file exists, or any error from decoding
+    """
+    try:
+        with open(join(partition_dir, HASH_FILE), 'rb') as fp:
+            return decode_hashes(fp.read())
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    with open(join(partition_dir, LEGACY_HASH_FILE), 'rb') as fp:
+        return pickle.load(fp)
+
+
+def write_hashes(partition_dir, hashes):
+    """
+    Atomically replace a partition's hashes file, removing any hashes.pkl
+    left over from older versions. The caller must hold the partition lock.
+
+    :param partition_dir: absolute path of partition
+    :param hashes: dict of suffix -> hex md5, or None if invalidated
+    """
+    fd, tmppath = mkstemp(dir=partition_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fo:
+        fo.write(encode_hashes(hashes))
+        fo.flush()
+        os.fsync(fd)
+        renamer(tmppath, join(partition_dir, HASH_FILE))
+    try:
+        os.unlink(join(partition_dir, LEGACY_HASH_FILE))
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def consolidate_hashes(partition_dir):
+    """
+    Fold the suffixes in a partition's invalidations journal into its hashes
+    file and empty the journal.
+
+    :param partition_dir: absolute path of partition
+    :returns: dict of suffix -> hex md5, or None if invalidated
+    :raises: any error from :func:`read_hashes`
+    """
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
     with lock_path(partition_dir):
+        hashes = read_hashes(partition_dir)
         try:
-            with open(hashes_file, 'rb') as fp:
-                hashes = pickle.load(fp)
-            if suffix in hashes and not hashes[suffix]:
-                return
-        except Exception:
-            return
-        hashes[suffix] = None
-        write_pickle(hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+            with open(invalidations_file, 'rb') as fp:
+                suffixes = fp.read().split()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            suffixes = []
+        if suffixes:
+            hashes.update((suffix, None) for suffix in suffixes)
+            write_hashes(partition_dir, hashes)
+            open(invalidations_file, 'wb').close()
+    return hashes
 
 
 def get_hashes(partition_dir, recalculate=None, do_listdir=False,
-               reclaim_age=ONE_WEEK):
+               reclaim_age=ONE_WEEK, use_index=False, check_index=False,
+               volumes=None):
     """
     Get a list of hashes for the suffix dir.  do_listdir causes it to mistrust
     the hash cache for suffix existence at the (unexpectedly high) cost of a
     listdir.  reclaim_age is just passed on to hash_suffix.
 
+    With use_index, invalidated suffixes are rehashed from the partition's
+    hash index (see :func:`read_hash_index`) instead of by listing each hash
+    dir. Suffixes given in recalculate, e.g. after an rsync into the
+    partition, are always rehashed from disk. The index is built by a full
+    walk of the partition when it does not exist yet, and check_index forces
+    such a rebuild to correct and report any drift.
+
     :param partition_dir: absolute path of partition to get hashes for
     :param recalculate: list of suffixes which should be recalculated when got
     :param do_listdir: force existence check for all hashes in the partition
     :param reclaim_age: age at which to remove tombstones
+    :param use_index: use and maintain the partition's hash index
+    :param check_index: rebuild the hash index from disk, logging any
+                        hashes it had wrong
+    :param volumes: PartitionVolumes of the partition, if its device packs
+                    small objects; their records are hashed as the files
+                    they would otherwise be, so that suffix hashes match
+                    those of devices that do not
 
     :returns: tuple of (number of suffix dirs hashed, dictionary of hashes)
     """
@@ -250,43 +860,88 @@ def get_hashes(partition_dir, recalculate=None, do_listdir=False,
     force_rewrite = False
     hashes = {}
     mtime = -1
+    index = old_index = None
+    index_offset = 0
+    rebuild_index = False
 
     if recalculate is None:
         recalculate = []
 
     try:
-        with open(hashes_file, 'rb') as fp:
-            hashes = pickle.load(fp)
+        hashes = consolidate_hashes(partition_dir)
         mtime = getmtime(hashes_file)
     except Exception:
         do_listdir = True
         force_rewrite = True
+    if use_index:
+        index, index_offset = read_hash_index(partition_dir)
+        if index is None or check_index:
+            if index is None:
+                index_offset = start_hash_index(partition_dir)
+            old_index, index = index, {}
+            rebuild_index = do_listdir = True
     if do_listdir:
         for suff in os.listdir(partition_dir):
             if len(suff) == 3:
                 hashes.setdefault(suff, None)
+        if volumes:
+            for suff in volumes.suffixes():
+                hashes.setdefault(suff, None)
         modified = True
+    if rebuild_index:
+        recalculate = list(hashes)
     hashes.update((hash_, None) for hash_ in recalculate)
     for suffix, hash_ in hashes.items():
         if not hash_:
             suffix_dir = join(partition_dir, suffix)
             try:
-                hashes[suffix] = hash_suffix(suffix_dir, reclaim_age)
+                if index is not None and suffix not in recalculate:
+                    hashes[suffix] = hash_suffix_from_index(
+                        suffix_dir, index.setdefault(suffix, {}),
+                        reclaim_age, volumes)
+                elif index is not None:
+                    index[suffix] = {}
+                    hashes[suffix] = hash_suffix(
+                        suffix_dir, reclaim_age, index[suffix], volumes)
+                else:
+                    hashes[suffix] = hash_suffix(suffix_dir, reclaim_age,
+                                                 volumes=volumes)
                 hashed += 1
             except PathNotDir:
                 del hashes[suffix]
+                if index is not None:
+                    index.pop(suffix, None)
             except OSError:
                 logging.exception(_('Error hashing suffix'))
             modified = True
+    if old_index is not None:
+        drifted = 0
+        for suffix in set(old_index) | set(index):
+            old_entries = old_index.get(suffix, {})
+            entries = index.get(suffix, {})
+            drifted += sum(1 for hsh in set(old_entries) | set(entries)
+                           if old_entries.get(hsh) != entries.get(hsh))
+        if drifted:
+            logging.error(_('Hash index for %(part)s had %(count)d wrong '
+                            'entries, rebuilt'),
+                          {'part': partition_dir, 'count': drifted})
     if modified:
         with lock_path(partition_dir):
             if force_rewrite or not exists(hashes_file) or \
                     getmtime(hashes_file) == mtime:
-                write_pickle(
-                    hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+                write_hashes(partition_dir, hashes)
+                if index is not None:
+                    write_hash_index(partition_dir, index, index_offset)
+                elif not use_index:
+                    # stop appends to an index that will no longer be kept
+                    # in step with replication
+                    try:
+                        os.unlink(join(partition_dir, HASH_INDEX_FILE))
+                    except OSError:
+                        pass
                 return hashed, hashes
         return get_hashes(partition_dir, recalculate, do_listdir,
-                          reclaim_age)
+                          reclaim_age, use_index, check_index, volumes)
     else:
         return hashed, hashes
 
@@ -306,7 +961,8 @@ class AuditLocation(object):
         return str(self.path)
 
 
-def object_audit_location_generator(devices, mount_check=True, logger=None):
+def object_audit_location_generator(devices, mount_check=True, logger=None,
+                                    get_volumes=None):
     """
     Given a devices path (e.g. "/srv/node"), yield an AuditLocation for all
     objects stored under that directory. The AuditLocation only knows the path
@@ -318,6 +974,11 @@ def object_audit_location_generator(devices, mount_check=True, logger=None):
     :param mount_check: flag to check if a mount check should be performed
                         on devices
     :param logger: a logger object
+    :param get_volumes: callable taking a device and partition and returning
+                        the PartitionVolumes of the partition, or None if the
+                        device does not pack small objects; packed objects
+                        are yielded at the hash dirs they would otherwise
+                        have
     """
     device_dirs = listdir(devices)
     # randomize devices in case of process restart before sweep completed
@@ -339,7 +1000,11 @@ def object_audit_location_generator(devices, mount_check=True, logger=None):
                 if e.errno != errno.ENOTDIR:
                     raise
                 continue
+            volumes = get_volumes(device, partition) if get_volumes else None
+            listed = set()
             for asuffix in suffixes:
+                if asuffix == VOLUME_DIR:
+                    continue
                 suff_path = os.path.join(part_path, asuffix)
                 try:
                     hashes = listdir(suff_path)
@@ -349,7 +1014,66 @@ def object_audit_location_generator(devices, mount_check=True, logger=None):
                     continue
                 for hsh in hashes:
                     hsh_path = os.path.join(suff_path, hsh)
+                    if volumes:
+                        listed.add(hsh)
                     yield AuditLocation(hsh_path, device, partition)
+            if volumes:
+                for asuffix in volumes.suffixes():
+                    for hsh in volumes.hashes(asuffix):
+                        if hsh not in listed:
+                            hsh_path = os.path.join(part_path, asuffix, hsh)
+                            yield AuditLocation(hsh_path, device, partition)
+
+
+class OpenObjectCache(object):
+    """
+    A bounded cache of what opening an object found in its hash dir: its
+    .data and .meta files and their merged metadata. An entry is used for as
+    long as the hash dir keeps the inode and mtime it had when the entry was
+    made, which every PUT, POST, DELETE and quarantine changes.
+
+    Each object server worker has its own, shared by its greenthreads.
+
+    :param size: the number of hash dirs to keep entries for
+    """
+
+    def __init__(self, size):
+        self._entries = LRUCache(maxsize=size, ttl=ONE_WEEK)
+
+    def get(self, datadir, dir_stat):
+        """
+        Look up the entry for a hash dir.
+
+        :param datadir: path to the hash dir
+        :param dir_stat: result of os.stat of the hash dir
+        :returns: the entry, or None if there is none still current
+        """
+        entry = self._entries.get(datadir)
+        if entry is None:
+            return None
+        if entry[:2] != (dir_stat.st_ino, dir_stat.st_mtime):
+            self._entries.delete(datadir)
+            return None
+        return entry
+
+    def set(self, datadir, dir_stat, data_file, meta_file, metadata):
+        """
+        Make the entry for a hash dir, unless it has changed too recently.
+
+        :param datadir: path to the hash dir
+        :param dir_stat: result of os.stat of the hash dir, taken before it
+                         was listed
+        :param data_file: path to the object's .data file
+        :param meta_file: path to the object's .meta file, or None
+        :param metadata: the object's metadata
+        :returns: the entry, or None if it was not made
+        """
+        if dir_stat.st_mtime > time.time() - OPEN_CACHE_MIN_AGE:
+            return None
+        entry = (dir_stat.st_ino, dir_stat.st_mtime, data_file, meta_file,
+                 metadata)
+        self._entries.set(datadir, entry)
+        return entry
 
 
 class DiskFileManager(object):
@@ -386,9 +1110,34 @@ class DiskFileManager(object):
             conf.get('replication_one_per_device', 'true'))
         self.replication_lock_timeout = int(conf.get(
             'replication_lock_timeout', 15))
+        self.suffix_hash_index = config_true_value(
+            conf.get('suffix_hash_index', 'false'))
         threads_per_disk = int(conf.get('threads_per_disk', '0'))
+        group_commit_window = float(conf.get('group_commit_window', 0))
         self.threadpools = defaultdict(
-            lambda: ThreadPool(nthreads=threads_per_disk))
+            lambda: ThreadPool(nthreads=threads_per_disk,
+                               group_commit_window=group_commit_window))
+        self.compact_metadata = config_true_value(
+            conf.get('compact_metadata', 'false'))
+        self.zero_copy_get = config_true_value(
+            conf.get('zero_copy_get', 'false'))
+        if self.zero_copy_get and not sendfile_available():
+            self.logger.warn(_('zero_copy_get is set but sendfile is not '
+                               'available; serving GETs through Python'))
+            self.zero_copy_get = False
+        self.packed_devices = set(list_from_csv(
+            conf.get('packed_devices', '')))
+        self.packed_max_size = int(conf.get('packed_max_size', 32768))
+        self.packed_volume_size = \
+            int(conf.get('packed_volume_mb', 256)) * 1024 * 1024
+        self.packed_compact_at = float(conf.get('packed_compact_at', 0.5))
+        self.packed_index_records = int(
+            conf.get('packed_index_records', 250000))
+        self._volumes = OrderedDict()
+        metadata_cache_size = int(conf.get('metadata_cache_size', 0))
+        self.open_cache = None
+        if metadata_cache_size > 0:
+            self.open_cache = OpenObjectCache(metadata_cache_size)
 
     def construct_dev_path(self, device):
         """
@@ -442,28 +1191,65 @@ class DiskFileManager(object):
         async_dir = os.path.join(device_path, ASYNCDIR)
         ohash = hash_path(account, container, obj)
         self.threadpools[device].run_in_thread(
-            write_pickle,
+            write_async_update,
             data,
             os.path.join(async_dir, ohash[-3:], ohash + '-' +
                          normalize_timestamp(timestamp)),
             os.path.join(device_path, 'tmp'))
         self.logger.increment('async_pendings')
 
+    def get_volumes(self, device, partition):
+        """
+        Get the volumes the small objects of a partition are packed into, on
+        a device listed in packed_devices. The index of a partition not
+        already in memory is loaded in the device's threadpool, and those of
+        the partitions most recently used are kept until they hold more than
+        packed_index_records records between them.
+
+        :param device: name of target device
+        :param partition: partition on the device
+        :returns: PartitionVolumes, or None if the device does not pack
+                  small objects
+        """
+        if device not in self.packed_devices:
+            return None
+        path = os.path.join(self.construct_dev_path(device), DATADIR,
+                            partition, VOLUME_DIR)
+        volumes = self._volumes.pop(path, None)
+        if volumes is None:
+            volumes = PartitionVolumes(path, self.packed_volume_size,
+                                       self.reclaim_age, self.logger)
+            # loaded before it is shared, so other greenthreads never wait
+            # on it in the hub while it scans
+            self.threadpools[device].run_in_thread(volumes.refresh)
+            total = sum(v.record_count for v in self._volumes.itervalues())
+            while self._volumes and \
+                    total + volumes.record_count > self.packed_index_records:
+                total -= self._volumes.popitem(last=False)[1].record_count
+        self._volumes[path] = volumes
+        return volumes
+
+    def _diskfile_class(self, device):
+        if device in self.packed_devices:
+            return PackedDiskFile
+        return DiskFile
+
     def get_diskfile(self, device, partition, account, container, obj,
                      **kwargs):
         dev_path = self.get_dev_path(device)
         if not dev_path:
             raise DiskFileDeviceUnavailable()
-        return DiskFile(self, dev_path, self.threadpools[device],
-                        partition, account, container, obj, **kwargs)
+        return self._diskfile_class(device)(
+            self, dev_path, self.threadpools[device], partition, account,
+            container, obj, **kwargs)
 
     def object_audit_location_generator(self):
         return object_audit_location_generator(self.devices, self.mount_check,
-                                               self.logger)
+                                               self.logger, self.get_volumes)
 
     def get_diskfile_from_audit_location(self, audit_location):
         dev_path = self.get_dev_path(audit_location.device, mount_check=False)
-        return DiskFile.from_hash_dir(
+        return self._diskfile_class(audit_location.device).from_hash_dir(
             self, audit_location.path, dev_path,
             audit_location.partition)
 
@@ -482,8 +1268,13 @@ class DiskFileManager(object):
             raise DiskFileDeviceUnavailable()
         object_path = os.path.join(
             dev_path, DATADIR, partition, object_hash[-3:], object_hash)
+        volumes = self.get_volumes(device, partition)
         try:
-            filenames = hash_cleanup_listdir(object_path, self.reclaim_age)
+            if volumes:
+                filenames = packed_cleanup_listdir(
+                    object_path, volumes, self.reclaim_age)
+            else:
+                filenames = hash_cleanup_listdir(object_path, self.reclaim_age)
         except OSError as err:
             if err.errno == errno.ENOTDIR:
                 quar_path = quarantine_renamer(dev_path, object_path)
@@ -496,17 +1287,28 @@ class DiskFileManager(object):
             raise DiskFileNotExist()
         if not filenames:
             raise DiskFileNotExist()
+        record = volumes and volumes.get(object_hash).get(filenames[-1])
         try:
-            metadata = read_metadata(os.path.join(object_path, filenames[-1]))
+            if record:
+                metadata = decode_metadata(
+                    volumes.read(object_hash, record)[0])
+            else:
+                metadata = read_metadata(
+                    os.path.join(object_path, filenames[-1]))
         except EOFError:
             raise DiskFileNotExist()
+        except (IOError, ValueError):
+            if not record:
+                raise
+            raise DiskFileNotExist()
         try:
             account, container, obj = split_path(
                 metadata.get('name', ''), 3, 3, True)
         except ValueError:
             raise DiskFileNotExist()
-        return DiskFile(self, dev_path, self.threadpools[device],
-                        partition, account, container, obj, **kwargs)
+        return self._diskfile_class(device)(
+            self, dev_path, self.threadpools[device], partition, account,
+            container, obj, **kwargs)
 
     def get_hashes(self, device, partition, suffix):
         dev_path = self.get_dev_path(device)
@@ -517,7 +1319,9 @@ class DiskFileManager(object):
             mkdirs(partition_path)
         suffixes = suffix.split('-') if suffix else []
         _junk, hashes = self.threadpools[device].force_run_in_thread(
-            get_hashes, partition_path, recalculate=suffixes)
+            get_hashes, partition_path, recalculate=suffixes,
+            use_index=self.suffix_hash_index,
+            volumes=self.get_volumes(device, partition))
         return hashes
 
     def _listdir(self, path):
@@ -539,7 +1343,11 @@ class DiskFileManager(object):
         if not dev_path:
             raise DiskFileDeviceUnavailable()
         partition_path = os.path.join(dev_path, DATADIR, partition)
-        for suffix in self._listdir(partition_path):
+        suffixes = self._listdir(partition_path)
+        volumes = self.get_volumes(device, partition)
+        if volumes:
+            suffixes = set(suffixes).union(volumes.suffixes())
+        for suffix in suffixes:
             if len(suffix) != 3:
                 continue
             try:
@@ -567,11 +1375,20 @@ class DiskFileManager(object):
             suffixes = (
                 (os.path.join(partition_path, suffix), suffix)
                 for suffix in suffixes)
+        volumes = self.get_volumes(device, partition)
         for suffix_path, suffix in suffixes:
-            for object_hash in self._listdir(suffix_path):
+            object_hashes = self._listdir(suffix_path)
+            if volumes:
+                object_hashes = sorted(
+                    set(object_hashes).union(volumes.hashes(suffix)))
+            for object_hash in object_hashes:
                 object_path = os.path.join(suffix_path, object_hash)
-                for name in hash_cleanup_listdir(
-                        object_path, self.reclaim_age):
+                if volumes:
+                    names = packed_cleanup_listdir(
+                        object_path, volumes, self.reclaim_age)
+                else:
+                    names = hash_cleanup_listdir(object_path, self.reclaim_age)
+                for name in names:
                     ts, ext = name.rsplit('.', 1)
                     yield (object_path, object_hash, ts)
                     break
@@ -602,8 +1419,11 @@ class DiskFileWriter(object):
     :param tmppath: full path name of the opened file descriptor
     :param bytes_per_sync: number bytes written between sync calls
     :param threadpool: internal thread pool to use for disk operations
+    :param compact_metadata: whether to write the metadata in the compact
+                             format
     """
-    def __init__(self, name, datadir, fd, tmppath, bytes_per_sync, threadpool):
+    def __init__(self, name, datadir, fd, tmppath, bytes_per_sync, threadpool,
+                 compact_metadata=False):
         # Parameter tracking
         self._name = name
         self._datadir = datadir
@@ -611,11 +1431,15 @@ class DiskFileWriter(object):
         self._tmppath = tmppath
         self._bytes_per_sync = bytes_per_sync
         self._threadpool = threadpool
+        self._compact_metadata = compact_metadata
 
         # Internal attributes
         self._upload_size = 0
         self._last_sync = 0
         self._extension = '.data'
+        # PartitionVolumes of a device that packs small objects, whose
+        # records this file makes obsolete are cleaned up
+        self._volumes = None
 
     def write(self, chunk):
         """
@@ -647,13 +1471,15 @@ class DiskFileWriter(object):
         return self._upload_size
 
     def _finalize_put(self, metadata, target_path):
-        # Write the metadata before calling fsync() so that both data and
-        # metadata are flushed to disk.
-        write_metadata(self._fd, metadata)
-        # We call fsync() before calling drop_cache() to lower the amount of
-        # redundant work the drop cache code will perform on the pages (now
-        # that after fsync the pages will be all clean).
-        fsync(self._fd)
+        with self._threadpool.group_commit() as sync:
+            # Write the metadata before calling fsync() so that both data and
+            # metadata are flushed to disk.
+            write_metadata(self._fd, metadata, self._compact_metadata)
+            # We call fsync() before calling drop_cache() to lower the amount
+            # of redundant work the drop cache code will perform on the pages
+            # (now that after fsync the pages will be all clean). With group
+            # commit, this waits for a sync shared with other PUTs.
+            sync(self._fd)
         # From the Department of the Redundancy Department, make sure we call
         # drop_cache() after fsync() to avoid redundant work (pages all
         # clean).
@@ -663,9 +1489,14 @@ class DiskFileWriter(object):
         # requests to reference.
         renamer(self._tmppath, target_path)
         try:
-            hash_cleanup_listdir(self._datadir)
+            if self._volumes:
+                files = packed_cleanup_listdir(self._datadir, self._volumes)
+            else:
+                files = hash_cleanup_listdir(self._datadir)
         except OSError:
             logging.exception(_('Problem cleaning up %s'), self._datadir)
+        else:
+            update_hash_index(self._datadir, files)
 
     def put(self, metadata):
         """
@@ -717,10 +1548,11 @@ class DiskFileReader(object):
     :param logger: logger caller wants this object to use
     :param quarantine_hook: 1-arg callable called w/reason when quarantined
     :param keep_cache: should resulting reads be kept in the buffer cache
+    :param zero_copy: whether the object may be sent with zero_copy_send
     """
     def __init__(self, fp, data_file, obj_size, etag, threadpool,
                  disk_chunk_size, keep_cache_size, device_path, logger,
-                 quarantine_hook, keep_cache=False):
+                 quarantine_hook, keep_cache=False, zero_copy=False):
         # Parameter tracking
         self._fp = fp
         self._data_file = data_file
@@ -737,6 +1569,7 @@ class DiskFileReader(object):
             self._keep_cache = obj_size < keep_cache_size
         else:
             self._keep_cache = False
+        self._zero_copy = zero_copy
 
         # Internal Attributes
         self._iter_etag = None
@@ -816,6 +1649,63 @@ class DiskFileReader(object):
                 except DiskFileQuarantined:
                     pass
 
+    def can_zero_copy_send(self):
+        """Whether the object may be sent with zero_copy_send."""
+        return self._zero_copy
+
+    def zero_copy_send(self, wsockfd, start=0, length=None, timeout=None):
+        """
+        Send the object, or a range of it, from the data file straight to a
+        socket with sendfile, so that it is never copied through Python.
+
+        Unlike iterating over the reader, this does not check the data's MD5
+        against the etag; the object auditor still does. Sending the whole
+        object still checks its size, and quarantines it if that is wrong.
+
+        :param wsockfd: file descriptor of the client socket
+        :param start: offset of the first byte to send
+        :param length: number of bytes to send, or None to send the rest of
+                       the file
+        :param timeout: seconds to wait for the socket to take more data,
+                        or None to wait as long as it takes
+        :raises ChunkWriteTimeout: if the socket takes no more data within
+                                   the timeout
+        """
+        try:
+            fd = self._fp.fileno()
+            offset = dropped_cache = start
+            self._iter_etag = None
+            self._bytes_read = 0
+            self._started_at_0 = not start
+            self._read_to_eof = False
+            while length is None or self._bytes_read < length:
+                # as much as the socket takes, and at most as much as is
+                # dropped from the buffer cache at once
+                count = 1024 * 1024
+                if length is not None:
+                    count = min(count, length - self._bytes_read)
+                try:
+                    sent = self._threadpool.run_in_thread(
+                        sendfile, wsockfd, fd, offset, count)
+                except OSError as err:
+                    if err.errno != errno.EAGAIN:
+                        raise
+                    trampoline(wsockfd, write=True, timeout=timeout,
+                               timeout_exc=ChunkWriteTimeout)
+                    continue
+                if not sent:
+                    self._read_to_eof = True
+                    break
+                offset += sent
+                self._bytes_read += sent
+                if offset - dropped_cache > (1024 * 1024):
+                    self._drop_cache(fd, dropped_cache,
+                                     offset - dropped_cache)
+                    dropped_cache = offset
+            self._drop_cache(fd, dropped_cache, offset - dropped_cache)
+        finally:
+            self.close()
+
     def _drop_cache(self, fd, offset, length):
         """Method for no-oping buffer cache drop method."""
         if not self._keep_cache:
@@ -909,6 +1799,7 @@ class DiskFile(object):
             self._obj = None
             self._datadir = None
         self._tmpdir = join(device_path, 'tmp')
+        self._open_cache = mgr.open_cache
         self._metadata = None
         self._data_file = None
         self._fp = None
@@ -970,6 +1861,16 @@ class DiskFile(object):
                                      some data did pass cross checks
         :returns: itself for use as a context manager
         """
+        dir_stat = None
+        if self._open_cache and self._name is not None:
+            try:
+                # taken before listing, so a change made after it shows
+                dir_stat = os.stat(self._datadir)
+            except OSError:
+                pass
+            else:
+                if self._open_from_cache(dir_stat):
+                    return self
         data_file, meta_file, ts_file = self._get_ondisk_file()
         if not data_file:
             raise self._construct_exception_from_ts_file(ts_file)
@@ -978,8 +1879,39 @@ class DiskFile(object):
         # This method must populate the internal _metadata attribute.
         self._metadata = self._metadata or {}
         self._data_file = data_file
+        if dir_stat is not None:
+            self._open_cache.set(self._datadir, dir_stat, data_file,
+                                 meta_file, dict(self._metadata))
         return self
 
+    def _open_from_cache(self, dir_stat):
+        """
+        Open the object from the manager's open cache, skipping the listing
+        of its hash dir and the reading of its metadata.
+
+        :param dir_stat: result of os.stat of the object's hash dir
+        :returns: True if the object was opened, False if it has no current
+                  entry in the cache
+        """
+        entry = self._open_cache.get(self._datadir, dir_stat)
+        if entry is None:
+            return False
+        data_file, metadata = entry[2], entry[4]
+        try:
+            # still opened each time, so the object stays as it was found
+            # for as long as it is open
+            fp = open(data_file, 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            # removed since the hash dir was stat-ed
+            return False
+        self._metadata = dict(metadata)
+        self._verify_data_file(data_file, fp)
+        self._fp = fp
+        self._data_file = data_file
+        return True
+
     def __enter__(self):
         """
         Context enter.
@@ -1045,7 +1977,7 @@ class DiskFile(object):
         """
         data_file = meta_file = ts_file = None
         try:
-            files = sorted(os.listdir(self._datadir), reverse=True)
+            files = self._list_files()
         except OSError as err:
             if err.errno == errno.ENOTDIR:
                 # If there's a file here instead of a directory, quarantine
@@ -1088,6 +2020,15 @@ class DiskFile(object):
             " %s, meta_file: %s, ts_file: %s" % (data_file, meta_file, ts_file)
         return data_file, meta_file, ts_file
 
+    def _list_files(self):
+        """
+        List the object's files.
+
+        :returns: the names of the files, reverse sorted
+        :raises OSError: if the data directory cannot be listed
+        """
+        return sorted(os.listdir(self._datadir), reverse=True)
+
     def _construct_exception_from_ts_file(self, ts_file):
         """
         If a tombstone is present it means the object is considered
@@ -1177,22 +2118,27 @@ class DiskFile(object):
             raise self._quarantine(
                 data_file, "bad metadata content-length value %s" % (
                     self._metadata['Content-Length']))
-        fd = fp.fileno()
         try:
-            statbuf = os.fstat(fd)
+            obj_size = self._data_size(fp)
         except OSError as err:
             # Quarantine, we can't successfully stat the file.
             raise self._quarantine(data_file, "not stat-able: %s" % err)
-        else:
-            obj_size = statbuf.st_size
         if obj_size != metadata_size:
             raise self._quarantine(
                 data_file, "metadata content-length %s does"
                 " not match actual object size %s" % (
-                    metadata_size, statbuf.st_size))
+                    metadata_size, obj_size))
         self._content_length = obj_size
         return obj_size
 
+    def _data_size(self, fp):
+        """
+        :param fp: open data file pointer
+        :returns: the on-disk size of the object's data
+        :raises OSError: if the file cannot be stat-ed
+        """
+        return os.fstat(fp.fileno()).st_size
+
     def _failsafe_read_metadata(self, source, quarantine_filename=None):
         # Takes source and filename separately so we can read from an open
         # file if we have one
@@ -1215,7 +2161,7 @@ class DiskFile(object):
         :raises DiskFileError: various exceptions from
                     :func:`swift.obj.diskfile.DiskFile._verify_data_file`
         """
-        fp = open(data_file, 'rb')
+        fp = self._open_data_file(data_file)
         datafile_metadata = self._failsafe_read_metadata(fp, data_file)
         if meta_file:
             self._metadata = self._failsafe_read_metadata(meta_file, meta_file)
@@ -1234,6 +2180,13 @@ class DiskFile(object):
         self._verify_data_file(data_file, fp)
         return fp
 
+    def _open_data_file(self, data_file):
+        """
+        :param data_file: on-disk `.data` file being considered
+        :returns: an opened data file pointer
+        """
+        return open(data_file, 'rb')
+
     def get_metadata(self):
         """
         Provide the metadata for a previously opened object as a dictionary.
@@ -1281,7 +2234,8 @@ class DiskFile(object):
             self._fp, self._data_file, int(self._metadata['Content-Length']),
             self._metadata['ETag'], self._threadpool, self._disk_chunk_size,
             self._mgr.keep_cache_size, self._device_path, self._logger,
-            quarantine_hook=_quarantine_hook, keep_cache=keep_cache)
+            quarantine_hook=_quarantine_hook, keep_cache=keep_cache,
+            zero_copy=self._mgr.zero_copy_get)
         # At this point the reader object is now responsible for closing
         # the file pointer.
         self._fp = None
@@ -1313,7 +2267,8 @@ class DiskFile(object):
                 except OSError:
                     raise DiskFileNoSpace()
             yield DiskFileWriter(self._name, self._datadir, fd, tmppath,
-                                 self._bytes_per_sync, self._threadpool)
+                                 self._bytes_per_sync, self._threadpool,
+                                 self._mgr.compact_metadata)
         finally:
             try:
                 os.close(fd)
@@ -1360,3 +2315,241 @@ class DiskFile(object):
         with self.create() as deleter:
             deleter._extension = '.ts'
             deleter.put({'X-Timestamp': timestamp})
+
+
+class PackedDataFile(StringIO):
+    """
+    The data of an object packed into a volume, read into memory along with
+    its metadata. It has no file descriptor of its own.
+    """
+
+    def fileno(self):
+        return None
+
+
+class PackedDiskFileWriter(object):
+    """
+    Encapsulation of the write context for an object small enough to be
+    packed into its partition's volumes, see
+    :func:`swift.obj.diskfile.PackedDiskFile.create`. The data is kept in
+    memory and written out with the metadata as a single record.
+
+    :param name: name of object from REST API
+    :param datadir: directory the object would otherwise have on disk
+    :param volumes: PartitionVolumes of the object's partition
+    :param threadpool: internal thread pool to use for disk operations
+    """
+    def __init__(self, name, datadir, volumes, threadpool):
+        # Parameter tracking
+        self._name = name
+        self._datadir = datadir
+        self._volumes = volumes
+        self._threadpool = threadpool
+
+        # Internal attributes
+        self._chunks = []
+        self._upload_size = 0
+        self._extension = '.data'
+
+    def write(self, chunk):
+        """
+        Buffer a chunk of data.
+
+        :param chunk: the chunk of data to write as a string object
+
+        :returns: the total number of bytes written to an object
+        """
+        self._chunks.append(chunk)
+        self._upload_size += len(chunk)
+        return self._upload_size
+
+    def _finalize_put(self, metadata, timestamp):
+        invalidate_hash(dirname(self._datadir))
+        # The record is synced to disk before append returns; once it has,
+        # this object will be available for other requests to reference.
+        try:
+            self._volumes.append(
+                EXTENSION_RECORDS[self._extension], basename(self._datadir),
+                timestamp, encode_metadata(metadata), ''.join(self._chunks))
+        except OSError as err:
+            if err.errno in (errno.ENOSPC, errno.EDQUOT):
+                raise DiskFileNoSpace()
+            raise
+        try:
+            files = packed_cleanup_listdir(self._datadir, self._volumes)
+        except OSError:
+            logging.exception(_('Problem cleaning up %s'), self._datadir)
+        else:
+            update_hash_index(self._datadir, files)
+
+    def put(self, metadata):
+        """
+        Finalize writing the object, by appending it to the newest volume of
+        its partition.
+
+        :param metadata: dictionary of metadata to be associated with the
+                         object
+        """
+        timestamp = normalize_timestamp(metadata['X-Timestamp'])
+        metadata['name'] = self._name
+        self._threadpool.force_run_in_thread(
+            self._finalize_put, metadata, timestamp)
+
+
+class PackedDiskFileReader(DiskFileReader):
+    """
+    DiskFileReader for an object packed into a volume, whose data is read
+    into memory when it is opened.
+
+    :param quarantine: callable taking no arguments that quarantines the
+                       object, returning the directory it was moved to
+    """
+    def __init__(self, *args, **kwargs):
+        self._quarantine_object = kwargs.pop('quarantine')
+        super(PackedDiskFileReader, self).__init__(*args, **kwargs)
+
+    def _drop_cache(self, fd, offset, length):
+        """No-op; a record is not worth dropping from the cache alone."""
+        pass
+
+    def _quarantine(self, msg):
+        self._quarantined_dir = self._threadpool.run_in_thread(
+            self._quarantine_object)
+        self._logger.increment('quarantines')
+        self._quarantine_hook(msg)
+
+
+class PackedDiskFile(DiskFile):
+    """
+    Manage object files on a device that packs small objects, one listed in
+    packed_devices.
+
+    Objects of at most packed_max_size bytes, and all .meta and .ts files,
+    are appended as records to their partition's volumes (see
+    :mod:`swift.obj.volume`) rather than written to a hash dir. Larger
+    objects are written to a hash dir as on any other device, and an
+    object's files and records are treated as one set of files.
+    """
+
+    def __init__(self, mgr, device_path, threadpool, partition,
+                 account=None, container=None, obj=None, _datadir=None):
+        super(PackedDiskFile, self).__init__(
+            mgr, device_path, threadpool, partition, account, container, obj,
+            _datadir)
+        self._volumes = mgr.get_volumes(basename(device_path), partition)
+        self._records = {}
+        self._record_reads = {}
+        # appending a record does not change the hash dir, so there is
+        # nothing to tell a cache entry is stale by; the volumes' index is
+        # in memory anyway
+        self._open_cache = None
+
+    def _list_files(self):
+        try:
+            files = os.listdir(self._datadir)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            files = []
+        self._records = self._volumes.get(basename(self._datadir))
+        return sorted(set(files).union(self._records), reverse=True)
+
+    def _read_record(self, filename):
+        """
+        Read a packed record's metadata and data, once per open.
+
+        :param filename: path the record would have as a file
+        :returns: tuple of (encoded metadata, data)
+        :raises DiskFileQuarantined: if the record is damaged
+        """
+        name = basename(filename)
+        if name not in self._record_reads:
+            try:
+                self._record_reads[name] = self._volumes.read(
+                    basename(self._datadir), self._records[name])
+            except ValueError as err:
+                raise self._quarantine(filename, str(err))
+        return self._record_reads[name]
+
+    def _open_data_file(self, data_file):
+        if basename(data_file) not in self._records:
+            return super(PackedDiskFile, self)._open_data_file(data_file)
+        return PackedDataFile(self._read_record(data_file)[1])
+
+    def _data_size(self, fp):
+        if isinstance(fp, PackedDataFile):
+            return len(fp.getvalue())
+        return super(PackedDiskFile, self)._data_size(fp)
+
+    def _failsafe_read_metadata(self, source, quarantine_filename=None):
+        if not quarantine_filename or \
+                basename(quarantine_filename) not in self._records:
+            return super(PackedDiskFile, self)._failsafe_read_metadata(
+                source, quarantine_filename)
+        metastr = self._read_record(quarantine_filename)[0]
+        try:
+            return decode_metadata(metastr)
+        except Exception as err:
+            raise self._quarantine(
+                quarantine_filename,
+                "Exception reading metadata: %s" % err)
+
+    def _quarantine(self, data_file, msg):
+        if not self._volumes.get(basename(self._datadir)):
+            return super(PackedDiskFile, self)._quarantine(data_file, msg)
+        self._quarantined_dir = self._threadpool.run_in_thread(
+            quarantine_packed, self._device_path, self._datadir,
+            self._volumes)
+        self._logger.increment('quarantines')
+        return DiskFileQuarantined(msg)
+
+    def reader(self, keep_cache=False,
+               _quarantine_hook=lambda m: None):
+        if not isinstance(self._fp, PackedDataFile):
+            return super(PackedDiskFile, self).reader(keep_cache,
+                                                      _quarantine_hook)
+        dr = PackedDiskFileReader(
+            self._fp, self._data_file, int(self._metadata['Content-Length']),
+            self._metadata['ETag'], self._threadpool, self._disk_chunk_size,
+            self._mgr.keep_cache_size, self._device_path, self._logger,
+            quarantine_hook=_quarantine_hook, keep_cache=keep_cache,
+            quarantine=lambda: quarantine_packed(
+                self._device_path, self._datadir, self._volumes))
+        self._fp = None
+        return dr
+
+    @contextmanager
+    def _create_packed(self):
+        yield PackedDiskFileWriter(self._name, self._datadir, self._volumes,
+                                   self._threadpool)
+
+    @contextmanager
+    def create(self, size=None):
+        """
+        Context manager to create a file, packed into the partition's
+        volumes if size is given and is at most packed_max_size; objects of
+        unknown size are written to a file.
+
+        :param size: optional size of the object
+        :raises DiskFileNoSpace: if a size is specified and allocation fails
+        """
+        if size is not None and size <= self._mgr.packed_max_size:
+            with self._create_packed() as writer:
+                yield writer
+        else:
+            with super(PackedDiskFile, self).create(size) as writer:
+                # so that it cleans up any records it makes obsolete
+                writer._volumes = self._volumes
+                yield writer
+
+    def write_metadata(self, metadata):
+        with self._create_packed() as writer:
+            writer._extension = '.meta'
+            writer.put(metadata)
+
+    def delete(self, timestamp):
+        timestamp = normalize_timestamp(timestamp)
+
+        with self._create_packed() as deleter:
+            deleter._extension = '.ts'
+            deleter.put({'X-Timestamp': timestamp})
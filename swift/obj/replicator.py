@@ -94,6 +94,9 @@ class ObjectReplicator(Daemon):
         self.handoff_delete = config_auto_int_value(
             conf.get('handoff_delete', 'auto'), 0)
         self._diskfile_mgr = DiskFileManager(conf, self.logger)
+        self.suffix_hash_index = self._diskfile_mgr.suffix_hash_index
+        self.suffix_hash_index_check_interval = int(
+            conf.get('suffix_hash_index_check_interval', 0))
 
     def sync(self, node, job, suffixes):  # Just exists for doc anchor point
         """
@@ -157,7 +160,13 @@ class ObjectReplicator(Daemon):
         """
         Uses rsync to implement the sync method. This was the first
         sync method in Swift.
+
+        Devices that pack small objects are synced with ssync instead, as
+        rsync would copy whole volumes and know nothing of the objects packed
+        into them.
         """
+        if job['device'] in self._diskfile_mgr.packed_devices:
+            return self.ssync(node, job, suffixes)
         if not os.path.exists(job['path']):
             return False
         args = [
@@ -212,15 +221,21 @@ class ObjectReplicator(Daemon):
         :param job: a dict containing info about the partition to be replicated
         """
 
-        def tpool_get_suffixes(path):
-            return [suff for suff in os.listdir(path)
-                    if len(suff) == 3 and isdir(join(path, suff))]
+        def tpool_get_suffixes(path, volumes):
+            suffixes = set(suff for suff in os.listdir(path)
+                           if len(suff) == 3 and isdir(join(path, suff)))
+            if volumes:
+                suffixes.update(volumes.suffixes())
+            return list(suffixes)
         self.replication_count += 1
         self.logger.increment('partition.delete.count.%s' % (job['device'],))
         begin = time.time()
         try:
             responses = []
-            suffixes = tpool.execute(tpool_get_suffixes, job['path'])
+            suffixes = tpool.execute(
+                tpool_get_suffixes, job['path'],
+                self._diskfile_mgr.get_volumes(job['device'],
+                                               job['partition']))
             if suffixes:
                 for node in job['nodes']:
                     success = self.sync(node, job, suffixes)
@@ -260,10 +275,23 @@ class ObjectReplicator(Daemon):
         self.logger.increment('partition.update.count.%s' % (job['device'],))
         begin = time.time()
         try:
+            check_index = self.suffix_hash_index_check_interval and \
+                (self.replication_count %
+                 self.suffix_hash_index_check_interval) == 0
+            volumes = self._diskfile_mgr.get_volumes(job['device'],
+                                                     job['partition'])
             hashed, local_hash = tpool_reraise(
                 get_hashes, job['path'],
                 do_listdir=(self.replication_count % 10) == 0,
-                reclaim_age=self.reclaim_age)
+                reclaim_age=self.reclaim_age,
+                use_index=self.suffix_hash_index,
+                check_index=check_index, volumes=volumes)
+            if volumes:
+                compacted = tpool_reraise(
+                    volumes.compact, self._diskfile_mgr.packed_compact_at)
+                if compacted:
+                    self.logger.update_stats('volumes.compacted_bytes',
+                                             compacted)
             self.suffix_hash += hashed
             self.logger.update_stats('suffix.hashes', hashed)
             attempts_left = len(job['nodes'])
@@ -301,7 +329,8 @@ class ObjectReplicator(Daemon):
                     hashed, recalc_hash = tpool_reraise(
                         get_hashes,
                         job['path'], recalculate=suffixes,
-                        reclaim_age=self.reclaim_age)
+                        reclaim_age=self.reclaim_age,
+                        use_index=self.suffix_hash_index, volumes=volumes)
                     self.logger.update_stats('suffix.hashes', hashed)
                     local_hash = recalc_hash
                     suffixes = [suffix for suffix in local_hash if
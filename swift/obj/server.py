@@ -29,12 +29,13 @@ from eventlet import sleep, Timeout
 
 from swift.common.utils import public, get_logger, \
     config_true_value, timing_stats, replication
+from swift.common.wsgi import EventletPlungerString
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_object_creation, \
     check_float, check_utf8
 from swift.common.exceptions import ConnectionTimeout, DiskFileQuarantined, \
     DiskFileNotExist, DiskFileCollision, DiskFileNoSpace, DiskFileDeleted, \
-    DiskFileDeviceUnavailable
+    DiskFileDeviceUnavailable, ChunkWriteTimeout
 from swift.obj import ssync_receiver
 from swift.common.http import is_success
 from swift.common.request_helpers import split_and_validate_path
@@ -47,6 +48,57 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPCreated, \
 from swift.obj.diskfile import DATAFILE_SYSTEM_META, DiskFileManager
 
 
+class ZeroCopyBody(object):
+    """
+    Body of a GET response that a DiskFileReader sends straight to the
+    client socket with its zero_copy_send, behind eventlet's back.
+
+    :param reader: the DiskFileReader to send the body from
+    :param wsock: the client socket
+    :param start: offset of the first byte to send
+    :param length: number of bytes to send, or None to send the rest
+    :param timeout: seconds to wait for the client to read more, after
+                    which the connection is given up on
+    :param logger: logger to report clients timing out to
+    """
+
+    def __init__(self, reader, wsock, start, length, timeout, logger):
+        self._reader = reader
+        self._wsock = wsock
+        self._start = start
+        self._length = length
+        self._timeout = timeout
+        self._logger = logger
+
+    def __iter__(self):
+        # Hold the headers back until the body follows them, so that they
+        # go out in full packets with it; then force them out of eventlet
+        # before sending the body behind its back.
+        cork = hasattr(socket, 'TCP_CORK')
+        if cork:
+            self._wsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        yield EventletPlungerString()
+        try:
+            self._reader.zero_copy_send(self._wsock.fileno(), self._start,
+                                        self._length, self._timeout)
+        except ChunkWriteTimeout:
+            self._logger.warning(
+                _('Client did not read from object server within %ss'),
+                self._timeout)
+            # The body cannot be finished, so end the connection rather
+            # than leave the client waiting for the rest of it.
+            self._wsock.shutdown(socket.SHUT_RDWR)
+        finally:
+            if cork:
+                self._wsock.setsockopt(socket.IPPROTO_TCP,
+                                       socket.TCP_CORK, 0)
+        yield ''
+
+    def close(self):
+        """Close the reader, even if the body was never sent."""
+        self._reader.close()
+
+
 class ObjectController(object):
     """Implements the WSGI application for the Swift Object Server."""
 
@@ -233,6 +285,12 @@ class ObjectController(object):
         else:
             updates = []
 
+        # The proxy sends the updates for a sharded container to the shard
+        # container holding the object's name.
+        container_path = headers_in.get('X-Backend-Container-Path')
+        if container_path:
+            account, container = container_path.split('/', 1)
+
         headers_out['x-trans-id'] = headers_in.get('x-trans-id', '-')
         headers_out['referer'] = request.as_referer()
         for conthost, contdevice in updates:
@@ -503,9 +561,10 @@ class ObjectController(object):
                 keep_cache = (self.keep_cache_private or
                               ('X-Auth-Token' not in request.headers and
                                'X-Storage-Token' not in request.headers))
+                reader = disk_file.reader(keep_cache=keep_cache)
                 response = Response(
-                    app_iter=disk_file.reader(keep_cache=keep_cache),
-                    request=request, conditional_response=True)
+                    app_iter=reader, request=request,
+                    conditional_response=True)
                 response.headers['Content-Type'] = metadata.get(
                     'Content-Type', 'application/octet-stream')
                 for key, value in metadata.iteritems():
@@ -522,6 +581,11 @@ class ObjectController(object):
                     pass
                 response.headers['X-Timestamp'] = file_x_ts
                 resp = request.get_response(response)
+                # not all DiskFile implementations can do this
+                can_zero_copy_send = getattr(reader, 'can_zero_copy_send',
+                                             None)
+                if can_zero_copy_send and can_zero_copy_send():
+                    self._zero_copy_body(request, resp, reader)
         except DiskFileNotExist:
             if request.headers.get('if-match') == '*':
                 resp = HTTPPreconditionFailed(request=request)
@@ -531,6 +595,34 @@ class ObjectController(object):
             resp = HTTPNotFound(request=request)
         return resp
 
+    def _zero_copy_body(self, request, resp, reader):
+        """
+        Have a GET response send its body with the reader's zero_copy_send,
+        if it is the whole object or a single range of it and the plain,
+        unencrypted socket of the client can be had from eventlet.
+
+        :param request: the GET request
+        :param resp: the response to the request
+        :param reader: the DiskFileReader the response was made from
+        """
+        get_socket = getattr(request.environ['wsgi.input'], 'get_socket',
+                             None)
+        if not get_socket or request.environ['wsgi.url_scheme'] != 'http':
+            return
+        if resp.status_int == 200:
+            start, length = 0, None
+        elif resp.status_int == 206 and resp.headers.get('Content-Range'):
+            first, last = resp.headers['Content-Range'].split()[1].split(
+                '/')[0].split('-')
+            start, length = int(first), int(last) - int(first) + 1
+        else:
+            return
+        request.environ['eventlet.minimum_write_chunk_size'] = 0
+        content_length = resp.content_length
+        resp.app_iter = ZeroCopyBody(reader, get_socket(), start, length,
+                                     self.client_timeout, self.logger)
+        resp.content_length = content_length
+
     @public
     @timing_stats(sample_rate=0.8)
     def HEAD(self, request):
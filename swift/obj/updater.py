@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cPickle as pickle
 import os
 import signal
 import sys
@@ -26,10 +25,11 @@ from eventlet import patcher, Timeout
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ConnectionTimeout
 from swift.common.ring import Ring
-from swift.common.utils import get_logger, renamer, write_pickle, \
+from swift.common.utils import get_logger, renamer, \
     dump_recon_cache, config_true_value, ismount
 from swift.common.daemon import Daemon
-from swift.obj.diskfile import ASYNCDIR
+from swift.obj.diskfile import ASYNCDIR, read_async_update, \
+    write_async_update
 from swift.common.http import is_success, HTTP_NOT_FOUND, \
     HTTP_INTERNAL_SERVER_ERROR
 
@@ -174,14 +174,15 @@ class ObjectUpdater(Daemon):
         """
         Process the object information to be updated and update.
 
-        :param update_path: path to pickled object update file
+        :param update_path: path to async pending object update file
         :param device: path to device
         """
         try:
-            update = pickle.load(open(update_path, 'rb'))
+            update = read_async_update(update_path)
         except Exception:
             self.logger.exception(
-                _('ERROR Pickle problem, quarantining %s'), update_path)
+                _('ERROR Unreadable async pending, quarantining %s'),
+                update_path)
             self.logger.increment('quarantines')
             renamer(update_path, os.path.join(
                     device, 'quarantined', 'objects',
@@ -217,7 +218,8 @@ class ObjectUpdater(Daemon):
                               {'obj': obj, 'path': update_path})
             if new_successes:
                 update['successes'] = successes
-                write_pickle(update, update_path, os.path.join(device, 'tmp'))
+                write_async_update(update, update_path,
+                                   os.path.join(device, 'tmp'))
 
     def object_update(self, node, part, op, obj, headers):
         """
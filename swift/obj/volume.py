@@ -0,0 +1,858 @@
+# Copyright (c) 2010-2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Log-structured volume files, which pack the small objects of a partition
+into a few large files rather than a hash dir and a file or more each.
+
+Each object file that would otherwise go in the object's hash dir (a .data,
+.meta or .ts) is appended as a record, with its metadata and data, to the
+newest volume in the partition's volumes dir. Records are never changed once
+written. Every process keeps its own index of the records that are still
+live, which it keeps up to date by reading whatever other processes append,
+and the volumes are compacted once enough of their records are obsolete.
+
+Beside each volume is an index file, with an entry for each of its records
+in the same order, so that the index can be built without reading the
+volumes themselves. Appends add their entry to it, and compaction writes it
+in full. It is not synced, since the volume can always be scanned for what
+it misses: volumes from before index files, and records whose entries were
+lost in a crash. A volume without an index file gets one once it is no
+longer the newest and has been scanned.
+"""
+
+import errno
+import os
+import struct
+import threading
+import time
+import zlib
+from itertools import groupby
+from os.path import join
+from tempfile import mkstemp
+
+from swift import gettext_ as _
+from swift.common.utils import fdatasync, fsync, lock_path, renamer
+
+VOLUME_DIR = 'volumes'
+VOLUME_EXT = '.vol'
+INDEX_EXT = '.idx'
+RECORD_MAGIC = 'SWVR'
+# Bump this when changing the layout of records; readers must keep
+# understanding every older version.
+RECORD_VERSION = 1
+# magic, version, kind, object hash, timestamp, metadata length, data length
+# and the crc32 of the rest of the header and the metadata
+RECORD_HEADER = '!4sBB32s16sIII'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+#: Kinds of records: an object file each, or the removal of all of an
+#: object's records up to a timestamp, e.g. when it is quarantined.
+RECORD_DATA, RECORD_META, RECORD_TOMBSTONE, RECORD_REMOVED = range(4)
+RECORD_EXTENSIONS = {RECORD_DATA: '.data', RECORD_META: '.meta',
+                     RECORD_TOMBSTONE: '.ts'}
+EXTENSION_RECORDS = dict((ext, kind)
+                         for kind, ext in RECORD_EXTENSIONS.iteritems())
+INDEX_MAGIC = 'SWVI'
+# Bump this when changing the layout of index files; files of a newer
+# version than a reader understands are ignored, and the volume scanned.
+INDEX_VERSION = 1
+# magic and version, at the start of an index file
+INDEX_HEADER = '!4sB'
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER)
+# offset of the record in the volume, kind, object hash, timestamp,
+# metadata length, data length and the crc32 of the rest of the entry
+INDEX_ENTRY = '!QB32s16sIII'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY)
+
+
+def live_names(names):
+    """
+    Pick the names of an object's files that are still live, by the same
+    rules as :func:`swift.obj.diskfile.hash_cleanup_listdir`: the newest .ts
+    or .data, and the newest .meta if it is newer than that.
+
+    :param names: iterable of file names, as <timestamp><extension>
+    :returns: list of the live names, reverse sorted
+    """
+    meta = data = tomb = None
+    live = []
+    for name in sorted(set(names), reverse=True):
+        if not meta and name.endswith('.meta'):
+            meta = name
+        if not data and name.endswith('.data'):
+            data = name
+        if not tomb and name.endswith('.ts'):
+            tomb = name
+        if name < tomb or name < data or \
+                (name.endswith('.meta') and name < meta):
+            continue
+        live.append(name)
+    return live
+
+
+def _volume_number(filename):
+    if not filename.endswith(VOLUME_EXT):
+        return None
+    number = filename[:-len(VOLUME_EXT)]
+    if not number.isdigit():
+        return None
+    return int(number)
+
+
+class VolumeRecord(object):
+    """
+    Where an object file is in a partition's volumes.
+
+    :param volume: number of the volume the record is in
+    :param offset: offset of the record in the volume
+    :param kind: one of the RECORD_* kinds
+    :param timestamp: normalized timestamp of the object file
+    :param metadata_length: length of the record's metadata
+    :param data_length: length of the record's data
+    """
+    __slots__ = ('volume', 'offset', 'kind', 'timestamp', 'metadata_length',
+                 'data_length')
+
+    def __init__(self, volume, offset, kind, timestamp, metadata_length,
+                 data_length):
+        self.volume = volume
+        self.offset = offset
+        self.kind = kind
+        self.timestamp = timestamp
+        self.metadata_length = metadata_length
+        self.data_length = data_length
+
+    @property
+    def name(self):
+        """The name the object file would have in its hash dir."""
+        return self.timestamp + RECORD_EXTENSIONS.get(self.kind, '')
+
+    @property
+    def size(self):
+        """The length of the whole record."""
+        return RECORD_HEADER_SIZE + self.metadata_length + self.data_length
+
+
+def encode_record(kind, object_hash, timestamp, metadata='', data=''):
+    """
+    Serialize a volume record.
+
+    :param kind: one of the RECORD_* kinds
+    :param object_hash: hash of the object's name
+    :param timestamp: normalized timestamp of the object file
+    :param metadata: encoded metadata of the object file
+    :param data: data of the object file
+    :returns: the record as a string
+    :raises ValueError: if the hash or the timestamp do not fit the header
+    """
+    if len(object_hash) != 32 or len(timestamp) != 16:
+        raise ValueError('Bad object hash %r or timestamp %r' %
+                         (object_hash, timestamp))
+    header = struct.pack(RECORD_HEADER[:-1], RECORD_MAGIC, RECORD_VERSION,
+                         kind, object_hash, timestamp, len(metadata),
+                         len(data))
+    crc = zlib.crc32(header + metadata) & 0xffffffff
+    return header + struct.pack('!I', crc) + metadata + data
+
+
+def decode_record(data):
+    """
+    Parse the header of a volume record, and check it and the metadata.
+
+    :param data: the record, or at least its header and metadata
+    :returns: tuple of (kind, object hash, timestamp, metadata length, data
+              length)
+    :raises ValueError: if the record is damaged or of an unknown version
+    """
+    try:
+        magic, version, kind, object_hash, timestamp, metadata_length, \
+            data_length, crc = struct.unpack_from(RECORD_HEADER, data)
+    except struct.error:
+        raise ValueError('Truncated record header')
+    if magic != RECORD_MAGIC or version > RECORD_VERSION:
+        raise ValueError('Unknown record format')
+    metadata_end = RECORD_HEADER_SIZE + metadata_length
+    if len(data) < metadata_end:
+        raise ValueError('Truncated record metadata')
+    if zlib.crc32(data[:RECORD_HEADER_SIZE - 4] +
+                  data[RECORD_HEADER_SIZE:metadata_end]) & 0xffffffff != crc:
+        raise ValueError('Record checksum mismatch')
+    return kind, object_hash, timestamp, metadata_length, data_length
+
+
+def encode_index_entry(offset, kind, object_hash, timestamp, metadata_length,
+                       data_length):
+    """
+    Serialize the entry of a record in its volume's index file.
+
+    :param offset: offset of the record in the volume
+    :param kind: one of the RECORD_* kinds
+    :param object_hash: hash of the object's name
+    :param timestamp: normalized timestamp of the object file
+    :param metadata_length: length of the record's metadata
+    :param data_length: length of the record's data
+    :returns: the entry as a string
+    """
+    entry = struct.pack(INDEX_ENTRY[:-1], offset, kind, object_hash,
+                        timestamp, metadata_length, data_length)
+    return entry + struct.pack('!I', zlib.crc32(entry) & 0xffffffff)
+
+
+def decode_index_entry(data, start=0):
+    """
+    Parse and check an entry of an index file.
+
+    :param data: the entries
+    :param start: where in data the entry starts
+    :returns: tuple of (offset, kind, object hash, timestamp, metadata
+              length, data length)
+    :raises ValueError: if the entry is truncated or damaged
+    """
+    try:
+        offset, kind, object_hash, timestamp, metadata_length, \
+            data_length, crc = struct.unpack_from(INDEX_ENTRY, data, start)
+    except struct.error:
+        raise ValueError('Truncated index entry')
+    if zlib.crc32(data[start:start + INDEX_ENTRY_SIZE - 4]) & \
+            0xffffffff != crc:
+        raise ValueError('Index entry checksum mismatch')
+    return offset, kind, object_hash, timestamp, metadata_length, data_length
+
+
+class PartitionVolumes(object):
+    """
+    The volumes of a partition, and an index of the live records in them.
+
+    An instance is meant to be shared by the greenthreads and threads of a
+    process, and any number of processes may use the same volumes at once:
+    appends and compactions take the volumes dir's lock, and every lookup
+    first reads any records other processes have appended since.
+
+    A record is only ever appended to the newest volume. Each lookup stats
+    the volumes dir, the newest volume and the one that would follow it, and
+    only lists the volumes dir again when the first changes or the last
+    turns up.
+
+    :param path: path of the partition's volumes dir
+    :param volume_size: size in bytes past which records are appended to a
+                        new volume instead
+    :param reclaim_age: age in seconds at which lone tombstones are dropped
+    :param logger: logger for reporting damaged volumes
+    """
+
+    def __init__(self, path, volume_size, reclaim_age, logger=None):
+        self.path = path
+        self.volume_size = volume_size
+        self.reclaim_age = reclaim_age
+        self.logger = logger
+        self._mutex = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._dir_stamp = None
+        self._volumes = []
+        # volume -> offset of the end of the last whole record read
+        self._ends = {}
+        # volume -> offset in its index file of the next entry to read, or
+        # None if the index file is not to be read
+        self._index_ends = {}
+        # volumes without an index file; appends go to a new volume
+        # rather than after them
+        self._unindexed = set()
+        # volumes with a damaged record; no more is read from or appended
+        # to them, and compaction saves what came before the damage
+        self._damaged = set()
+        # object hash -> {name: VolumeRecord} of its live records
+        self._records = {}
+        # suffix -> set of object hashes
+        self._suffixes = {}
+        self.total_bytes = 0
+        self.live_bytes = 0
+        self.record_count = 0
+
+    def _volume_path(self, volume):
+        return join(self.path, '%08d%s' % (volume, VOLUME_EXT))
+
+    def _index_path(self, volume):
+        return join(self.path, '%08d%s' % (volume, INDEX_EXT))
+
+    def _apply(self, object_hash, record):
+        records = self._records.get(object_hash)
+        if records is None:
+            records = self._records[object_hash] = {}
+            self._suffixes.setdefault(object_hash[-3:], set()).add(
+                object_hash)
+        count = len(records)
+        self.total_bytes += record.size
+        if record.kind == RECORD_REMOVED:
+            obsolete = [name for name, old in records.iteritems()
+                        if old.timestamp <= record.timestamp]
+        else:
+            old = records.get(record.name)
+            if old:
+                self.live_bytes -= old.size
+            records[record.name] = record
+            self.live_bytes += record.size
+            live = live_names(records)
+            obsolete = [name for name in records if name not in live]
+        for name in obsolete:
+            self.live_bytes -= records.pop(name).size
+        self.record_count += len(records) - count
+        if not records:
+            del self._records[object_hash]
+            suffix = self._suffixes[object_hash[-3:]]
+            suffix.discard(object_hash)
+            if not suffix:
+                del self._suffixes[object_hash[-3:]]
+
+    def _read_index(self, volume, size):
+        """
+        Apply the records of a volume that its index file has entries for,
+        from where the index of the volume ends.
+
+        :param volume: number of the volume
+        :param size: size of the volume
+        """
+        start = self._index_ends.get(volume, 0)
+        if start is None:
+            return
+        try:
+            fp = open(self._index_path(volume), 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            self._index_ends[volume] = None
+            self._unindexed.add(volume)
+            return
+        with fp:
+            if not start:
+                try:
+                    magic, version = struct.unpack(
+                        INDEX_HEADER, fp.read(INDEX_HEADER_SIZE))
+                except struct.error:
+                    # still being created
+                    return
+                if magic != INDEX_MAGIC or version > INDEX_VERSION:
+                    self._index_ends[volume] = None
+                    return
+                start = INDEX_HEADER_SIZE
+            fp.seek(start)
+            data = fp.read()
+        end = self._ends[volume]
+        for entry_start in xrange(0, len(data) - INDEX_ENTRY_SIZE + 1,
+                                  INDEX_ENTRY_SIZE):
+            try:
+                offset, kind, object_hash, timestamp, metadata_length, \
+                    data_length = decode_index_entry(data, entry_start)
+            except ValueError:
+                # damaged, e.g. by a crash; the volume is scanned instead
+                start = None
+                break
+            record = VolumeRecord(volume, offset, kind, timestamp,
+                                  metadata_length, data_length)
+            if offset > end or offset + record.size > size:
+                # the index misses records before this one, whose process
+                # crashed before it wrote their entries; scan them first
+                break
+            if offset == end:
+                self._apply(object_hash, record)
+                end += record.size
+            # else read from the volume already
+            start += INDEX_ENTRY_SIZE
+        self._index_ends[volume] = start
+        self._ends[volume] = end
+
+    def _write_index(self, volume, entries):
+        """
+        Write the index file of a volume that had none, now that no more
+        records are appended to it.
+
+        :param volume: number of the volume
+        :param entries: the entries of all the volume's records, in order
+        """
+        fd, tmppath = mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(struct.pack(INDEX_HEADER, INDEX_MAGIC,
+                                     INDEX_VERSION))
+                fp.write(''.join(entries))
+            renamer(tmppath, self._index_path(volume))
+        except (IOError, OSError):
+            # index files only save scanning volumes; the next process to
+            # scan this one tries again
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            return
+        self._unindexed.discard(volume)
+
+    def _scan(self, volume, errors):
+        if volume in self._damaged:
+            return
+        try:
+            size = os.path.getsize(self._volume_path(volume))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            # compacted away; the next listing of the volumes dir drops it
+            return
+        if size < self._ends[volume] + RECORD_HEADER_SIZE:
+            # nothing new
+            return
+        self._read_index(volume, size)
+        offset = self._ends[volume]
+        if size < offset + RECORD_HEADER_SIZE:
+            return
+        # the rest is read from the volume itself; a whole volume read like
+        # this gets an index file once appends have moved on from it
+        entries = None
+        if not offset and volume in self._unindexed and \
+                volume != self._volumes[-1]:
+            entries = []
+        try:
+            fp = open(self._volume_path(volume), 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+        with fp:
+            fp.seek(offset)
+            while offset + RECORD_HEADER_SIZE <= size:
+                data = fp.read(RECORD_HEADER_SIZE)
+                metadata_length, data_length = struct.unpack_from(
+                    '!II', data, RECORD_HEADER_SIZE - 12)
+                end = offset + RECORD_HEADER_SIZE + metadata_length + \
+                    data_length
+                if end > size:
+                    # not all written yet, or torn by a crash; appends
+                    # go to a new volume rather than after it
+                    break
+                data += fp.read(metadata_length)
+                try:
+                    kind, object_hash, timestamp, metadata_length, \
+                        data_length = decode_record(data)
+                except ValueError as err:
+                    self._damaged.add(volume)
+                    errors.append((volume, offset, err))
+                    break
+                self._apply(object_hash, VolumeRecord(
+                    volume, offset, kind, timestamp, metadata_length,
+                    data_length))
+                if entries is not None:
+                    entries.append(encode_index_entry(
+                        offset, kind, object_hash, timestamp,
+                        metadata_length, data_length))
+                offset = end
+                fp.seek(offset)
+        self._ends[volume] = offset
+        if entries and volume not in self._damaged:
+            self._write_index(volume, entries)
+
+    def _refresh(self, errors):
+        try:
+            stat = os.stat(self.path)
+        except OSError as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            if self._dir_stamp is not None or self._volumes:
+                self._reset()
+            return
+        dir_stamp = (stat.st_ino, stat.st_mtime)
+        if dir_stamp == self._dir_stamp and not (
+                self._volumes and
+                os.path.exists(self._volume_path(self._volumes[-1] + 1))):
+            if self._volumes:
+                self._scan(self._volumes[-1], errors)
+            return
+        volumes = []
+        for filename in os.listdir(self.path):
+            volume = _volume_number(filename)
+            if volume is not None:
+                volumes.append(volume)
+        if set(self._volumes) - set(volumes):
+            # some were compacted away by another process
+            self._reset()
+        self._dir_stamp = dir_stamp
+        for volume in sorted(volumes):
+            if volume not in self._ends:
+                self._volumes.append(volume)
+                self._ends[volume] = 0
+        for volume in self._volumes:
+            self._scan(volume, errors)
+
+    def _log_errors(self, errors):
+        # logged outside the mutex, since a log handler may yield to another
+        # greenthread that would then block the whole process waiting on it
+        if self.logger:
+            for volume, offset, err in errors:
+                self.logger.error(
+                    _('Damaged record at %(offset)d in %(volume)s, the rest '
+                      'of the volume is ignored: %(err)s'),
+                    {'offset': offset, 'volume': self._volume_path(volume),
+                     'err': err})
+
+    def refresh(self, rescan=False):
+        """
+        Bring the index up to date with the volumes.
+
+        :param rescan: drop the index and build it again
+        """
+        errors = []
+        with self._mutex:
+            if rescan:
+                self._reset()
+            self._refresh(errors)
+        self._log_errors(errors)
+
+    def _live(self, records):
+        if len(records) == 1:
+            record = records.values()[0]
+            if record.kind == RECORD_TOMBSTONE and \
+                    time.time() - float(record.timestamp) > self.reclaim_age:
+                return {}
+        return records
+
+    def get(self, object_hash):
+        """
+        Look up an object's live records. Unlike :func:`hashes`, this
+        includes a lone tombstone older than reclaim_age, which is only
+        dropped by compaction.
+
+        :param object_hash: hash of the object's name
+        :returns: dict of name -> VolumeRecord
+        """
+        errors = []
+        with self._mutex:
+            self._refresh(errors)
+            records = dict(self._records.get(object_hash, {}))
+        self._log_errors(errors)
+        return records
+
+    def suffixes(self):
+        """
+        :returns: list of the suffixes with live records
+        """
+        errors = []
+        with self._mutex:
+            self._refresh(errors)
+            suffixes = [suffix for suffix, hashes in self._suffixes.items()
+                        if any(self._live(self._records[object_hash])
+                               for object_hash in hashes)]
+        self._log_errors(errors)
+        return suffixes
+
+    def hashes(self, suffix):
+        """
+        :param suffix: suffix to list the objects of
+        :returns: dict of object hash -> reverse sorted names of its live
+                  records, for the objects in the suffix
+        """
+        errors = []
+        hashes = {}
+        with self._mutex:
+            self._refresh(errors)
+            for object_hash in self._suffixes.get(suffix, ()):
+                records = self._live(self._records[object_hash])
+                if records:
+                    hashes[object_hash] = sorted(records, reverse=True)
+        self._log_errors(errors)
+        return hashes
+
+    def read(self, object_hash, record):
+        """
+        Read a record's metadata and data.
+
+        :param object_hash: hash of the object's name
+        :param record: the VolumeRecord, as from :func:`get`
+        :returns: tuple of (metadata, data)
+        :raises IOError: with ENOENT if the record is no longer live
+        :raises ValueError: if the record is damaged
+        """
+        for attempt in (0, 1):
+            try:
+                with open(self._volume_path(record.volume), 'rb') as fp:
+                    fp.seek(record.offset)
+                    data = fp.read(record.size)
+                break
+            except IOError as err:
+                if err.errno != errno.ENOENT or attempt:
+                    raise
+            # compacted away by another process since it was looked up
+            self.refresh(rescan=True)
+            record = self.get(object_hash).get(record.name)
+            if not record:
+                raise IOError(errno.ENOENT, 'Record no longer live')
+        kind, found_hash, timestamp, metadata_length, data_length = \
+            decode_record(data)
+        if (kind, found_hash, timestamp, metadata_length, data_length) != (
+                record.kind, object_hash, record.timestamp,
+                record.metadata_length, record.data_length) or \
+                len(data) != record.size:
+            raise ValueError('Record does not match its index entry')
+        metadata_end = RECORD_HEADER_SIZE + metadata_length
+        return data[RECORD_HEADER_SIZE:metadata_end], data[metadata_end:]
+
+    def _sync_dir(self):
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _open_new_volume(self):
+        """
+        Create the volume after the newest one, and its index file. The
+        caller must hold the volumes dir's lock.
+
+        :returns: tuple of (volume number, open file descriptor)
+        """
+        errors = []
+        while True:
+            with self._mutex:
+                self._refresh(errors)
+                volume = self._volumes[-1] + 1 if self._volumes else 0
+            if os.path.exists(self._volume_path(volume)):
+                continue
+            # first, so that no process ever finds the volume without it;
+            # this replaces any left by a crashed compaction
+            with open(self._index_path(volume), 'wb') as fp:
+                fp.write(struct.pack(INDEX_HEADER, INDEX_MAGIC,
+                                     INDEX_VERSION))
+            try:
+                fd = os.open(self._volume_path(volume),
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT |
+                             os.O_EXCL, 0o644)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+                continue
+            self._log_errors(errors)
+            self._sync_dir()
+            return volume, fd
+
+    def _append_index_entry(self, volume, entry):
+        """
+        Add the entry of a record just appended to its volume's index file,
+        if the volume has one. The caller must hold the volumes dir's lock.
+
+        :param volume: number of the volume
+        :param entry: the entry, from :func:`encode_index_entry`
+        """
+        try:
+            fd = os.open(self._index_path(volume), os.O_WRONLY | os.O_APPEND)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            written = 0
+            while written < len(entry):
+                written += os.write(fd, entry[written:])
+        finally:
+            os.close(fd)
+
+    def append(self, kind, object_hash, timestamp, metadata='', data=''):
+        """
+        Append a record to the newest volume, or to a new one if the newest
+        is full, ends in a torn record or has no index file, and sync it to
+        disk.
+
+        :param kind: one of the RECORD_* kinds
+        :param object_hash: hash of the object's name
+        :param timestamp: normalized timestamp of the object file
+        :param metadata: encoded metadata of the object file
+        :param data: data of the object file
+        :returns: the VolumeRecord appended
+        """
+        record = encode_record(kind, object_hash, timestamp, metadata, data)
+        errors = []
+        with lock_path(self.path):
+            with self._mutex:
+                self._refresh(errors)
+                volume = self._volumes[-1] if self._volumes else None
+                if volume is not None and (
+                        volume in self._damaged or
+                        volume in self._unindexed or
+                        self._ends[volume] + len(record) > self.volume_size):
+                    volume = None
+                offset = self._ends.get(volume)
+            self._log_errors(errors)
+            fd = None
+            if volume is not None:
+                fd = os.open(self._volume_path(volume),
+                             os.O_WRONLY | os.O_APPEND)
+                if os.fstat(fd).st_size != offset:
+                    os.close(fd)
+                    fd = None
+            if fd is None:
+                volume, fd = self._open_new_volume()
+                offset = 0
+            try:
+                written = 0
+                while written < len(record):
+                    written += os.write(fd, record[written:])
+                fdatasync(fd)
+            finally:
+                os.close(fd)
+            self._append_index_entry(volume, encode_index_entry(
+                offset, kind, object_hash, timestamp, len(metadata),
+                len(data)))
+            self.refresh()
+        return VolumeRecord(volume, offset, kind, timestamp, len(metadata),
+                            len(data))
+
+    def remove(self, object_hash, timestamp):
+        """
+        Remove all of an object's records up to a timestamp.
+
+        :param object_hash: hash of the object's name
+        :param timestamp: normalized timestamp of the newest record to remove
+        """
+        self.append(RECORD_REMOVED, object_hash, timestamp)
+
+    def _copy_records(self, fp, volume, start, end, out, offset, entries,
+                      errors):
+        """
+        Copy the records of a volume between two offsets to the end of a
+        new volume, as they are, stopping at a damaged one.
+
+        :param fp: file object of the volume to copy from
+        :param volume: number of the volume to copy from
+        :param start: offset of the first record to copy
+        :param end: offset of the end of the last record to copy
+        :param out: file object of the new volume
+        :param offset: offset in the new volume to copy to
+        :param entries: list to add the index entries of the copies to
+        :param errors: list to add any damaged record to
+        :returns: offset in the new volume after the copies
+        """
+        fp.seek(start)
+        while start < end:
+            data = fp.read(RECORD_HEADER_SIZE)
+            try:
+                metadata_length, data_length = struct.unpack_from(
+                    '!II', data, RECORD_HEADER_SIZE - 12)
+                data += fp.read(metadata_length + data_length)
+                kind, object_hash, timestamp, metadata_length, \
+                    data_length = decode_record(data)
+            except (struct.error, ValueError) as err:
+                errors.append((volume, start, err))
+                break
+            out.write(data)
+            entries.append(encode_index_entry(
+                offset, kind, object_hash, timestamp, metadata_length,
+                data_length))
+            offset += len(data)
+            start += len(data)
+        return offset
+
+    def compact(self, min_obsolete_ratio):
+        """
+        Copy the live records into a new volume and delete the old ones, if
+        enough of the volumes' bytes are taken by obsolete records. Lone
+        tombstones older than reclaim_age are dropped.
+
+        The live records are copied without the volumes dir's lock, so that
+        appends go on meanwhile. The lock is only taken at the end, to copy
+        whatever was appended since, as it is, and to swap the new volume in
+        for the old ones.
+
+        :param min_obsolete_ratio: fraction of the volumes' bytes that must
+                                   be obsolete
+        :returns: number of bytes freed, 0 if not compacted
+        """
+        errors = []
+        with self._mutex:
+            self._refresh(errors)
+            records = []
+            for object_hash, records_ in self._records.iteritems():
+                records.extend((object_hash, record) for record in
+                               self._live(records_).itervalues())
+            volumes = list(self._volumes)
+            ends = dict(self._ends)
+        self._log_errors(errors)
+        live_bytes = sum(record.size for object_hash, record in records)
+        try:
+            total_bytes = sum(os.path.getsize(self._volume_path(volume))
+                              for volume in volumes)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            # compacted by another process
+            return 0
+        if not volumes or \
+                total_bytes - live_bytes < min_obsolete_ratio * total_bytes:
+            return 0
+        records.sort(key=lambda (object_hash, record): (record.volume,
+                                                        record.offset))
+        fd, tmppath = mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                offset = 0
+                entries = []
+                # the live records of the volumes as they were
+                for volume, volume_records in groupby(
+                        records, lambda (object_hash, record): record.volume):
+                    with open(self._volume_path(volume), 'rb') as fp:
+                        for object_hash, record in volume_records:
+                            offset = self._copy_records(
+                                fp, volume, record.offset,
+                                record.offset + record.size, out, offset,
+                                entries, errors)
+                with lock_path(self.path):
+                    with self._mutex:
+                        self._refresh(errors)
+                        current = list(self._volumes)
+                        current_ends = dict(self._ends)
+                    if set(volumes) - set(current):
+                        # compacted by another process meanwhile
+                        return 0
+                    for volume in current:
+                        # and then every record appended since
+                        with open(self._volume_path(volume), 'rb') as fp:
+                            offset = self._copy_records(
+                                fp, volume, ends.get(volume, 0),
+                                current_ends[volume], out, offset, entries,
+                                errors)
+                    out.flush()
+                    fsync(out.fileno())
+                    freed = sum(os.path.getsize(self._volume_path(volume))
+                                for volume in current) - offset
+                    volume = current[-1] + 1
+                    with open(self._index_path(volume), 'wb') as fp:
+                        fp.write(struct.pack(INDEX_HEADER, INDEX_MAGIC,
+                                             INDEX_VERSION))
+                        fp.write(''.join(entries))
+                    renamer(tmppath, self._volume_path(volume))
+                    for old in current:
+                        try:
+                            os.unlink(self._index_path(old))
+                        except OSError as err:
+                            if err.errno != errno.ENOENT:
+                                raise
+                        os.unlink(self._volume_path(old))
+                    self._sync_dir()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            # compacted by another process meanwhile
+            return 0
+        finally:
+            self._log_errors(errors)
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+        self.refresh(rescan=True)
+        return freed
@@ -28,17 +28,18 @@ import os
 import time
 import functools
 import inspect
+from collections import deque
 from sys import exc_info
 from swift import gettext_ as _
 from urllib import quote
 
-from eventlet import sleep
+from eventlet import sleep, spawn_n
 from eventlet.timeout import Timeout
 
 from swift.common.wsgi import make_pre_authed_env
 from swift.common.utils import normalize_timestamp, config_true_value, \
     public, split_path, list_from_csv, GreenthreadSafeIterator, \
-    quorum_size, GreenAsyncPile
+    quorum_size, GreenAsyncPile, LRUCache
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ChunkReadTimeout, ChunkWriteTimeout, \
     ConnectionTimeout
@@ -139,6 +140,7 @@ def headers_to_container_info(headers, status_int=HTTP_OK):
         'object_count': headers.get('x-container-object-count'),
         'bytes': headers.get('x-container-bytes-used'),
         'versions': headers.get('x-versions-location'),
+        'sharded': config_true_value(headers.get('x-backend-sharded')),
         'cors': {
             'allow_origin': headers.get(
                 'x-container-meta-access-control-allow-origin'),
@@ -153,6 +155,21 @@ def headers_to_container_info(headers, status_int=HTTP_OK):
     }
 
 
+def load_shard_ranges(shard_ranges):
+    """
+    Get shard ranges as the container server lists them, decoded from JSON,
+    with their names and bounds as UTF-8 strs to compare with object names.
+
+    :param shard_ranges: list of shard range dicts decoded from JSON
+    :returns: list of shard range dicts
+    """
+    for shard_range in shard_ranges:
+        for key in ('name', 'lower', 'upper'):
+            if isinstance(shard_range[key], unicode):
+                shard_range[key] = shard_range[key].encode('utf-8')
+    return shard_ranges
+
+
 def headers_to_object_info(headers, status_int=HTTP_OK):
     """
     Construct a cacheable dict of object info based on response headers.
@@ -316,9 +333,120 @@ def get_object_env_key(account, container, obj):
     return env_key
 
 
+class InfoCache(LRUCache):
+    """
+    Process-local cache of account and container info kept in front of
+    memcache, so that requests for the same containers do not each need a
+    round trip to memcache. Entries are kept only for a short time since
+    changes made through another proxy worker are not seen until they
+    expire; not-found info is kept for negative_ttl seconds instead.
+
+    :param maxsize: the maximum number of entries to keep
+    :param ttl: seconds to keep info for existing accounts and containers
+    :param negative_ttl: seconds to keep info for missing ones
+    :param logger: logger used to count info_cache.hit and info_cache.miss
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl, logger=None):
+        super(InfoCache, self).__init__(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self.logger = logger
+
+    def get_info(self, cache_key):
+        info = self.get(cache_key)
+        if self.logger:
+            if info:
+                self.logger.increment('info_cache.hit')
+            else:
+                self.logger.increment('info_cache.miss')
+        return info
+
+    def set_info(self, cache_key, info):
+        if info.get('status') == HTTP_NOT_FOUND:
+            self.set(cache_key, info, ttl=self.negative_ttl)
+        else:
+            self.set(cache_key, info)
+
+
+class ReadHedger(object):
+    """
+    Decides when an object GET should send a second, speculative request to
+    the next node because the first has not answered yet.
+
+    The delay before hedging is the given percentile of recent response
+    times, so only the slowest requests are hedged. Hedges are also paid for
+    out of a budget that grows by max_ratio with every request, so they can
+    never add more than that fraction of extra backend requests.
+
+    :param percentile: percentile of recent response times to wait before
+                       hedging
+    :param max_ratio: the most hedges allowed per request, on average
+    :param window: number of recent response times to keep
+    :param logger: logger used to count hedge.issued and hedge.won
+    """
+
+    def __init__(self, percentile=95, max_ratio=0.05, window=1000,
+                 logger=None):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.logger = logger
+        self._timings = deque(maxlen=window)
+        self._new_timings = 0
+        self._delay = None
+        # allow a few hedges in a row, but no more
+        self._max_tokens = max(1.0, max_ratio * 100)
+        self._tokens = 0.0
+
+    def record(self, timing):
+        """
+        Note how long a backend took to send its response headers.
+
+        :param timing: seconds from the start of the request
+        """
+        self._timings.append(timing)
+        self._new_timings += 1
+        # Sorting the whole window for every request would cost more than
+        # hedging saves; a delay a few requests old is good enough.
+        if self._new_timings >= self._timings.maxlen // 10 or \
+                (self._delay is None and
+                 len(self._timings) == self._timings.maxlen // 10):
+            self._new_timings = 0
+            timings = sorted(self._timings)
+            index = int(len(timings) * self.percentile / 100.0)
+            self._delay = timings[min(index, len(timings) - 1)]
+
+    def delay(self):
+        """
+        Called once per request; pays into the hedging budget.
+
+        :returns: seconds to wait for a response before hedging, or None if
+                  too few response times have been seen yet
+        """
+        self._tokens = min(self._tokens + self.max_ratio, self._max_tokens)
+        return self._delay
+
+    def try_hedge(self):
+        """
+        Take a hedge out of the budget.
+
+        :returns: True if a hedge may be sent
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        if self.logger:
+            self.logger.increment('hedge.issued')
+        return True
+
+    def won(self):
+        """Count a hedge that answered before the request it backed up."""
+        if self.logger:
+            self.logger.increment('hedge.won')
+
+
 def _set_info_cache(app, env, account, container, resp):
     """
-    Cache info in both memcache and env.
+    Cache info in memcache, the app's info cache (if used) and env.
 
     Caching is used to avoid unnecessary calls to account & container servers.
     This is a private function that is being called by GETorHEAD_base and
@@ -346,10 +474,13 @@ def _set_info_cache(app, env, account, container, resp):
     else:
         cache_time = None
 
-    # Next actually set both memcache and the env chache
+    # Next actually set memcache, the app's info cache and the env chache
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    info_cache = getattr(app, 'info_cache', None)
     if not cache_time:
         env.pop(env_key, None)
+        if info_cache is not None:
+            info_cache.delete(cache_key)
         if memcache:
             memcache.delete(cache_key)
         return
@@ -359,7 +490,9 @@ def _set_info_cache(app, env, account, container, resp):
     else:
         info = headers_to_account_info(resp.headers, resp.status_int)
     if memcache:
-        memcache.set(cache_key, info, time=cache_time)
+        memcache.set(cache_key, info, time=cache_time, noreply=True)
+    if info_cache is not None:
+        info_cache.set_info(cache_key, info)
     env[env_key] = info
 
 
@@ -393,7 +526,8 @@ def _set_object_info_cache(app, env, account, container, obj, resp):
 
 def clear_info_cache(app, env, account, container=None):
     """
-    Clear the cached info in both memcache and env
+    Clear the cached info in memcache, env and the app's info cache. Other
+    proxy workers keep their copy until its short TTL expires.
 
     :param  app: the application object
     :param  account: the account name
@@ -402,9 +536,62 @@ def clear_info_cache(app, env, account, container=None):
     _set_info_cache(app, env, account, container, None)
 
 
+def get_info_from_memcache(memcache, env, account, container=None,
+                           info_cache=None):
+    """
+    Get the cached info from env, the process-local info cache (if used) or
+    memcache in that order, caching what is found in env and what is found
+    in memcache in the info cache. Used for both account and container info.
+
+    When looking up a container, the account's info is fetched in the same
+    round trip (one concurrent get per memcache server) since it is usually
+    needed by the same request.
+
+    :param  memcache: the memcache client or None
+    :param  env: the environment used by the current request
+    :param  account: the account name
+    :param  container: the container name or None if getting account info
+    :param  info_cache: an InfoCache or None
+    :returns the cached info or None if not cached
+    """
+    cache_key, env_key = _get_cache_key(account, container)
+    if env_key in env:
+        return env[env_key]
+    keys = [cache_key]
+    if container:
+        account_key, account_env_key = _get_cache_key(account, None)
+        if account_env_key not in env:
+            keys.append(account_key)
+    found = {}
+    if info_cache is not None:
+        for key in keys:
+            info = info_cache.get_info(key)
+            if info:
+                found[key] = info
+    if cache_key in found or not memcache:
+        keys = []
+    else:
+        keys = [key for key in keys if key not in found]
+    if len(keys) > 1:
+        values = memcache.get_multi(keys)
+    elif keys:
+        values = [memcache.get(keys[0])]
+    else:
+        values = []
+    for key, info in zip(keys, values):
+        if info:
+            found[key] = info
+            if info_cache is not None:
+                info_cache.set_info(key, info)
+    for key, info in found.iteritems():
+        env['swift.%s' % key] = info
+    return found.get(cache_key)
+
+
 def _get_info_cache(app, env, account, container=None):
     """
-    Get the cached info from env or memcache (if used) in that order
+    Get the cached info from env, the app's info cache or memcache (if used)
+    in that order
     Used for both account and container info
     A private function used by get_info
 
@@ -417,11 +604,10 @@ def _get_info_cache(app, env, account, container=None):
     if env_key in env:
         return env[env_key]
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
-    if memcache:
-        info = memcache.get(cache_key)
-        if info:
-            env[env_key] = info
-        return info
+    info_cache = getattr(app, 'info_cache', None)
+    if memcache or info_cache is not None:
+        return get_info_from_memcache(memcache, env, account, container,
+                                      info_cache=info_cache)
     return None
 
 
@@ -541,6 +727,23 @@ def close_swift_conn(src):
         pass
 
 
+def release_swift_conn(src):
+    """
+    Put the http connection to the backend back in its pool if the response
+    has been read to the end and the backend will keep the connection open,
+    otherwise close it with :func:`close_swift_conn`.
+
+    :param src: the response from the backend
+    """
+    conn = getattr(src, 'swift_conn', None)
+    pool = getattr(conn, 'pool', None)
+    if pool and not src.will_close and (src.isclosed() or src.length == 0):
+        src.close()
+        pool.put(conn)
+    else:
+        close_swift_conn(src)
+
+
 class GetOrHeadHandler(object):
 
     def __init__(self, app, req, server_type, ring, partition, path,
@@ -559,6 +762,10 @@ class GetOrHeadHandler(object):
         self.req_path = req.path
         self.req_query_string = req.query_string
         self.newest = config_true_value(req.headers.get('x-newest', 'f'))
+        self.hedger = None
+        if server_type == 'Object' and self.req_method == 'GET' and \
+                not self.newest:
+            self.hedger = getattr(app, 'read_hedger', None)
 
         # populated when finding source
         self.statuses = []
@@ -684,9 +891,103 @@ class GetOrHeadHandler(object):
             self.app.logger.exception(_('Trying to send to client'))
             raise
         finally:
-            # Close-out the connection as best as possible.
+            # Close-out the connection as best as possible, or keep it for
+            # another request if the whole body was read.
             if getattr(source, 'swift_conn', None):
-                close_swift_conn(source)
+                release_swift_conn(source)
+
+    def _make_node_request(self, node, logger_thread_locals=None):
+        """
+        Send the request to one node and wait for its response headers.
+
+        :param node: the node to send the request to
+        :param logger_thread_locals: if given, set on self.app.logger first;
+                                     for requests made in another
+                                     greenthread
+        :returns: a tuple of (response or None if the request failed, node)
+        """
+        if logger_thread_locals:
+            self.app.logger.thread_locals = logger_thread_locals
+        start_node_timing = time.time()
+        self.app.node_request_started(node)
+        try:
+            with ConnectionTimeout(self.app.conn_timeout):
+                conn = http_connect(
+                    node['ip'], node['port'], node['device'],
+                    self.partition, self.req_method, self.path,
+                    headers=self.backend_headers,
+                    query_string=self.req_query_string,
+                    pool=self.app.conn_pool)
+            self.app.set_node_timing(node, time.time() - start_node_timing)
+
+            with Timeout(self.app.node_timeout):
+                possible_source = conn.getresponse()
+                # See NOTE: swift_conn at top of file about this.
+                possible_source.swift_conn = conn
+            timing = time.time() - start_node_timing
+            self.app.node_request_finished(node, timing)
+            if self.hedger:
+                self.hedger.record(timing)
+        except (Exception, Timeout):
+            self.app.node_request_finished(
+                node, time.time() - start_node_timing, failed=True)
+            self.app.exception_occurred(
+                node, self.server_type,
+                _('Trying to %(method)s %(path)s') %
+                {'method': self.req_method, 'path': self.req_path})
+            return None, node
+        return possible_source, node
+
+    def _node_responses(self):
+        """
+        Yields a (response, node) tuple for each node tried in turn; the
+        response is None if the request to the node failed.
+
+        If reads are hedged and a node is slow to answer, the next node is
+        asked as well and whichever answers first is yielded first. Any
+        response still on its way when the caller stops iterating is closed
+        when it arrives.
+        """
+        nodes = (node for node in
+                 self.app.iter_nodes(self.ring, self.partition)
+                 if node not in self.used_nodes)
+        delay = self.hedger.delay() if self.hedger else None
+        if delay is None:
+            for node in nodes:
+                yield self._make_node_request(node)
+            return
+
+        pile = GreenAsyncPile(2)
+        hedged = hedge_pending = False
+        try:
+            for node in nodes:
+                pile.spawn(self._make_node_request, node,
+                           self.app.logger.thread_locals)
+                if not hedged:
+                    result = None
+                    with Timeout(delay, False):
+                        result = pile.next()
+                    if result is None and self.hedger.try_hedge():
+                        # Still waiting; ask the next node as well. Only one
+                        # hedge is sent per request.
+                        hedged = hedge_pending = True
+                        continue
+                    if result is not None:
+                        yield result
+                        continue
+                for result in pile:
+                    if hedge_pending:
+                        hedge_pending = False
+                        if result[1] is node:
+                            self.hedger.won()
+                    yield result
+        finally:
+            spawn_n(self._close_responses, pile)
+
+    def _close_responses(self, pile):
+        for possible_source, _junk in pile:
+            if possible_source:
+                close_swift_conn(possible_source)
 
     def _get_source_and_node(self):
 
@@ -696,28 +997,9 @@ class GetOrHeadHandler(object):
         self.source_headers = []
         sources = []
 
-        for node in self.app.iter_nodes(self.ring, self.partition):
-            if node in self.used_nodes:
-                continue
-            start_node_timing = time.time()
-            try:
-                with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(
-                        node['ip'], node['port'], node['device'],
-                        self.partition, self.req_method, self.path,
-                        headers=self.backend_headers,
-                        query_string=self.req_query_string)
-                self.app.set_node_timing(node, time.time() - start_node_timing)
-
-                with Timeout(self.app.node_timeout):
-                    possible_source = conn.getresponse()
-                    # See NOTE: swift_conn at top of file about this.
-                    possible_source.swift_conn = conn
-            except (Exception, Timeout):
-                self.app.exception_occurred(
-                    node, self.server_type,
-                    _('Trying to %(method)s %(path)s') %
-                    {'method': self.req_method, 'path': self.req_path})
+        responses = self._node_responses()
+        for possible_source, node in responses:
+            if not possible_source:
                 continue
             if self.is_good_source(possible_source):
                 # 404 if we know we don't have a synced copy
@@ -752,6 +1034,7 @@ class GetOrHeadHandler(object):
                 self.reasons.append(possible_source.reason)
                 self.bodies.append(possible_source.read())
                 self.source_headers.append(possible_source.getheaders())
+                release_swift_conn(possible_source)
                 if possible_source.status == HTTP_INSUFFICIENT_STORAGE:
                     self.app.error_limit(node, _('ERROR Insufficient Storage'))
                 elif is_server_error(possible_source.status):
@@ -762,6 +1045,8 @@ class GetOrHeadHandler(object):
                          'body': self.bodies[-1][:1024],
                          'type': self.server_type})
 
+        responses.close()
+
         if sources:
             sources.sort(key=lambda s: source_key(s[0]))
             source, node = sources.pop()
@@ -796,6 +1081,8 @@ class GetOrHeadHandler(object):
             if source.getheader('Content-Type'):
                 res.charset = None
                 res.content_type = source.getheader('Content-Type')
+            if res.app_iter is None:
+                release_swift_conn(source)
         return res
 
 
@@ -878,7 +1165,10 @@ class Controller(object):
         else:
             referer = ''
         headers['x-trans-id'] = self.trans_id
-        headers['connection'] = 'close'
+        if self.app.conn_pool:
+            headers['connection'] = 'keep-alive'
+        else:
+            headers['connection'] = 'close'
         headers['user-agent'] = 'proxy-server %s' % os.getpid()
         headers['referer'] = referer
         return headers
@@ -957,24 +1247,37 @@ class Controller(object):
         """
         self.app.logger.thread_locals = logger_thread_locals
         for node in nodes:
+            start_node_timing = time.time()
+            self.app.node_request_started(node)
+            resp = None
             try:
-                start_node_timing = time.time()
                 with ConnectionTimeout(self.app.conn_timeout):
                     conn = http_connect(node['ip'], node['port'],
                                         node['device'], part, method, path,
-                                        headers=headers, query_string=query)
+                                        headers=headers, query_string=query,
+                                        pool=self.app.conn_pool)
                     conn.node = node
                 self.app.set_node_timing(node, time.time() - start_node_timing)
                 with Timeout(self.app.node_timeout):
                     resp = conn.getresponse()
+                    self.app.node_request_finished(
+                        node, time.time() - start_node_timing)
+                    # See NOTE: swift_conn at top of file about this.
+                    resp.swift_conn = conn
                     if not is_informational(resp.status) and \
                             not is_server_error(resp.status):
+                        body = resp.read()
+                        release_swift_conn(resp)
                         return resp.status, resp.reason, resp.getheaders(), \
-                            resp.read()
-                    elif resp.status == HTTP_INSUFFICIENT_STORAGE:
+                            body
+                    close_swift_conn(resp)
+                    if resp.status == HTTP_INSUFFICIENT_STORAGE:
                         self.app.error_limit(node,
                                              _('ERROR Insufficient Storage'))
             except (Exception, Timeout):
+                if resp is None:
+                    self.app.node_request_finished(
+                        node, time.time() - start_node_timing, failed=True)
                 self.app.exception_occurred(
                     node, self.server_type,
                     _('Trying to %(method)s %(path)s') %
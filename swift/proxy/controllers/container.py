@@ -14,15 +14,19 @@
 # limitations under the License.
 
 from swift import gettext_ as _
-from urllib import unquote
+from urllib import unquote, urlencode
 
-from swift.common.utils import public, csv_append
-from swift.common.constraints import check_metadata, MAX_CONTAINER_NAME_LENGTH
-from swift.common.http import HTTP_ACCEPTED
+from swift.common.utils import public, csv_append, json, quote
+from swift.common.constraints import check_metadata, \
+    MAX_CONTAINER_NAME_LENGTH, CONTAINER_LISTING_LIMIT
+from swift.common.http import HTTP_ACCEPTED, HTTP_NO_CONTENT, \
+    HTTP_NOT_FOUND, is_success
+from swift.common.request_helpers import get_listing_content_type, \
+    container_xml_listing
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation, clear_info_cache
+    cors_validation, clear_info_cache, load_shard_ranges
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
-    HTTPNotFound
+    HTTPNotFound, HTTPServiceUnavailable, Request
 
 
 class ContainerController(Controller):
@@ -63,6 +67,9 @@ class ContainerController(Controller):
             return HTTPNotFound(request=req)
         part = self.app.container_ring.get_part(
             self.account_name, self.container_name)
+        if req.method == 'GET':
+            # a sharded container answers with its shard ranges instead
+            req.headers['X-Backend-Record-Type'] = 'auto'
         resp = self.GETorHEAD_base(
             req, _('Container'), self.app.container_ring, part, req.path_info)
         if 'swift.authorize' in req.environ:
@@ -70,12 +77,108 @@ class ContainerController(Controller):
             aresp = req.environ['swift.authorize'](req)
             if aresp:
                 return aresp
+        if resp.headers.get('X-Backend-Record-Type') == 'shard' and \
+                is_success(resp.status_int):
+            resp = self._get_from_shards(req, resp)
+        for key in ('X-Backend-Record-Type', 'X-Backend-Sharded'):
+            if key in resp.headers:
+                del resp.headers[key]
         if not req.environ.get('swift_owner', False):
             for key in self.app.swift_owner_headers:
                 if key in resp.headers:
                     del resp.headers[key]
         return resp
 
+    def _get_from_shards(self, req, resp):
+        """
+        Put together the listing of a sharded container from the listings
+        of the shard containers holding the names asked for.
+
+        :param req: the GET request for the container
+        :param resp: the container's response, listing its shard ranges
+        :returns: swob.Response object with the listing
+        """
+        params = dict(req.params)
+        limit = CONTAINER_LISTING_LIMIT
+        if params.get('limit', '').isdigit():
+            limit = min(int(params['limit']), limit)
+        objects = self._get_shard_objects(
+            req, load_shard_ranges(json.loads(resp.body)), params, limit)
+        if objects is None:
+            return HTTPServiceUnavailable(request=req)
+        out_content_type = get_listing_content_type(req)
+        if out_content_type == 'application/json':
+            resp.body = json.dumps(objects)
+        elif out_content_type.endswith('/xml'):
+            resp.body = ''.join(
+                container_xml_listing(self.container_name, [objects]))
+        else:
+            if not objects:
+                resp.status = HTTP_NO_CONTENT
+            resp.body = ''.join(
+                (record.get('name') or record['subdir']).encode('utf-8') +
+                '\n' for record in objects)
+        resp.headers['Content-Type'] = out_content_type + '; charset=utf-8'
+        return resp
+
+    def _get_shard_objects(self, req, shard_ranges, params, limit):
+        """
+        Get a listing from the shard containers of a container, going
+        through the shard ranges in order until the limit is reached.
+
+        :param req: the GET request for the container
+        :param shard_ranges: list of shard range dicts
+        :param params: the query parameters of the listing
+        :param limit: maximum number of entries to get
+        :returns: list of entries as in JSON listings, or None if a shard
+                  could not be listed
+        """
+        marker = params.get('marker', '')
+        end_marker = params.get('end_marker')
+        prefix = params.get('prefix')
+        objects = []
+        for shard_range in shard_ranges:
+            if len(objects) >= limit:
+                break
+            upper, lower = shard_range['upper'], shard_range['lower']
+            if upper and (upper <= marker or (prefix and upper < prefix)):
+                continue
+            if lower and ((end_marker and lower >= end_marker) or
+                          (prefix and lower >= prefix and
+                           not lower.startswith(prefix))):
+                break
+            # Continuing from the last entry also keeps a subdir spanning
+            # two shards from being listed twice.
+            shard_params = dict(params, marker=marker, format='json',
+                                limit=str(limit - len(objects)))
+            account, container = shard_range['name'].split('/')
+            path = '/%s/%s' % (account, container)
+            shard_req = Request.blank(
+                quote(path) + '?' + urlencode(shard_params),
+                headers={'X-Backend-Record-Type': 'auto',
+                         'X-Trans-Id': req.headers.get('X-Trans-Id', '-')})
+            shard_resp = self.GETorHEAD_base(
+                shard_req, _('Container'), self.app.container_ring,
+                self.app.container_ring.get_part(account, container), path)
+            if shard_resp.status_int == HTTP_NOT_FOUND:
+                # not created yet, so nothing has been moved to it yet
+                continue
+            if not is_success(shard_resp.status_int):
+                return None
+            if shard_resp.headers.get('X-Backend-Record-Type') == 'shard':
+                listing = self._get_shard_objects(
+                    req, load_shard_ranges(json.loads(shard_resp.body)),
+                    shard_params, limit - len(objects))
+                if listing is None:
+                    return None
+            else:
+                listing = json.loads(shard_resp.body)
+            if listing:
+                objects.extend(listing)
+                marker = (listing[-1].get('name') or
+                          listing[-1]['subdir']).encode('utf-8')
+        return objects
+
     @public
     @delay_denial
     @cors_validation
@@ -41,7 +41,7 @@ from eventlet.timeout import Timeout
 from swift.common.utils import ContextPool, normalize_timestamp, \
     config_true_value, public, json, csv_append, GreenthreadSafeIterator, \
     quorum_size, split_path, override_bytes_from_content_type, \
-    get_valid_utf8_str, GreenAsyncPile
+    get_valid_utf8_str, GreenAsyncPile, find_shard_range
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_metadata, check_object_creation, \
     CONTAINER_LISTING_LIMIT, MAX_FILE_SIZE
@@ -53,7 +53,7 @@ from swift.common.http import is_success, is_client_error, HTTP_CONTINUE, \
     HTTP_INTERNAL_SERVER_ERROR, HTTP_SERVICE_UNAVAILABLE, \
     HTTP_INSUFFICIENT_STORAGE, HTTP_OK
 from swift.proxy.controllers.base import Controller, delay_denial, \
-    cors_validation
+    cors_validation, load_shard_ranges
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPNotFound, \
     HTTPPreconditionFailed, HTTPRequestEntityTooLarge, HTTPRequestTimeout, \
     HTTPServerError, HTTPServiceUnavailable, Request, Response, \
@@ -744,6 +744,60 @@ class ObjectController(Controller):
                                       'POST', req.path_info, headers)
             return resp
 
+    def _get_update_target(self, req, container_info):
+        """
+        Get the container the object servers should update about the object.
+        That is the container itself unless it is sharded; then it is the
+        shard container holding the object's name, and the object servers
+        are told its path in X-Backend-Container-Path.
+
+        :param req: the request for the object
+        :param container_info: the container info, as from container_info
+        :returns: tuple of (partition, nodes) of the container to update
+        """
+        if container_info.get('sharded'):
+            shard_range = find_shard_range(self.object_name,
+                                           self._get_shard_ranges(req))
+            if shard_range:
+                req.headers['X-Backend-Container-Path'] = shard_range['name']
+                return self.app.container_ring.get_nodes(
+                    *shard_range['name'].split('/'))
+        return container_info['partition'], container_info['nodes']
+
+    def _get_shard_ranges(self, req):
+        """
+        Get the shard ranges of the container, from memcache if they were
+        looked up lately.
+
+        :param req: the request for the object
+        :returns: list of shard range dicts; empty if they could not be got
+        """
+        memcache = getattr(self.app, 'memcache', None) or \
+            req.environ.get('swift.cache')
+        cache_key = 'shard-ranges/%s/%s' % (self.account_name,
+                                            self.container_name)
+        shard_ranges = None
+        if memcache:
+            shard_ranges = memcache.get(cache_key)
+        if shard_ranges is None:
+            path = '/%s/%s' % (self.account_name, self.container_name)
+            shard_req = Request.blank(
+                quote(path),
+                headers={'X-Backend-Record-Type': 'shard',
+                         'X-Trans-Id': req.headers.get('X-Trans-Id', '-')})
+            resp = self.GETorHEAD_base(
+                shard_req, _('Container'), self.app.container_ring,
+                self.app.container_ring.get_part(self.account_name,
+                                                 self.container_name),
+                path)
+            if not is_success(resp.status_int):
+                return []
+            shard_ranges = json.loads(resp.body)
+            if memcache:
+                memcache.set(cache_key, shard_ranges,
+                             time=self.app.recheck_container_existence)
+        return load_shard_ranges(shard_ranges)
+
     def _backend_requests(self, req, n_outgoing,
                           container_partition, containers,
                           delete_at_container=None, delete_at_partition=None,
@@ -1073,6 +1127,8 @@ class ObjectController(Controller):
         te = req.headers.get('transfer-encoding', '')
         chunked = ('chunked' in te)
 
+        container_partition, containers = self._get_update_target(
+            req, container_info)
         outgoing_headers = self._backend_requests(
             req, len(nodes), container_partition, containers,
             delete_at_container, delete_at_part, delete_at_nodes)
@@ -1253,6 +1309,8 @@ class ObjectController(Controller):
         else:
             req.headers['X-Timestamp'] = normalize_timestamp(time.time())
 
+        container_partition, containers = self._get_update_target(
+            req, container_info)
         headers = self._backend_requests(
             req, len(nodes), container_partition, containers)
         resp = self.make_requests(req, self.app.object_ring,
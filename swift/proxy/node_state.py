@@ -0,0 +1,156 @@
+# Copyright (c) 2010-2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Error-limiting and timing state for backend nodes that is shared by all the
+proxy server workers on a host.
+
+The state lives in a file that every worker maps into memory, so as soon as
+one worker finds a node is failing or slow, the others skip or demote it too
+instead of each paying the timeouts again.
+"""
+
+import mmap
+import os
+import struct
+from hashlib import md5
+
+from swift.common.utils import mkdirs
+
+# key, errors, padding, last_error, timing, timing_expires
+SLOT_FORMAT = '=QIIddd'
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+MAX_PROBES = 8
+# Bump when changing the layout of the table, so that workers of different
+# versions use different files.
+LAYOUT_VERSION = 1
+
+
+class SharedNodeState(object):
+    """
+    A fixed-size, open-addressed hash table of per-node state in a shared
+    memory-mapped file.
+
+    Error counts are kept per device and timings per IP, as the proxy does
+    with its in-process state. Updates are not locked: two workers updating
+    the same node at the same moment may lose one of the updates, which only
+    makes the counts a little less exact. If the table is too full to place
+    a node, that node is simply not tracked.
+
+    Each layout of the table, i.e. each number of slots, has its own file,
+    named after it, since workers started before a reload may still have
+    the file of the old one mapped. A file is only ever grown, never
+    shrunk, as shrinking it would kill any worker that has it mapped with
+    SIGBUS.
+
+    :param path: path the state file is named after; the file used is this
+                 with the layout version and number of slots appended, and
+                 it is created if missing
+    :param slots: number of entries in the table; keep this well above the
+                  number of devices plus the number of servers in the rings
+    """
+
+    def __init__(self, path, slots=65536):
+        self.path = '%s.v%d.%d' % (path, LAYOUT_VERSION, slots)
+        self.slots = slots
+        size = slots * SLOT_SIZE
+        mkdirs(os.path.dirname(os.path.abspath(path)))
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                # new, or only partly grown by a worker that then died
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _find(self, name, create=False):
+        """
+        Find the slot for a name.
+
+        :param name: the name of the entry
+        :param create: if True, claim an empty slot for the name when it is
+                       not in the table yet
+        :returns: the byte offset of the slot, or None
+        """
+        key = struct.unpack_from('=Q', md5(name).digest())[0] or 1
+        index = key % self.slots
+        for _junk in xrange(MAX_PROBES):
+            offset = index * SLOT_SIZE
+            slot_key = struct.unpack_from('=Q', self._map, offset)[0]
+            if slot_key == key:
+                return offset
+            if not slot_key:
+                if not create:
+                    return None
+                struct.pack_into(SLOT_FORMAT, self._map, offset,
+                                 key, 0, 0, 0.0, 0.0, 0.0)
+                return offset
+            index = (index + 1) % self.slots
+        return None
+
+    def _error_name(self, node):
+        return 'errors:%s:%s/%s' % (node['ip'], node['port'], node['device'])
+
+    def get_errors(self, node):
+        """
+        Get the error count of a node and when its last error happened.
+
+        :param node: node dictionary from the ring
+        :returns: tuple of (errors, last_error)
+        """
+        offset = self._find(self._error_name(node))
+        if offset is None:
+            return 0, 0.0
+        _key, errors, _pad, last_error, _timing, _expires = \
+            struct.unpack_from(SLOT_FORMAT, self._map, offset)
+        return errors, last_error
+
+    def set_errors(self, node, errors, last_error):
+        """
+        Set the error count of a node and when its last error happened.
+
+        :param node: node dictionary from the ring
+        :param errors: the error count
+        :param last_error: time of the last error
+        """
+        offset = self._find(self._error_name(node), create=bool(errors))
+        if offset is not None:
+            struct.pack_into('=IId', self._map, offset + 8,
+                             errors, 0, last_error)
+
+    def get_timing(self, ip):
+        """
+        Get the last connection timing recorded for a server.
+
+        :param ip: IP address of the server
+        :returns: tuple of (timing, expires)
+        """
+        offset = self._find('timing:%s' % ip)
+        if offset is None:
+            return -1.0, 0.0
+        return struct.unpack_from('=dd', self._map, offset + 24)
+
+    def set_timing(self, ip, timing, expires):
+        """
+        Record a connection timing for a server.
+
+        :param ip: IP address of the server
+        :param timing: the timing in seconds
+        :param expires: time after which the timing should be ignored
+        """
+        offset = self._find('timing:%s' % ip, create=True)
+        if offset is not None:
+            struct.pack_into('=dd', self._map, offset + 24, timing, expires)
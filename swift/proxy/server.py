@@ -24,6 +24,7 @@ import itertools
 from eventlet import Timeout
 
 from swift import __canonical_version__ as swift_version
+from swift.common.bufferedhttp import ConnectionPool
 from swift.common.ring import Ring
 from swift.common.utils import cache_from_env, get_logger, \
     get_remote_client, split_path, config_true_value, generate_trans_id, \
@@ -32,6 +33,8 @@ from swift.common.utils import cache_from_env, get_logger, \
 from swift.common.constraints import check_utf8
 from swift.proxy.controllers import AccountController, ObjectController, \
     ContainerController, InfoController
+from swift.proxy.controllers.base import InfoCache, ReadHedger
+from swift.proxy.node_state import SharedNodeState
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
     HTTPMethodNotAllowed, HTTPNotFound, HTTPPreconditionFailed, \
     HTTPServerError, HTTPException, Request
@@ -76,6 +79,22 @@ class Application(object):
         self.account_ring = account_ring or Ring(swift_dir,
                                                  ring_name='account')
         self.memcache = memcache
+        info_cache_ttl = float(conf.get('info_cache_ttl', 0))
+        info_cache_size = int(conf.get('info_cache_size', 10000))
+        self.info_cache = None
+        if info_cache_ttl > 0 and info_cache_size > 0:
+            self.info_cache = InfoCache(
+                info_cache_size, info_cache_ttl,
+                float(conf.get('info_cache_negative_ttl',
+                               info_cache_ttl * 0.1)),
+                logger=self.logger)
+        conn_pool_size = int(conf.get('backend_connection_pool_size', 0))
+        self.conn_pool = None
+        if conn_pool_size > 0:
+            self.conn_pool = ConnectionPool(
+                conn_pool_size,
+                float(conf.get('backend_conn_idle_timeout', 10)),
+                logger=self.logger)
         mimetypes.init(mimetypes.knownfiles +
                        [os.path.join(swift_dir, 'mime.types')])
         self.account_autocreate = \
@@ -105,7 +124,21 @@ class Application(object):
             if a.strip()]
         self.node_timings = {}
         self.timing_expiry = int(conf.get('timing_expiry', 300))
+        node_state_file = conf.get('node_state_file')
+        self.node_state = None
+        if node_state_file:
+            self.node_state = SharedNodeState(
+                node_state_file, int(conf.get('node_state_slots', 65536)))
         self.sorting_method = conf.get('sorting_method', 'shuffle').lower()
+        self.latency_ewma_alpha = float(conf.get('latency_ewma_alpha', 0.3))
+        self.node_latencies = {}
+        self.node_outstanding = {}
+        self.read_hedger = None
+        if config_true_value(conf.get('hedge_reads', 'false')):
+            self.read_hedger = ReadHedger(
+                float(conf.get('hedge_percentile', 95)),
+                float(conf.get('hedge_max_ratio', 0.05)),
+                logger=self.logger)
         self.allow_static_large_object = config_true_value(
             conf.get('allow_static_large_object', 'true'))
         self.max_large_object_get_time = float(
@@ -325,7 +358,10 @@ class Application(object):
         Sorts nodes in-place (and returns the sorted list) according to
         the configured strategy. The default "sorting" is to randomly
         shuffle the nodes. If the "timing" strategy is chosen, the nodes
-        are sorted according to the stored timing data.
+        are sorted according to the stored timing data. If the "ewma"
+        strategy is chosen, each place goes to the less loaded of two
+        randomly chosen remaining nodes, where load is a device's average
+        latency times its number of requests in flight plus one.
         '''
         # In the case of timing sorting, shuffling ensures that close timings
         # (ie within the rounding resolution) won't prefer one over another.
@@ -335,11 +371,34 @@ class Application(object):
             now = time()
 
             def key_func(node):
-                timing, expires = self.node_timings.get(node['ip'], (-1.0, 0))
+                if self.node_state:
+                    timing, expires = self.node_state.get_timing(node['ip'])
+                else:
+                    timing, expires = self.node_timings.get(node['ip'],
+                                                            (-1.0, 0))
                 return timing if expires > now else -1.0
             nodes.sort(key=key_func)
         elif self.sorting_method == 'affinity':
             nodes.sort(key=self.read_affinity_sort_key)
+        elif self.sorting_method == 'ewma':
+            now = time()
+
+            def load(node):
+                key = _node_key(node)
+                latency, expires = self.node_latencies.get(key, (0.0, 0))
+                if expires <= now:
+                    # unknown or stale; worth trying again
+                    latency = 0.0
+                return latency * (self.node_outstanding.get(key, 0) + 1)
+            # The nodes are shuffled, so the first two are a random pair.
+            remaining = nodes[:]
+            del nodes[:]
+            while len(remaining) > 1:
+                if load(remaining[1]) < load(remaining[0]):
+                    nodes.append(remaining.pop(1))
+                else:
+                    nodes.append(remaining.pop(0))
+            nodes.extend(remaining)
         return nodes
 
     def set_node_timing(self, node, timing):
@@ -347,7 +406,64 @@ class Application(object):
             return
         now = time()
         timing = round(timing, 3)  # sort timings to the millisecond
-        self.node_timings[node['ip']] = (timing, now + self.timing_expiry)
+        if self.node_state:
+            self.node_state.set_timing(node['ip'], timing,
+                                       now + self.timing_expiry)
+        else:
+            self.node_timings[node['ip']] = (timing, now + self.timing_expiry)
+
+    def node_request_started(self, node):
+        """
+        Count a request to a node as in flight, for the "ewma" sorting
+        method.
+
+        :param node: dictionary of the node the request is sent to
+        """
+        if self.sorting_method != 'ewma':
+            return
+        key = _node_key(node)
+        self.node_outstanding[key] = self.node_outstanding.get(key, 0) + 1
+
+    def node_request_finished(self, node, timing, failed=False):
+        """
+        Record that a request to a node has its response headers (or has
+        failed), for the "ewma" sorting method.
+
+        :param node: dictionary of the node the request was sent to
+        :param timing: seconds from the start of the request
+        :param failed: True if the request failed; it then counts as having
+                       taken at least node_timeout
+        """
+        if self.sorting_method != 'ewma':
+            return
+        key = _node_key(node)
+        outstanding = self.node_outstanding.pop(key, 0) - 1
+        if outstanding > 0:
+            self.node_outstanding[key] = outstanding
+        if failed:
+            timing = max(timing, self.node_timeout)
+        now = time()
+        latency, expires = self.node_latencies.get(key, (timing, 0))
+        if expires > now:
+            latency += self.latency_ewma_alpha * (timing - latency)
+        else:
+            latency = timing
+        self.node_latencies[key] = (latency, now + self.timing_expiry)
+
+    def _get_node_errors(self, node):
+        if self.node_state:
+            return self.node_state.get_errors(node)
+        return node.get('errors', 0), node.get('last_error')
+
+    def _set_node_errors(self, node, errors, last_error):
+        if self.node_state:
+            self.node_state.set_errors(node, errors, last_error)
+        elif errors:
+            node['errors'] = errors
+            node['last_error'] = last_error
+        else:
+            node.pop('errors', None)
+            node.pop('last_error', None)
 
     def error_limited(self, node):
         """
@@ -357,15 +473,14 @@ class Application(object):
         :returns: True if error limited, False otherwise
         """
         now = time()
-        if 'errors' not in node:
+        errors, last_error = self._get_node_errors(node)
+        if not errors:
             return False
-        if 'last_error' in node and node['last_error'] < \
-                now - self.error_suppression_interval:
-            del node['last_error']
-            if 'errors' in node:
-                del node['errors']
+        if last_error is not None and \
+                last_error < now - self.error_suppression_interval:
+            self._set_node_errors(node, 0, 0)
             return False
-        limited = node['errors'] > self.error_suppression_limit
+        limited = errors > self.error_suppression_limit
         if limited:
             self.logger.debug(
                 _('Node error limited %(ip)s:%(port)s (%(device)s)'), node)
@@ -381,8 +496,7 @@ class Application(object):
         :param node: dictionary of node to error limit
         :param msg: error message
         """
-        node['errors'] = self.error_suppression_limit + 1
-        node['last_error'] = time()
+        self._set_node_errors(node, self.error_suppression_limit + 1, time())
         self.logger.error(_('%(msg)s %(ip)s:%(port)s/%(device)s'),
                           {'msg': msg, 'ip': node['ip'],
                           'port': node['port'], 'device': node['device']})
@@ -394,8 +508,8 @@ class Application(object):
         :param node: dictionary of node to handle errors for
         :param msg: error message
         """
-        node['errors'] = node.get('errors', 0) + 1
-        node['last_error'] = time()
+        errors, _junk = self._get_node_errors(node)
+        self._set_node_errors(node, errors + 1, time())
         self.logger.error(_('%(msg)s %(ip)s:%(port)s/%(device)s'),
                           {'msg': msg, 'ip': node['ip'],
                           'port': node['port'], 'device': node['device']})
@@ -468,6 +582,13 @@ class Application(object):
               '%(info)s'),
             {'type': typ, 'ip': node['ip'], 'port': node['port'],
              'device': node['device'], 'info': additional_info})
+        if self.conn_pool:
+            # Whatever went wrong may have broken the idle connections too.
+            self.conn_pool.discard(node['ip'], node['port'])
+
+
+def _node_key(node):
+    return (node['ip'], node['port'], node['device'])
 
 
 def app_factory(global_conf, **local_conf):
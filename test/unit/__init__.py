@@ -92,10 +92,13 @@ class FakeMemcache(object):
     def get(self, key):
         return self.store.get(key)
 
+    def get_multi(self, keys, server_key=None):
+        return [self.store.get(key) for key in keys]
+
     def keys(self):
         return self.store.keys()
 
-    def set(self, key, value, time=0):
+    def set(self, key, value, time=0, noreply=False):
         self.store[key] = value
         return True
 
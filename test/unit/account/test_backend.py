@@ -473,6 +473,46 @@ class TestAccountBroker(unittest.TestCase):
         self.assertEqual(['a', 'b', 'c'],
                          sorted([rec['name'] for rec in items]))
 
+    def test_merge_items_same_name(self):
+        broker = AccountBroker(':memory:', account='a')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_container('a', normalize_timestamp(2), 0, 3, 30)
+        broker.put_container('b', normalize_timestamp(2), 0, 1, 10)
+
+        def record(name, put_timestamp, delete_timestamp, object_count,
+                   bytes_used, deleted=0):
+            return {'name': name, 'put_timestamp': put_timestamp,
+                    'delete_timestamp': delete_timestamp,
+                    'object_count': object_count, 'bytes_used': bytes_used,
+                    'deleted': deleted}
+
+        broker.merge_items([
+            # an older update loses to the row already there
+            record('a', normalize_timestamp(1), 0, 5, 50),
+            # b is deleted, then the delete is reported again
+            record('b', normalize_timestamp(2), normalize_timestamp(3),
+                   0, 0, 1),
+            record('b', 0, normalize_timestamp(3), 0, 0, 1),
+            # c is put, updated and deleted all in one batch
+            record('c', normalize_timestamp(4), 0, 1, 100),
+            record('c', normalize_timestamp(4), 0, 2, 200),
+            record('c', 0, normalize_timestamp(5), 0, 0, 1)])
+        items = dict((rec['name'], rec)
+                     for rec in broker.get_items_since(-1, 1000))
+        self.assertEqual(sorted(items), ['a', 'b', 'c'])
+        self.assertEqual(items['a']['put_timestamp'], normalize_timestamp(2))
+        self.assertEqual(items['a']['object_count'], 5)
+        self.assertEqual(items['a']['deleted'], 0)
+        self.assertEqual(items['b']['deleted'], 1)
+        self.assertEqual(items['c']['put_timestamp'], normalize_timestamp(4))
+        self.assertEqual(items['c']['delete_timestamp'],
+                         normalize_timestamp(5))
+        self.assertEqual(items['c']['deleted'], 1)
+        info = broker.get_info()
+        self.assertEqual(info['container_count'], 1)
+        self.assertEqual(info['object_count'], 5)
+        self.assertEqual(info['bytes_used'], 50)
+
 
 def premetadata_create_account_stat_table(self, conn, put_timestamp):
     """
@@ -1092,6 +1092,44 @@ class TestAccountController(unittest.TestCase):
         self.assertEqual(resp.body.strip().split('\n'),
                          ['sub.1.0', 'sub.1.1', 'sub.1.2'])
 
+    def test_GET_streamed(self):
+        req = Request.blank('/sda1/p/a', environ={'REQUEST_METHOD': 'PUT',
+                                                  'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for name in ('sub.0', 'sub.0.0', 'sub.0.1', 'sub.1', 'sub.1.0',
+                     '<&>', '"x"'):
+            req = Request.blank(
+                '/sda1/p/a/%s' % name,
+                environ={'REQUEST_METHOD': 'PUT'},
+                headers={'X-Put-Timestamp': '1',
+                         'X-Delete-Timestamp': '0',
+                         'X-Object-Count': '1',
+                         'X-Bytes-Used': '2',
+                         'X-Timestamp': normalize_timestamp(0)})
+            req.get_response(self.controller)
+        for query in ('', 'format=json', 'format=xml', 'limit=3',
+                      'format=json&delimiter=.',
+                      'format=xml&prefix=sub.&delimiter=.',
+                      'format=json&marker=sub.0.0', 'prefix=nothing',
+                      'format=json&prefix=nothing',
+                      'format=xml&prefix=nothing'):
+            req = Request.blank('/sda1/p/a?' + query,
+                                environ={'REQUEST_METHOD': 'GET'})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.content_length, len(resp.body))
+            with mock.patch('swift.common.db.LISTING_BATCH_SIZE', 2):
+                req = Request.blank('/sda1/p/a?' + query,
+                                    environ={'REQUEST_METHOD': 'GET'})
+                streamed = req.get_response(self.controller)
+            self.assertEquals(streamed.status_int, resp.status_int)
+            self.assertEquals(streamed.body, resp.body)
+            if query in ('', 'format=json', 'format=xml'):
+                # more than one batch, so no Content-Length
+                self.assertEquals(streamed.content_length, None)
+            if 'nothing' in query:
+                self.assertEquals(streamed.content_length,
+                                  len(streamed.body))
+
     def test_GET_prefix_delimiter_json(self):
         req = Request.blank('/sda1/p/a', environ={'REQUEST_METHOD': 'PUT',
                                                   'HTTP_X_TIMESTAMP': '0'})
@@ -29,6 +29,9 @@ class FakeCache(object):
     def get(self, *args):
         return self.val
 
+    def get_multi(self, keys, server_key=None):
+        return [self.val for key in keys]
+
     def set(self, *args, **kwargs):
         pass
 
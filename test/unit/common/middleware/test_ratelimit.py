@@ -37,7 +37,10 @@ class FakeMemcache(object):
     def get(self, key):
         return self.store.get(key)
 
-    def set(self, key, value, serialize=False, time=0):
+    def get_multi(self, keys, server_key=None):
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, serialize=False, time=0, noreply=False):
         self.store[key] = value
         return True
 
@@ -399,12 +399,13 @@ class TestReconSuccess(TestCase):
                 "start": 1333044050.855202,
                 "success": 2, "ts_repl": 0},
             "replication_time": 0.2615511417388916,
-            "replication_last": 1357969645.25}
+            "replication_last": 1357969645.25,
+            "replication_lag": 0.25}
         self.fakecache.fakeout = from_cache_response
         rv = self.app.get_replication_info('account')
         self.assertEquals(self.fakecache.fakeout_calls,
                           [((['replication_time', 'replication_stats',
-                              'replication_last'],
+                              'replication_last', 'replication_lag'],
                               '/var/cache/swift/account.recon'), {})])
         self.assertEquals(rv, {
             "replication_stats": {
@@ -416,7 +417,8 @@ class TestReconSuccess(TestCase):
                 "start": 1333044050.855202,
                 "success": 2, "ts_repl": 0},
             "replication_time": 0.2615511417388916,
-            "replication_last": 1357969645.25})
+            "replication_last": 1357969645.25,
+            "replication_lag": 0.25})
 
     def test_get_replication_info_container(self):
         from_cache_response = {
@@ -435,7 +437,7 @@ class TestReconSuccess(TestCase):
         rv = self.app.get_replication_info('container')
         self.assertEquals(self.fakecache.fakeout_calls,
                           [((['replication_time', 'replication_stats',
-                              'replication_last'],
+                              'replication_last', 'replication_lag'],
                               '/var/cache/swift/container.recon'), {})])
         self.assertEquals(rv, {
             "replication_time": 200.0,
@@ -23,6 +23,8 @@ from gzip import GzipFile
 from shutil import rmtree
 from time import sleep, time
 
+from mock import patch
+
 from swift.common import ring, utils
 
 
@@ -37,8 +39,10 @@ class TestRingData(unittest.TestCase):
         rmtree(self.testdir, ignore_errors=1)
 
     def assert_ring_data_equal(self, rd_expected, rd_got):
-        self.assertEquals(rd_expected._replica2part2dev_id,
-                          rd_got._replica2part2dev_id)
+        self.assertEquals(
+            [list(part2dev_id)
+             for part2dev_id in rd_expected._replica2part2dev_id],
+            [list(part2dev_id) for part2dev_id in rd_got._replica2part2dev_id])
         self.assertEquals(rd_expected.devs, rd_got.devs)
         self.assertEquals(rd_expected._part_shift, rd_got._part_shift)
 
@@ -72,6 +76,73 @@ class TestRingData(unittest.TestCase):
         rd2 = ring.RingData.load(ring_fname)
         self.assert_ring_data_equal(rd, rd2)
 
+    def test_roundtrip_serialization_v1(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [0, 1, 0, 1])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30)
+        rd.save(ring_fname, format_version=1)
+        with closing(GzipFile(ring_fname, 'rb')) as f:
+            self.assertEquals(f.read(4), 'R1NG')
+        rd2 = ring.RingData.load(ring_fname)
+        self.assert_ring_data_equal(rd, rd2)
+        self.assertRaises(Exception, rd.save, ring_fname, format_version=3)
+
+    def test_v2_tables_are_mapped_and_aligned(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [1, 0, 1, 0]),
+             array.array('H', [2, 2])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1},
+             {'id': 2, 'zone': 2}], 30)
+        rd.save(ring_fname)
+        self.assertEquals(os.listdir(self.testdir), ['foo.ring.gz'])
+        with open(ring_fname, 'rb') as f:
+            raw = f.read()
+        self.assertEquals(raw[:6], 'R1NG\x00\x02')
+        tables_len = 2 * (4 + 4 + 2)
+        self.assertEquals((len(raw) - tables_len) % ring.ring.V2_ALIGNMENT,
+                          0)
+        rd2 = ring.RingData.load(ring_fname)
+        self.assert_ring_data_equal(rd, rd2)
+        self.assertEquals(len(rd2._replica2part2dev_id[2]), 2)
+        self.assertFalse(isinstance(rd2._replica2part2dev_id[0],
+                                    array.array))
+        # a mapped ring can be saved again
+        rd2.save(ring_fname)
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+
+    def test_v2_ring_saved_as_v1(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 1]), array.array('H', [1, 0, 1, 0])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30)
+        rd.save(ring_fname)
+        rd2 = ring.RingData.load(ring_fname)
+        # older readers still need the gzipped format
+        rd2.save(ring_fname, format_version=1)
+        with closing(GzipFile(ring_fname, 'rb')) as f:
+            self.assertEquals(f.read(6), 'R1NG\x00\x01')
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+
+    def test_v2_other_byteorder(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData(
+            [array.array('H', [0, 1, 0, 258])],
+            [{'id': 0, 'zone': 0}, {'id': 1, 'zone': 1}], 30)
+        other = 'big' if sys.byteorder == 'little' else 'little'
+        swapped = array.array('H', [0, 1, 0, 258])
+        swapped.byteswap()
+        with patch('sys.byteorder', other):
+            ring.RingData([swapped], rd.devs, 30).save(ring_fname)
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+
+    def test_v2_empty_ring(self):
+        ring_fname = os.path.join(self.testdir, 'foo.ring.gz')
+        rd = ring.RingData([], [{'id': 0, 'zone': 0}], 30)
+        rd.save(ring_fname)
+        self.assert_ring_data_equal(rd, ring.RingData.load(ring_fname))
+
     def test_deterministic_serialization(self):
         """
         Two identical rings should produce identical .gz files on disk.
@@ -139,8 +210,11 @@ class TestRing(unittest.TestCase):
         rmtree(self.testdir, ignore_errors=1)
 
     def test_creation(self):
-        self.assertEquals(self.ring._replica2part2dev_id,
-                          self.intended_replica2part2dev_id)
+        self.assertEquals(
+            [list(part2dev_id)
+             for part2dev_id in self.ring._replica2part2dev_id],
+            [list(part2dev_id)
+             for part2dev_id in self.intended_replica2part2dev_id])
         self.assertEquals(self.ring._part_shift, self.intended_part_shift)
         self.assertEquals(self.ring.devs, self.intended_devs)
         self.assertEquals(self.ring.reload_time, self.intended_reload_time)
@@ -719,5 +793,39 @@ class TestRing(unittest.TestCase):
                     index, dev_ids[index:], exp_handoffs[index:]))
 
 
+    def test_get_more_nodes_cached_handoffs(self):
+        rb = ring.RingBuilder(8, 3, 1)
+        next_dev_id = 0
+        for zone in xrange(1, 10):
+            for server in xrange(1, 5):
+                rb.add_dev({'id': next_dev_id,
+                            'ip': '1.2.%d.%d' % (zone, server),
+                            'port': 1234, 'zone': zone, 'region': 0,
+                            'weight': 1.0})
+                next_dev_id += 1
+        rb.rebalance(seed=1)
+        rb.get_ring().save(self.testgz)
+        r = ring.Ring(self.testdir, ring_name='whatever')
+        uncached = ring.Ring(self.testdir, ring_name='whatever',
+                             handoff_cache_size=0)
+        self.assertEquals(r._handoff_depth, 6)
+        for part in (0, 17, 255):
+            exp_ids = [d['id'] for d in uncached.get_more_nodes(part)]
+            self.assertEquals(len(exp_ids), 33)
+            # the first call fills the cache, later ones replay it and then
+            # resume the walk
+            first = r.get_more_nodes(part).next()['id']
+            self.assertEquals(first, exp_ids[0])
+            self.assertEquals(list(r._handoff_cache.get(part)), exp_ids[:6])
+            self.assertEquals([d['id'] for d in r.get_more_nodes(part)],
+                              exp_ids)
+        self.assertEquals(len(r._handoff_cache), 3)
+        self.assertEquals(len(uncached._handoff_cache), 0)
+
+        # a reload throws the cached handoffs away
+        r._reload(force=True)
+        self.assertEquals(len(r._handoff_cache), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
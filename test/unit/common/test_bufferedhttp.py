@@ -18,6 +18,7 @@ import unittest
 from eventlet import spawn, Timeout, listen
 
 from swift.common import bufferedhttp
+from test.unit import FakeLogger
 
 
 class TestBufferedHTTP(unittest.TestCase):
@@ -102,6 +103,94 @@ class TestBufferedHTTP(unittest.TestCase):
         finally:
             bufferedhttp.HTTPSConnection = origHTTPSConnection
 
+    def test_connection_pool(self):
+        bindsock = listen(('127.0.0.1', 0))
+        port = bindsock.getsockname()[1]
+
+        def serve(requests):
+            # answer the given number of requests on one connection, then
+            # hang up
+            try:
+                with Timeout(3):
+                    sock, addr = bindsock.accept()
+                    fp = sock.makefile()
+                    for i in xrange(requests):
+                        line = fp.readline()
+                        while line and line != '\r\n':
+                            line = fp.readline()
+                        fp.write('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                                 '\r\nok')
+                        fp.flush()
+                    fp.close()
+                    sock.close()
+            except BaseException as err:
+                return err
+            return None
+
+        logger = FakeLogger()
+        pool = bufferedhttp.ConnectionPool(logger=logger)
+        event = spawn(serve, 2)
+        try:
+            with Timeout(3):
+                conns = []
+                for i in xrange(2):
+                    conn = bufferedhttp.http_connect(
+                        '127.0.0.1', port, 'dev', 1, 'GET', '/path',
+                        pool=pool)
+                    resp = conn.getresponse()
+                    self.assertEquals(resp.read(), 'ok')
+                    self.assertTrue(resp.isclosed())
+                    pool.put(conn)
+                    conns.append(conn)
+                # both requests went over the same connection
+                self.assertTrue(conns[0] is conns[1])
+                self.assertEquals(
+                    logger.log_dict['increment'],
+                    [(('connection_pool.miss',), {}),
+                     (('connection_pool.hit',), {})])
+        finally:
+            err = event.wait()
+            if err:
+                raise Exception(err)
+
+        # the server has hung up, so the idle connection is dropped
+        self.assertEquals(pool.get('127.0.0.1', port), None)
+        self.assertEquals(conns[0].sock, None)
+
+    def test_connection_pool_limits(self):
+
+        class FakeSock(object):
+
+            def fileno(self):
+                return -1
+
+        class FakeConn(object):
+
+            def __init__(self):
+                self.ipaddr = '1.2.3.4'
+                self.port = 6000
+                self.sock = FakeSock()
+
+            def close(self):
+                self.sock = None
+
+        pool = bufferedhttp.ConnectionPool(max_idle_per_node=2)
+        conns = [FakeConn() for _junk in xrange(3)]
+        for conn in conns:
+            pool.put(conn)
+        self.assertEquals(len(pool._idle[('1.2.3.4', '6000')]), 2)
+        self.assertEquals(conns[2].sock, None)
+        pool.discard('1.2.3.4', '6000')
+        self.assertEquals([conn.sock for conn in conns], [None] * 3)
+        self.assertEquals(pool.get('1.2.3.4', 6000), None)
+
+        # connections idle for too long are closed instead of handed out
+        pool = bufferedhttp.ConnectionPool(idle_timeout=0)
+        conn = FakeConn()
+        pool.put(conn)
+        self.assertEquals(pool.get('1.2.3.4', 6000), None)
+        self.assertEquals(conn.sock, None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,6 +18,7 @@
 import os
 import unittest
 from shutil import rmtree, copy
+from tempfile import mkdtemp
 from uuid import uuid4
 
 import simplejson
@@ -27,9 +28,9 @@ from mock import patch, MagicMock
 from eventlet.timeout import Timeout
 
 import swift.common.db
-from swift.common.db import chexor, dict_factory, get_db_connection, \
-    DatabaseBroker, DatabaseConnectionError, DatabaseAlreadyExists, \
-    GreenDBConnection
+from swift.common.db import chexor, entry_hash, dict_factory, \
+    get_db_connection, DatabaseBroker, DatabaseConnectionError, \
+    DatabaseAlreadyExists, GreenDBConnection, pending_entry, split_pending
 from swift.common.utils import normalize_timestamp
 from swift.common.exceptions import LockTimeout
 
@@ -81,6 +82,33 @@ class TestChexor(unittest.TestCase):
                           'd41d8cd98f00b204e9800998ecf8427e', None,
                           normalize_timestamp(1))
 
+    def test_entry_hash(self):
+        old = 'd41d8cd98f00b204e9800998ecf8427e'
+        self.assertEquals(
+            '%032x' % (int(old, 16) ^
+                       entry_hash(u'\u00e9', normalize_timestamp(1))),
+            chexor(old, u'\u00e9', normalize_timestamp(1)))
+        self.assertEquals(
+            entry_hash(u'\u00e9'.encode('utf-8'), normalize_timestamp(1)),
+            entry_hash(u'\u00e9', normalize_timestamp(1)))
+        self.assertRaises(Exception, entry_hash, None,
+                          normalize_timestamp(1))
+
+
+class TestSplitPending(unittest.TestCase):
+
+    def test_mixed_entries(self):
+        data = ':b2xk:b2xkZXI=' + pending_entry('new:one') + \
+            pending_entry('\x00two')
+        self.assertEquals(list(split_pending(data)),
+                          ['b2xk', 'b2xkZXI=', '\x00new:one', '\x00\x00two'])
+
+    def test_torn_entries(self):
+        torn = pending_entry('torn')[:-1]
+        data = ':b2xk' + torn + pending_entry('new') + torn
+        self.assertEquals(list(split_pending(data)),
+                          ['b2xk', torn, '\x00new', torn])
+
 
 class TestGreenDBConnection(unittest.TestCase):
 
@@ -146,6 +174,69 @@ class TestGetDBConnection(unittest.TestCase):
                                   mock_db_cmd.call_count))
 
 
+class TestDBConnectionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        swift.common.db.set_db_profile({'db_conn_cache_size': '2'})
+        self.cache = swift.common.db.DB_CONNECTION_CACHE
+
+    def tearDown(self):
+        swift.common.db.set_db_profile({})
+        rmtree(self.testdir, ignore_errors=1)
+
+    def _broker(self, name):
+        broker = DatabaseBroker(os.path.join(self.testdir, name))
+        broker._initialize = lambda conn, put_timestamp: None
+        if not os.path.exists(broker.db_file):
+            broker.initialize(normalize_timestamp('1'))
+        return broker
+
+    def _get_conn(self, broker):
+        with broker.get() as conn:
+            return conn
+
+    def test_reuse(self):
+        broker = self._broker('1.db')
+        conn = self._get_conn(broker)
+        self.assertEquals(len(self.cache), 1)
+        # a new broker for the same db gets the same connection
+        broker = self._broker('1.db')
+        self.assertEquals(self._get_conn(broker), conn)
+        with broker.lock():
+            pass
+        self.assertEquals(self._get_conn(broker), conn)
+        # while it is in use, another connection is made
+        with broker.get() as conn2:
+            self.assertNotEqual(self._get_conn(self._broker('1.db')), conn2)
+        self.assertEquals(len(self.cache), 1)
+        # least recently used are closed
+        self._get_conn(self._broker('2.db'))
+        self._get_conn(self._broker('3.db'))
+        self.assertEquals(len(self.cache), 2)
+        self.assertRaises(sqlite3.ProgrammingError, conn2.execute,
+                          'SELECT 1')
+        broker = self._broker('3.db')
+        broker.close()
+        self.assertEquals(len(self.cache), 1)
+
+    def test_replaced_db(self):
+        broker = self._broker('1.db')
+        conn = self._get_conn(broker)
+        # replaced, as by replication
+        copy(broker.db_file, broker.db_file + '.tmp')
+        os.rename(broker.db_file + '.tmp', broker.db_file)
+        self.assertNotEqual(self._get_conn(self._broker('1.db')), conn)
+        self.assertRaises(sqlite3.ProgrammingError, conn.execute,
+                          'SELECT 1')
+        # deleted
+        conn = self._get_conn(broker)
+        os.unlink(broker.db_file)
+        self.assertEquals(self.cache.get(broker.db_file), None)
+        self.assertRaises(sqlite3.ProgrammingError, conn.execute,
+                          'SELECT 1')
+
+
 class TestDatabaseBroker(unittest.TestCase):
 
     def setUp(self):
@@ -343,6 +434,57 @@ class TestDatabaseBroker(unittest.TestCase):
                 'Quarantined %s to %s due to corrupted database' %
                 (self.testdir, qpath))
 
+    def test_wal_profile(self):
+        self.assertRaises(ValueError, swift.common.db.set_db_profile,
+                          {'db_journal_mode': 'truncate'})
+        swift.common.db.set_db_profile({
+            'db_journal_mode': 'wal', 'db_mmap_size': '1048576',
+            'db_cache_size': '500', 'db_page_size': '8192'})
+        try:
+            db_file = os.path.join(self.testdir, '1.db')
+            broker = DatabaseBroker(db_file)
+
+            def stub(conn, put_timestamp):
+                conn.execute('CREATE TABLE test (one TEXT)')
+            broker._initialize = stub
+            broker.initialize(normalize_timestamp('1'))
+            with broker.get() as conn:
+                self.assertEquals(
+                    conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+                self.assertEquals(
+                    conn.execute('PRAGMA page_size').fetchone()[0], 8192)
+                self.assertEquals(
+                    conn.execute('PRAGMA cache_size').fetchone()[0], 500)
+                conn.execute('INSERT INTO test (one) VALUES ("1")')
+                conn.commit()
+            self.assert_(os.path.exists(db_file + '-wal'))
+
+            def copy_has_row():
+                copy(db_file, db_file + '.copy')
+                conn = sqlite3.connect(db_file + '.copy')
+                try:
+                    return conn.execute('SELECT * FROM test').fetchall() == \
+                        [('1',)]
+                finally:
+                    conn.close()
+                    os.unlink(db_file + '.copy')
+
+            # the row is only in the log until it is checkpointed
+            self.assertFalse(copy_has_row())
+            with broker.lock():
+                self.assertTrue(broker.checkpoint())
+            self.assertTrue(copy_has_row())
+            # closing the only connection removes the log
+            broker.close()
+            self.assertFalse(os.path.exists(db_file + '-wal'))
+            self.assertTrue(broker.checkpoint())
+        finally:
+            swift.common.db.set_db_profile({})
+        # back to a rollback journal
+        with broker.get() as conn:
+            self.assertEquals(
+                conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+
     def test_lock(self):
         broker = DatabaseBroker(os.path.join(self.testdir, '1.db'), timeout=.1)
         got_exc = False
@@ -16,20 +16,24 @@
 import unittest
 from contextlib import contextmanager
 import os
+import zlib
 import logging
 import errno
+import itertools
 import math
 from mock import patch
 from shutil import rmtree
 from tempfile import mkdtemp, NamedTemporaryFile
 import mock
 import simplejson
+from eventlet import sleep
 
+import swift.common.db
 from swift.common import db_replicator
 from swift.common.utils import normalize_timestamp
 from swift.container import server as container_server
 from swift.common.exceptions import DriveNotMounted
-from swift.common.swob import HTTPException
+from swift.common.swob import HTTPException, Request
 
 from test.unit import FakeLogger
 
@@ -172,10 +176,16 @@ class FakeBroker:
         yield True
         self.locked = False
 
+    def checkpoint(self):
+        return True
+
+    def close(self):
+        pass
+
     def get_sync(self, *args, **kwargs):
         return 5
 
-    def get_syncs(self):
+    def get_syncs(self, *args, **kwargs):
         return []
 
     def get_items_since(self, point, *args):
@@ -419,6 +429,93 @@ class TestDBReplicator(unittest.TestCase):
         replicator = TestReplicator({})
         replicator._usync_db(0, FakeBroker(), fake_http, '12345', '67890')
 
+    def _usync_broker(self, rows):
+        broker = FakeBroker()
+        broker.merged_syncs = []
+        broker.get_items_since = lambda point, count: \
+            [{'ROWID': row} for row in xrange(point + 1, rows + 1)][:count]
+        broker.merge_syncs = lambda syncs, incoming=True: \
+            broker.merged_syncs.append((syncs[0]['sync_point'], incoming))
+        return broker
+
+    def _usync_http(self, status=202):
+        http = ReplHttp(set_status=status)
+        http.calls = []
+
+        def replicate(*args):
+            http.calls.append(args)
+            return ReplHttp.replicate(http, *args)
+        http.replicate = replicate
+        return http
+
+    def test_usync_adaptive_batches(self):
+        replicator = TestReplicator({'per_diff': '10', 'max_per_diff': '40',
+                                     'node_timeout': '10'})
+        broker = self._usync_broker(150)
+        http = self._usync_http()
+        # each merge takes a second
+        with mock.patch('swift.common.db_replicator.time') as mock_time:
+            mock_time.time.side_effect = itertools.count().next
+            self.assertTrue(replicator._usync_db(0, broker, http, 'remote',
+                                                 'local'))
+        # the next batch is read before the last one's merge is timed
+        self.assertEquals([len(args[1]) for args in http.calls[:-1]],
+                          [10, 10, 20, 40, 40, 30])
+        self.assertEquals(http.calls[-1][0], 'merge_syncs')
+        # the sync point is saved as each batch is merged
+        self.assertEquals(broker.merged_syncs,
+                          [(10, False), (20, False), (40, False),
+                           (80, False), (120, False), (150, False)])
+
+        # slow merges get smaller batches
+        replicator.node_timeout = 1
+        broker = self._usync_broker(30)
+        http = self._usync_http()
+        with mock.patch('swift.common.db_replicator.time') as mock_time:
+            mock_time.time.side_effect = itertools.count().next
+            self.assertTrue(replicator._usync_db(0, broker, http, 'remote',
+                                                 'local'))
+        self.assertEquals([len(args[1]) for args in http.calls[:-1]],
+                          [10, 10, 5, 2, 1, 1, 1])
+
+    def test_usync_capped(self):
+        replicator = TestReplicator({'per_diff': '10', 'max_per_diff': '40',
+                                     'max_diffs': '3'})
+        broker = self._usync_broker(100)
+        http = self._usync_http()
+        self.assertFalse(replicator._usync_db(0, broker, http, 'remote',
+                                              'local'))
+        # no more than max_diffs * per_diff rows, however large the batches
+        self.assertEquals(sum(len(args[1]) for args in http.calls), 30)
+        self.assertEquals(broker.merged_syncs[-1], (30, False))
+        self.assertEquals(replicator.stats['diff_capped'], 1)
+
+        # which picks up from the saved point next time
+        http = self._usync_http()
+        self.assertFalse(replicator._usync_db(30, broker, http, 'remote',
+                                              'local'))
+        self.assertEquals(http.calls[0][1][0]['ROWID'], 31)
+        self.assertEquals(broker.merged_syncs[-1], (60, False))
+        self.assertEquals(replicator.stats['diff_capped'], 2)
+
+        # reaching the cap with no rows left is not capped
+        broker = self._usync_broker(30)
+        http = self._usync_http()
+        self.assertTrue(replicator._usync_db(0, broker, http, 'remote',
+                                             'local'))
+        self.assertEquals(http.calls[-1][0], 'merge_syncs')
+        self.assertEquals(broker.merged_syncs[-1], (30, False))
+        self.assertEquals(replicator.stats['diff_capped'], 2)
+
+    def test_usync_error(self):
+        replicator = TestReplicator({'per_diff': '10'})
+        broker = self._usync_broker(100)
+        http = self._usync_http(status=500)
+        self.assertFalse(replicator._usync_db(0, broker, http, 'remote',
+                                              'local'))
+        self.assertEquals(len(http.calls), 1)
+        self.assertEquals(broker.merged_syncs, [])
+
     def test_stats(self):
         # I'm not sure how to test that this logs the right thing,
         # but we can at least make sure it gets covered.
@@ -634,6 +731,54 @@ class TestDBReplicator(unittest.TestCase):
         finally:
             rmtree(drive)
 
+    def test_complete_rsync_removes_old_logs(self):
+        drive = mkdtemp()
+        args = ['old_file']
+        rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker, False)
+        os.mkdir('%s/tmp' % drive)
+        old_file = '%s/tmp/old_file' % drive
+        new_file = '%s/new_db_file' % drive
+        try:
+            for name in (old_file, new_file + '-wal', new_file + '-shm'):
+                with open(name, 'w') as fp:
+                    fp.write('void')
+            resp = rpc.complete_rsync(drive, new_file, args)
+            self.assertEquals(204, resp.status_int)
+            self.assertEquals(os.listdir(drive), ['new_db_file', 'tmp'])
+        finally:
+            rmtree(drive)
+
+    def test_rsync_then_merge_wal(self):
+        drive = mkdtemp()
+        os.mkdir('%s/tmp' % drive)
+        db_file = '%s/db_file.db' % drive
+        old_file = '%s/tmp/old_file' % drive
+        rpc = db_replicator.ReplicatorRpc(
+            '/', '/', container_server.ContainerBroker, False)
+        swift.common.db.set_db_profile({'db_journal_mode': 'wal'})
+        try:
+            for path, name in ((db_file, 'a'), (old_file, 'b')):
+                broker = container_server.ContainerBroker(
+                    path, account='a', container='c')
+                broker.initialize(normalize_timestamp(1))
+                broker.put_object(name, normalize_timestamp(2), 0,
+                                  'text/plain', 'etag')
+                broker.close()
+            broker = container_server.ContainerBroker(db_file)
+            info = broker.get_info()
+            resp = rpc.rsync_then_merge(drive, db_file, ['old_file'])
+            self.assertEquals(204, resp.status_int)
+            # merged into the db where it was, not swapped for the copy
+            self.assertFalse(os.path.exists(old_file))
+            self.assertEquals(broker.get_info()['id'], info['id'])
+            self.assertEquals(
+                sorted(o['name'] for o in broker.get_items_since(-1, 10)),
+                ['a', 'b'])
+            self.assertEquals(broker.get_sync('old_file'), 1)
+        finally:
+            swift.common.db.set_db_profile({})
+            rmtree(drive)
+
     def test_roundrobin_datadirs(self):
         listdir_calls = []
         isdir_calls = []
@@ -789,6 +934,214 @@ class TestDBReplicator(unittest.TestCase):
             db_replicator.os.path.exists = orig_exists
             db_replicator.random.shuffle = orig_shuffle
 
+    def test_get_priority(self):
+        tempdir = mkdtemp()
+        try:
+            replicator = TestReplicator({})
+            replicator.ring = FakeRingWithNodes().Ring('path')
+            db_file = os.path.join(tempdir, 'hash.db')
+            self.assertEquals(replicator._get_priority('0', db_file, 1),
+                              (db_replicator.PRIORITY_IDLE, 0))
+            with open(db_file, 'w'):
+                pass
+            os.utime(db_file, (100, 100))
+            replicator.modified_since = 200
+
+            class Broker(FakeBroker):
+                syncs = []
+
+                def get_replication_info(self):
+                    return {'max_row': 10}
+
+                def get_syncs(self, incoming=True):
+                    self.assertFalse(incoming)
+                    return self.syncs
+
+            Broker.assertFalse = self.assertFalse
+            replicator.brokerclass = Broker
+
+            def assertPriority(priority, node_id=1):
+                self.assertEquals(
+                    replicator._get_priority('0', db_file, node_id),
+                    priority)
+
+            # sent to some peers, but not to all of them
+            Broker.syncs = [{'remote_id': 'a', 'sync_point': 10}]
+            assertPriority((db_replicator.PRIORITY_PENDING, -100))
+            Broker.syncs.append({'remote_id': 'b', 'sync_point': 5})
+            assertPriority((db_replicator.PRIORITY_PENDING, -100))
+            Broker.syncs[1]['sync_point'] = 10
+            assertPriority((db_replicator.PRIORITY_IDLE, -100))
+            # on a handoff node
+            assertPriority((db_replicator.PRIORITY_HANDOFF, -100), node_id=4)
+            # changed since the last pass began
+            os.utime(db_file, (300, 300))
+            assertPriority((db_replicator.PRIORITY_MODIFIED, -300))
+            # with rows waiting to be committed
+            with open(db_file + '.pending', 'w') as fp:
+                fp.write('x')
+            os.utime(db_file + '.pending', (400, 400))
+            assertPriority((db_replicator.PRIORITY_PENDING, -400))
+            os.unlink(db_file + '.pending')
+            # that cannot be read
+            Broker.get_replication_info = mock.Mock(
+                side_effect=Exception('no such table'))
+            assertPriority((db_replicator.PRIORITY_PENDING, -300))
+        finally:
+            rmtree(tempdir)
+
+    def test_schedule(self):
+        replicator = TestReplicator({})
+        dbs = {'/sda': [('0', '/sda/a.db', 1), ('1', '/sda/b.db', 1),
+                        ('2', '/sda/c.db', 1)],
+               '/sdb': [('0', '/sdb/d.db', 2)],
+               '/sdc': []}
+        priorities = {'/sda/a.db': (db_replicator.PRIORITY_IDLE, -5),
+                      '/sda/b.db': (db_replicator.PRIORITY_MODIFIED, -1),
+                      '/sda/c.db': (db_replicator.PRIORITY_MODIFIED, -2),
+                      '/sdb/d.db': (db_replicator.PRIORITY_HANDOFF, -3)}
+        replicator._get_priority = \
+            lambda part, object_file, node_id: priorities[object_file]
+        with mock.patch.object(db_replicator, 'roundrobin_datadirs',
+                               lambda dirs: iter(dbs[dirs[0][0]])):
+            scheduled = list(replicator._schedule(
+                [('/sda', 1), ('/sdb', 2), ('/sdc', 3)]))
+        # by priority and then the most recently changed first, on each
+        # device in turn
+        self.assertEquals(scheduled, [
+            (db_replicator.PRIORITY_MODIFIED, '2', '/sda/c.db', 1),
+            (db_replicator.PRIORITY_HANDOFF, '0', '/sdb/d.db', 2),
+            (db_replicator.PRIORITY_MODIFIED, '1', '/sda/b.db', 1),
+            (db_replicator.PRIORITY_IDLE, '0', '/sda/a.db', 1)])
+
+    def test_replicate_dirs_device_concurrency(self):
+        replicator = TestReplicator({'concurrency': '8',
+                                     'device_concurrency': '2'})
+        running = {1: 0, 2: 0}
+        most = {1: 0, 2: 0}
+
+        def fake_schedule(dirs):
+            for i in xrange(10):
+                for node_id in (1, 2):
+                    yield (db_replicator.PRIORITY_PENDING, '0',
+                           '/%d/%d.db' % (node_id, i), node_id)
+
+        def fake_replicate_object(partition, object_file, node_id):
+            running[node_id] += 1
+            most[node_id] = max(most[node_id], running[node_id])
+            sleep(0.001)
+            running[node_id] -= 1
+
+        replicator._schedule = fake_schedule
+        replicator._replicate_object = fake_replicate_object
+        replicator._replicate_dirs([('/1', 1), ('/2', 2)])
+        self.assertEquals(most, {1: 2, 2: 2})
+        self.assertEquals(running, {1: 0, 2: 0})
+        self.assertTrue(replicator.replication_lag > 0)
+
+    def test_node_semaphore(self):
+        replicator = TestReplicator({'node_concurrency': '3'})
+        node = {'ip': '1.2.3.4', 'port': 6001, 'device': 'sda'}
+        semaphore = replicator._node_semaphore(node)
+        self.assertEquals(semaphore.balance, 3)
+        self.assertTrue(semaphore is replicator._node_semaphore(
+            dict(node, device='sdb')))
+        self.assertFalse(semaphore is replicator._node_semaphore(
+            dict(node, port=6002)))
+
+    def test_replicate_in_processes(self):
+        tempdir = mkdtemp()
+        tmpfiles = [os.path.join(tempdir, str(i)) for i in xrange(2)]
+        dirs = [('/sda', 1), ('/sdb', 2), ('/sdc', 3)]
+        try:
+            def fake_mkstemp():
+                path = tmpfiles[len(fake_mkstemp.paths)]
+                fake_mkstemp.paths.append(path)
+                return os.open(path, os.O_RDWR | os.O_CREAT), path
+
+            def fake_replicate_dirs(group):
+                replicator.stats['attempted'] += len(group)
+                replicator.replication_lag = 10 * len(group)
+
+            # each child replicates its share of the devices
+            replicator = TestReplicator({'processes': '2'})
+            replicator._replicate_dirs = mock.Mock(
+                side_effect=fake_replicate_dirs)
+            fake_mkstemp.paths = []
+            with mock.patch.multiple(db_replicator.os,
+                                     fork=mock.Mock(return_value=0)), \
+                    mock.patch.object(db_replicator, 'mkstemp',
+                                      fake_mkstemp), \
+                    mock.patch.object(db_replicator, 'signal'), \
+                    mock.patch.object(db_replicator, 'patcher'):
+                self.assertRaises(SystemExit,
+                                  replicator._replicate_in_processes, dirs)
+            replicator._replicate_dirs.assert_called_once_with(
+                [('/sda', 1), ('/sdc', 3)])
+            with open(tmpfiles[0]) as fp:
+                results = simplejson.load(fp)
+            self.assertEquals(results['stats']['attempted'], 2)
+            self.assertEquals(results['lag'], 20)
+
+            # and the parent adds up their stats
+            with open(tmpfiles[1], 'w') as fp:
+                simplejson.dump({'stats': {'attempted': 1, 'start': 5},
+                                 'lag': 10}, fp)
+            replicator = TestReplicator({'processes': '2'})
+            replicator.logger = FakeLogger()
+            start = replicator.stats['start']
+            fake_mkstemp.paths = []
+            waits = [(102, 0), (101, 0)]
+            with mock.patch.multiple(
+                    db_replicator.os, fork=mock.Mock(side_effect=[101, 102]),
+                    wait=lambda: waits.pop(0)), \
+                    mock.patch.object(db_replicator, 'mkstemp',
+                                      fake_mkstemp):
+                replicator._replicate_in_processes(dirs)
+            self.assertEquals(replicator.stats['attempted'], 3)
+            self.assertEquals(replicator.stats['start'], start)
+            self.assertEquals(replicator.replication_lag, 20)
+            self.assertEquals(os.listdir(tempdir), [])
+
+            # a child that died without its stats is logged
+            for tmpfile in tmpfiles:
+                with open(tmpfile, 'w'):
+                    pass
+            replicator = TestReplicator({'processes': '2'})
+            replicator.logger = FakeLogger()
+            fake_mkstemp.paths = []
+            waits = [(101, 0), (102, 0)]
+            with mock.patch.multiple(
+                    db_replicator.os, fork=mock.Mock(side_effect=[101, 102]),
+                    wait=lambda: waits.pop(0)), \
+                    mock.patch.object(db_replicator, 'mkstemp',
+                                      fake_mkstemp):
+                replicator._replicate_in_processes(dirs)
+            self.assertEquals(replicator.stats['attempted'], 0)
+            self.assertEquals(len(replicator.logger.get_lines_for_level(
+                'error')), 2)
+        finally:
+            rmtree(tempdir)
+
+    def test_run_once_processes(self):
+        replicator = TestReplicator({'processes': '2'})
+        replicator._replicate_in_processes = mock.Mock()
+        replicator._replicate_dirs = mock.Mock()
+        replicator.run_once()
+        # no devices to share out
+        replicator._replicate_dirs.assert_called_once_with([])
+        self.assertFalse(replicator._replicate_in_processes.called)
+
+    def test_report_stats_lag(self):
+        replicator = TestReplicator({})
+        replicator.replication_lag = 12.5
+        with mock.patch.object(db_replicator,
+                               'dump_recon_cache') as mock_dump:
+            replicator._report_stats()
+        self.assertEquals(mock_dump.call_args[0][0]['replication_lag'], 12.5)
+        replicator._zero_stats()
+        self.assertEquals(replicator.replication_lag, 0)
+
     @mock.patch("swift.common.db_replicator.ReplConnection", mock.Mock())
     def test_http_connect(self):
         node = "node"
@@ -802,6 +1155,40 @@ class TestDBReplicator(unittest.TestCase):
                       replicator.logger))
 
 
+class TestReplConnection(unittest.TestCase):
+
+    def test_replicate_compress(self):
+        node = {'replication_ip': '127.0.0.1', 'replication_port': 6001,
+                'device': 'sda1'}
+        for compress in (False, True):
+            conn = db_replicator.ReplConnection(node, '0', 'hash',
+                                                FakeLogger())
+            conn.compress = compress
+            conn.request = mock.Mock()
+            conn.getresponse = mock.Mock()
+            conn.replicate('merge_items', [{'ROWID': 1}], 'id')
+            path, body, headers = conn.request.call_args[0][1:]
+            self.assertEquals(path, '/sda1/0/hash')
+            req = Request.blank(path, body=body, headers=headers)
+            self.assertEquals(db_replicator.get_replicate_args(req),
+                              ['merge_items', [{'ROWID': 1}], 'id'])
+            self.assertEquals('Content-Encoding' in headers, compress)
+
+    def test_get_replicate_args(self):
+        req = Request.blank('/sda1/0/hash', body='["sync"]')
+        self.assertEquals(db_replicator.get_replicate_args(req), ['sync'])
+        req = Request.blank('/sda1/0/hash',
+                            headers={'Content-Encoding': 'deflate'},
+                            body=zlib.compress('["sync"]'))
+        self.assertEquals(db_replicator.get_replicate_args(req), ['sync'])
+        req = Request.blank('/sda1/0/hash',
+                            headers={'Content-Encoding': 'deflate'},
+                            body='["sync"]')
+        self.assertRaises(ValueError, db_replicator.get_replicate_args, req)
+        req = Request.blank('/sda1/0/hash', body='["sync"')
+        self.assertRaises(ValueError, db_replicator.get_replicate_args, req)
+
+
 class TestReplToNode(unittest.TestCase):
     def setUp(self):
         db_replicator.ring = FakeRing()
@@ -834,6 +1221,7 @@ class TestReplToNode(unittest.TestCase):
     def test_repl_to_node_rsync_success(self):
         rinfo = {"id": 3, "point": -1, "max_row": 4, "hash": "c"}
         self.http = ReplHttp(simplejson.dumps(rinfo))
+        self.fake_info['max_row'] = 1000000
         self.broker.get_sync()
         self.assertEquals(self.replicator._repl_to_node(
             self.fake_node, self.broker, '0', self.fake_info), True)
@@ -847,6 +1235,29 @@ class TestReplToNode(unittest.TestCase):
                       replicate_timeout=(self.fake_info['count'] / 2000))
         ])
 
+    def test_repl_to_node_drifted_usync(self):
+        # only brand new remote dbs are rsynced, however far behind others
+        # are
+        for remote_max_row, local_max_row in ((4, 10), (1000, 1000000)):
+            self.replicator._usync_db.reset_mock()
+            rinfo = {"id": 3, "point": -1, "max_row": remote_max_row,
+                     "hash": "c"}
+            self.http = ReplHttp(simplejson.dumps(rinfo))
+            self.fake_info['max_row'] = local_max_row
+            self.assertEquals(self.replicator._repl_to_node(
+                self.fake_node, self.broker, '0', self.fake_info), True)
+            self.assertEquals(self.replicator._rsync_db.call_count, 0)
+            self.assertEquals(self.replicator._usync_db.call_count, 1)
+            self.assertFalse(self.http.compress)
+
+    def test_repl_to_node_compress(self):
+        rinfo = {"id": 3, "point": -1, "max_row": 5, "hash": "c",
+                 "accept_encoding": "deflate"}
+        self.http = ReplHttp(simplejson.dumps(rinfo))
+        self.assertEquals(self.replicator._repl_to_node(
+            self.fake_node, self.broker, '0', self.fake_info), True)
+        self.assertTrue(self.http.compress)
+
     def test_repl_to_node_already_in_sync(self):
         rinfo = {"id": 3, "point": -1, "max_row": 10, "hash": "b"}
         self.http = ReplHttp(simplejson.dumps(rinfo))
@@ -332,6 +332,65 @@ class TestMemcached(unittest.TestCase):
             ('some_key2', 'some_key1', 'not_exists'), 'multi_key'),
             [[4, 5, 6], [1, 2, 3], None])
 
+    def test_multi_across_servers(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mocks = {}
+        for server in servers:
+            mocks[server] = MockMemcached()
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mocks[server], mocks[server])] * 2)
+        keys = ['key%d' % i for i in xrange(30)]
+        memcache_client.set_multi(dict((key, [key]) for key in keys))
+        # every key went to the server a plain set would have used
+        for key in keys:
+            server = next(memcache_client._get_servers(
+                memcached.md5hash(key)))
+            self.assertTrue(memcached.md5hash(key) in mocks[server].cache)
+        self.assertTrue(all(mock.cache for mock in mocks.values()))
+        self.assertEquals(memcache_client.get_multi(keys + ['not_exists']),
+                          [[key] for key in keys] + [None])
+        self.assertEquals(memcache_client.get(keys[3]), [keys[3]])
+        # one get per server
+        sent = []
+        for mock in mocks.values():
+            orig_sendall = mock.sendall
+
+            def sendall(string, orig_sendall=orig_sendall):
+                sent.append(string)
+                return orig_sendall(string)
+            mock.sendall = sendall
+        memcache_client.get_multi(keys)
+        self.assertEquals(len(sent), len(servers))
+
+    def test_multi_across_servers_retries(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mock = MockMemcached()
+        memcache_client._client_cache[servers[0]] = MockedMemcachePool(
+            [(mock, mock)] * 2)
+        memcache_client._client_cache[servers[1]] = MockedMemcachePool(
+            [(ExplodingMockMemcached(), ExplodingMockMemcached())] * 2)
+        keys = ['key%d' % i for i in xrange(10)]
+        memcache_client.set_multi(dict((key, [key]) for key in keys))
+        self.assertEquals(len(mock.cache), len(keys))
+        self.assertEquals(memcache_client.get_multi(keys),
+                          [[key] for key in keys])
+
+    def test_noreply(self):
+        memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'])
+        mock = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock, mock)] * 2)
+        memcache_client.set('some_key', [1, 2, 3], noreply=True)
+        memcache_client.set_multi({'some_key1': [4], 'some_key2': [5]},
+                                  noreply=True)
+        self.assertEquals(mock.outbuf, '')
+        self.assertEquals(memcache_client.get('some_key'), [1, 2, 3])
+        self.assertEquals(
+            memcache_client.get_multi(['some_key1', 'some_key2']),
+            [[4], [5]])
+
     def test_serialization(self):
         memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'],
                                                  allow_pickle=True)
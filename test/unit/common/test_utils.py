@@ -1405,6 +1405,36 @@ log_name = %(yarr)s'''
         finally:
             utils._sys_fallocate = orig__sys_fallocate
 
+    def test_sendfile(self):
+        with NamedTemporaryFile() as fp:
+            fp.write('0123456789')
+            fp.flush()
+            rsock, wsock = socket.socketpair()
+            try:
+                self.assertEquals(
+                    utils.sendfile(wsock.fileno(), fp.fileno(), 2, 5), 5)
+                self.assertEquals(rsock.recv(10), '23456')
+                # the end of the file
+                self.assertEquals(
+                    utils.sendfile(wsock.fileno(), fp.fileno(), 10, 5), 0)
+                try:
+                    utils.sendfile(wsock.fileno(), -1, 0, 5)
+                except OSError as err:
+                    self.assertEquals(err.errno, errno.EBADF)
+                else:
+                    self.fail('OSError not raised')
+            finally:
+                rsock.close()
+                wsock.close()
+
+        orig__sys_sendfile = utils._sys_sendfile
+        try:
+            utils._sys_sendfile = utils.noop_libc_function
+            self.assertFalse(utils.sendfile_available())
+            self.assertRaises(OSError, utils.sendfile, 1, 2, 0, 5)
+        finally:
+            utils._sys_sendfile = orig__sys_sendfile
+
     def test_generate_trans_id(self):
         fake_time = 1366428370.5163341
         with patch.object(utils.time, 'time', return_value=fake_time):
@@ -2623,6 +2653,114 @@ class TestThreadpool(unittest.TestCase):
             caught = True
         self.assertTrue(caught)
 
+    def test_group_commit_off(self):
+        tp = utils.ThreadPool(0)
+        with tp.group_commit() as sync:
+            self.assertEquals(sync, utils.fsync)
+
+    def _group_sync(self, group_sync, fds, entered=None):
+        # each thread enters the batch before any syncs
+        entered = entered or []
+        all_in = threading.Event()
+        errors = []
+
+        def put(fd):
+            try:
+                with group_sync.batch() as sync:
+                    entered.append(fd)
+                    if len(entered) == len(fds):
+                        all_in.set()
+                    all_in.wait(10)
+                    sync(fd)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=put, args=(fd,)) for fd in fds]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEquals(errors, [])
+
+    def test_group_commit(self):
+        tp = utils.ThreadPool(0, group_commit_window=10)
+        group_sync = tp._group_sync
+        flushed = []
+        with patch.object(group_sync, '_flush', flushed.append):
+            with tp.group_commit() as sync:
+                self.assertNotEquals(sync, utils.fsync)
+                sync(1)
+            self.assertEquals(flushed, [[1]])
+            del flushed[:]
+            start = time.time()
+            self._group_sync(group_sync, range(10))
+        # one sync for all, without waiting for the window
+        self.assertEquals(len(flushed), 1)
+        self.assertEquals(sorted(flushed[0]), range(10))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_group_commit_window(self):
+        group_sync = utils.GroupSync(0.1)
+        flushed = []
+        # another file still being written holds the sync back for no more
+        # than the window
+        with patch.object(group_sync, '_flush', flushed.append):
+            with group_sync.batch():
+                with group_sync.batch() as sync:
+                    start = time.time()
+                    sync(1)
+                    self.assertTrue(time.time() - start >= 0.1)
+            # nor does one that left without syncing
+            with group_sync.batch():
+                pass
+            start = time.time()
+            with group_sync.batch() as sync:
+                sync(2)
+            self.assertTrue(time.time() - start < 0.1)
+        self.assertEquals(flushed, [[1], [2]])
+
+    def test_group_commit_syncfs(self):
+        group_sync = utils.GroupSync(1)
+        calls = []
+        with nested(
+                patch('swift.common.utils.syncfs_available',
+                      lambda: True),
+                patch('swift.common.utils.syncfs',
+                      lambda fd: calls.append(('syncfs', fd))),
+                patch('swift.common.utils.fsync',
+                      lambda fd: calls.append(('fsync', fd)))):
+            group_sync._flush([3, 4])
+        self.assertEquals(calls, [('syncfs', 3)])
+        del calls[:]
+        with nested(
+                patch('swift.common.utils.syncfs_available',
+                      lambda: False),
+                patch('swift.common.utils.fsync',
+                      lambda fd: calls.append(('fsync', fd)))):
+            group_sync._flush([3, 4])
+        self.assertEquals(calls, [('fsync', 3), ('fsync', 4)])
+
+    def test_group_commit_flush_fails(self):
+        group_sync = utils.GroupSync(10)
+        fsynced = []
+
+        def fail(fds):
+            raise OSError(errno.EIO, 'oops')
+
+        def fsync(fd):
+            fsynced.append(fd)
+            if fd == 2:
+                raise OSError(errno.EIO, 'oops')
+
+        with nested(patch.object(group_sync, '_flush', fail),
+                    patch('swift.common.utils.fsync', fsync)):
+            # each falls back to syncing its own file, and sees its own
+            # error
+            self._group_sync(group_sync, [1, 3])
+            self.assertEquals(sorted(fsynced), [1, 3])
+            with group_sync.batch() as sync:
+                self.assertRaises(OSError, sync, 2)
+
 
 class TestAuditLocationGenerator(unittest.TestCase):
     def test_non_dir_contents(self):
@@ -2747,5 +2885,75 @@ class TestGreenAsyncPile(unittest.TestCase):
         self.assertEqual(completed[0], 2)
 
 
+class TestOrderedDict(unittest.TestCase):
+
+    def test_fallback(self):
+        d = utils._OrderedDict()
+        for key in 'cab':
+            d[key] = key.upper()
+        d['c'] = 'C2'
+        self.assertEquals(d.keys(), ['c', 'a', 'b'])
+        self.assertEquals(list(d.itervalues()), ['C2', 'A', 'B'])
+        self.assertEquals(d.items(), [('c', 'C2'), ('a', 'A'), ('b', 'B')])
+        self.assertEquals(d.pop('a'), 'A')
+        self.assertEquals(d.pop('a', None), None)
+        self.assertRaises(KeyError, d.pop, 'a')
+        d['a'] = 'A2'
+        self.assertEquals(d.values(), ['C2', 'B', 'A2'])
+        self.assertEquals(d.popitem(last=False), ('c', 'C2'))
+        self.assertEquals(d.popitem(), ('a', 'A2'))
+        self.assertEquals(len(d), 1)
+        self.assertEquals(d.get('b'), 'B')
+        d.clear()
+        self.assertEquals(list(d), [])
+        self.assertRaises(KeyError, d.popitem)
+        d['x'] = 1
+        self.assertEquals(dict(d.iteritems()), {'x': 1})
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_set_delete(self):
+        cache = utils.LRUCache(maxsize=10, ttl=60)
+        self.assertEquals(cache.get('a'), None)
+        self.assertEquals(cache.get('a', 'missing'), 'missing')
+        cache.set('a', 1)
+        self.assertEquals(cache.get('a'), 1)
+        cache.set('a', 2)
+        self.assertEquals(cache.get('a'), 2)
+        self.assertEquals(len(cache), 1)
+        cache.delete('a')
+        cache.delete('a')
+        self.assertEquals(cache.get('a'), None)
+        cache.set('b', 1)
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.get('a'), 1)
+        self.assertEquals(cache.get('c'), 3)
+
+    def test_expiry(self):
+        cache = utils.LRUCache(maxsize=10, ttl=60)
+        with patch('time.time', return_value=1000.0):
+            cache.set('a', 1)
+            cache.set('b', 2, ttl=5)
+            cache.set('c', 3, ttl=0)
+        with patch('time.time', return_value=1004.0):
+            self.assertEquals(cache.get('b'), 2)
+        with patch('time.time', return_value=1005.0):
+            self.assertEquals(cache.get('a'), 1)
+            self.assertEquals(cache.get('b'), None)
+            self.assertEquals(cache.get('c'), None)
+        self.assertEquals(len(cache), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -40,6 +40,9 @@ class FakeContainerBroker(object):
         if self.file.startswith('true'):
             return 'ok'
 
+    def get_shard_ranges(self):
+        return []
+
 
 class TestAuditor(unittest.TestCase):
 
@@ -117,5 +120,50 @@ class TestAuditor(unittest.TestCase):
         self.assertEquals(test_auditor.container_failures, 2)
         self.assertEquals(test_auditor.container_passes, 3)
 
+    def test_check_shard_ranges(self):
+        test_auditor = auditor.ContainerAuditor({})
+
+        def shard_ranges(*bounds):
+            return [{'name': '.shards_a/c-%d' % i, 'lower': lower,
+                     'upper': upper}
+                    for i, (lower, upper) in enumerate(bounds)]
+
+        self.assertEquals(test_auditor.check_shard_ranges([]), None)
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', 'f'), ('f', 'p'), ('p', ''))), None)
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', ''))), None)
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', 'f'), ('g', ''))),
+            ".shards_a/c-1 starts at 'g', not 'f'")
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('a', ''))), ".shards_a/c-0 starts at 'a', not ''")
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', 'f'), ('f', 'f'), ('f', ''))),
+            '.shards_a/c-1 is empty')
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', 'f'), ('f', 'p'))), "no range after 'p'")
+        self.assertEquals(test_auditor.check_shard_ranges(
+            shard_ranges(('', ''), ('', ''))),
+            '.shards_a/c-1 is after the last range')
+
+    def test_container_auditor_shard_ranges(self):
+        test_auditor = auditor.ContainerAuditor({})
+        test_auditor.logger = FakeLogger()
+        path = os.path.join(self.testdir, 'true1.db')
+
+        class FakeShardedBroker(FakeContainerBroker):
+            def get_shard_ranges(self):
+                return [{'name': '.shards_a/c-0', 'lower': '',
+                         'upper': 'f'}]
+
+        with mock.patch('swift.container.auditor.ContainerBroker',
+                        FakeShardedBroker):
+            test_auditor.container_audit(path)
+        self.assertEquals(test_auditor.container_failures, 1)
+        self.assertEquals(test_auditor.container_passes, 0)
+        self.assertEquals(len(test_auditor.logger.get_lines_for_level(
+            'error')), 1)
+
 if __name__ == '__main__':
     unittest.main()
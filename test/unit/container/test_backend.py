@@ -15,13 +15,22 @@
 
 """ Tests for swift.container.backend """
 
+import cPickle as pickle
 import hashlib
+import os
 import unittest
+
+import mock
+from shutil import rmtree
+from tempfile import mkdtemp
 from time import sleep, time
 from uuid import uuid4
 
+import swift.container.backend
 from swift.container.backend import ContainerBroker
+from swift.common.db import chexor
 from swift.common.utils import normalize_timestamp
+from test.unit import FakeLogger
 
 
 class TestContainerBroker(unittest.TestCase):
@@ -125,6 +134,105 @@ class TestContainerBroker(unittest.TestCase):
         broker.reclaim(normalize_timestamp(time()), time())
         broker.delete_db(normalize_timestamp(time()))
 
+    def _assert_object_stats(self, broker):
+        with broker.get() as conn:
+            rows = conn.execute('''
+                SELECT name, created_at, size, deleted FROM object
+            ''').fetchall()
+        expected_hash = '0' * 32
+        for row in rows:
+            expected_hash = chexor(expected_hash, row[0].decode('utf-8'),
+                                   row[1])
+        info = broker.get_info()
+        self.assertEquals(
+            (info['object_count'], info['bytes_used'], info['hash']),
+            (sum(1 - row[3] for row in rows), sum(row[2] for row in rows),
+             expected_hash))
+
+    def test_object_stats(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self._assert_object_stats(broker)
+        broker.put_object('a', normalize_timestamp(1), 1, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        broker.put_object(u'\u00e9'.encode('utf-8'), normalize_timestamp(1),
+                          2, 'text/plain', 'd41d8cd98f00b204e9800998ecf8427e')
+        self._assert_object_stats(broker)
+        # replaced, then replaced by a tombstone
+        broker.put_object('a', normalize_timestamp(2), 4, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        broker.delete_object(u'\u00e9'.encode('utf-8'),
+                             normalize_timestamp(2))
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['object_count'], 1)
+        self.assertEquals(broker.get_info()['bytes_used'], 4)
+        # older records and duplicates in one batch
+        broker.merge_items([
+            {'name': 'a', 'created_at': normalize_timestamp(1), 'size': 8,
+             'content_type': 'text/plain', 'etag': 'x', 'deleted': 0},
+            {'name': 'b', 'created_at': normalize_timestamp(3), 'size': 16,
+             'content_type': 'text/plain', 'etag': 'x', 'deleted': 0},
+            {'name': 'b', 'created_at': normalize_timestamp(4), 'size': 32,
+             'content_type': 'text/plain', 'etag': 'x', 'deleted': 0},
+            {'name': 'c', 'created_at': normalize_timestamp(3), 'size': 0,
+             'content_type': 'text/plain', 'etag': 'x', 'deleted': 1}])
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['object_count'], 2)
+        self.assertEquals(broker.get_info()['bytes_used'], 36)
+        broker.merge_items([])
+        self._assert_object_stats(broker)
+        broker.reclaim(normalize_timestamp(3), time())
+        self._assert_object_stats(broker)
+        self.assertEquals([item['name']
+                           for item in broker.get_items_since(-1, 10)],
+                          ['a', 'b', 'c'])
+        broker.remove_shard_items('a', 'b', 100)
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['object_count'], 1)
+        broker.reclaim(normalize_timestamp(4), time())
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['object_count'], 1)
+        self.assertEquals([item['name']
+                           for item in broker.get_items_since(-1, 10)],
+                          ['a'])
+
+    def _object_triggers(self, broker):
+        with broker.get() as conn:
+            return sorted(row[0] for row in conn.execute('''
+                SELECT name FROM sqlite_master
+                WHERE type = 'trigger' AND tbl_name = 'object'
+            '''))
+
+    def test_object_triggers(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(self._object_triggers(broker),
+                          ['object_delete', 'object_insert', 'object_update'])
+        broker.put_object('a', normalize_timestamp(1), 1, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEquals(self._object_triggers(broker),
+                          ['object_delete', 'object_insert', 'object_update'])
+
+    def test_object_stats_without_triggers(self):
+        # DBs whose triggers were dropped are still accounted for in batch
+        # without BATCH_STATS
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        with mock.patch('swift.container.backend.BATCH_STATS', True):
+            broker.put_object('a', normalize_timestamp(1), 1, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEquals(self._object_triggers(broker), ['object_update'])
+        with mock.patch('swift.container.backend.BATCH_STATS', False):
+            broker.put_object('b', normalize_timestamp(1), 2, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+            broker.delete_object('a', normalize_timestamp(2))
+            self._assert_object_stats(broker)
+            self.assertEquals(broker.get_info()['object_count'], 1)
+            self.assertEquals(broker.get_info()['bytes_used'], 2)
+            broker.reclaim(normalize_timestamp(3), time())
+            self._assert_object_stats(broker)
+        self.assertEquals(self._object_triggers(broker), ['object_update'])
+
     def test_delete_object(self):
         # Test ContainerBroker.delete_object
         broker = ContainerBroker(':memory:', account='a', container='c')
@@ -751,6 +859,65 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals([row[0] for row in listing],
                           ['/pets/fish/a', '/pets/fish/b'])
 
+    def test_list_objects_iter_seek_past_subdirs(self):
+        # the listings are the same when every subdir is skipped with a
+        # new query
+        with mock.patch('swift.container.backend.DELIMITER_SKIP_ROWS', 1):
+            self.test_list_objects_iter()
+            self.test_list_objects_iter_non_slash()
+            self.test_list_objects_iter_prefix_delim()
+            self.test_double_check_trailing_delimiter()
+
+    def test_list_objects_iter_path_after_subdir(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        for name in ('p/a/1', 'p/a/2', 'p/a0', 'p/b', '/x', '0'):
+            broker.put_object(name, normalize_timestamp(0), 0, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        for skip_rows in (1, 32):
+            with mock.patch('swift.container.backend.DELIMITER_SKIP_ROWS',
+                            skip_rows):
+                listing = broker.list_objects_iter(100, None, None, None,
+                                                   None, 'p')
+                self.assertEquals([row[0] for row in listing],
+                                  ['p/a0', 'p/b'])
+                listing = broker.list_objects_iter(100, None, None, None,
+                                                   None, '')
+                self.assertEquals([row[0] for row in listing], ['0'])
+
+    def test_list_objects_iter_prefix_end(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        highest = u'\U0010ffff'.encode('utf-8')
+        for name in ('a', 'a' + highest, 'a' + highest + 'b', 'a0', 'ab',
+                     'b', highest):
+            broker.put_object(name, normalize_timestamp(0), 0, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        listing = broker.list_objects_iter(100, None, None, 'a', None)
+        self.assertEquals([row[0] for row in listing],
+                          ['a', 'a0', 'ab', 'a' + highest,
+                           'a' + highest + 'b'])
+        listing = broker.list_objects_iter(100, None, None, highest, None)
+        self.assertEquals([row[0] for row in listing], [highest])
+        listing = broker.list_objects_iter(100, None, 'ab', 'a', None)
+        self.assertEquals([row[0] for row in listing], ['a', 'a0'])
+        listing = broker.list_objects_iter(100, 'a0', None, 'a', '0')
+        self.assertEquals([row[0] for row in listing],
+                          ['ab', 'a' + highest, 'a' + highest + 'b'])
+
+    def test_covering_index(self):
+        with mock.patch('swift.container.backend.COVERING_INDEX', True):
+            broker = ContainerBroker(':memory:', account='a', container='c')
+            broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            self.assertEquals(broker.get_db_version(conn), 1)
+            sql = conn.execute('''
+                SELECT sql FROM sqlite_master
+                WHERE name = 'ix_object_deleted_name'
+            ''').fetchone()[0]
+        self.assert_('created_at, size, content_type, etag' in sql)
+        self.test_list_objects_iter()
+
     def test_double_check_trailing_delimiter(self):
         # Test ContainerBroker.list_objects_iter for a
         # container that has an odd file with a trailing delimiter
@@ -986,6 +1153,82 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals(['a', 'b', 'c'],
                           sorted([rec['name'] for rec in items]))
 
+    def test_merge_items_same_name(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_object('a', normalize_timestamp(3), 3,
+                          'text/plain', 'd41d8cd98f00b204e9800998ecf8427e')
+
+        def record(name, timestamp, size, deleted=0):
+            return {'name': name, 'created_at': normalize_timestamp(timestamp),
+                    'size': size, 'content_type': 'text/plain',
+                    'etag': 'd41d8cd98f00b204e9800998ecf8427e',
+                    'deleted': deleted}
+
+        broker.merge_items([
+            record('a', 2, 2), record('a', 4, 4), record('a', 3, 5),
+            record('b', 1, 1), record('b', 1, 10),
+            record('c', 1, 1), record('c', 2, 0, deleted=1)])
+        items = broker.get_items_since(-1, 1000)
+        self.assertEquals([(rec['name'], rec['created_at'], rec['size'])
+                           for rec in items],
+                          [('a', normalize_timestamp(4), 4),
+                           ('b', normalize_timestamp(1), 1),
+                           ('c', normalize_timestamp(2), 0)])
+        info = broker.get_info()
+        self.assertEquals(info['object_count'], 2)
+        self.assertEquals(info['bytes_used'], 5)
+        # older records change nothing
+        broker.merge_items([record('a', 3, 3), record('c', 1, 1)])
+        self.assertEquals(broker.get_items_since(-1, 1000), items)
+
+    def test_pending_file(self):
+        tempdir = mkdtemp()
+        try:
+            broker = ContainerBroker(os.path.join(tempdir, 'c.db'),
+                                     account='a', container='c')
+            broker.initialize(normalize_timestamp('1'))
+            broker.logger = FakeLogger()
+            # an entry in the old base64 format is still loaded
+            with open(broker.pending_file, 'a+b') as fp:
+                fp.write(':' + pickle.dumps(
+                    ('old', normalize_timestamp(2), 1, 'text/plain',
+                     'etag', 0), protocol=2).encode('base64'))
+            broker.put_object(u'new\u2603:', normalize_timestamp(3), 2,
+                              'text/plain', 'etag')
+            # ... and so is a base64 entry written after binary ones
+            with open(broker.pending_file, 'a+b') as fp:
+                fp.write(':' + pickle.dumps(
+                    ('older', normalize_timestamp(2), 3, 'text/plain',
+                     'etag', 0), protocol=2).encode('base64'))
+            broker.put_object('gone', normalize_timestamp(4), 0,
+                              'text/plain', 'etag', deleted=1)
+            with open(broker.pending_file, 'rb') as fp:
+                self.assert_(':new' not in fp.read())
+            items = broker.get_items_since(-1, 1000)
+            self.assertEquals(
+                [(rec['name'], rec['size'], rec['deleted'])
+                 for rec in items],
+                [('old', 1, 0), (u'new\u2603:'.encode('utf8'), 2, 0),
+                 ('older', 3, 0), ('gone', 0, 1)])
+            self.assertEquals(os.path.getsize(broker.pending_file), 0)
+            self.assertEquals(broker.logger.log_dict['exception'], [])
+
+            # a torn binary entry is logged and skipped
+            broker.put_object('torn', normalize_timestamp(5), 0,
+                              'text/plain', 'etag')
+            with open(broker.pending_file, 'r+b') as fp:
+                fp.truncate(os.path.getsize(broker.pending_file) - 1)
+            broker.put_object('whole', normalize_timestamp(5), 0,
+                              'text/plain', 'etag')
+            self.assertEquals(
+                [rec['name'] for rec in broker.get_items_since(-1, 1000)],
+                ['old', u'new\u2603:'.encode('utf8'), 'older', 'gone',
+                 'whole'])
+            self.assertEquals(len(broker.logger.log_dict['exception']), 1)
+        finally:
+            rmtree(tempdir)
+
     def test_merge_items_overwrite(self):
         # test DatabaseBroker.merge_items
         broker1 = ContainerBroker(':memory:', account='a', container='c')
@@ -1056,6 +1299,262 @@ class TestContainerBroker(unittest.TestCase):
                 self.assertEquals(rec['created_at'], normalize_timestamp(5))
                 self.assertEquals(rec['content_type'], 'text/plain')
 
+    def _shard_ranges(self, timestamp, *bounds):
+        return [{'name': '.shards_a/c-%d' % i, 'lower': lower,
+                 'upper': upper, 'created_at': normalize_timestamp(timestamp),
+                 'object_count': 0, 'bytes_used': 0, 'deleted': 0,
+                 'usage_at': '0'}
+                for i, (lower, upper) in enumerate(bounds)]
+
+    def test_shard_ranges(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(broker.get_shard_ranges(), [])
+        shard_ranges = self._shard_ranges(2, ('', 'f'), ('f', ''))
+        broker.merge_shard_ranges(list(reversed(shard_ranges)))
+        self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+
+        # only newer shard ranges replace the ones there
+        older = self._shard_ranges(1, ('', 'g'))
+        newer = self._shard_ranges(3, ('', 'e'), ('e', ''))
+        newer[1]['deleted'] = 1
+        broker.merge_shard_ranges(older)
+        self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+        broker.merge_shard_ranges(newer)
+        self.assertEquals(broker.get_shard_ranges(), [newer[0]])
+        self.assertEquals(broker.get_shard_ranges(include_deleted=True),
+                          newer)
+
+    def test_shard_ranges_usage(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_object('o', normalize_timestamp(1), 10, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        broker.merge_shard_ranges(self._shard_ranges(2, ('', 'f'), ('f', '')))
+        info = broker.get_info()
+        self.assertEquals(info['object_count'], 1)
+        self.assertEquals(info['bytes_used'], 10)
+        broker.set_shard_range_usage('.shards_a/c-0', 3, 30)
+        broker.set_shard_range_usage('.shards_a/c-1', 4, 40)
+        info = broker.get_info()
+        self.assertEquals(info['object_count'], 8)
+        self.assertEquals(info['bytes_used'], 80)
+        broker.delete_object('o', normalize_timestamp(2))
+        self.assertFalse(broker.empty())
+        broker.set_shard_range_usage('.shards_a/c-0', 0, 0)
+        broker.set_shard_range_usage('.shards_a/c-1', 0, 0)
+        self.assert_(broker.empty())
+
+    def test_shard_ranges_usage_replicated(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        broker.merge_shard_ranges(self._shard_ranges(2, ('', '')))
+        broker.set_shard_range_usage('.shards_a/c-0', 3, 30,
+                                     normalize_timestamp(5))
+        # as sent by a replica with older usage, and one with newer
+        other = self._shard_ranges(2, ('', ''))
+        other[0].update(object_count=1, bytes_used=10,
+                        usage_at=normalize_timestamp(4))
+        broker.merge_shard_ranges(other)
+        self.assertEquals(broker.get_info()['object_count'], 3)
+        other[0].update(object_count=4, bytes_used=40,
+                        usage_at=normalize_timestamp(6))
+        broker.merge_shard_ranges(other)
+        self.assertEquals(broker.get_shard_ranges(), other)
+        self.assertEquals(broker.get_info()['bytes_used'], 40)
+
+    def test_shard_ranges_without_usage_at(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        shard_ranges = self._shard_ranges(2, ('', ''))
+        with broker.get() as conn:
+            conn.execute('DROP TABLE shard_range')
+            conn.execute('''
+                CREATE TABLE shard_range (
+                    name TEXT PRIMARY KEY, lower TEXT, upper TEXT,
+                    created_at TEXT, object_count INTEGER DEFAULT 0,
+                    bytes_used INTEGER DEFAULT 0, deleted INTEGER DEFAULT 0)
+            ''')
+            conn.execute('''
+                INSERT INTO shard_range (name, lower, upper, created_at)
+                VALUES (?, '', '', ?)
+            ''', (shard_ranges[0]['name'], shard_ranges[0]['created_at']))
+            conn.commit()
+        self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+        broker.set_shard_range_usage('.shards_a/c-0', 3, 30,
+                                     normalize_timestamp(5))
+        shard_ranges[0].update(object_count=3, bytes_used=30,
+                               usage_at=normalize_timestamp(5))
+        self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+
+    def test_shard_ranges_old_db(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        with broker.get() as conn:
+            conn.execute('DROP TABLE shard_range')
+            conn.commit()
+        self.assertEquals(broker.get_shard_ranges(), [])
+        self.assertEquals(broker.get_info()['object_count'], 0)
+        self.assert_(broker.empty())
+        shard_ranges = self._shard_ranges(2, ('', ''))
+        broker.merge_shard_ranges(shard_ranges)
+        self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+
+    def test_find_shard_points(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(broker.find_shard_points(2), [])
+        for i in xrange(7):
+            broker.put_object('o%d' % i, normalize_timestamp(1), 0,
+                              'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        broker.delete_object('o3', normalize_timestamp(2))
+        self.assertEquals(broker.find_shard_points(2), ['o1', 'o4'])
+        self.assertEquals(broker.find_shard_points(3), ['o2'])
+        self.assertEquals(broker.find_shard_points(5), ['o5'])
+        self.assertEquals(broker.find_shard_points(6), [])
+
+    def test_get_and_remove_shard_items(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            broker.put_object(name, normalize_timestamp(1), 0, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        broker.delete_object('c', normalize_timestamp(2))
+        max_row = broker.get_replication_info()['max_row']
+        broker.put_object('b2', normalize_timestamp(3), 0, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+
+        def names(batches):
+            return [[item['name'] for item in items] for items in batches]
+
+        self.assertEquals(names(broker.get_shard_items('a', 'd', max_row)),
+                          [['b', 'd'], ['c']])
+        self.assertEquals(names(broker.get_shard_items('a', 'd', max_row, 1)),
+                          [['b'], ['d'], ['c']])
+        self.assertEquals(names(broker.get_shard_items('', '', max_row, 2)),
+                          [['a', 'b'], ['d', 'e'], ['c']])
+        self.assertEquals(names(broker.get_shard_items('e', '', max_row)),
+                          [])
+        item = list(broker.get_shard_items('b', 'c', max_row))[0][0]
+        self.assertEquals(item['deleted'], 1)
+        self.assertEquals(item['created_at'], normalize_timestamp(2))
+
+        broker.remove_shard_items('a', 'd', max_row)
+        self.assertEquals(
+            [item['name'] for item in broker.get_items_since(-1, 10)],
+            ['a', 'e', 'b2'])
+        info = broker.get_info()
+        self.assertEquals(info['object_count'], 3)
+
+
+def prebatchstats_create_object_table(self, conn):
+    """
+    Copied from ContainerBroker before container_stat was updated in batch
+    instead of by triggers on each row change; used for testing with
+    TestContainerBrokerBeforeBatchStats.
+
+    Create the object table which is specifc to the container DB.
+
+    :param conn: DB connection object
+    """
+    index_columns = 'deleted, name'
+    if swift.container.backend.COVERING_INDEX:
+        index_columns += ', created_at, size, content_type, etag'
+    conn.executescript("""
+        CREATE TABLE object (
+            ROWID INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            created_at TEXT,
+            size INTEGER,
+            content_type TEXT,
+            etag TEXT,
+            deleted INTEGER DEFAULT 0
+        );
+
+        CREATE INDEX ix_object_deleted_name ON object (%s);
+
+        CREATE TRIGGER object_insert AFTER INSERT ON object
+        BEGIN
+            UPDATE container_stat
+            SET object_count = object_count + (1 - new.deleted),
+                bytes_used = bytes_used + new.size,
+                hash = chexor(hash, new.name, new.created_at);
+        END;
+
+        CREATE TRIGGER object_update BEFORE UPDATE ON object
+        BEGIN
+            SELECT RAISE(FAIL, 'UPDATE not allowed; DELETE and INSERT');
+        END;
+
+        CREATE TRIGGER object_delete AFTER DELETE ON object
+        BEGIN
+            UPDATE container_stat
+            SET object_count = object_count - (1 - old.deleted),
+                bytes_used = bytes_used - old.size,
+                hash = chexor(hash, old.name, old.created_at);
+        END;
+    """ % index_columns)
+
+
+class TestContainerBrokerBatchStats(TestContainerBroker):
+    """
+    Tests for ContainerBroker updating container_stat in batch instead of
+    by triggers.
+    """
+
+    def setUp(self):
+        self._orig_batch_stats = swift.container.backend.BATCH_STATS
+        swift.container.backend.BATCH_STATS = True
+
+    def tearDown(self):
+        swift.container.backend.BATCH_STATS = self._orig_batch_stats
+
+    def test_object_triggers(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(self._object_triggers(broker), ['object_update'])
+
+
+class TestContainerBrokerBeforeBatchStats(TestContainerBrokerBatchStats):
+    """
+    Tests for ContainerBroker updating container_stat in batch against
+    databases created before it could, with triggers.
+    """
+
+    def setUp(self):
+        super(TestContainerBrokerBeforeBatchStats, self).setUp()
+        self._imported_create_object_table = \
+            ContainerBroker.create_object_table
+        ContainerBroker.create_object_table = \
+            prebatchstats_create_object_table
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(self._object_triggers(broker),
+                          ['object_delete', 'object_insert', 'object_update'])
+
+    def tearDown(self):
+        ContainerBroker.create_object_table = \
+            self._imported_create_object_table
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        self.assertEquals(self._object_triggers(broker), ['object_update'])
+        super(TestContainerBrokerBeforeBatchStats, self).tearDown()
+
+    def test_object_triggers(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_object('a', normalize_timestamp(1), 1, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['bytes_used'], 1)
+        # the triggers are dropped by the first update, in its transaction
+        self.assertEquals(self._object_triggers(broker), ['object_update'])
+        broker.put_object('b', normalize_timestamp(1), 2, 'text/plain',
+                          'd41d8cd98f00b204e9800998ecf8427e')
+        self._assert_object_stats(broker)
+        self.assertEquals(broker.get_info()['bytes_used'], 3)
+
 
 def premetadata_create_container_stat_table(self, conn, put_timestamp=None):
     """
@@ -13,9 +13,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import mock
+
 from swift.container import replicator
-from swift.common.utils import normalize_timestamp
+from swift.container.backend import ContainerBroker, DATADIR
+from swift.common.utils import normalize_timestamp, hash_path, mkdirs, \
+    storage_directory
+from test.unit import FakeLogger
+
+
+# test_db_replicator reloads db_replicator, so patch the class this one
+# was actually built on
+BaseReplicator = replicator.ContainerReplicator.__bases__[0]
+
+
+class FakeRing(object):
+    devs = [{'id': i, 'device': 'sda%d' % i, 'ip': '127.0.0.%d' % i,
+             'port': 6001, 'replication_ip': '127.0.0.%d' % i,
+             'replication_port': 6001} for i in xrange(3)]
+
+    def get_part(self, account, container=None):
+        return 0
+
+    def get_part_nodes(self, part):
+        return self.devs
+
+    def get_nodes(self, account, container=None):
+        return 0, self.devs
 
 
 class TestReplicator(unittest.TestCase):
@@ -55,6 +84,160 @@ class TestReplicator(unittest.TestCase):
         info['reported_put_timestamp'] = normalize_timestamp(3)
         self.assertTrue(repl.report_up_to_date(info))
 
+    def _make_container(self, testdir, objects):
+        hsh = hash_path('a', 'c')
+        db_dir = os.path.join(testdir, 'sda0',
+                              storage_directory(DATADIR, 0, hsh))
+        mkdirs(db_dir)
+        broker = ContainerBroker(os.path.join(db_dir, hsh + '.db'),
+                                 account='a', container='c')
+        broker.initialize(normalize_timestamp(1))
+        for name in objects:
+            broker.put_object(name, normalize_timestamp(1), 1, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+        return broker
+
+    def test_process_shards(self):
+        testdir = mkdtemp()
+        try:
+            repl = replicator.ContainerReplicator(
+                {'devices': testdir, 'shard_container_threshold': '4'})
+            repl.ring = FakeRing()
+            repl.logger = FakeLogger()
+            broker = self._make_container(
+                testdir, ['o%d' % i for i in xrange(6)])
+            broker.delete_object('o2', normalize_timestamp(2))
+            broker.put_object('o6', normalize_timestamp(1), 1, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+
+            heads = []
+
+            def fake_head(node, part, account, container, **kwargs):
+                heads.append(container)
+                return {'x-container-object-count': '2',
+                        'x-container-bytes-used': '2'}
+
+            replicated = []
+            with mock.patch.object(replicator, 'direct_head_container',
+                                   fake_head):
+                with mock.patch.object(
+                        BaseReplicator, '_replicate_object',
+                        lambda self, *args: replicated.append(args)):
+                    # only the first primary picks the shard ranges
+                    repl._process_shards('0', broker.db_file, 1)
+                    self.assertEquals(broker.get_shard_ranges(), [])
+                    repl._process_shards('0', broker.db_file, 0)
+
+            shard_ranges = broker.get_shard_ranges()
+            self.assertEquals(len(heads), 3)
+            self.assertEquals(
+                [(r['lower'], r['upper']) for r in shard_ranges],
+                [('', 'o1'), ('o1', 'o4'), ('o4', '')])
+            for shard_range in shard_ranges:
+                self.assert_(shard_range['name'].startswith('.shards_a/c-'))
+                self.assertEquals(shard_range['object_count'], 2)
+            self.assertEquals(broker.get_items_since(-1, 10), [])
+            info = broker.get_info()
+            self.assertEquals(info['object_count'], 6)
+            self.assertEquals(info['bytes_used'], 6)
+
+            # the rows, deleted ones too, went to the shard DBs on the same
+            # device, which were then replicated
+            self.assertEquals(len(replicated), 3)
+            names = []
+            for shard_range, (part, db_file, node_id) in zip(shard_ranges,
+                                                             replicated):
+                self.assertEquals((part, node_id), (0, 0))
+                account, container = shard_range['name'].split('/')
+                self.assert_(db_file.startswith(
+                    os.path.join(testdir, 'sda0', DATADIR)))
+                shard_broker = ContainerBroker(db_file)
+                info = shard_broker.get_info()
+                self.assertEquals((info['account'], info['container']),
+                                  (account, container))
+                self.assertEquals(info['put_timestamp'],
+                                  shard_range['created_at'])
+                names.append(
+                    [(item['name'], item['deleted'])
+                     for item in shard_broker.get_items_since(-1, 10)])
+            self.assertEquals(names, [
+                [('o0', 0), ('o1', 0)], [('o3', 0), ('o4', 0), ('o2', 1)],
+                [('o5', 0), ('o6', 0)]])
+
+            # rows that reach the sharded DB later are moved too
+            broker.put_object('o7', normalize_timestamp(3), 1, 'text/plain',
+                              'd41d8cd98f00b204e9800998ecf8427e')
+            with mock.patch.object(replicator, 'direct_head_container',
+                                   fake_head):
+                with mock.patch.object(
+                        BaseReplicator, '_replicate_object',
+                        lambda self, *args: replicated.append(args)):
+                    repl._process_shards('0', broker.db_file, 1)
+            # only the first primary asks the shards for their usage
+            self.assertEquals(len(heads), 3)
+            self.assertEquals(broker.get_shard_ranges(), shard_ranges)
+            self.assertEquals(broker.get_items_since(-1, 10), [])
+            self.assertEquals(len(replicated), 4)
+            self.assertEquals(
+                [item['name'] for item in ContainerBroker(
+                    replicated[-1][1]).get_items_since(-1, 10)],
+                ['o5', 'o6', 'o7'])
+        finally:
+            rmtree(testdir)
+
+    def test_process_shards_below_threshold(self):
+        testdir = mkdtemp()
+        try:
+            for threshold in ('0', '4'):
+                repl = replicator.ContainerReplicator(
+                    {'devices': testdir,
+                     'shard_container_threshold': threshold})
+                repl.ring = FakeRing()
+                broker = self._make_container(
+                    testdir, ['o%d' % i for i in xrange(4)])
+                repl._process_shards('0', broker.db_file, 0)
+                self.assertEquals(broker.get_shard_ranges(), [])
+                self.assertEquals(len(broker.get_items_since(-1, 10)), 4)
+                rmtree(os.path.join(testdir, 'sda0'))
+        finally:
+            rmtree(testdir)
+
+    def test_repl_to_node_shard_ranges(self):
+        repl = replicator.ContainerReplicator({})
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp(1))
+        node = FakeRing.devs[1]
+        calls = []
+
+        class FakeResponse(object):
+            status = 202
+
+        class FakeConnection(object):
+            def replicate(self, *args):
+                calls.append(args)
+                return FakeResponse()
+
+        with mock.patch.object(BaseReplicator, '_repl_to_node',
+                               return_value=True):
+            with mock.patch.object(repl, '_http_connect',
+                                   return_value=FakeConnection()):
+                self.assert_(repl._repl_to_node(node, broker, 0, {}))
+                self.assertEquals(calls, [])
+                shard_ranges = [{
+                    'name': '.shards_a/c-0', 'lower': '', 'upper': '',
+                    'created_at': normalize_timestamp(2), 'object_count': 0,
+                    'bytes_used': 0, 'deleted': 0, 'usage_at': '0'}]
+                broker.merge_shard_ranges(shard_ranges)
+                self.assert_(repl._repl_to_node(node, broker, 0, {}))
+                self.assertEquals(calls,
+                                  [('merge_shard_ranges', shard_ranges)])
+                FakeResponse.status = 500
+                self.assertFalse(repl._repl_to_node(node, broker, 0, {}))
+        with mock.patch.object(BaseReplicator, '_repl_to_node',
+                               return_value=False):
+            self.assertFalse(repl._repl_to_node(node, broker, 0, {}))
+            self.assertEquals(len(calls), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
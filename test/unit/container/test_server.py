@@ -17,6 +17,7 @@ import operator
 import os
 import mock
 import unittest
+import zlib
 from contextlib import contextmanager
 from shutil import rmtree
 from StringIO import StringIO
@@ -29,7 +30,8 @@ import simplejson
 from swift.common.swob import Request, HeaderKeyDict
 import swift.container
 from swift.container import server as container_server
-from swift.common.utils import normalize_timestamp, mkdirs, public, replication
+from swift.common.utils import normalize_timestamp, mkdirs, public, \
+    replication, hash_path
 from test.unit import fake_http_connect
 
 
@@ -1293,6 +1295,105 @@ class TestContainerController(unittest.TestCase):
         self.assertEquals(unicode(name.childNodes[0].data),
                           u'<\'sub\' "dir">/')
 
+    def test_GET_streamed(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for i in ('US-TX-A', 'US-TX-B', 'US-OK-A', 'US-OK-B', 'US-UT-A',
+                  'US/<&>', 'US/"x"'):
+            req = Request.blank(
+                '/sda1/p/a/c/%s' % i,
+                environ={
+                    'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain', 'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': 0})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.status_int, 201)
+        for query in ('', 'format=json', 'format=xml', 'limit=3',
+                      'format=json&prefix=US-&delimiter=-',
+                      'format=xml&prefix=US-&delimiter=-',
+                      'format=xml&delimiter=/', 'path=US',
+                      'format=json&marker=US-TX-A', 'prefix=nothing',
+                      'format=json&prefix=nothing',
+                      'format=xml&prefix=nothing'):
+            req = Request.blank('/sda1/p/a/c?' + query,
+                                environ={'REQUEST_METHOD': 'GET'})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.content_length, len(resp.body))
+            with mock.patch('swift.common.db.LISTING_BATCH_SIZE', 2):
+                req = Request.blank('/sda1/p/a/c?' + query,
+                                    environ={'REQUEST_METHOD': 'GET'})
+                streamed = req.get_response(self.controller)
+            self.assertEquals(streamed.status_int, resp.status_int)
+            self.assertEquals(streamed.body, resp.body)
+            if query in ('', 'format=json', 'format=xml'):
+                # more than one batch, so no Content-Length
+                self.assertEquals(streamed.content_length, None)
+            if 'nothing' in query:
+                self.assertEquals(streamed.content_length,
+                                  len(streamed.body))
+
+    def test_GET_sharded(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for name in ('a', 'b'):
+            req = Request.blank(
+                '/sda1/p/a/c/%s' % name,
+                environ={
+                    'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain', 'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': 1})
+            resp = req.get_response(self.controller)
+            self.assertEquals(resp.status_int, 201)
+        req = Request.blank('/sda1/p/a/c?format=json',
+                            headers={'X-Backend-Record-Type': 'shard'})
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.headers['X-Backend-Record-Type'], 'shard')
+        self.assertEquals(simplejson.loads(resp.body), [])
+        req = Request.blank('/sda1/p/a/c',
+                            headers={'X-Backend-Record-Type': 'auto'})
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.body, 'a\nb\n')
+        self.assert_('X-Backend-Record-Type' not in resp.headers)
+        self.assert_('X-Backend-Sharded' not in resp.headers)
+
+        shard_ranges = [
+            {'name': '.shards_a/c-0', 'lower': '', 'upper': 'm',
+             'created_at': normalize_timestamp(2), 'object_count': 5,
+             'bytes_used': 50, 'deleted': 0,
+             'usage_at': normalize_timestamp(3)},
+            {'name': '.shards_a/c-1', 'lower': 'm', 'upper': '',
+             'created_at': normalize_timestamp(2), 'object_count': 0,
+             'bytes_used': 0, 'deleted': 0, 'usage_at': '0'}]
+        req = Request.blank(
+            '/sda1/p/%s' % hash_path('a', 'c'),
+            environ={'REQUEST_METHOD': 'REPLICATE'},
+            body=simplejson.dumps(['merge_shard_ranges', shard_ranges]))
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 202)
+
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.headers['X-Backend-Sharded'], 'true')
+        self.assertEquals(resp.headers['X-Container-Object-Count'], '7')
+        self.assertEquals(resp.headers['X-Container-Bytes-Used'], '52')
+        req = Request.blank('/sda1/p/a/c',
+                            headers={'X-Backend-Record-Type': 'auto'})
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.headers['X-Backend-Record-Type'], 'shard')
+        self.assertEquals(resp.headers['X-Backend-Sharded'], 'true')
+        self.assertEquals(resp.content_type, 'application/json')
+        self.assertEquals(simplejson.loads(resp.body), shard_ranges)
+        # without asking for them, the rows left in the DB are listed
+        req = Request.blank('/sda1/p/a/c')
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.body, 'a\nb\n')
+        self.assert_('X-Backend-Record-Type' not in resp.headers)
+
     def test_GET_path(self):
         req = Request.blank(
             '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
@@ -1656,6 +1757,43 @@ class TestContainerController(unittest.TestCase):
             conf['replication_server'] = val
             self.assertFalse(container_controller(conf).replication_server)
 
+    def test_REPLICATE_compressed(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '1'})
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 201)
+        path = '/sda1/p/%s' % hash_path('a', 'c')
+        req = Request.blank(
+            path, environ={'REQUEST_METHOD': 'REPLICATE'},
+            body=simplejson.dumps(['sync', -1, 'hash', 'id', '1', '1', '0',
+                                   '']))
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(simplejson.loads(resp.body)['accept_encoding'],
+                          'deflate')
+
+        items = [{'name': 'o', 'created_at': normalize_timestamp(2),
+                  'size': 1, 'content_type': 'text/plain', 'etag': 'x',
+                  'deleted': 0, 'ROWID': 1}]
+        req = Request.blank(
+            path, environ={'REQUEST_METHOD': 'REPLICATE'},
+            headers={'Content-Encoding': 'deflate'},
+            body=zlib.compress(simplejson.dumps(
+                ['merge_items', items, 'id'])))
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 202)
+        req = Request.blank('/sda1/p/a/c')
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.body, 'o\n')
+
+        req = Request.blank(
+            path, environ={'REQUEST_METHOD': 'REPLICATE'},
+            headers={'Content-Encoding': 'deflate'},
+            body=simplejson.dumps(['merge_items', items, 'id']))
+        resp = req.get_response(self.controller)
+        self.assertEquals(resp.status_int, 400)
+
     def test_list_allowed_methods(self):
         # Test list of allowed_methods
         obj_methods = ['DELETE', 'PUT', 'HEAD', 'GET', 'POST']
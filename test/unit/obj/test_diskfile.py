@@ -19,6 +19,8 @@
 import cPickle as pickle
 import os
 import errno
+import socket
+import struct
 import mock
 import unittest
 import email
@@ -40,7 +42,7 @@ from swift.common.utils import hash_path, mkdirs, normalize_timestamp
 from swift.common import ring
 from swift.common.exceptions import DiskFileNotExist, DiskFileQuarantined, \
     DiskFileDeviceUnavailable, DiskFileDeleted, DiskFileNotOpen, \
-    DiskFileError, ReplicationLockTimeout
+    DiskFileError, ReplicationLockTimeout, ChunkWriteTimeout
 
 
 def _create_test_ring(path):
@@ -186,30 +188,186 @@ class TestDiskFileModuleMethods(unittest.TestCase):
         self.assertEquals(len(os.listdir(whole_hsh_path)), 2)
 
     def test_invalidate_hash(self):
-
-        def assertFileData(file_path, data):
-            with open(file_path, 'r') as fp:
-                fdata = fp.read()
-                self.assertEquals(pickle.loads(fdata), pickle.loads(data))
-
         df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
         mkdirs(df._datadir)
         ohash = hash_path('a', 'c', 'o')
         data_dir = ohash[-3:]
         whole_path_from = os.path.join(self.objects, '0', data_dir)
-        hashes_file = os.path.join(self.objects, '0',
-                                   diskfile.HASH_FILE)
-        # test that non existent file except caught
+        part = os.path.join(self.objects, '0')
+        invalidations_file = os.path.join(part,
+                                          diskfile.HASH_INVALIDATIONS_FILE)
+        # test that a missing hashes file is no problem
         self.assertEquals(diskfile.invalidate_hash(whole_path_from),
                           None)
-        # test that hashes get cleared
-        check_pickle_data = pickle.dumps({data_dir: None},
-                                         diskfile.PICKLE_PROTOCOL)
-        for data_hash in [{data_dir: None}, {data_dir: 'abcdefg'}]:
-            with open(hashes_file, 'wb') as fp:
-                pickle.dump(data_hash, fp, diskfile.PICKLE_PROTOCOL)
+        with open(invalidations_file, 'rb') as fp:
+            self.assertEquals(fp.read(), data_dir + '\n')
+        # test that hashes get cleared when consolidated
+        for data_hash in [{data_dir: None},
+                          {data_dir: md5('x').hexdigest()}]:
+            with utils.lock_path(part):
+                diskfile.write_hashes(part, data_hash)
             diskfile.invalidate_hash(whole_path_from)
-            assertFileData(hashes_file, check_pickle_data)
+            self.assertEquals(diskfile.consolidate_hashes(part),
+                              {data_dir: None})
+            self.assertEquals(diskfile.read_hashes(part), {data_dir: None})
+            self.assertEquals(os.path.getsize(invalidations_file), 0)
+
+    def test_encode_decode_hashes(self):
+        hashes = {'a83': md5('x').hexdigest(), 'fff': None, '000': None,
+                  '123': md5('y').hexdigest()}
+        data = diskfile.encode_hashes(hashes)
+        self.assertEquals(diskfile.decode_hashes(data), hashes)
+        self.assertEquals(len(data), 5 + 4 * 5 + 2 * 16)
+        self.assertEquals(diskfile.decode_hashes(
+            diskfile.encode_hashes({})), {})
+        self.assertRaises(ValueError, diskfile.decode_hashes, data[:-1])
+        self.assertRaises(ValueError, diskfile.decode_hashes, '')
+        self.assertRaises(ValueError, diskfile.decode_hashes,
+                          pickle.dumps(hashes))
+        self.assertRaises(ValueError, diskfile.decode_hashes,
+                          'SWHS\xff' + data[5:])
+
+    def test_read_legacy_hashes(self):
+        part = os.path.join(self.objects, '0')
+        with open(os.path.join(part, diskfile.LEGACY_HASH_FILE), 'wb') as fp:
+            pickle.dump({'a83': 'abcdef', 'fff': None}, fp,
+                        diskfile.PICKLE_PROTOCOL)
+        self.assertEquals(diskfile.read_hashes(part),
+                          {'a83': 'abcdef', 'fff': None})
+        diskfile.invalidate_hash(os.path.join(part, 'a83'))
+        self.assertEquals(diskfile.consolidate_hashes(part),
+                          {'a83': None, 'fff': None})
+        self.assertFalse(os.path.exists(
+            os.path.join(part, diskfile.LEGACY_HASH_FILE)))
+        self.assertEquals(diskfile.read_hashes(part),
+                          {'a83': None, 'fff': None})
+
+    def test_get_hashes_upgrades_legacy_hashes(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        with open(
+                os.path.join(df._datadir,
+                             normalize_timestamp(time()) + '.ts'),
+                'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, hashes = diskfile.get_hashes(part)
+        os.unlink(os.path.join(part, diskfile.HASH_FILE))
+        with open(os.path.join(part, diskfile.LEGACY_HASH_FILE), 'wb') as fp:
+            pickle.dump(hashes, fp, diskfile.PICKLE_PROTOCOL)
+        hashed, new_hashes = diskfile.get_hashes(part)
+        self.assertEquals(hashed, 0)
+        self.assertEquals(hashes, new_hashes)
+        self.assertEquals(diskfile.read_hashes(part), hashes)
+        self.assertFalse(os.path.exists(
+            os.path.join(part, diskfile.LEGACY_HASH_FILE)))
+
+    def test_encode_decode_async_update(self):
+        update = {'op': 'PUT', 'account': 'a', 'container': 'c',
+                  'obj': '\xe2\x98\x83', 'successes': [1, 2],
+                  'headers': {'x-timestamp': '1', 'x-size': '0'}}
+        data = diskfile.encode_async_update(update)
+        self.assert_(data.startswith(diskfile.ASYNC_UPDATE_MAGIC))
+        decoded = diskfile.decode_async_update(data)
+        self.assertEquals(decoded, update)
+        self.assert_(isinstance(decoded['obj'], str))
+        self.assert_(isinstance(decoded['headers'].keys()[0], str))
+        # pickles written by older versions are still understood
+        self.assertEquals(diskfile.decode_async_update(
+            pickle.dumps(update, diskfile.PICKLE_PROTOCOL)), update)
+        self.assertRaises(ValueError, diskfile.decode_async_update,
+                          diskfile.ASYNC_UPDATE_MAGIC + '\xff{}')
+        # non-UTF-8 values can only go in the older format
+        update['obj'] = '\xff'
+        self.assertEquals(diskfile.decode_async_update(
+            diskfile.encode_async_update(update)), update)
+
+    def test_encode_decode_metadata(self):
+        metadata = {'name': '/a/c/\xe2\x98\x83', 'Content-Length': '10',
+                    'X-Object-Meta-Test': 'x' * 1000, 'X-Object-Meta-E': ''}
+        metastr = diskfile.encode_metadata(metadata)
+        self.assert_(metastr.startswith(diskfile.METADATA_MAGIC))
+        self.assertEquals(diskfile.decode_metadata(metastr), metadata)
+        self.assertEquals(diskfile.decode_metadata(
+            diskfile.encode_metadata({})), {})
+        # whatever follows the encoded metadata is ignored
+        self.assertEquals(diskfile.decode_metadata(metastr + 'junk'),
+                          metadata)
+        self.assertRaises(ValueError, diskfile.decode_metadata,
+                          metastr[:-1])
+        self.assertRaises(ValueError, diskfile.decode_metadata,
+                          metastr[:4] + '\xff' + metastr[5:])
+        self.assertRaises(ValueError, diskfile.decode_metadata, struct.pack(
+            diskfile.METADATA_HEADER, diskfile.METADATA_MAGIC,
+            diskfile.METADATA_VERSION, 1) + 'a')
+        # pickles are still understood
+        self.assertEquals(diskfile.decode_metadata(
+            pickle.dumps(metadata, diskfile.PICKLE_PROTOCOL)), metadata)
+        # anything but strings without NULs can only go in the older format
+        for key, value in (('Content-Length', 10), ('name', u'/a/c/o'),
+                           ('name', '/a/c/\x00')):
+            metadata[key] = value
+            metastr = diskfile.encode_metadata(metadata)
+            self.assertFalse(metastr.startswith(diskfile.METADATA_MAGIC))
+            decoded = diskfile.decode_metadata(metastr)
+            self.assertEquals(decoded, metadata)
+            self.assertEquals(type(decoded[key]), type(value))
+
+    def test_write_read_metadata(self):
+        metadata = {'name': '/a/c/o', 'X-Object-Meta-Test': 'x' * 1000}
+        path = os.path.join(self.testdir, 'object')
+        with open(path, 'wb'):
+            pass
+
+        def pieces():
+            key = 0
+            try:
+                while True:
+                    xattr.getxattr(path, '%s%s' % (diskfile.METADATA_KEY,
+                                                   key or ''))
+                    key += 1
+            except IOError:
+                return key
+
+        diskfile.write_metadata(path, metadata)
+        self.assertEquals(diskfile.read_metadata(path), metadata)
+        self.assertEquals(pieces(), 5)
+
+        # compact metadata written over longer pickles reads back in one
+        # getxattr, whatever pieces of them are left
+        short = {'name': '/a/c/o'}
+        diskfile.write_metadata(path, short, compact=True)
+        self.assertEquals(pieces(), 5)
+        with mock.patch.object(diskfile, 'getxattr',
+                               side_effect=xattr.getxattr) as mock_getxattr:
+            self.assertEquals(diskfile.read_metadata(path), short)
+        self.assertEquals(mock_getxattr.call_count, 1)
+        with open(path, 'rb') as fp:
+            self.assertEquals(diskfile.read_metadata(fp), short)
+
+        # where the filesystem does not take large xattrs, it is split
+        def small_setxattr(fd, key, value):
+            if len(value) > 254:
+                raise IOError(errno.ENOSPC, 'No space left on device')
+            xattr.setxattr(fd, key, value)
+
+        with mock.patch.object(diskfile, 'setxattr', small_setxattr):
+            diskfile.write_metadata(path, metadata, compact=True)
+        self.assertEquals(diskfile.read_metadata(path), metadata)
+        self.assert_(xattr.getxattr(path, diskfile.METADATA_KEY).startswith(
+            diskfile.METADATA_MAGIC))
+
+        with mock.patch.object(diskfile, 'setxattr',
+                               side_effect=IOError(errno.EIO, 'oops')):
+            self.assertRaises(IOError, diskfile.write_metadata, path,
+                              metadata, compact=True)
+
+    def test_write_read_async_update(self):
+        update = {'op': 'PUT', 'account': 'a', 'container': 'c',
+                  'obj': 'o', 'headers': {'x-timestamp': '1'}}
+        path = os.path.join(self.testdir, 'update')
+        diskfile.write_async_update(update, path)
+        self.assertEquals(diskfile.read_async_update(path), update)
 
     def test_get_hashes(self):
         df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
@@ -303,6 +461,155 @@ class TestDiskFileModuleMethods(unittest.TestCase):
                 part, recalculate=['a83'])
         self.assertEquals(i[0], 3)
 
+    def test_get_hashes_builds_index(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        ts = normalize_timestamp(time())
+        with open(os.path.join(df._datadir, ts + '.ts'), 'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, hashes = diskfile.get_hashes(part, use_index=True)
+        self.assertEquals(hashed, 1)
+        index, offset = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {df._datadir[-32:]: [ts + '.ts']}})
+        self.assertEquals(
+            offset,
+            os.path.getsize(os.path.join(part, diskfile.HASH_INDEX_FILE)))
+        _junk, disk_hashes = diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertEquals(hashes, disk_hashes)
+
+    def test_get_hashes_builds_index_during_put(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        part = os.path.join(self.objects, '0')
+        mkdirs(part)
+        orig_hash_suffix = diskfile.hash_suffix
+        put_ts = normalize_timestamp(time())
+
+        def hash_suffix(*args, **kwargs):
+            # a PUT lands after the walk has listed the suffix
+            result = orig_hash_suffix(*args, **kwargs)
+            with df.create() as writer:
+                writer.write('1234567890')
+                writer.put({'X-Timestamp': put_ts,
+                            'ETag': md5('1234567890').hexdigest(),
+                            'Content-Length': '10'})
+            return result
+
+        mkdirs(os.path.join(part, 'a83'))
+        with mock.patch('swift.obj.diskfile.hash_suffix', hash_suffix):
+            diskfile.get_hashes(part, use_index=True)
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {df._datadir[-32:]:
+                                          [put_ts + '.data']}})
+        hashed, hashes = diskfile.get_hashes(part, use_index=True)
+        self.assertEquals(hashed, 1)
+        _junk, disk_hashes = diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertEquals(hashes, disk_hashes)
+
+    def test_get_hashes_rebuilds_unfinished_index(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        ts = normalize_timestamp(time())
+        with open(os.path.join(df._datadir, ts + '.ts'), 'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        with open(os.path.join(part, diskfile.HASH_INDEX_FILE), 'wb') as f:
+            f.write(diskfile.HASH_INDEX_REBUILDING)
+        self.assertEquals(diskfile.read_hash_index(part), (None, 0))
+        hashed, hashes = diskfile.get_hashes(part, use_index=True)
+        self.assertEquals(hashed, 1)
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {df._datadir[-32:]: [ts + '.ts']}})
+
+    def test_get_hashes_from_index(self):
+        part = os.path.join(self.objects, '0')
+        diskfile.get_hashes(part, use_index=True)
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        with df.create() as writer:
+            writer.write('1234567890')
+            writer.put({'X-Timestamp': normalize_timestamp(time()),
+                        'ETag': md5('1234567890').hexdigest(),
+                        'Content-Length': '10'})
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index['a83'][df._datadir[-32:]],
+                          os.listdir(df._datadir))
+        with mock.patch('swift.obj.diskfile.hash_suffix') as hash_suffix:
+            hashed, hashes = diskfile.get_hashes(part, use_index=True)
+        self.assertFalse(hash_suffix.called)
+        self.assertEquals(hashed, 1)
+        _junk, disk_hashes = diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertEquals(hashes, disk_hashes)
+
+        df.delete(normalize_timestamp(time() + 1))
+        hashed, hashes = diskfile.get_hashes(part, use_index=True)
+        self.assertEquals(hashed, 1)
+        _junk, disk_hashes = diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertEquals(hashes, disk_hashes)
+
+    def test_get_hashes_from_index_reclaims_tombstones(self):
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        with open(os.path.join(df._datadir, normalize_timestamp(
+                time() - 1000) + '.ts'), 'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        diskfile.get_hashes(part, use_index=True)
+        diskfile.invalidate_hash(os.path.dirname(df._datadir))
+        hashed, hashes = diskfile.get_hashes(part, reclaim_age=100,
+                                             use_index=True)
+        self.assertEquals(hashed, 1)
+        self.assertEquals(hashes, {'a83': md5().hexdigest()})
+        self.assertFalse(os.path.exists(os.path.dirname(df._datadir)))
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {})
+
+    def test_get_hashes_check_index(self):
+        part = os.path.join(self.objects, '0')
+        diskfile.get_hashes(part, use_index=True)
+        # files placed without going through the DiskFileWriter
+        df = self.df_mgr.get_diskfile('sda', '0', 'a', 'c', 'o')
+        mkdirs(df._datadir)
+        ts = normalize_timestamp(time())
+        with open(os.path.join(df._datadir, ts + '.ts'), 'wb') as f:
+            f.write('1234567890')
+        with mock.patch('swift.obj.diskfile.logging') as logging:
+            hashed, hashes = diskfile.get_hashes(part, use_index=True,
+                                                 check_index=True)
+        self.assertEquals(logging.error.call_count, 1)
+        self.assertEquals(hashed, 1)
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {df._datadir[-32:]: [ts + '.ts']}})
+
+    def test_get_hashes_removes_index_when_unused(self):
+        part = os.path.join(self.objects, '0')
+        diskfile.get_hashes(part, use_index=True)
+        index_file = os.path.join(part, diskfile.HASH_INDEX_FILE)
+        self.assertTrue(os.path.exists(index_file))
+        diskfile.get_hashes(part, recalculate=['a83'])
+        self.assertFalse(os.path.exists(index_file))
+
+    def test_update_hash_index(self):
+        part = os.path.join(self.objects, '0')
+        hsh_path = os.path.join(part, 'a83', 'f' * 29 + 'a83')
+        # no index, nothing to update, nor to lock the partition for
+        with mock.patch('swift.obj.diskfile.lock_path') as lock_path:
+            diskfile.update_hash_index(hsh_path, ['1.data'])
+        self.assertFalse(lock_path.called)
+        self.assertEquals(diskfile.read_hash_index(part), (None, 0))
+        open(os.path.join(part, diskfile.HASH_INDEX_FILE), 'wb').close()
+        diskfile.update_hash_index(hsh_path, ['2.meta', '1.data'])
+        index, offset = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {'f' * 29 + 'a83': ['2.meta',
+                                                             '1.data']}})
+        diskfile.update_hash_index(hsh_path, [])
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {}})
+        # entries appended since the index was read are not lost
+        diskfile.update_hash_index(hsh_path, ['3.ts'])
+        diskfile.write_hash_index(part, {}, offset)
+        index, _junk = diskfile.read_hash_index(part)
+        self.assertEquals(index, {'a83': {'f' * 29 + 'a83': ['3.ts']}})
+
     def test_hash_cleanup_listdir(self):
         file_list = []
 
@@ -815,6 +1122,106 @@ class TestDiskFile(unittest.TestCase):
                 pass
             self.assertTrue(goo.called)
 
+    def _zero_copy_recv(self, reader, *args):
+        rsock, wsock = socket.socketpair()
+        try:
+            reader.zero_copy_send(wsock.fileno(), *args)
+            wsock.close()
+            data = ''
+            while True:
+                chunk = rsock.recv(4096)
+                if not chunk:
+                    return data
+                data += chunk
+        finally:
+            rsock.close()
+            wsock.close()
+
+    def test_zero_copy_send(self):
+        df = self._get_open_disk_file(fsize=1024)
+        self.assertFalse(df.reader().can_zero_copy_send())
+
+        self.conf['zero_copy_get'] = 'true'
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        self.assertTrue(reader.can_zero_copy_send())
+        self.assertEquals(self._zero_copy_recv(reader), '0' * 1024)
+        self.assertEquals(reader._fp, None)
+        self.assertEquals(reader._quarantined_dir, None)
+
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        self.assertEquals(self._zero_copy_recv(reader, 1000, 50), '0' * 24)
+        self.assertEquals(reader._fp, None)
+
+        # the etag is left to the auditor, but the size is still checked
+        df = self._get_open_disk_file(fsize=1024, invalid_type='ETag')
+        reader = df.reader()
+        self._zero_copy_recv(reader)
+        self.assertEquals(reader._quarantined_dir, None)
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        with open(df._data_file, 'a') as fp:
+            fp.write('1')
+        self.assertEquals(self._zero_copy_recv(reader), '0' * 1024 + '1')
+        self.assertTrue(reader._quarantined_dir)
+        # which a range does not
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        with open(df._data_file, 'a') as fp:
+            fp.write('1')
+        self._zero_copy_recv(reader, 0, 10)
+        self.assertEquals(reader._quarantined_dir, None)
+
+    def test_zero_copy_send_waits_for_socket(self):
+        self.conf['zero_copy_get'] = 'true'
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        with nested(
+                mock.patch.object(diskfile, 'sendfile', side_effect=[
+                    OSError(errno.EAGAIN, 'full'), 1000, 24, 0]),
+                mock.patch.object(diskfile, 'trampoline')) as \
+                (mock_sendfile, mock_trampoline):
+            reader.zero_copy_send(99)
+        mock_trampoline.assert_called_once_with(
+            99, write=True, timeout=None, timeout_exc=ChunkWriteTimeout)
+        self.assertEquals([call[0][2] for call in mock_sendfile.call_args_list],
+                          [0, 0, 1000, 1024])
+        self.assertEquals(reader._quarantined_dir, None)
+
+        df = self._get_open_disk_file(fsize=1024)
+        reader = df.reader()
+        with mock.patch.object(diskfile, 'sendfile',
+                               side_effect=OSError(errno.EPIPE, 'gone')):
+            self.assertRaises(OSError, reader.zero_copy_send, 99)
+        self.assertEquals(reader._fp, None)
+
+    def test_zero_copy_send_timeout(self):
+        self.conf['zero_copy_get'] = 'true'
+        df = self._get_open_disk_file(fsize=1024 * 1024 * 4)
+        reader = df.reader()
+        rsock, wsock = socket.socketpair()
+        try:
+            wsock.setblocking(False)
+            # nothing reads from the socket once its buffer is full
+            self.assertRaises(ChunkWriteTimeout, reader.zero_copy_send,
+                              wsock.fileno(), timeout=0.01)
+        finally:
+            rsock.close()
+            wsock.close()
+        self.assertEquals(reader._fp, None)
+        self.assertTrue(0 < reader._bytes_read < 1024 * 1024 * 4)
+        self.assertEquals(reader._quarantined_dir, None)
+
+    def test_zero_copy_get_unavailable(self):
+        self.conf['zero_copy_get'] = 'true'
+        with mock.patch.object(diskfile, 'sendfile_available',
+                               return_value=False):
+            df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        self.assertFalse(df_mgr.zero_copy_get)
+        self.assertEquals(len(df_mgr.logger.get_lines_for_level('warning')),
+                          1)
+
     def test_quarantine_valids(self):
 
         def verify(*args, **kwargs):
@@ -1015,6 +1422,21 @@ class TestDiskFile(unittest.TestCase):
         exp_name = '%s.meta' % timestamp
         self.assertTrue(exp_name in set(dl))
 
+    def test_compact_metadata(self):
+        self.conf['compact_metadata'] = 'true'
+        self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        df = self._get_open_disk_file(extra_metadata={
+            'X-Object-Meta-Test': 'x' * 1000})
+        self.assertEquals(df.get_metadata()['X-Object-Meta-Test'], 'x' * 1000)
+        metastr = xattr.getxattr(df._data_file, diskfile.METADATA_KEY)
+        self.assert_(metastr.startswith(diskfile.METADATA_MAGIC))
+        self.assertEquals(diskfile.decode_metadata(metastr),
+                          df.get_metadata())
+
+        for invalid_type in ('Corrupt-Xattrs', 'Truncated-Xattrs'):
+            self.assertRaises(DiskFileQuarantined, self._get_open_disk_file,
+                              invalid_type=invalid_type)
+
     def test_delete(self):
         df = self._get_open_disk_file()
         ts = time()
@@ -1596,5 +2018,270 @@ class TestDiskFile(unittest.TestCase):
         self.assertTrue(exp_name in set(dl))
 
 
+class TestPackedDiskFile(unittest.TestCase):
+    """Test swift.obj.diskfile.PackedDiskFile"""
+
+    def setUp(self):
+        self.testdir = os.path.join(mkdtemp(), 'tmp_test_obj_server_DiskFile')
+        mkdirs(os.path.join(self.testdir, 'sda1', 'tmp'))
+        mkdirs(os.path.join(self.testdir, 'sdb1', 'tmp'))
+        self._orig_tpool_exc = tpool.execute
+        tpool.execute = lambda f, *args, **kwargs: f(*args, **kwargs)
+        self.conf = dict(devices=self.testdir, mount_check='false',
+                         packed_devices='sdb1', packed_max_size='100')
+        self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        self.ts = time()
+
+    def tearDown(self):
+        rmtree(os.path.dirname(self.testdir))
+        tpool.execute = self._orig_tpool_exc
+
+    def _timestamp(self, offset=0):
+        return normalize_timestamp(self.ts + offset)
+
+    def _put(self, device, obj, data, offset=0, etag=None):
+        df = self.df_mgr.get_diskfile(device, '0', 'a', 'c', obj)
+        with df.create(size=len(data)) as writer:
+            writer.write(data)
+            writer.put({'ETag': etag or md5(data).hexdigest(),
+                        'X-Timestamp': self._timestamp(offset),
+                        'Content-Length': str(len(data))})
+        return df
+
+    def _read(self, device, obj):
+        df = self.df_mgr.get_diskfile(device, '0', 'a', 'c', obj)
+        with df.open():
+            return df.get_metadata(), ''.join(df.reader())
+
+    def test_packed(self):
+        df = self._put('sdb1', 'o', 'small')
+        self.assertTrue(isinstance(df, diskfile.PackedDiskFile))
+        self.assertFalse(os.path.exists(df._datadir))
+        self.assertEquals(sorted(os.listdir(os.path.join(
+            self.testdir, 'sdb1', 'objects', '0', diskfile.VOLUME_DIR))),
+            ['.lock', '00000000.idx', '00000000.vol'])
+        metadata, data = self._read('sdb1', 'o')
+        self.assertEquals(data, 'small')
+        self.assertEquals(metadata['name'], '/a/c/o')
+        self.assertEquals(metadata['X-Timestamp'], self._timestamp())
+
+        df.write_metadata({'X-Timestamp': self._timestamp(1),
+                           'X-Object-Meta-Test': 'test'})
+        metadata, data = self._read('sdb1', 'o')
+        self.assertEquals(data, 'small')
+        self.assertEquals(metadata['X-Object-Meta-Test'], 'test')
+        self.assertEquals(metadata['Content-Length'], '5')
+
+        # too big to pack
+        self._put('sdb1', 'o', 'x' * 101, 2)
+        self.assertEquals(os.listdir(df._datadir),
+                          [self._timestamp(2) + '.data'])
+        self.assertEquals(self._read('sdb1', 'o')[1], 'x' * 101)
+        # and then smaller again
+        self._put('sdb1', 'o', 'small', 3)
+        self.assertFalse(os.path.exists(df._datadir))
+        self.assertEquals(self._read('sdb1', 'o')[1], 'small')
+
+        df.delete(self._timestamp(4))
+        df = self.df_mgr.get_diskfile('sdb1', '0', 'a', 'c', 'o')
+        self.assertRaises(DiskFileDeleted, df.open)
+        records = df._volumes.get(os.path.basename(df._datadir))
+        self.assertEquals(records.keys(), [self._timestamp(4) + '.ts'])
+
+        # of unknown size
+        df = self.df_mgr.get_diskfile('sdb1', '0', 'a', 'c', 'o2')
+        with df.create() as writer:
+            self.assertTrue(isinstance(writer, diskfile.DiskFileWriter))
+
+    def test_hashes_match_unpacked(self):
+        for device in ('sda1', 'sdb1'):
+            self._put(device, 'o1', 'small')
+            self._put(device, 'o2', 'x' * 200)
+            df = self._put(device, 'o3', 'small')
+            df.write_metadata({'X-Timestamp': self._timestamp(1)})
+            df = self._put(device, 'o4', 'small')
+            df.delete(self._timestamp(1))
+            self._put(device, 'o5', 'small')
+            self._put(device, 'o5', 'x' * 200, 1)
+            self._put(device, 'o6', 'x' * 200)
+            self._put(device, 'o6', 'small', 1)
+        self.assertEquals(self.df_mgr.get_hashes('sda1', '0', ''),
+                          self.df_mgr.get_hashes('sdb1', '0', ''))
+        self.assertEquals(sorted(h[1:] for h in
+                                 self.df_mgr.yield_hashes('sda1', '0')),
+                          sorted(h[1:] for h in
+                                 self.df_mgr.yield_hashes('sdb1', '0')))
+        self.assertEquals(
+            sorted(s[1] for s in self.df_mgr.yield_suffixes('sda1', '0')),
+            sorted(s[1] for s in self.df_mgr.yield_suffixes('sdb1', '0')))
+        locations = [location for location in
+                     self.df_mgr.object_audit_location_generator()]
+        self.assertEquals(
+            sorted(str(location)[len(self.testdir) + 6:]
+                   for location in locations if location.device == 'sda1'),
+            sorted(str(location)[len(self.testdir) + 6:]
+                   for location in locations if location.device == 'sdb1'))
+        for location in locations:
+            df = self.df_mgr.get_diskfile_from_audit_location(location)
+            if location.device == 'sdb1':
+                self.assertTrue(isinstance(df, diskfile.PackedDiskFile))
+            try:
+                with df.open():
+                    ''.join(df.reader())
+            except DiskFileDeleted:
+                pass
+
+    def test_get_diskfile_from_hash(self):
+        df = self._put('sdb1', 'o', 'small')
+        object_hash = os.path.basename(df._datadir)
+        df = self.df_mgr.get_diskfile_from_hash('sdb1', '0', object_hash)
+        self.assertTrue(isinstance(df, diskfile.PackedDiskFile))
+        self.assertEquals(df.obj, 'o')
+        self.assertRaises(DiskFileNotExist,
+                          self.df_mgr.get_diskfile_from_hash, 'sdb1', '0',
+                          'f' * 32)
+
+    def test_quarantine(self):
+        df = self._put('sdb1', 'o', 'small', etag='bad')
+        df.write_metadata({'X-Timestamp': self._timestamp(1)})
+        df = self.df_mgr.get_diskfile('sdb1', '0', 'a', 'c', 'o')
+        with df.open():
+            reader = df.reader()
+            ''.join(reader)
+        quarantined = reader._quarantined_dir
+        self.assertEquals(sorted(os.listdir(quarantined)),
+                          [self._timestamp() + '.data',
+                           self._timestamp(1) + '.meta'])
+        with open(os.path.join(quarantined,
+                               self._timestamp() + '.data')) as fp:
+            self.assertEquals(fp.read(), 'small')
+        self.assertEquals(diskfile.read_metadata(
+            os.path.join(quarantined, self._timestamp() + '.data'))['ETag'],
+            'bad')
+        df = self.df_mgr.get_diskfile('sdb1', '0', 'a', 'c', 'o')
+        self.assertRaises(DiskFileNotExist, df.open)
+        self.assertEquals(self.df_mgr.get_hashes('sdb1', '0', ''), {})
+
+    def test_get_volumes(self):
+        self.assertEquals(self.df_mgr.get_volumes('sda1', '0'), None)
+        self.conf['packed_index_records'] = '3'
+        self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        for partition, count in (('0', 2), ('1', 1), ('2', 1)):
+            for i in range(count):
+                df = self.df_mgr.get_diskfile('sdb1', partition, 'a', 'c',
+                                              'o%d' % i)
+                with df.create(size=1) as writer:
+                    writer.write('x')
+                    writer.put({'ETag': md5('x').hexdigest(),
+                                'X-Timestamp': self._timestamp(),
+                                'Content-Length': '1'})
+        self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        with mock.patch.object(self.df_mgr.threadpools['sdb1'],
+                               'run_in_thread') as run_in_thread:
+            volumes = self.df_mgr.get_volumes('sdb1', '0')
+        # loaded in the device's threadpool
+        run_in_thread.assert_called_once_with(volumes.refresh)
+        volumes.refresh()
+        self.assertEquals(volumes.record_count, 2)
+        self.assertTrue(self.df_mgr.get_volumes('sdb1', '0') is volumes)
+        self.df_mgr.get_volumes('sdb1', '1')
+        self.df_mgr.get_volumes('sdb1', '0')
+        # the least recently used are dropped past packed_index_records
+        self.df_mgr.get_volumes('sdb1', '2')
+        self.assertEquals([os.path.basename(os.path.dirname(path))
+                           for path in self.df_mgr._volumes], ['0', '2'])
+        self.df_mgr.get_volumes('sdb1', '1')
+        self.assertEquals([os.path.basename(os.path.dirname(path))
+                           for path in self.df_mgr._volumes], ['2', '1'])
+
+
+
+class TestOpenObjectCache(unittest.TestCase):
+    """Test swift.obj.diskfile.OpenObjectCache"""
+
+    def setUp(self):
+        self.testdir = os.path.join(mkdtemp(), 'tmp_test_obj_server_DiskFile')
+        mkdirs(os.path.join(self.testdir, 'sda1', 'tmp'))
+        mkdirs(os.path.join(self.testdir, 'sdb1', 'tmp'))
+        self._orig_tpool_exc = tpool.execute
+        tpool.execute = lambda f, *args, **kwargs: f(*args, **kwargs)
+        self.conf = dict(devices=self.testdir, mount_check='false',
+                         metadata_cache_size='10', packed_devices='sdb1')
+        self.df_mgr = diskfile.DiskFileManager(self.conf, FakeLogger())
+        self.ts = time() - 100
+
+    def tearDown(self):
+        rmtree(os.path.dirname(self.testdir))
+        tpool.execute = self._orig_tpool_exc
+
+    def _put(self, data, offset=0, metadata=None, device='sda1'):
+        df = self.df_mgr.get_diskfile(device, '0', 'a', 'c', 'o')
+        with df.create(size=len(data)) as writer:
+            writer.write(data)
+            metadata = dict(metadata or {})
+            metadata.update({'ETag': md5(data).hexdigest(),
+                             'X-Timestamp': normalize_timestamp(
+                                 self.ts + offset),
+                             'Content-Length': str(len(data))})
+            writer.put(metadata)
+        self._age(df)
+        return df
+
+    def _age(self, df):
+        # as if last changed long enough ago to be cached
+        if os.path.isdir(df._datadir):
+            os.utime(df._datadir, (self.ts, self.ts))
+        self.ts += 1
+
+    def _read(self, device='sda1'):
+        df = self.df_mgr.get_diskfile(device, '0', 'a', 'c', 'o')
+        with df.open():
+            return df.get_metadata(), ''.join(df.reader())
+
+    def test_cached(self):
+        self._put('data', metadata={'X-Object-Meta-Color': 'red'})
+        metadata, data = self._read()
+        self.assertEquals(len(self.df_mgr.open_cache._entries), 1)
+        with nested(
+                mock.patch('os.listdir', side_effect=Exception('listed')),
+                mock.patch('swift.obj.diskfile.read_metadata',
+                           side_effect=Exception('read'))):
+            self.assertEquals(self._read(), (metadata, data))
+        self.assertEquals(metadata['X-Object-Meta-Color'], 'red')
+        self.assertEquals(data, 'data')
+
+    def test_changed(self):
+        df = self._put('data')
+        self._read()
+        df.write_metadata({'X-Timestamp': normalize_timestamp(self.ts),
+                           'X-Object-Meta-Color': 'blue'})
+        self._age(df)
+        metadata, data = self._read()
+        self.assertEquals(metadata['X-Object-Meta-Color'], 'blue')
+        self.assertEquals(data, 'data')
+        self._put('new data', offset=10)
+        self.assertEquals(self._read()[1], 'new data')
+        df.delete(normalize_timestamp(self.ts + 10))
+        self.assertRaises(DiskFileDeleted, self._read)
+
+    def test_recently_changed_not_cached(self):
+        df = self._put('data')
+        os.utime(df._datadir, None)
+        self._read()
+        self.assertEquals(len(self.df_mgr.open_cache._entries), 0)
+
+    def test_expired(self):
+        self._put('data', metadata={'X-Delete-At': str(int(time() + 10))})
+        self._read()
+        with mock.patch('swift.obj.diskfile.time.time',
+                        return_value=time() + 20):
+            self.assertRaises(DiskFileNotExist, self._read)
+
+    def test_not_packed(self):
+        self._put('data', device='sdb1')
+        self.assertEquals(self._read('sdb1')[1], 'data')
+        self.assertEquals(len(self.df_mgr.open_cache._entries), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -558,6 +558,42 @@ class TestObjectReplicator(unittest.TestCase):
         self.replicator.sync_method.assert_called_once_with(
             'node', 'job', 'suffixes')
 
+    def test_rsync_packed_device(self):
+        self.conf['packed_devices'] = 'sda'
+        self.replicator = object_replicator.ObjectReplicator(self.conf)
+        self.replicator.ssync = mock.MagicMock(return_value=True)
+        job = {'device': 'sda', 'partition': '0', 'path': self.parts['0']}
+        self.assertTrue(self.replicator.rsync('node', job, ['abc']))
+        self.replicator.ssync.assert_called_once_with('node', job, ['abc'])
+
+    def test_delete_partition_packed(self):
+        self.conf['packed_devices'] = 'sda'
+        self.replicator = object_replicator.ObjectReplicator(self.conf)
+        self.replicator.logger = FakeLogger()
+        df_mgr = diskfile.DiskFileManager(self.conf, self.replicator.logger)
+        df = df_mgr.get_diskfile('sda', '1', 'a', 'c', 'o')
+        with df.create(size=10) as writer:
+            writer.write('1234567890')
+            writer.put({'X-Timestamp': normalize_timestamp(time.time()),
+                        'ETag': 'etag', 'Content-Length': '10'})
+        self.assertFalse(os.path.exists(df._datadir))
+        part_path = os.path.join(self.objects, '1')
+        synced = []
+
+        def fake_ssync(node, job, suffixes):
+            synced.append(suffixes)
+            return True
+
+        self.replicator.ssync = fake_ssync
+        with mock.patch('swift.obj.replicator.http_connect',
+                        mock_http_connect(200)):
+            self.replicator.replicate()
+        ohash = hash_path('a', 'c', 'o')
+        self.assertTrue(synced)
+        self.assertEquals(set(suffix for suffixes in synced
+                              for suffix in suffixes), set([ohash[-3:]]))
+        self.assertFalse(os.access(part_path, os.F_OK))
+
     @mock.patch('swift.obj.replicator.tpool_reraise', autospec=True)
     @mock.patch('swift.obj.replicator.http_connect', autospec=True)
     def test_update(self, mock_http, mock_tpool_reraise):
@@ -40,6 +40,7 @@ from swift.common.utils import hash_path, mkdirs, normalize_timestamp, \
     NullLogger, storage_directory, public, replication
 from swift.common import constraints
 from swift.common.swob import Request, HeaderKeyDict
+from swift.common.exceptions import ChunkWriteTimeout
 
 
 def mock_time(*args, **kwargs):
@@ -1532,6 +1533,145 @@ class TestObjectController(unittest.TestCase):
         self.assertEquals(response, 'oh hai')
         killer.kill()
 
+    def test_zero_copy_GET(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'zero_copy_get': 'true'}
+        object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        body = ''.join(chr(i % 251) for i in xrange(300000))
+        req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': normalize_timestamp(1),
+                                     'Content-Type': 'application/x-test'},
+                            body=body)
+        resp = req.get_response(object_controller)
+        self.assertEquals(resp.status_int, 201)
+
+        listener = listen(('localhost', 0))
+        port = listener.getsockname()[1]
+        killer = spawn(wsgi.server, listener, object_controller,
+                       NullLogger())
+        orig_zero_copy_send = diskfile.DiskFileReader.zero_copy_send
+        try:
+            with mock.patch.object(
+                    diskfile.DiskFileReader, 'zero_copy_send', autospec=True,
+                    side_effect=orig_zero_copy_send) as mock_send:
+                for headers, status, expected in (
+                        ('', 200, body),
+                        ('Range: bytes=100000-100009\r\n', 206,
+                         body[100000:100010]),
+                        ('Range: bytes=-5\r\n', 206, body[-5:])):
+                    sock = connect_tcp(('localhost', port))
+                    fd = sock.makefile()
+                    fd.write('GET /sda1/p/a/c/o HTTP/1.1\r\n'
+                             'Host: localhost\r\nConnection: close\r\n'
+                             '%s\r\n' % headers)
+                    fd.flush()
+                    resp_headers = readuntil2crlfs(fd)
+                    exp = 'HTTP/1.1 %d' % status
+                    self.assertEquals(resp_headers[:len(exp)], exp)
+                    self.assertTrue('Content-Length: %d\r\n' % len(expected)
+                                    in resp_headers)
+                    self.assertEquals(fd.read(), expected)
+                self.assertEquals(
+                    [call[0][2:] for call in mock_send.call_args_list],
+                    [(0, None, 60), (100000, 10, 60),
+                     (len(body) - 5, 5, 60)])
+
+                # several ranges are sent the usual way
+                sock = connect_tcp(('localhost', port))
+                fd = sock.makefile()
+                fd.write('GET /sda1/p/a/c/o HTTP/1.1\r\n'
+                         'Host: localhost\r\nConnection: close\r\n'
+                         'Range: bytes=0-1,5-6\r\n\r\n')
+                fd.flush()
+                resp_headers = readuntil2crlfs(fd)
+                self.assertEquals(resp_headers[:len('HTTP/1.1 206')],
+                                  'HTTP/1.1 206')
+                self.assertTrue(body[5:7] in fd.read())
+                self.assertEquals(mock_send.call_count, 3)
+        finally:
+            killer.kill()
+
+        # without eventlet's socket, the body is iterated over as usual
+        req = Request.blank('/sda1/p/a/c/o')
+        resp = req.get_response(object_controller)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.body, body)
+
+    def test_zero_copy_GET_client_timeout(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'zero_copy_get': 'true', 'client_timeout': '1'}
+        logger = debug_logger()
+        object_controller = object_server.ObjectController(
+            conf, logger=logger)
+        req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': normalize_timestamp(1),
+                                     'Content-Type': 'application/x-test'},
+                            body='x' * 10)
+        resp = req.get_response(object_controller)
+        self.assertEquals(resp.status_int, 201)
+
+        listener = listen(('localhost', 0))
+        port = listener.getsockname()[1]
+        killer = spawn(wsgi.server, listener, object_controller,
+                       NullLogger())
+        try:
+            with mock.patch.object(
+                    diskfile.DiskFileReader, 'zero_copy_send', autospec=True,
+                    side_effect=ChunkWriteTimeout) as mock_send:
+                sock = connect_tcp(('localhost', port))
+                fd = sock.makefile()
+                fd.write('GET /sda1/p/a/c/o HTTP/1.1\r\n'
+                         'Host: localhost\r\n\r\n')
+                fd.flush()
+                resp_headers = readuntil2crlfs(fd)
+                self.assertEquals(resp_headers[:len('HTTP/1.1 200')],
+                                  'HTTP/1.1 200')
+                # the connection is ended without the body, even though it
+                # was not asked to be closed
+                self.assertEquals(fd.read(), '')
+                fd.close()
+                sock.close()
+                self.assertEquals(mock_send.call_count, 1)
+                self.assertEquals(mock_send.call_args[0][2:], (0, None, 1))
+                reader = mock_send.call_args[0][0]
+                sleep(0.01)
+                self.assertEquals(reader._fp, None)
+        finally:
+            killer.kill()
+        self.assertEquals(
+            logger.logger.get_lines_for_level('warning'),
+            ['Client did not read from object server within 1s'])
+
+    def test_zero_copy_GET_closed_unsent(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'zero_copy_get': 'true'}
+        object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': normalize_timestamp(1),
+                                     'Content-Type': 'application/x-test'},
+                            body='x' * 10)
+        resp = req.get_response(object_controller)
+        self.assertEquals(resp.status_int, 201)
+
+        wsock = mock.MagicMock()
+        req = Request.blank('/sda1/p/a/c/o', environ={
+            'wsgi.input': mock.MagicMock(get_socket=lambda: wsock)})
+        with mock.patch.object(diskfile.DiskFileReader, 'close',
+                               autospec=True) as mock_close:
+            resp = req.get_response(object_controller)
+            self.assertEquals(resp.status_int, 200)
+            self.assertTrue(isinstance(resp.app_iter,
+                                       object_server.ZeroCopyBody))
+            self.assertFalse(mock_close.called)
+            # the client went away before the body was started
+            resp.app_iter.close()
+            self.assertEquals(mock_close.call_count, 1)
+        self.assertFalse(wsock.fileno.called)
+        resp.app_iter.close()
+        self.assertEquals(resp.app_iter._reader._fp, None)
+
     def test_chunked_content_length_mismatch_zero(self):
         listener = listen(('localhost', 0))
         port = listener.getsockname()[1]
@@ -1962,9 +2102,9 @@ class TestObjectController(unittest.TestCase):
             object_server.http_connect = orig_http_connect
             utils.HASH_PATH_PREFIX = _prefix
         self.assertEquals(
-            pickle.load(open(os.path.join(
+            diskfile.read_async_update(os.path.join(
                 self.testdir, 'sda1', 'async_pending', 'a83',
-                '06fbf0b514e5199dfc4e00f42eb5ea83-0000000001.00000'))),
+                '06fbf0b514e5199dfc4e00f42eb5ea83-0000000001.00000')),
             {'headers': {'x-timestamp': '1', 'x-out': 'set',
                          'user-agent': 'obj-server %s' % os.getpid()},
              'account': 'a', 'container': 'c', 'obj': 'o', 'op': 'PUT'})
@@ -1996,9 +2136,9 @@ class TestObjectController(unittest.TestCase):
                     'PUT', 'a', 'c', 'o', '127.0.0.1:1234', 1, 'sdc1',
                     {'x-timestamp': '1', 'x-out': str(status)}, 'sda1')
                 self.assertEquals(
-                    pickle.load(open(os.path.join(
+                    diskfile.read_async_update(os.path.join(
                         self.testdir, 'sda1', 'async_pending', 'a83',
-                        '06fbf0b514e5199dfc4e00f42eb5ea83-0000000001.00000'))),
+                        '06fbf0b514e5199dfc4e00f42eb5ea83-0000000001.00000')),
                     {'headers': {'x-timestamp': '1', 'x-out': str(status),
                                  'user-agent': 'obj-server %s' % os.getpid()},
                      'account': 'a', 'container': 'c', 'obj': 'o',
@@ -2088,6 +2228,31 @@ class TestObjectController(unittest.TestCase):
                     'referer': 'PUT http://localhost/v1/a/c/o'},
                 'sda1'])
 
+    def test_container_update_shard_container(self):
+        given_args = []
+
+        def fake_async_update(*args):
+            given_args.extend(args)
+
+        self.object_controller.async_update = fake_async_update
+        req = Request.blank(
+            '/v1/a/c/o',
+            environ={'REQUEST_METHOD': 'PUT'},
+            headers={'X-Timestamp': 1,
+                     'X-Trans-Id': '123',
+                     'X-Container-Host': 'chost',
+                     'X-Container-Partition': 'cpartition',
+                     'X-Container-Device': 'cdevice',
+                     'X-Backend-Container-Path': '.shards_a/c-1'})
+        self.object_controller.container_update(
+            'PUT', 'a', 'c', 'o', req, {
+                'x-size': '0', 'x-etag': 'd41d8cd98f00b204e9800998ecf8427e',
+                'x-content-type': 'text/plain', 'x-timestamp': '1'},
+            'sda1')
+        self.assertEquals(given_args[:7], [
+            'PUT', '.shards_a', 'c-1', 'o', 'chost', 'cpartition',
+            'cdevice'])
+
     def test_delete_at_update_on_put(self):
         # Test how delete_at_update works when issued a delete for old
         # expiration info after a new put with no new expiration info.
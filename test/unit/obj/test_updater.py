@@ -26,7 +26,7 @@ from distutils.dir_util import mkpath
 from eventlet import spawn, Timeout, listen
 
 from swift.obj import updater as object_updater
-from swift.obj.diskfile import ASYNCDIR
+from swift.obj.diskfile import ASYNCDIR, read_async_update
 from swift.common.ring import RingData
 from swift.common import utils
 from swift.common.utils import hash_path, normalize_timestamp, mkdirs, \
@@ -220,7 +220,7 @@ class TestObjectUpdater(unittest.TestCase):
         self.assertEqual(cu.logger.get_increment_counts(),
                          {'failures': 1, 'unlinks': 1})
         self.assertEqual(None,
-                         pickle.load(open(op_path)).get('successes'))
+                         read_async_update(op_path).get('successes'))
 
         bindsock = listen(('127.0.0.1', 0))
 
@@ -276,7 +276,7 @@ class TestObjectUpdater(unittest.TestCase):
         self.assertEqual(cu.logger.get_increment_counts(),
                          {'failures': 1})
         self.assertEqual([0],
-                         pickle.load(open(op_path)).get('successes'))
+                         read_async_update(op_path).get('successes'))
 
         event = spawn(accept, [404, 500])
         cu.logger = FakeLogger()
@@ -288,7 +288,7 @@ class TestObjectUpdater(unittest.TestCase):
         self.assertEqual(cu.logger.get_increment_counts(),
                          {'failures': 1})
         self.assertEqual([0, 1],
-                         pickle.load(open(op_path)).get('successes'))
+                         read_async_update(op_path).get('successes'))
 
         event = spawn(accept, [201])
         cu.logger = FakeLogger()
@@ -0,0 +1,345 @@
+# Copyright (c) 2010-2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from test.unit import FakeLogger
+from swift.common.utils import normalize_timestamp
+from swift.obj import diskfile, volume
+
+HASH = 'f' * 29 + 'abc'
+OTHER_HASH = 'e' * 29 + 'abc'
+
+
+class TestVolumeModuleMethods(unittest.TestCase):
+
+    def test_encode_decode_record(self):
+        record = volume.encode_record(volume.RECORD_DATA, HASH,
+                                      normalize_timestamp(1), 'meta', 'data')
+        self.assertEquals(len(record), volume.RECORD_HEADER_SIZE + 8)
+        self.assertEquals(volume.decode_record(record),
+                          (volume.RECORD_DATA, HASH, normalize_timestamp(1),
+                           4, 4))
+        # the data is not checked, the header and metadata are
+        self.assertEquals(volume.decode_record(record[:-4]),
+                          (volume.RECORD_DATA, HASH, normalize_timestamp(1),
+                           4, 4))
+        self.assertRaises(ValueError, volume.decode_record, record[:-5])
+        self.assertRaises(ValueError, volume.decode_record, record[:10])
+        self.assertRaises(ValueError, volume.decode_record,
+                          record[:-6] + 'x' + record[-5:])
+        self.assertRaises(ValueError, volume.decode_record,
+                          'XXXX' + record[4:])
+        self.assertRaises(ValueError, volume.encode_record,
+                          volume.RECORD_DATA, 'abc', normalize_timestamp(1))
+
+    def test_live_names(self):
+        # the same files hash_cleanup_listdir keeps
+        tempdir = mkdtemp()
+        try:
+            for names in (['1.data', '2.meta', '3.meta'],
+                          ['1.data', '2.ts', '3.meta'],
+                          ['1.ts', '2.data', '3.meta', '2.meta'],
+                          ['1.meta', '2.data'],
+                          ['5.ts', '1.data', '6.ts']):
+                for name in names:
+                    name = normalize_timestamp(name.split('.')[0]) + '.' + \
+                        name.split('.')[1]
+                    with open(os.path.join(tempdir, name), 'w'):
+                        pass
+                listed = os.listdir(tempdir)
+                expected = diskfile.hash_cleanup_listdir(tempdir, time.time())
+                self.assertEquals(volume.live_names(listed), expected)
+                for name in os.listdir(tempdir):
+                    os.unlink(os.path.join(tempdir, name))
+        finally:
+            rmtree(tempdir)
+
+
+class TestPartitionVolumes(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.path = os.path.join(self.testdir, volume.VOLUME_DIR)
+        self.logger = FakeLogger()
+        self.ts = time.time()
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def _volumes(self, volume_size=4096):
+        return volume.PartitionVolumes(self.path, volume_size, 3600,
+                                       self.logger)
+
+    def _timestamp(self, offset=0):
+        return normalize_timestamp(self.ts + offset)
+
+    def test_append_and_read(self):
+        volumes = self._volumes()
+        self.assertEquals(volumes.get(HASH), {})
+        self.assertEquals(volumes.suffixes(), [])
+        record = volumes.append(volume.RECORD_DATA, HASH, self._timestamp(),
+                                'meta', 'data')
+        records = volumes.get(HASH)
+        self.assertEquals(records.keys(), [self._timestamp() + '.data'])
+        self.assertEquals(records.values()[0].offset, record.offset)
+        self.assertEquals(volumes.read(HASH, records.values()[0]),
+                          ('meta', 'data'))
+        self.assertEquals(volumes.suffixes(), ['abc'])
+        self.assertEquals(volumes.hashes('abc'),
+                          {HASH: [self._timestamp() + '.data']})
+        self.assertEquals(os.listdir(self.path).count('00000000.vol'), 1)
+
+    def test_obsolete_records(self):
+        volumes = self._volumes()
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm', 'd')
+        volumes.append(volume.RECORD_META, HASH, self._timestamp(1), 'm')
+        volumes.append(volume.RECORD_META, HASH, self._timestamp(2), 'm')
+        self.assertEquals(sorted(volumes.get(HASH)),
+                          [self._timestamp() + '.data',
+                           self._timestamp(2) + '.meta'])
+        volumes.append(volume.RECORD_TOMBSTONE, HASH, self._timestamp(3))
+        self.assertEquals(volumes.get(HASH).keys(),
+                          [self._timestamp(3) + '.ts'])
+        self.assertEquals(volumes.live_bytes, volume.RECORD_HEADER_SIZE)
+        volumes.remove(HASH, self._timestamp(3))
+        self.assertEquals(volumes.get(HASH), {})
+        self.assertEquals(volumes.suffixes(), [])
+
+    def test_reclaimed_tombstone(self):
+        volumes = self._volumes()
+        volumes.append(volume.RECORD_TOMBSTONE, HASH, self._timestamp(-7200))
+        # still there for whoever needs to clean up after it
+        self.assertEquals(volumes.get(HASH).keys(),
+                          [self._timestamp(-7200) + '.ts'])
+        self.assertEquals(volumes.hashes('abc'), {})
+        self.assertEquals(volumes.suffixes(), [])
+
+    def test_shared_between_instances(self):
+        volumes1 = self._volumes(volume_size=200)
+        volumes2 = self._volumes(volume_size=200)
+        volumes1.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm',
+                        'x' * 100)
+        self.assertEquals(volumes2.get(HASH).keys(),
+                          [self._timestamp() + '.data'])
+        # full, so the next goes to a new volume
+        volumes2.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(),
+                        'm', 'x' * 100)
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000000.idx', '00000000.vol',
+                           '00000001.idx', '00000001.vol'])
+        self.assertEquals(volumes1.get(OTHER_HASH).keys(),
+                          [self._timestamp() + '.data'])
+        volumes1.append(volume.RECORD_TOMBSTONE, OTHER_HASH,
+                        self._timestamp(1))
+        self.assertEquals(volumes2.get(OTHER_HASH).keys(),
+                          [self._timestamp(1) + '.ts'])
+
+    def test_torn_and_damaged_records(self):
+        volumes = self._volumes()
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm', 'd')
+        volume_path = os.path.join(self.path, '00000000.vol')
+        with open(volume_path, 'ab') as fp:
+            fp.write(volume.encode_record(volume.RECORD_DATA, OTHER_HASH,
+                                          self._timestamp(), 'm', 'd')[:-1])
+        volumes = self._volumes()
+        self.assertEquals(volumes.suffixes(), ['abc'])
+        self.assertEquals(volumes.get(OTHER_HASH), {})
+        # appends skip the torn record
+        volumes.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(1),
+                       'm', 'd')
+        self.assertEquals(volumes.get(OTHER_HASH).keys(),
+                          [self._timestamp(1) + '.data'])
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000000.idx', '00000000.vol',
+                           '00000001.idx', '00000001.vol'])
+
+        # damage is found scanning a volume, or else reading the record
+        with open(volume_path, 'r+b') as fp:
+            fp.write('XXXX')
+        volumes = self._volumes()
+        self.assertRaises(ValueError, volumes.read, HASH,
+                          volumes.get(HASH).values()[0])
+        os.unlink(os.path.join(self.path, '00000000.idx'))
+        volumes = self._volumes()
+        self.assertEquals(volumes.get(HASH), {})
+        self.assertEquals(volumes.get(OTHER_HASH).keys(),
+                          [self._timestamp(1) + '.data'])
+        self.assertEquals(len(self.logger.get_lines_for_level('error')), 1)
+        # and a damaged volume gets no index file
+        self.assertFalse(os.path.exists(
+            os.path.join(self.path, '00000000.idx')))
+
+    def test_read_damaged_record(self):
+        volumes = self._volumes()
+        record = volumes.append(volume.RECORD_DATA, HASH, self._timestamp(),
+                                'meta', 'data')
+        with open(os.path.join(self.path, '00000000.vol'), 'r+b') as fp:
+            fp.seek(record.offset + volume.RECORD_HEADER_SIZE)
+            fp.write('x')
+        self.assertRaises(ValueError, volumes.read, HASH, record)
+
+    def test_compact(self):
+        volumes = self._volumes()
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm',
+                       'x' * 100)
+        volumes.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(),
+                       'm', 'y' * 100)
+        self.assertEquals(volumes.compact(0.1), 0)
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(1), 'm',
+                       'z' * 10)
+        volumes.append(volume.RECORD_TOMBSTONE, 'd' * 29 + 'def',
+                       self._timestamp(-7200))
+        other = self._volumes()
+        before = os.path.getsize(os.path.join(self.path, '00000000.vol'))
+        freed = volumes.compact(0.1)
+        self.assertEquals(freed, before - os.path.getsize(
+            os.path.join(self.path, '00000001.vol')))
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000001.idx', '00000001.vol'])
+        self.assertEquals(volumes.total_bytes, volumes.live_bytes)
+        self.assertEquals(volumes.suffixes(), ['abc'])
+        for vols in (volumes, other):
+            records = vols.get(HASH)
+            self.assertEquals(records.keys(), [self._timestamp(1) + '.data'])
+            self.assertEquals(vols.read(HASH, records.values()[0]),
+                              ('m', 'z' * 10))
+        # a record looked up before the compaction is found again
+        records = other.get(OTHER_HASH)
+        volumes.append(volume.RECORD_META, HASH, self._timestamp(2), 'm')
+        volumes.compact(0)
+        self.assertEquals(other.read(OTHER_HASH, records.values()[0]),
+                          ('m', 'y' * 100))
+        # the new volume's index file is loaded rather than the volume
+        with mock.patch.object(volume, 'decode_record',
+                               side_effect=ValueError('scanned')):
+            self.assertEquals(sorted(self._volumes().hashes('abc')),
+                              [OTHER_HASH, HASH])
+
+    def test_compact_during_appends(self):
+        volumes = self._volumes()
+        other = self._volumes()
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm',
+                       'x' * 100)
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(1), 'm',
+                       'y' * 100)
+        volumes.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(),
+                       'm', 'z' * 100)
+        orig_copy_records = volume.PartitionVolumes._copy_records
+        appended = []
+
+        def copy_records(*args):
+            if not appended:
+                # appends are not held up while the live records are copied
+                with mock.patch.object(volume, 'lock_path',
+                                       side_effect=volume.lock_path) as lock:
+                    other.append(volume.RECORD_TOMBSTONE, HASH,
+                                 self._timestamp(2))
+                    other.remove(OTHER_HASH, self._timestamp())
+                    self.assertEquals(lock.call_count, 2)
+                appended.append(True)
+            return orig_copy_records(*args)
+
+        with mock.patch.object(volume.PartitionVolumes, '_copy_records',
+                               copy_records):
+            self.assertTrue(volumes.compact(0.1))
+        self.assertTrue(appended)
+        for vols in (volumes, other, self._volumes()):
+            self.assertEquals(vols.get(HASH).keys(),
+                              [self._timestamp(2) + '.ts'])
+            self.assertEquals(vols.get(OTHER_HASH), {})
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000001.idx', '00000001.vol'])
+
+    def test_index_files(self):
+        volumes = self._volumes(volume_size=300)
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm',
+                       'x' * 100)
+        volumes.append(volume.RECORD_META, HASH, self._timestamp(1), 'm')
+        volumes.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(),
+                       'm', 'y' * 100)
+        index_path = os.path.join(self.path, '00000000.idx')
+        with open(index_path, 'rb') as fp:
+            index = fp.read()
+        self.assertEquals(len(index), volume.INDEX_HEADER_SIZE +
+                          2 * volume.INDEX_ENTRY_SIZE)
+        self.assertEquals(volume.decode_index_entry(
+            index, volume.INDEX_HEADER_SIZE + volume.INDEX_ENTRY_SIZE),
+            (volume.RECORD_HEADER_SIZE + 101, volume.RECORD_META, HASH,
+             self._timestamp(1), 1, 0))
+        with mock.patch.object(volume, 'decode_record',
+                               side_effect=ValueError('scanned')):
+            volumes = self._volumes(volume_size=300)
+            self.assertEquals(sorted(volumes.get(HASH)),
+                              [self._timestamp() + '.data',
+                               self._timestamp(1) + '.meta'])
+            self.assertEquals(volumes.get(OTHER_HASH).keys(),
+                              [self._timestamp() + '.data'])
+
+        # a record whose entry was lost in a crash is read from the volume
+        with open(os.path.join(self.path, '00000001.vol'), 'ab') as fp:
+            fp.write(volume.encode_record(volume.RECORD_META, OTHER_HASH,
+                                          self._timestamp(1), 'm'))
+        volumes.append(volume.RECORD_META, OTHER_HASH, self._timestamp(2),
+                       'm')
+        self.assertEquals(sorted(self._volumes().get(OTHER_HASH)),
+                          [self._timestamp() + '.data',
+                           self._timestamp(2) + '.meta'])
+        # as is what follows a damaged entry
+        with open(os.path.join(self.path, '00000001.idx'), 'r+b') as fp:
+            fp.seek(volume.INDEX_HEADER_SIZE)
+            fp.write('x')
+        self.assertEquals(sorted(self._volumes().get(OTHER_HASH)),
+                          [self._timestamp() + '.data',
+                           self._timestamp(2) + '.meta'])
+
+    def test_volumes_without_index_files(self):
+        volumes = self._volumes(volume_size=200)
+        volumes.append(volume.RECORD_DATA, HASH, self._timestamp(), 'm',
+                       'x' * 100)
+        volumes.append(volume.RECORD_DATA, OTHER_HASH, self._timestamp(),
+                       'm', 'y' * 100)
+        for name in ('00000000.idx', '00000001.idx'):
+            os.unlink(os.path.join(self.path, name))
+        volumes = self._volumes(volume_size=200)
+        self.assertEquals(sorted(volumes.suffixes()), ['abc'])
+        # only a volume no longer appended to gets one once scanned
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000000.idx', '00000000.vol',
+                           '00000001.vol'])
+        with open(os.path.join(self.path, '00000000.idx'), 'rb') as fp:
+            self.assertEquals(len(fp.read()), volume.INDEX_HEADER_SIZE +
+                              volume.INDEX_ENTRY_SIZE)
+        # and nothing is appended to one without
+        volumes.append(volume.RECORD_META, OTHER_HASH, self._timestamp(1),
+                       'm')
+        self.assertEquals(sorted(os.listdir(self.path)),
+                          ['.lock', '00000000.idx', '00000000.vol',
+                           '00000001.vol', '00000002.idx', '00000002.vol'])
+        volumes = self._volumes(volume_size=200)
+        self.assertEquals(sorted(volumes.get(OTHER_HASH)),
+                          [self._timestamp() + '.data',
+                           self._timestamp(1) + '.meta'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.path, '00000001.idx')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,15 +14,19 @@
 # limitations under the License.
 
 import unittest
+from eventlet import sleep
 from mock import patch
 from swift.proxy.controllers.base import headers_to_container_info, \
     headers_to_account_info, headers_to_object_info, get_container_info, \
     get_container_memcache_key, get_account_info, get_account_memcache_key, \
     get_object_env_key, _get_cache_key, get_info, get_object_info, \
-    Controller, GetOrHeadHandler
+    Controller, GetOrHeadHandler, get_info_from_memcache, InfoCache, \
+    clear_info_cache, release_swift_conn, ReadHedger
+from swift.common.memcached import MemcacheRing
 from swift.common.swob import Request, HTTPException
 from swift.common.utils import split_path
-from test.unit import fake_http_connect, FakeRing, FakeMemcache
+from test.unit import fake_http_connect, FakeRing, FakeMemcache, \
+    FakeLogger
 from swift.proxy import server as proxy_server
 
 
@@ -79,6 +83,9 @@ class FakeCache(object):
     def get(self, *args):
         return self.val
 
+    def get_multi(self, keys, server_key=None):
+        return [self.val for key in keys]
+
 
 class TestFuncs(unittest.TestCase):
     def setUp(self):
@@ -270,6 +277,72 @@ class TestFuncs(unittest.TestCase):
         resp = get_container_info(req.environ, 'xxx')
         self.assertEquals(resp['bytes'], 3867)
 
+    def test_get_info_from_memcache_prefetches_account(self):
+        calls = []
+
+        class FakeRingCache(object):
+            def get_multi(self, keys, server_key=None):
+                calls.append(keys)
+                return [{'bytes': 1}, {'bytes': 2}]
+
+        env = {}
+        info = get_info_from_memcache(FakeRingCache(), env, 'a', 'c')
+        self.assertEquals(info, {'bytes': 1})
+        self.assertEquals(calls, [[get_container_memcache_key('a', 'c'),
+                                   get_account_memcache_key('a')]])
+        self.assertEquals(env['swift.account/a'], {'bytes': 2})
+        # account info now comes straight from env
+        self.assertEquals(
+            get_info_from_memcache(FakeRingCache(), env, 'a'), {'bytes': 2})
+        self.assertEquals(len(calls), 1)
+
+    def test_get_info_from_info_cache(self):
+        logger = FakeLogger()
+        info_cache = InfoCache(10, 60, 6, logger=logger)
+        memcache = FakeMemcache()
+        cache_key = get_container_memcache_key('a', 'c')
+        memcache.set(cache_key, {'status': 200, 'bytes': 1})
+        info = get_info_from_memcache(memcache, {}, 'a', 'c',
+                                      info_cache=info_cache)
+        self.assertEquals(info, {'status': 200, 'bytes': 1})
+        self.assertEquals(logger.get_increment_counts(),
+                          {'info_cache.miss': 2})
+        # memcache is not asked again while the local copy is fresh
+        memcache.delete(cache_key)
+        env = {}
+        info = get_info_from_memcache(memcache, env, 'a', 'c',
+                                      info_cache=info_cache)
+        self.assertEquals(info, {'status': 200, 'bytes': 1})
+        self.assertEquals(env['swift.' + cache_key], info)
+        self.assertEquals(logger.get_increment_counts(),
+                          {'info_cache.miss': 3, 'info_cache.hit': 1})
+        info = get_info_from_memcache(None, {}, 'a', 'c2',
+                                      info_cache=info_cache)
+        self.assertEquals(info, None)
+
+    def test_info_cache_negative_ttl(self):
+        info_cache = InfoCache(10, 60, 6)
+        with patch('time.time', return_value=1000.0):
+            info_cache.set_info('container/a/c', {'status': 200})
+            info_cache.set_info('container/a/c2', {'status': 404})
+        with patch('time.time', return_value=1010.0):
+            self.assertEquals(info_cache.get_info('container/a/c'),
+                              {'status': 200})
+            self.assertEquals(info_cache.get_info('container/a/c2'), None)
+
+    def test_clear_info_cache_clears_info_cache(self):
+        app = proxy_server.Application({'info_cache_ttl': '5'},
+                                       FakeMemcache(),
+                                       account_ring=FakeRing(),
+                                       container_ring=FakeRing(),
+                                       object_ring=FakeRing())
+        self.assertEquals(app.info_cache.ttl, 5)
+        self.assertEquals(app.info_cache.negative_ttl, 0.5)
+        app.info_cache.set_info('container/a/c', {'status': 200})
+        clear_info_cache(app, {}, 'a', 'c')
+        self.assertEquals(app.info_cache.get_info('container/a/c'), None)
+        self.assertEquals(self.app.info_cache, None)
+
     def test_get_account_info_swift_source(self):
         req = Request.blank("/v1/a", environ={'swift.cache': FakeCache({})})
         with patch('swift.proxy.controllers.base.'
@@ -435,6 +508,143 @@ class TestFuncs(unittest.TestCase):
             resp,
             headers_to_object_info(headers.items(), 200))
 
+    def test_release_swift_conn(self):
+
+        class FakePool(object):
+
+            def __init__(self):
+                self.conns = []
+
+            def put(self, conn):
+                self.conns.append(conn)
+
+        class FakeSrc(object):
+
+            def __init__(self, will_close, length):
+                self.swift_conn = type('FakeConn', (object,), {})()
+                self.swift_conn.pool = pool
+                self.will_close = will_close
+                self.length = length
+                self.closed = self.nuked = False
+
+            def isclosed(self):
+                return self.closed
+
+            def close(self):
+                self.closed = True
+
+            def nuke_from_orbit(self):
+                self.nuked = True
+
+        pool = FakePool()
+        # fully read, or nothing to read: back in the pool
+        for src in (FakeSrc(False, 0), FakeSrc(False, None)):
+            if src.length is None:
+                src.close()
+            release_swift_conn(src)
+            self.assertTrue(src.closed)
+            self.assertFalse(src.nuked)
+            self.assertEquals(pool.conns[-1], src.swift_conn)
+        self.assertEquals(len(pool.conns), 2)
+        # unread body or the server is closing the connection: killed
+        for src in (FakeSrc(False, 10), FakeSrc(True, 0)):
+            release_swift_conn(src)
+            self.assertTrue(src.nuked)
+        # no pool: killed
+        pool = None
+        src = FakeSrc(False, 0)
+        release_swift_conn(src)
+        self.assertTrue(src.nuked)
+
+    def test_read_hedger(self):
+        logger = FakeLogger()
+        hedger = ReadHedger(90, 0.5, window=100, logger=logger)
+        # no delay until enough timings are seen
+        for timing in xrange(9):
+            hedger.record(timing / 100.0)
+        self.assertEquals(hedger.delay(), None)
+        hedger.record(0.09)
+        self.assertEquals(hedger.delay(), 0.09)
+        for timing in xrange(10, 100):
+            hedger.record(timing / 100.0)
+        self.assertEquals(hedger.delay(), 0.9)
+        # hedges are limited to the budget
+        hedger = ReadHedger(90, 0.5, window=100, logger=logger)
+        self.assertFalse(hedger.try_hedge())
+        hedger.delay()
+        self.assertFalse(hedger.try_hedge())
+        hedger.delay()
+        self.assertTrue(hedger.try_hedge())
+        self.assertFalse(hedger.try_hedge())
+        for _junk in xrange(1000):
+            hedger.delay()
+        hedges = 0
+        while hedger.try_hedge():
+            hedges += 1
+        self.assertEquals(hedges, 50)
+        hedger.won()
+        self.assertEquals(logger.get_increment_counts(),
+                          {'hedge.issued': 51, 'hedge.won': 1})
+
+    def test_hedged_get(self):
+        self.app.read_hedger = ReadHedger(logger=FakeLogger())
+        self.app.read_hedger._delay = 0.01
+        self.app.read_hedger._tokens = 1
+        self.app.sort_nodes = lambda nodes: nodes
+        req = Request.blank('/a/c/o')
+
+        def fake_connect(slow):
+            def connect(ip, port, device, *args, **kwargs):
+                connected.append(ip)
+                conn = fake_http_connect(200, body=ip)()
+                getresponse = conn.getresponse
+
+                def slow_getresponse():
+                    sleep(slow.get(ip, 0))
+                    return getresponse()
+                conn.getresponse = slow_getresponse
+                conn.nuke_from_orbit = lambda: closed.append(ip)
+                return conn
+            return connect
+
+        # the first node is slow, the second answers first
+        connected = []
+        closed = []
+        with patch('swift.proxy.controllers.base.http_connect',
+                   fake_connect({'10.0.0.0': 0.1})):
+            handler = GetOrHeadHandler(self.app, req, 'Object', FakeRing(),
+                                       0, '/a/c/o', {})
+            source, node = handler._get_source_and_node()
+            self.assertEquals(node['ip'], '10.0.0.1')
+            self.assertEquals(connected, ['10.0.0.0', '10.0.0.1'])
+            sleep(0.2)
+            # the slow response was closed when it came in
+            self.assertEquals(closed, ['10.0.0.0'])
+        self.assertEquals(
+            self.app.read_hedger.logger.get_increment_counts(),
+            {'hedge.issued': 1, 'hedge.won': 1})
+
+        # the budget is spent, so no more hedging
+        connected = []
+        with patch('swift.proxy.controllers.base.http_connect',
+                   fake_connect({'10.0.0.0': 0.05})):
+            handler = GetOrHeadHandler(self.app, req, 'Object', FakeRing(),
+                                       0, '/a/c/o', {})
+            source, node = handler._get_source_and_node()
+            self.assertEquals(node['ip'], '10.0.0.0')
+            self.assertEquals(connected, ['10.0.0.0'])
+
+        # only object GETs are hedged
+        self.app.read_hedger._tokens = 1
+        connected = []
+        with patch('swift.proxy.controllers.base.http_connect',
+                   fake_connect({'10.0.0.0': 0.05})):
+            handler = GetOrHeadHandler(self.app, req, 'Container',
+                                       FakeRing(), 0, '/a/c', {})
+            source, node = handler._get_source_and_node()
+            self.assertEquals(node['ip'], '10.0.0.0')
+            self.assertEquals(connected, ['10.0.0.0'])
+
     def test_have_quorum(self):
         base = Controller(self.app)
         # just throw a bunch of test cases at it
@@ -16,7 +16,8 @@
 import mock
 import unittest
 
-from swift.common.swob import Request
+from swift.common.swob import Request, Response
+from swift.common.utils import json
 from swift.proxy import server as proxy_server
 from swift.proxy.controllers.base import headers_to_container_info
 from test.unit import fake_http_connect, FakeRing, FakeMemcache
@@ -62,6 +63,107 @@ class TestContainerController(unittest.TestCase):
         for key in owner_headers:
             self.assertTrue(key in resp.headers)
 
+    def _fake_backend(self, listings, calls):
+        def fake_GETorHEAD_base(req, server_type, ring, partition, path):
+            calls.append((path, dict(req.params)))
+            if path not in listings:
+                return Response(status=404, request=req)
+            record_type, records = listings[path]
+            if record_type == 'object':
+                marker = req.params.get('marker', '')
+                end_marker = req.params.get('end_marker')
+                records = [r for r in records if r['name'] > marker and
+                           (not end_marker or r['name'] < end_marker)]
+                records = records[:int(req.params.get('limit', 10000))]
+            return Response(status=200, body=json.dumps(records),
+                            request=req,
+                            headers={'X-Backend-Record-Type': record_type,
+                                     'X-Backend-Sharded': 'true',
+                                     'Content-Type': 'application/json'})
+        return fake_GETorHEAD_base
+
+    def _shard_range(self, name, lower, upper):
+        return {'name': '.shards_a/%s' % name, 'lower': lower,
+                'upper': upper, 'created_at': '1', 'object_count': 2,
+                'bytes_used': 2, 'deleted': 0}
+
+    def _objects(self, *names):
+        return [{'name': name, 'hash': 'x', 'bytes': 1,
+                 'content_type': 'text/plain',
+                 'last_modified': '1970-01-01T00:00:01.000000'}
+                for name in names]
+
+    def test_GET_sharded(self):
+        listings = {
+            '/v1/a/c': ('shard', [self._shard_range('c-1', '', 'b'),
+                               self._shard_range('c-2', 'b', 'd'),
+                               self._shard_range('c-3', 'd', '')]),
+            '/.shards_a/c-1': ('object', self._objects('a', 'b')),
+            '/.shards_a/c-2': ('shard', [
+                self._shard_range('c-2-1', 'b', 'c'),
+                self._shard_range('c-2-2', 'c', 'd')]),
+            '/.shards_a/c-2-1': ('object', self._objects('b1', 'c')),
+            '/.shards_a/c-2-2': ('object', self._objects('d')),
+            # .shards_a/c-3 does not exist yet
+        }
+        calls = []
+        controller = proxy_server.ContainerController(self.app, 'a', 'c')
+        controller.account_info = mock.MagicMock(return_value=(1, [{}], 0))
+        controller.GETorHEAD_base = self._fake_backend(listings, calls)
+
+        req = Request.blank('/v1/a/c?format=json')
+        resp = controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals([o['name'] for o in json.loads(resp.body)],
+                          ['a', 'b', 'b1', 'c', 'd'])
+        self.assertEquals(req.headers['X-Backend-Record-Type'], 'auto')
+        self.assert_('X-Backend-Record-Type' not in resp.headers)
+        self.assert_('X-Backend-Sharded' not in resp.headers)
+        self.assertEquals(
+            [(path, params.get('marker')) for path, params in calls],
+            [('/v1/a/c', None),
+             ('/.shards_a/c-1', ''), ('/.shards_a/c-2', 'b'),
+             ('/.shards_a/c-2-1', 'b'), ('/.shards_a/c-2-2', 'c'),
+             ('/.shards_a/c-3', 'd')])
+
+        del calls[:]
+        req = Request.blank('/v1/a/c?marker=b&limit=2')
+        resp = controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.body, 'b1\nc\n')
+        self.assertEquals(resp.headers['Content-Type'],
+                          'text/plain; charset=utf-8')
+        self.assertEquals([path for path, params in calls],
+                          ['/v1/a/c', '/.shards_a/c-2', '/.shards_a/c-2-1'])
+
+        req = Request.blank('/v1/a/c?format=xml&end_marker=b')
+        resp = controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assert_('<container name="c">' in resp.body)
+        self.assert_('<name>a</name>' in resp.body)
+        self.assert_('<name>b</name>' not in resp.body)
+
+        req = Request.blank('/v1/a/c?marker=z')
+        resp = controller.GET(req)
+        self.assertEquals(resp.status_int, 204)
+        self.assertEquals(resp.body, '')
+
+    def test_GET_sharded_shard_error(self):
+        listings = {'/v1/a/c': ('shard', [self._shard_range('c-1', '', '')])}
+        calls = []
+        controller = proxy_server.ContainerController(self.app, 'a', 'c')
+        fake_backend = self._fake_backend(listings, calls)
+
+        def failing_backend(req, server_type, ring, partition, path):
+            if path != '/v1/a/c':
+                return Response(status=503, request=req)
+            return fake_backend(req, server_type, ring, partition, path)
+
+        controller.account_info = mock.MagicMock(return_value=(1, [{}], 0))
+        controller.GETorHEAD_base = failing_backend
+        resp = controller.GET(Request.blank('/v1/a/c'))
+        self.assertEquals(resp.status_int, 503)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -117,6 +117,55 @@ class TestObjController(unittest.TestCase):
             controller.PUT(req)
             self.assertEquals(req.environ.get('swift.log_info'), None)
 
+    def test_get_update_target(self):
+        app = proxy_server.Application(None, FakeMemcache(),
+                                       account_ring=FakeRing(),
+                                       container_ring=FakeRing(),
+                                       object_ring=FakeRing())
+        container_info = {'partition': 1, 'nodes': [{}], 'sharded': False}
+        controller = proxy_server.ObjectController(app, 'a', 'c', 'o')
+        req = swift.common.swob.Request.blank('/v1/a/c/o')
+        self.assertEquals(controller._get_update_target(req, container_info),
+                          (1, [{}]))
+        self.assert_('X-Backend-Container-Path' not in req.headers)
+
+        shard_ranges = [
+            {'name': u'.shards_a/c-1', 'lower': u'', 'upper': u'n',
+             'created_at': '1', 'object_count': 0, 'bytes_used': 0,
+             'deleted': 0},
+            {'name': u'.shards_a/c-2', 'lower': u'n', 'upper': u'',
+             'created_at': '1', 'object_count': 0, 'bytes_used': 0,
+             'deleted': 0}]
+        container_info['sharded'] = True
+        controller.GETorHEAD_base = mock.MagicMock(
+            return_value=swift.common.swob.Response(
+                body=swift.common.utils.json.dumps(shard_ranges)))
+        self.assertEquals(controller._get_update_target(req, container_info),
+                          app.container_ring.get_nodes('.shards_a', 'c-2'))
+        self.assertEquals(req.headers['X-Backend-Container-Path'],
+                          '.shards_a/c-2')
+        shard_req = controller.GETorHEAD_base.call_args[0][0]
+        self.assertEquals(shard_req.headers['X-Backend-Record-Type'],
+                          'shard')
+
+        # the shard ranges are cached
+        controller = proxy_server.ObjectController(app, 'a', 'c', 'm')
+        controller.GETorHEAD_base = mock.MagicMock(
+            side_effect=Exception('should use the cache'))
+        req = swift.common.swob.Request.blank('/v1/a/c/m')
+        controller._get_update_target(req, container_info)
+        self.assertEquals(req.headers['X-Backend-Container-Path'],
+                          '.shards_a/c-1')
+
+        # updates go to the container itself if the ranges are unknown
+        app.memcache = FakeMemcache()
+        controller.GETorHEAD_base = mock.MagicMock(
+            return_value=swift.common.swob.Response(status=503))
+        req = swift.common.swob.Request.blank('/v1/a/c/m')
+        self.assertEquals(controller._get_update_target(req, container_info),
+                          (1, [{}]))
+        self.assert_('X-Backend-Container-Path' not in req.headers)
+
 
 if __name__ == '__main__':
     unittest.main()
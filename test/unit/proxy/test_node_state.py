@@ -0,0 +1,102 @@
+# Copyright (c) 2010-2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from swift.proxy import node_state
+
+
+class TestSharedNodeState(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.path = os.path.join(self.testdir, 'run', 'node_state')
+        self.node = {'ip': '1.2.3.4', 'port': 6000, 'device': 'sda'}
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def test_shared_between_instances(self):
+        state1 = node_state.SharedNodeState(self.path, 64)
+        state2 = node_state.SharedNodeState(self.path, 64)
+        self.assertEquals(state1.path, self.path + '.v1.64')
+        self.assertEquals(os.path.getsize(state1.path),
+                          64 * node_state.SLOT_SIZE)
+        self.assertEquals(state2.get_errors(self.node), (0, 0.0))
+        state1.set_errors(self.node, 3, 12345.5)
+        self.assertEquals(state2.get_errors(self.node), (3, 12345.5))
+        # other devices on the same server are separate
+        other = dict(self.node, device='sdb')
+        self.assertEquals(state2.get_errors(other), (0, 0.0))
+
+        self.assertEquals(state2.get_timing('1.2.3.4'), (-1.0, 0.0))
+        state1.set_timing('1.2.3.4', 0.25, 99999.0)
+        self.assertEquals(state2.get_timing('1.2.3.4'), (0.25, 99999.0))
+        # timings and errors of the same server do not clobber each other
+        self.assertEquals(state2.get_errors(self.node), (3, 12345.5))
+
+        state2.set_errors(self.node, 0, 0)
+        self.assertEquals(state1.get_errors(self.node), (0, 0.0))
+
+    def test_resized(self):
+        old_state = node_state.SharedNodeState(self.path, 64)
+        old_state.set_errors(self.node, 3, 12345.5)
+        state = node_state.SharedNodeState(self.path, 128)
+        self.assertEquals(os.path.getsize(state.path),
+                          128 * node_state.SLOT_SIZE)
+        self.assertEquals(state.get_errors(self.node), (0, 0.0))
+        # the old table is left as it was for workers still using it
+        self.assertEquals(os.path.getsize(old_state.path),
+                          64 * node_state.SLOT_SIZE)
+        self.assertEquals(old_state.get_errors(self.node), (3, 12345.5))
+
+    def test_never_shrunk(self):
+        state = node_state.SharedNodeState(self.path, 64)
+        state.set_errors(self.node, 3, 12345.5)
+        # grown by anything else, it is left that size
+        with open(state.path, 'r+b') as fp:
+            fp.truncate(128 * node_state.SLOT_SIZE)
+        state = node_state.SharedNodeState(self.path, 64)
+        self.assertEquals(os.path.getsize(state.path),
+                          128 * node_state.SLOT_SIZE)
+        self.assertEquals(state.get_errors(self.node), (3, 12345.5))
+        # a partly grown one is grown the rest of the way
+        with open(state.path, 'r+b') as fp:
+            fp.truncate(node_state.SLOT_SIZE)
+        state = node_state.SharedNodeState(self.path, 64)
+        self.assertEquals(os.path.getsize(state.path),
+                          64 * node_state.SLOT_SIZE)
+
+    def test_full_table(self):
+        state = node_state.SharedNodeState(self.path, 4)
+        nodes = [dict(self.node, device='sd%d' % i) for i in xrange(5)]
+        for node in nodes:
+            state.set_errors(node, 1, 1.0)
+        # four fit, the fifth is just not tracked
+        self.assertEquals(
+            sorted(state.get_errors(node)[0] for node in nodes),
+            [0, 1, 1, 1, 1])
+        # clearing a node that was never tracked does not claim a slot
+        state = node_state.SharedNodeState(self.path, 8)
+        state.set_errors(self.node, 0, 0)
+        self.assertEquals(state._find(
+            state._error_name(self.node)), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
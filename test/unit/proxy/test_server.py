@@ -215,6 +215,9 @@ class FakeMemcacheReturnsNone(FakeMemcache):
         # using the FakeMemcache for container existence checks.
         return None
 
+    def get_multi(self, keys, server_key=None):
+        return [None] * len(keys)
+
 
 @contextmanager
 def save_globals():
@@ -634,6 +637,122 @@ class TestProxyServer(unittest.TestCase):
                        {'ip': '127.0.0.1'}]
         self.assertEquals(res, exp_sorting)
 
+    def test_node_ewma(self):
+        baseapp = proxy_server.Application({'sorting_method': 'ewma',
+                                            'latency_ewma_alpha': '0.5'},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           object_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        nodes = [{'ip': '127.0.0.1', 'port': 6000, 'device': 'sd%s' % d}
+                 for d in 'abc']
+        for node, timing in zip(nodes, (0.4, 0.2, 0.1)):
+            baseapp.node_request_started(node)
+            baseapp.node_request_finished(node, timing)
+        self.assertEquals(baseapp.node_outstanding, {})
+        self.assertEquals(
+            baseapp.node_latencies[('127.0.0.1', 6000, 'sda')][0], 0.4)
+        # averaged with what came before
+        baseapp.node_request_finished(nodes[0], 0.2)
+        self.assertAlmostEquals(
+            baseapp.node_latencies[('127.0.0.1', 6000, 'sda')][0], 0.3)
+
+        def sort(nodes):
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                return [n['device'] for n in baseapp.sort_nodes(list(nodes))]
+
+        # sda loses to sdb, then sdb to sdc
+        self.assertEquals(sort(nodes), ['sdb', 'sdc', 'sda'])
+        self.assertEquals(sort(nodes[::-1]), ['sdc', 'sdb', 'sda'])
+        # requests in flight to sdc make it look busier than sda
+        for i in xrange(3):
+            baseapp.node_request_started(nodes[2])
+        self.assertEquals(sort(nodes[::-1]), ['sdb', 'sda', 'sdc'])
+        for i in xrange(3):
+            baseapp.node_request_finished(nodes[2], 0.1)
+        self.assertEquals(sort(nodes[::-1]), ['sdc', 'sdb', 'sda'])
+
+        # failures count as taking at least node_timeout
+        baseapp.node_request_finished(nodes[2], 0.01, failed=True)
+        self.assertTrue(
+            baseapp.node_latencies[('127.0.0.1', 6000, 'sdc')][0] >
+            baseapp.node_timeout / 2)
+        self.assertEquals(sort(nodes[::-1]), ['sdb', 'sda', 'sdc'])
+
+        # stale latencies are forgotten, so the node gets tried again
+        with mock.patch('swift.proxy.server.time',
+                        lambda: time.time() + baseapp.timing_expiry + 1):
+            self.assertEquals(sort(nodes[::-1]), ['sdc', 'sdb', 'sda'])
+
+        # every request is counted in and out again
+        req = Request.blank('/v1/a', environ={'REQUEST_METHOD': 'HEAD'})
+        with save_globals():
+            set_http_connect(503, 204)
+            controller = proxy_server.AccountController(baseapp, 'a')
+            resp = controller.HEAD(req)
+            self.assertEquals(resp.status_int, 204)
+        self.assertEquals(baseapp.node_outstanding, {})
+
+    def test_backend_connection_pool(self):
+        baseapp = proxy_server.Application({},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           object_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        self.assertEquals(baseapp.conn_pool, None)
+        controller = proxy_server.ContainerController(baseapp, 'a', 'c')
+        self.assertEquals(
+            controller.generate_request_headers()['connection'], 'close')
+
+        baseapp = proxy_server.Application(
+            {'backend_connection_pool_size': '4',
+             'backend_conn_idle_timeout': '2.5'},
+            FakeMemcache(), container_ring=FakeRing(),
+            object_ring=FakeRing(), account_ring=FakeRing())
+        self.assertEquals(baseapp.conn_pool.max_idle_per_node, 4)
+        self.assertEquals(baseapp.conn_pool.idle_timeout, 2.5)
+        controller = proxy_server.ContainerController(baseapp, 'a', 'c')
+        self.assertEquals(
+            controller.generate_request_headers()['connection'], 'keep-alive')
+
+        # a failed node loses its idle connections
+        node = {'ip': '1.2.3.4', 'port': 6000, 'device': 'sda'}
+        with mock.patch.object(baseapp.conn_pool, 'discard') as discard:
+            baseapp.exception_occurred(node, 'Container', 'oops')
+        discard.assert_called_once_with('1.2.3.4', 6000)
+
+    def test_shared_node_state(self):
+        swift_dir = mkdtemp()
+        try:
+            conf = {'node_state_file': os.path.join(swift_dir, 'node_state'),
+                    'node_state_slots': '128',
+                    'sorting_method': 'timing'}
+            workers = [
+                proxy_server.Application(
+                    conf, FakeMemcache(), container_ring=FakeRing(),
+                    object_ring=FakeRing(), account_ring=FakeRing())
+                for _junk in xrange(2)]
+            node = {'ip': '1.2.3.4', 'port': 6000, 'device': 'sda'}
+            for _junk in xrange(workers[0].error_suppression_limit + 1):
+                workers[0].error_occurred(node, 'oops')
+            self.assertTrue(workers[1].error_limited(dict(node)))
+            # nothing is kept in the node dicts
+            self.assertEquals(node, {'ip': '1.2.3.4', 'port': 6000,
+                                     'device': 'sda'})
+            with mock.patch('swift.proxy.server.time',
+                            lambda: time.time() + 3600):
+                self.assertFalse(workers[0].error_limited(node))
+            self.assertFalse(workers[1].error_limited(node))
+
+            workers[1].set_node_timing({'ip': '127.0.0.1'}, 0.1)
+            nodes = [{'ip': '127.0.0.1'}, {'ip': '127.0.0.2'}]
+            with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+                self.assertEquals(workers[0].sort_nodes(nodes),
+                                  [{'ip': '127.0.0.2'}, {'ip': '127.0.0.1'}])
+            self.assertEquals(workers[0].node_timings, {})
+        finally:
+            rmtree(swift_dir, ignore_errors=True)
+
     def test_node_affinity(self):
         baseapp = proxy_server.Application({'sorting_method': 'affinity',
                                             'read_affinity': 'r1=1'},
@@ -749,7 +868,7 @@ class TestObjectController(unittest.TestCase):
         test_errors = []
 
         def test_connect(ipaddr, port, device, partition, method, path,
-                         headers=None, query_string=None):
+                         headers=None, query_string=None, pool=None):
             if path == '/a/c/o.jpg':
                 if 'expect' in headers or 'Expect' in headers:
                     test_errors.append('Expect was in headers for object '
@@ -776,7 +895,7 @@ class TestObjectController(unittest.TestCase):
         test_errors = []
 
         def test_connect(ipaddr, port, device, partition, method, path,
-                         headers=None, query_string=None):
+                         headers=None, query_string=None, pool=None):
             if path == '/a/c/o.jpg':
                 if 'Expect' not in headers:
                     test_errors.append('Expect was not in headers for '
@@ -799,7 +918,7 @@ class TestObjectController(unittest.TestCase):
         written_to = []
 
         def test_connect(ipaddr, port, device, partition, method, path,
-                         headers=None, query_string=None):
+                         headers=None, query_string=None, pool=None):
             if path == '/a/c/o.jpg':
                 written_to.append((ipaddr, port, device))
 
@@ -833,7 +952,7 @@ class TestObjectController(unittest.TestCase):
         written_to = []
 
         def test_connect(ipaddr, port, device, partition, method, path,
-                         headers=None, query_string=None):
+                         headers=None, query_string=None, pool=None):
             if path == '/a/c/o.jpg':
                 written_to.append((ipaddr, port, device))
 
@@ -1039,7 +1158,7 @@ class TestObjectController(unittest.TestCase):
         test_errors = []
 
         def test_connect(ipaddr, port, device, partition, method, path,
-                         headers=None, query_string=None):
+                         headers=None, query_string=None, pool=None):
             if method == 'DELETE':
                 if 'x-if-delete-at' in headers or 'X-If-Delete-At' in headers:
                     test_errors.append('X-If-Delete-At in headers')
@@ -1146,7 +1265,7 @@ class TestObjectController(unittest.TestCase):
 
                 def capture_requested_paths(ipaddr, port, device, partition,
                                             method, path, headers=None,
-                                            query_string=None):
+                                            query_string=None, pool=None):
                     qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                     requested.append([method, path, qs_dict])
 
@@ -1225,7 +1344,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1279,7 +1398,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1329,7 +1448,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1381,7 +1500,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1457,7 +1576,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1561,7 +1680,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1636,7 +1755,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -1694,7 +1813,7 @@ class TestObjectController(unittest.TestCase):
 
             def capture_requested_paths(ipaddr, port, device, partition,
                                         method, path, headers=None,
-                                        query_string=None):
+                                        query_string=None, pool=None):
                 qs_dict = dict(urlparse.parse_qsl(query_string or ''))
                 requested.append([method, path, qs_dict])
 
@@ -2150,7 +2269,7 @@ class TestObjectController(unittest.TestCase):
 
             def verify_content_type(ipaddr, port, device, partition,
                                     method, path, headers=None,
-                                    query_string=None):
+                                    query_string=None, pool=None):
                 if path == '/a/c/o.html':
                     it_worked.append(
                         headers['Content-Type'].startswith('something/right'))
@@ -2172,7 +2291,7 @@ class TestObjectController(unittest.TestCase):
 
             def verify_content_type(ipaddr, port, device, partition,
                                     method, path, headers=None,
-                                    query_string=None):
+                                    query_string=None, pool=None):
                 if path == '/a/c/o.html':
                     it_worked.append(
                         headers['Content-Type'].startswith('text/html'))
@@ -4837,7 +4956,7 @@ class TestObjectController(unittest.TestCase):
         seen_headers = []
 
         def capture_headers(ipaddr, port, device, partition, method,
-                            path, headers=None, query_string=None):
+                            path, headers=None, query_string=None, pool=None):
             captured = {}
             for header in header_list:
                 captured[header] = headers.get(header)
@@ -5443,7 +5562,7 @@ class TestContainerController(unittest.TestCase):
             test_errors = []
 
             def test_connect(ipaddr, port, device, partition, method, path,
-                             headers=None, query_string=None):
+                             headers=None, query_string=None, pool=None):
                 if path == '/a/c':
                     find_header = test_header
                     find_value = test_value
@@ -5833,7 +5952,7 @@ class TestContainerController(unittest.TestCase):
                       'X-Account-Device')
 
         def capture_headers(ipaddr, port, device, partition, method,
-                            path, headers=None, query_string=None):
+                            path, headers=None, query_string=None, pool=None):
             captured = {}
             for header in to_capture:
                 captured[header] = headers.get(header)
@@ -6198,7 +6317,7 @@ class TestAccountController(unittest.TestCase):
             test_errors = []
 
             def test_connect(ipaddr, port, device, partition, method, path,
-                             headers=None, query_string=None):
+                             headers=None, query_string=None, pool=None):
                 if path == '/a':
                     find_header = test_header
                     find_value = test_value